@@ -0,0 +1,56 @@
+"""Measures throughput of content defined chunking with native extension and with pure Python loop.
+
+Extension is built by `python setup.py build_ext --inplace`, boundaries found by both implementations
+are compared as well.
+
+    python benchmarks/benchmark_chunking.py --size-mib 64
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.chunking import ContentDefinedChunker, NATIVE_CHUNKING_AVAILABLE  # noqa
+
+BYTES_IN_MEGABYTE = 1024 * 1024
+
+
+def measure(data, use_native):
+    chunker = ContentDefinedChunker(use_native=use_native)
+
+    begin = time.perf_counter()
+    sizes = [len(chunk) for chunk in chunker.iterate_stream_chunks(io.BytesIO(data))]
+    spent = time.perf_counter() - begin
+
+    print("{:<8} {:>10.1f} MiB/s, chunks: {:>6}, average chunk size: {:>8.1f} KiB".format(
+        "native" if use_native else "python",
+        len(data) / BYTES_IN_MEGABYTE / spent,
+        len(sizes),
+        sum(sizes) / max(len(sizes), 1) / 1024
+    ))
+
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mib", type=int, default=32)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mib * BYTES_IN_MEGABYTE)
+
+    python_sizes = measure(data, use_native=False)
+    if not NATIVE_CHUNKING_AVAILABLE:
+        print("native chunking extension isn't built")
+        return
+
+    native_sizes = measure(data, use_native=True)
+    print("boundaries are {}".format("same" if native_sizes == python_sizes else "DIFFERENT"))
+
+
+if __name__ == "__main__":
+    main()
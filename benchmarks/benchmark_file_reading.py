@@ -0,0 +1,127 @@
+"""Measures throughput of hashing of large file and its impact on page cache for each read cache mode.
+
+File is evicted from page cache before each run (unless --warm is passed), pages of the file
+resident in cache after the run are counted with mincore. "normal" mode leaves whole file in cache,
+"drop" and "direct" modes shouldn't leave anything there.
+
+    python benchmarks/benchmark_file_reading.py --size-mib 1024 --folder /var/backups
+"""
+import argparse
+import ctypes
+import mmap
+import os
+import sys
+import time
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.file_io import CACHE_MODES, SequentialFileReader  # noqa
+from yabtool.shared.hashing import hash_file  # noqa
+
+BYTES_IN_MEGABYTE = 1024 * 1024
+
+_PROT_READ = 1
+_MAP_SHARED = 1
+
+
+def create_file(file_name, size):
+    block = os.urandom(BYTES_IN_MEGABYTE)
+    with open(file_name, "wb") as output_file:
+        for offset in range(0, size, len(block)):
+            output_file.write(block[:size - offset])
+
+
+def evict_file(file_name):
+    with open(file_name, "rb+") as input_file:
+        os.fdatasync(input_file.fileno())
+        os.posix_fadvise(input_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def warm_file(file_name):
+    with SequentialFileReader(file_name) as input_file:
+        while input_file.read(8 * BYTES_IN_MEGABYTE):
+            pass
+
+
+def get_resident_bytes(file_name):
+    """Returns amount of file data in page cache, file is mapped and checked with mincore."""
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+
+    size = os.path.getsize(file_name)
+    if not size:
+        return 0
+
+    pages_count = (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    vector = (ctypes.c_ubyte * pages_count)()
+    fd = os.open(file_name, os.O_RDONLY)
+    try:
+        address = libc.mmap(None, size, _PROT_READ, _MAP_SHARED, fd, 0)
+        if address in (None, ctypes.c_void_p(-1).value):
+            raise OSError(ctypes.get_errno(), "mmap failed")
+
+        try:
+            if libc.mincore(address, size, vector) != 0:
+                raise OSError(ctypes.get_errno(), "mincore failed")
+        finally:
+            libc.munmap(address, size)
+    finally:
+        os.close(fd)
+
+    return sum(item & 1 for item in vector) * mmap.PAGESIZE
+
+
+def measure(file_name, hot_file_name, cache_mode, warm):
+    if warm:
+        warm_file(file_name)
+    else:
+        evict_file(file_name)
+
+    warm_file(hot_file_name)
+    hot_resident_before = get_resident_bytes(hot_file_name)
+
+    begin = time.perf_counter()
+    _, hashed_bytes = hash_file(file_name, ["sha256"], cache_mode=cache_mode)
+    spent = time.perf_counter() - begin
+
+    print("{:<8} {:>10.1f} MiB/s, file in cache: {:>8.1f} MiB, hot file in cache: {:>8.1f} -> {:>8.1f} MiB".format(
+        cache_mode,
+        hashed_bytes / BYTES_IN_MEGABYTE / spent,
+        get_resident_bytes(file_name) / BYTES_IN_MEGABYTE,
+        hot_resident_before / BYTES_IN_MEGABYTE,
+        get_resident_bytes(hot_file_name) / BYTES_IN_MEGABYTE
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", default=".", help="folder for test files, should be on the disk of backups")
+    parser.add_argument("--size-mib", type=int, default=512)
+    parser.add_argument("--hot-size-mib", type=int, default=64, help="file which simulates hot database pages")
+    parser.add_argument("--warm", action="store_true", help="file is read into page cache before each run")
+    parser.add_argument("--modes", nargs="+", default=CACHE_MODES, choices=CACHE_MODES)
+    args = parser.parse_args()
+
+    if not hasattr(os, "posix_fadvise"):
+        print("posix_fadvise isn't available on this platform")
+        return
+
+    file_name = os.path.join(args.folder, "yabtool_benchmark_file_reading.bin")
+    hot_file_name = os.path.join(args.folder, "yabtool_benchmark_file_reading_hot.bin")
+    create_file(file_name, args.size_mib * BYTES_IN_MEGABYTE)
+    create_file(hot_file_name, args.hot_size_mib * BYTES_IN_MEGABYTE)
+
+    try:
+        for cache_mode in args.modes:
+            measure(file_name, hot_file_name, cache_mode, args.warm)
+    finally:
+        os.remove(file_name)
+        os.remove(hot_file_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Measures cost of rendering step parameters for flow with many steps.
+
+Legacy mode reproduces previous behaviour: template is compiled on every render and
+rendering context is rebuilt from values of all previous steps on every access.
+
+    python benchmarks/benchmark_rendering.py --steps 60 --rules 8
+"""
+import argparse
+import os
+import sys
+import time
+
+from jinja2 import BaseLoader, Environment, StrictUndefined
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.jinja2_helpers import create_rendering_environment, render_template  # noqa
+from yabtool.yabtool_flow_orchestrator import RenderingContext  # noqa
+
+
+def create_flow(steps_count, rules_count):
+    res = []
+    for step_index in range(steps_count):
+        step_context = {
+            "name": "step_{}".format(step_index),
+            "input_file_name": "{{output_folder_name}}/{{backup_file_name}}_" + str(step_index),
+            "target_prefix_in_bucket": "{{prefix_in_bucket}}{{main_target_name}}/{{current_date}}",
+            "upload_rules": [
+                {
+                    "destination_prefix": "{{target_prefix_in_bucket}}/rule_" + str(rule_index) + "/{{week_number}}",
+                    "dedup_tag_name": "flag_{{current_date}}_{{week_day_short_name}}_{{main_target_name | lower}}",
+                }
+                for rule_index in range(rules_count)
+            ],
+            "generates": {"value_{}".format(step_index): "{{input_file_name}}"},
+        }
+        res.append(step_context)
+
+    return res
+
+
+def create_basic_values():
+    res = {
+        "output_folder_name": "/tmp/yabtool/flow",
+        "backup_file_name": "db.fbk",
+        "prefix_in_bucket": "backups/",
+        "main_target_name": "MAIN_DB",
+        "current_date": "2020-01-01",
+        "week_number": "01",
+        "week_day_short_name": "Wed",
+    }
+    res.update({"basic_value_{}".format(index): index for index in range(40)})
+
+    return res
+
+
+def get_step_templates(step_context):
+    res = [step_context["input_file_name"], step_context["target_prefix_in_bucket"]]
+    for rule in step_context["upload_rules"]:
+        res.extend([rule["destination_prefix"], rule["dedup_tag_name"]])
+
+    res.extend(step_context["generates"].values())
+    return res
+
+
+def run_legacy(flow, basic_values):
+    env = Environment(loader=BaseLoader, undefined=StrictUndefined)
+    previous_steps_values = []
+
+    def to_context():
+        res = basic_values
+        for item in previous_steps_values:
+            res = {**res, **item}
+
+        return res
+
+    for step_context in flow:
+        for template in get_step_templates(step_context):
+            # every access to mixed_context merged all layers
+            mixed_context = {**to_context(), **step_context}
+            env.from_string(template).render(**mixed_context)
+
+        previous_steps_values.append({"value_{}".format(len(previous_steps_values)): "x"})
+
+
+def run_current(flow, basic_values, env):
+    rendering_context = RenderingContext()
+    rendering_context.basic_values = basic_values
+
+    for step_context in flow:
+        for template in get_step_templates(step_context):
+            mixed_context = rendering_context.to_context().new_child(step_context)
+            render_template(env.from_string(template), mixed_context)
+
+        rendering_context.add_step_values({"value_{}".format(len(rendering_context.previous_steps_values)): "x"})
+
+
+def measure(name, steps_count, func, repeat):
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        # dry run and active run
+        func()
+        func()
+
+    spent = (time.perf_counter() - begin) / repeat
+    print("{:<10} total: {:8.2f} ms, per step: {:8.3f} ms".format(name, spent * 1000, spent * 1000 / steps_count))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=60)
+    parser.add_argument("--rules", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    flow = create_flow(args.steps, args.rules)
+    basic_values = create_basic_values()
+    env = create_rendering_environment()
+
+    measure("legacy", args.steps, lambda: run_legacy(flow, basic_values), args.repeat)
+    measure("current", args.steps, lambda: run_current(flow, basic_values, env), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from setuptools import find_packages, setup  # noqa
+from setuptools import Extension, find_packages, setup  # noqa
 from yabtool import __version__  # noqa
 
 try:  # for pip >= 10
@@ -54,5 +54,13 @@ if __name__ == "__main__":
         install_requires=requirements,
         classifiers=[],
         license="MIT",
-        zip_safe=False
+        zip_safe=False,
+        # boundary search of content defined chunking, pure Python implementation is used when it's not built
+        ext_modules=[
+            Extension(
+                "yabtool.shared._gear_chunking",
+                sources=["yabtool/shared/_gear_chunking.c"],
+                optional=True
+            )
+        ]
     )
@@ -0,0 +1,246 @@
+import datetime
+import hashlib
+import io
+import threading
+
+from botocore.exceptions import ClientError
+
+
+class FakeS3Paginator(object):
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, Bucket, Prefix="", Delimiter=None, PaginationConfig=None):
+        page_size = (PaginationConfig or {}).get("PageSize", self._client.max_keys)
+        keys = sorted(key for key in self._client.objects.get(Bucket, {}) if key.startswith(Prefix))
+
+        contents = []
+        common_prefixes = []
+        for key in keys:
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                common_prefix = key[:len(Prefix) + key[len(Prefix):].index(Delimiter) + 1]
+                if common_prefix not in common_prefixes:
+                    common_prefixes.append(common_prefix)
+                continue
+
+            contents.append(key)
+
+        with self._client.lock:
+            self._client.calls.append("list_objects_v2")
+
+        for index in range(0, max(len(contents), 1), page_size):
+            page = {"Contents": [self._client.describe_object(Bucket, key) for key in contents[index:index + page_size]]}
+            if index == 0:
+                page["CommonPrefixes"] = [{"Prefix": item} for item in common_prefixes]
+
+            yield page
+
+
+class FakeS3ListPartsPaginator(object):
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, Bucket, Key, UploadId):
+        upload = self._client.get_upload(UploadId)
+        parts = [
+            {"PartNumber": part_number, "ETag": etag, "Size": len(data)}
+            for part_number, (etag, data) in sorted(upload["parts"].items())
+        ]
+
+        for index in range(0, max(len(parts), 1), 2):
+            yield {"Parts": parts[index:index + 2]}
+
+
+class FakeS3ListUploadsPaginator(object):
+    def __init__(self, client):
+        self._client = client
+
+    def paginate(self, Bucket, Prefix=""):
+        uploads = [
+            {"UploadId": upload_id, "Key": upload["key"], "Initiated": upload["initiated"]}
+            for upload_id, upload in sorted(self._client.uploads.items())
+            if upload["bucket"] == Bucket and upload["key"].startswith(Prefix)
+        ]
+        yield {"Uploads": uploads}
+
+
+class FakeS3Client(object):
+    """In memory subset of boto3 S3 client API used by tests."""
+
+    def __init__(self, max_keys=1000):
+        self.max_keys = max_keys
+        self.objects = {}
+        self.tags = {}
+        self.metadata = {}
+        self.etags = {}
+        self.calls = []
+        self.copy_concurrency = []
+        self.lock = threading.Lock()
+        self.undeletable_keys = set()
+        self.uploads = {}
+        self.fail_after_parts = None
+        self._uploaded_parts_count = 0
+
+    def head_bucket(self, Bucket):
+        with self.lock:
+            self.calls.append("head_bucket")
+            if Bucket not in self.objects:
+                raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadBucket")
+
+    def create_bucket(self, Bucket, **kwargs):
+        with self.lock:
+            self.calls.append("create_bucket")
+            self.objects.setdefault(Bucket, {})
+
+    def get_paginator(self, operation_name):
+        paginators = {
+            "list_objects_v2": FakeS3Paginator,
+            "list_parts": FakeS3ListPartsPaginator,
+            "list_multipart_uploads": FakeS3ListUploadsPaginator,
+        }
+        return paginators[operation_name](self)
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self.calls.append("create_multipart_upload")
+            upload_id = "upload-{}".format(len(self.uploads) + 1)
+            self.uploads[upload_id] = {
+                "bucket": Bucket,
+                "key": Key,
+                "parts": {},
+                "initiated": datetime.datetime.now(datetime.timezone.utc),
+                "metadata": kwargs.get("Metadata", {}),
+            }
+
+        return {"UploadId": upload_id}
+
+    def get_upload(self, upload_id):
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise ClientError({"Error": {"Code": "NoSuchUpload", "Message": "Not Found"}}, "ListParts")
+
+        return upload
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        data = Body if isinstance(Body, bytes) else Body.read()
+
+        with self.lock:
+            self.calls.append("upload_part")
+            if self.fail_after_parts is not None and self._uploaded_parts_count >= self.fail_after_parts:
+                raise ConnectionError("connection lost")
+
+            self._uploaded_parts_count += 1
+            etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+            self.get_upload(UploadId)["parts"][PartNumber] = (etag, data)
+
+        return {"ETag": etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        with self.lock:
+            self.calls.append("complete_multipart_upload")
+            upload = self.uploads.pop(UploadId)
+
+            data = b""
+            digests = b""
+            for part in MultipartUpload["Parts"]:
+                etag, part_data = upload["parts"][part["PartNumber"]]
+                assert etag == part["ETag"]
+                data += part_data
+                digests += hashlib.md5(part_data).digest()
+
+            self.objects.setdefault(Bucket, {})[Key] = data
+            self.metadata[(Bucket, Key)] = upload["metadata"]
+            etag = '"{}-{}"'.format(hashlib.md5(digests).hexdigest(), len(MultipartUpload["Parts"]))
+            self.etags[(Bucket, Key)] = etag
+
+        return {"ETag": etag}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self.lock:
+            self.calls.append("abort_multipart_upload")
+            self.get_upload(UploadId)
+            self.uploads.pop(UploadId)
+
+    def put_object(self, Bucket, Key, Body=b"", **kwargs):
+        data = Body if isinstance(Body, bytes) else Body.read()
+        with self.lock:
+            self.calls.append("put_object")
+            self.objects.setdefault(Bucket, {})[Key] = data
+            self.metadata[(Bucket, Key)] = kwargs.get("Metadata", {})
+            etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+            self.etags[(Bucket, Key)] = etag
+
+        return {"ETag": etag}
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs=None, Config=None):
+        # like old s3transfer versions copying by parts, metadata of source isn't copied
+        extra_args = ExtraArgs if ExtraArgs else {}
+        with self.lock:
+            self.calls.append("copy")
+            self.copy_concurrency.append(Config.max_concurrency if Config is not None else None)
+            data = self.objects[CopySource["Bucket"]][CopySource["Key"]]
+            self.objects.setdefault(Bucket, {})[Key] = data
+            self.metadata[(Bucket, Key)] = extra_args.get("Metadata", {})
+            self.etags[(Bucket, Key)] = self.etags.get((CopySource["Bucket"], CopySource["Key"]))
+
+    def get_object(self, Bucket, Key, Range=None):
+        with self.lock:
+            self.calls.append("get_object")
+            data = self.objects.get(Bucket, {}).get(Key)
+
+        if data is None:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "Not Found"}}, "GetObject")
+
+        if Range is not None:
+            first_byte, last_byte = Range[len("bytes="):].split("-")
+            data = data[int(first_byte):int(last_byte) + 1]
+
+        return {"Body": io.BytesIO(data)}
+
+    def head_object(self, Bucket, Key):
+        with self.lock:
+            self.calls.append("head_object")
+            if Key not in self.objects.get(Bucket, {}):
+                raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+
+            return {
+                "ContentLength": len(self.objects[Bucket][Key]),
+                "Metadata": self.metadata.get((Bucket, Key), {}),
+                "ETag": self.etags.get((Bucket, Key)),
+            }
+
+    def get_object_tagging(self, Bucket, Key):
+        with self.lock:
+            self.calls.append("get_object_tagging")
+            tags = self.tags.get((Bucket, Key), {})
+
+        return {"TagSet": [{"Key": key, "Value": value} for key, value in tags.items()]}
+
+    def put_object_tagging(self, Bucket, Key, Tagging):
+        with self.lock:
+            self.calls.append("put_object_tagging")
+            self.tags[(Bucket, Key)] = {item["Key"]: item["Value"] for item in Tagging["TagSet"]}
+
+    def delete_objects(self, Bucket, Delete):
+        assert len(Delete["Objects"]) <= 1000
+
+        errors = []
+        with self.lock:
+            self.calls.append("delete_objects")
+            for item in Delete["Objects"]:
+                if item["Key"] in self.undeletable_keys:
+                    errors.append({"Key": item["Key"], "Code": "AccessDenied", "Message": "Access Denied"})
+                    continue
+
+                self.objects.get(Bucket, {}).pop(item["Key"], None)
+
+        return {"Errors": errors} if errors else {}
+
+    def describe_object(self, bucket_name, key):
+        data = self.objects[bucket_name][key]
+        return {
+            "Key": key,
+            "Size": len(data),
+            "ETag": '"{}"'.format(hashlib.md5(data).hexdigest()),
+            "LastModified": datetime.datetime(2020, 1, 1),
+        }
@@ -0,0 +1,43 @@
+import os
+import sys
+import threading
+import time
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.bandwidth_limiter import BandwidthLimiter  # noqa
+
+RATE = 1024 * 1024
+PORTION_SIZE = 32 * 1024
+
+
+def test_rate_is_limited():
+    limiter = BandwidthLimiter(RATE, portion_size=PORTION_SIZE)
+
+    begin = time.monotonic()
+    waited = limiter.consume(RATE // 4 + PORTION_SIZE)
+    spent = time.monotonic() - begin
+
+    assert 0.2 < spent < 1.0
+    assert waited > 0.2
+    assert limiter.consumed_bytes == RATE // 4 + PORTION_SIZE
+
+
+def test_bandwidth_is_shared_evenly():
+    limiter = BandwidthLimiter(RATE, portion_size=PORTION_SIZE)
+    finished = dict()
+
+    def consume(name):
+        limiter.consume(RATE // 8)
+        finished[name] = time.monotonic()
+
+    threads = [threading.Thread(target=consume, args=(name,)) for name in ("first", "second")]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # portions are granted in FIFO order, so both transfers finish almost simultaneously
+    assert abs(finished["first"] - finished["second"]) < 0.1
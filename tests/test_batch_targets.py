@@ -0,0 +1,77 @@
+import os
+import sys
+
+import loguru
+import pytest
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.yabtool_application import YabtoolApplication  # noqa
+from yabtool.yabtool_batch import get_batch_targets, TargetExecutionResult  # noqa
+
+TARGETS_CONTEXT = {
+    "main_db": {"flow_type": "fbs3rotation-flow"},
+    "reports_db": {"flow_type": "pgs3rotation-flow"},
+    "draft_db": {}
+}
+
+
+def test_unknown_targets_are_listed():
+    with pytest.raises(ValueError) as error_info:
+        get_batch_targets(TARGETS_CONTEXT, ["main_db", "mian_db", "other_db"])
+
+    assert "mian_db, other_db" in str(error_info.value)
+
+
+def test_targets_without_flow_type_are_refused():
+    with pytest.raises(ValueError) as error_info:
+        get_batch_targets(TARGETS_CONTEXT)
+
+    assert "draft_db" in str(error_info.value)
+
+    # flow from command line is used for all targets
+    assert get_batch_targets(TARGETS_CONTEXT, ["main_db", "draft_db"], "fbs3rotation-flow") == [
+        ("main_db", "fbs3rotation-flow"),
+        ("draft_db", "fbs3rotation-flow")
+    ]
+
+
+def _create_result(target_name, succeeded):
+    res = TargetExecutionResult(target_name)
+    res.succeeded = succeeded
+    return res
+
+
+def test_failed_targets_fail_application(monkeypatch):
+    def initialize_logger(self, args):
+        self.logger = loguru.logger
+
+    monkeypatch.setattr(YabtoolApplication, "_initialize_logger", initialize_logger)
+    monkeypatch.setattr(
+        YabtoolApplication,
+        "_run_batch",
+        lambda self, args, unknown_args: [_create_result("main_db", True), _create_result("reports_db", False)]
+    )
+    monkeypatch.setattr(
+        YabtoolApplication,
+        "_run_target",
+        lambda self, args, unknown_args: _create_result("main_db", True)
+    )
+
+    assert not YabtoolApplication().run(["--secrets", "secrets.yaml", "--targets", "main_db,reports_db"])
+    assert YabtoolApplication().run(["--secrets", "secrets.yaml"])
+
+    monkeypatch.setattr(
+        YabtoolApplication,
+        "_run_batch",
+        lambda self, args, unknown_args: [_create_result("main_db", True), _create_result("reports_db", True)]
+    )
+    monkeypatch.setattr(
+        YabtoolApplication,
+        "_run_target",
+        lambda self, args, unknown_args: _create_result("main_db", False)
+    )
+
+    assert YabtoolApplication().run(["--secrets", "secrets.yaml", "--all-targets"])
+    assert not YabtoolApplication().run(["--secrets", "secrets.yaml"])
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+
+from botocore.awsrequest import AWSResponse
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.boto_clients_registry import BotoClientsRegistry, get_created_connections_count  # noqa
+
+CREDENTIALS = {"aws_access_key_id": "key", "aws_secret_access_key": "secret"}
+
+
+class FakeRawResponse(object):
+    def stream(self, **kwargs):
+        yield b"<ListAllMyBucketsResult></ListAllMyBucketsResult>"
+
+
+def _respond_without_network(**kwargs):
+    return AWSResponse(kwargs["request"].url, 200, {}, FakeRawResponse())
+
+
+def test_clients_are_shared_by_key():
+    registry = BotoClientsRegistry()
+
+    client = registry.get_client("s3", region_name="us-east-1", **CREDENTIALS)
+    assert registry.get_client("s3", region_name="us-east-1", **CREDENTIALS) is client
+
+    other_clients = [
+        registry.get_client("s3", region_name="us-east-1", aws_access_key_id="key", aws_secret_access_key="other"),
+        registry.get_client("s3", region_name="us-east-1", aws_access_key_id="other", aws_secret_access_key="secret"),
+        registry.get_client("s3", region_name="eu-west-1", **CREDENTIALS),
+        registry.get_client("s3", region_name="us-east-1", endpoint_url="http://localhost:9000", **CREDENTIALS),
+        registry.get_client("s3", region_name="us-east-1", max_pool_connections=50, **CREDENTIALS),
+        registry.get_client("ses", region_name="us-east-1", **CREDENTIALS),
+    ]
+    assert len(set(id(item) for item in [client] + other_clients)) == 7
+
+    # default size of pool is the same key
+    assert registry.get_client("s3", region_name="us-east-1", max_pool_connections=10, **CREDENTIALS) is client
+
+    statistics = registry.get_statistics()
+    assert statistics.clients_created == 7
+    assert statistics.clients_reused == 2
+
+
+def test_one_client_is_created_for_concurrent_requests():
+    registry = BotoClientsRegistry()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: registry.get_client("s3", region_name="us-east-1", **CREDENTIALS), range(64)))
+
+    assert all(item is clients[0] for item in clients)
+
+    statistics = registry.get_statistics()
+    assert statistics.clients_created == 1
+    assert statistics.clients_reused == 63
+
+
+def test_requests_are_counted_without_connections_internals():
+    registry = BotoClientsRegistry()
+    client = registry.get_client("s3", region_name="us-east-1", **CREDENTIALS)
+    client.meta.events.register("before-send", _respond_without_network)
+
+    client.list_buckets()
+    client.list_buckets()
+
+    statistics = registry.get_statistics()
+    assert statistics.requests_sent == 2
+    assert statistics.connections_created == get_created_connections_count(client) == 0
+    assert statistics.connections_reused == 2
+
+    # private layout of botocore is not available
+    client._endpoint = None
+    assert get_created_connections_count(client) is None
+
+    statistics = registry.get_statistics()
+    assert statistics.requests_sent == 2
+    assert statistics.connections_created is None
+    assert statistics.connections_reused is None
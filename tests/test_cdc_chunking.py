@@ -0,0 +1,84 @@
+import io
+import os
+import random
+import sys
+
+import loguru
+import pytest
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.chunking import ContentDefinedChunker, NATIVE_CHUNKING_AVAILABLE  # noqa
+from yabtool.supported_steps.cdc_chunk_store import (  # noqa
+    ChunkCodec,
+    ChunkedBackupWriter,
+    LocalChunkIndex,
+    LocalChunkStore,
+    restore_from_manifest
+)
+
+
+def _create_chunker(use_native=True):
+    return ContentDefinedChunker(min_size=1024, average_size=4096, max_size=16384, use_native=use_native)
+
+
+def _random_data(size, seed):
+    generator = random.Random(seed)
+    return bytes(generator.getrandbits(8) for _ in range(size))
+
+
+def test_insertion_changes_only_nearby_chunks():
+    data = _random_data(200000, seed=1)
+    modified_data = data[:100000] + b"inserted" + data[100000:]
+
+    chunks = list(_create_chunker().iterate_stream_chunks(io.BytesIO(data), read_size=20000))
+    modified_chunks = list(_create_chunker().iterate_stream_chunks(io.BytesIO(modified_data), read_size=20000))
+
+    assert b"".join(modified_chunks) == modified_data
+    assert len(set(chunks) - set(modified_chunks)) <= 2
+
+
+@pytest.mark.skipif(not NATIVE_CHUNKING_AVAILABLE, reason="native chunking extension isn't built")
+def test_native_and_python_boundaries_are_same():
+    # long runs of zeros reach max size of chunk, random data hits boundaries by masks
+    data = _random_data(300000, seed=3) + bytes(40000) + _random_data(50000, seed=4)
+
+    native_chunks = list(_create_chunker().iterate_stream_chunks(io.BytesIO(data), read_size=30000))
+    python_chunks = list(_create_chunker(use_native=False).iterate_stream_chunks(io.BytesIO(data), read_size=30000))
+
+    assert _create_chunker().is_native
+    assert native_chunks == python_chunks
+    assert b"".join(native_chunks) == data
+
+
+def test_only_new_chunks_are_stored(tmp_path):
+    store = LocalChunkStore(str(tmp_path / "store"))
+    codec = ChunkCodec(compression_preset=0)
+    chunk_index = LocalChunkIndex(str(tmp_path / "index"), store.location, "main/chunks")
+    chunk_index.load()
+
+    def write(file_data):
+        file_name = str(tmp_path / "db.fbk")
+        with open(file_name, "wb") as output_file:
+            output_file.write(file_data)
+
+        writer = ChunkedBackupWriter(loguru.logger, _create_chunker(), codec, store, "main/chunks", chunk_index)
+        return writer.write_file(file_name)
+
+    data = _random_data(100000, seed=2)
+    _, statistics = write(data)
+    assert statistics.new_bytes == len(data)
+
+    modified_data = data[:50000] + b"changed" + data[50007:]
+    manifest, statistics = write(modified_data)
+    assert 0 < statistics.new_bytes < len(data) / 4
+    assert statistics.deduplicated_bytes > len(data) / 2
+
+    # index is persistent, so chunks stored by previous executions are skipped without lookups
+    chunk_index = LocalChunkIndex(str(tmp_path / "index"), store.location, "main/chunks")
+    assert chunk_index.load() == len(store.list_keys("main/chunks"))
+
+    output_stream = io.BytesIO()
+    assert restore_from_manifest(store, codec, manifest, output_stream) == len(modified_data)
+    assert output_stream.getvalue() == modified_data
@@ -0,0 +1,125 @@
+import datetime
+import json
+import os
+import sys
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.jinja2_helpers import create_rendering_environment  # noqa
+from yabtool.supported_steps.cdc_chunk_store import LocalChunkStore  # noqa
+from yabtool.supported_steps.step_cdc_upload_with_rotation import StepCdcUploadWithRotation  # noqa
+from yabtool.yabtool_flow_orchestrator import get_date_rendering_values, RenderingContext  # noqa
+from yabtool.yabtool_stat import StepExecutionStatisticEntry  # noqa
+
+UPLOAD_RULES = [
+    {
+        "name": "weekdays",
+        "destination_prefix": "{{target_prefix_in_bucket}}/manifests/weekdays/{{week_day_short_name | lower}}",
+        "dedup_tag_name": "flag_{{current_date}}_{{week_day_short_name}}",
+        "dedup_tag_value": "1"
+    },
+    {
+        "name": "weekly",
+        "destination_prefix": "{{target_prefix_in_bucket}}/manifests/weeks/{{week_number}}",
+        "dedup_tag_name": "flag_{{current_year}}_{{week_number}}",
+        "dedup_tag_value": "1"
+    },
+]
+
+
+def _run_step(tmp_path, date, data):
+    backup_folder = tmp_path / "backup"
+    backup_folder.mkdir(exist_ok=True)
+    with open(str(backup_folder / "db.fbk"), "wb") as output_file:
+        output_file.write(data)
+
+    rendering_context = RenderingContext()
+    rendering_context.root_temporary_folder = str(tmp_path / "temp")
+    rendering_context.basic_values = {"main_target_name": "main", **get_date_rendering_values(date)}
+
+    step_context = {
+        "name": "cdc_upload_with_rotation",
+        "source_file": str(backup_folder / "db.fbk"),
+        "prefix_in_bucket": "backups/",
+        "target_prefix_in_bucket": "{{prefix_in_bucket}}{{main_target_name}}/cdc",
+        "chunks_prefix": "{{target_prefix_in_bucket}}/chunks",
+        "chunk_store": "local",
+        "local_chunk_store_folder": str(tmp_path / "store"),
+        "min_chunk_size_kib": 1,
+        "average_chunk_size_kib": 4,
+        "max_chunk_size_kib": 16,
+        "compression_preset": 0,
+        "max_chunk_threads": 2,
+        "upload_rules": UPLOAD_RULES
+    }
+
+    step = StepCdcUploadWithRotation(
+        logger=loguru.logger,
+        rendering_context=rendering_context,
+        step_context=step_context,
+        secret_context={},
+        rendering_environment=create_rendering_environment()
+    )
+    stat_entry = StepExecutionStatisticEntry(step.step_name())
+    skip_vote = step.vote_for_flow_execution_skipping()
+    step.run(stat_entry)
+    return skip_vote, stat_entry.metrics
+
+
+def _load_manifest_sizes(store):
+    res = {}
+    for key in store.list_keys("backups/main/cdc/manifests"):
+        res[key.split("/manifests/")[1]] = json.loads(store.get_object(key).decode("utf-8"))["size"]
+
+    return res
+
+
+def _load_chunk_ids(store, slot_name):
+    data = store.get_object("backups/main/cdc/manifests/{}/db.fbk.manifest.json".format(slot_name))
+    return {chunk_id for chunk_id, _ in json.loads(data.decode("utf-8"))["chunks"]}
+
+
+def _get_metric_value(metrics, metric_name):
+    return metrics.get_metric(metric_name).value
+
+
+def test_first_backup_of_week_is_kept_and_unreferenced_chunks_are_removed(tmp_path):
+    store = LocalChunkStore(str(tmp_path / "store"))
+
+    # weekly slot is filled by Monday, Tuesday fills only its weekday slot
+    _run_step(tmp_path, datetime.datetime(2020, 1, 13), os.urandom(40000))
+    skip_vote, metrics = _run_step(tmp_path, datetime.datetime(2020, 1, 14), os.urandom(50000))
+    assert not skip_vote
+    assert _get_metric_value(metrics, StepCdcUploadWithRotation.METRIC_MANIFESTS_COUNT) == 1
+    assert _load_manifest_sizes(store) == {
+        "weekdays/mon/db.fbk.manifest.json": 40000,
+        "weekdays/tue/db.fbk.manifest.json": 50000,
+        "weeks/02/db.fbk.manifest.json": 40000
+    }
+
+    # second execution of the same day is skipped by vote and writes nothing
+    skip_vote, metrics = _run_step(tmp_path, datetime.datetime(2020, 1, 14), os.urandom(60000))
+    assert skip_vote
+    assert _get_metric_value(metrics, StepCdcUploadWithRotation.METRIC_MANIFESTS_COUNT) is None
+
+    monday_chunks = _load_chunk_ids(store, "weekdays/mon")
+    tuesday_chunks = _load_chunk_ids(store, "weekdays/tue")
+
+    _, metrics = _run_step(tmp_path, datetime.datetime(2020, 1, 21), os.urandom(30000))
+    _run_step(tmp_path, datetime.datetime(2020, 1, 20), os.urandom(20000))
+
+    assert _load_manifest_sizes(store) == {
+        "weekdays/mon/db.fbk.manifest.json": 20000,
+        "weekdays/tue/db.fbk.manifest.json": 30000,
+        "weeks/02/db.fbk.manifest.json": 40000,
+        "weeks/03/db.fbk.manifest.json": 30000
+    }
+
+    # chunks of replaced Tuesday backup aren't referenced anymore, ones of Monday are kept by weekly slot
+    stored_chunks = {key.rsplit("/", 1)[-1] for key in store.list_keys("backups/main/cdc/chunks")}
+    assert _get_metric_value(metrics, StepCdcUploadWithRotation.METRIC_REMOVED_CHUNKS_COUNT) == len(tuesday_chunks)
+    assert not tuesday_chunks & stored_chunks
+    assert monday_chunks <= stored_chunks
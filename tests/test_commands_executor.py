@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.process_priority import call_with_priority, ProcessPriority  # noqa
+from yabtool.supported_steps.shared import ThirdPartyCommandsExecutor  # noqa
+
+
+def _python_command(code):
+    return [sys.executable, "-c", code]
+
+
+def test_only_tail_of_output_is_kept(tmp_path):
+    log_file_name = str(tmp_path / "stderr.log")
+    code = "import sys\nfor i in range(5000): print('line', i)\nsys.stderr.write('failed\\n')\nsys.exit(3)"
+
+    with open(log_file_name, "wb") as log_file:
+        result = ThirdPartyCommandsExecutor.execute(
+            _python_command(code),
+            shell=False,
+            stderr_file=log_file,
+            max_tail_lines=2
+        )
+
+    assert result.returncode == 3
+    assert result.stdout.splitlines() == [b"line 4998", b"line 4999"]
+    with open(log_file_name, "rb") as log_file:
+        assert log_file.read().strip() == b"failed"
+
+
+def test_command_is_killed_on_timeout():
+    with pytest.raises(subprocess.TimeoutExpired):
+        ThirdPartyCommandsExecutor.execute(_python_command("import time\ntime.sleep(30)"), shell=False, timeout=0.5)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="usage of children is collected by wait4 on posix only")
+def test_resource_usage_of_command_is_collected():
+    code = "data = bytearray(64 * 1024 * 1024)\nsum(range(3000000))"
+    result = ThirdPartyCommandsExecutor.execute(_python_command(code), shell=False)
+
+    assert result.returncode == 0
+    assert result.resource_usage.cpu_seconds > 0
+    assert result.resource_usage.peak_rss_bytes > 64 * 1024 * 1024
+    assert result.resource_usage.elapsed_seconds > 0
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="priority of threads is changed on Linux only")
+def test_priority_is_applied_to_command():
+    priority = ProcessPriority.from_config({"nice": 19, "cpu_affinity": [0]})
+    code = "import os\nprint(os.getpriority(os.PRIO_PROCESS, 0), sorted(os.sched_getaffinity(0)))"
+
+    result = ThirdPartyCommandsExecutor.execute(_python_command(code), shell=False, priority=priority)
+
+    assert result.stdout.strip() == b"19 [0]"
+    assert os.getpriority(os.PRIO_PROCESS, 0) != 19
+
+
+def test_environment_is_passed_to_command_only():
+    code = "import os\nprint(os.environ.get('YABTOOL_TEST_PASSWORD'))"
+    result = ThirdPartyCommandsExecutor.execute(
+        _python_command(code),
+        shell=False,
+        env={**os.environ, "YABTOOL_TEST_PASSWORD": "secret"}
+    )
+
+    assert result.stdout.strip() == b"secret"
+    assert "YABTOOL_TEST_PASSWORD" not in os.environ
+
+
+class ListLogger(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+
+def test_function_is_called_when_priority_can_not_be_lowered(monkeypatch):
+    def apply_to_current_thread(self):
+        raise PermissionError("operation not permitted")
+
+    monkeypatch.setattr(ProcessPriority, "apply_to_current_thread", apply_to_current_thread)
+    logger = ListLogger()
+
+    result = call_with_priority(ProcessPriority.from_config({"nice": 10}), logger, sum, [1, 2], start=3)
+
+    assert result == 6
+    assert logger.warnings == ["can't lower priority: operation not permitted"]
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.supported_steps.s3_steps_shared import S3ContentIndex  # noqa
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient  # noqa
+
+
+def test_unchanged_content_is_found_by_hash(tmp_path):
+    raw_client = FakeS3Client()
+    basic_client = S3BasicBotoClient(loguru.logger, raw_client)
+    content_index = S3ContentIndex(loguru.logger, basic_client, "bucket")
+
+    file_name = str(tmp_path / "reference.7z")
+    with open(file_name, "wb") as output_file:
+        output_file.write(b"reference data")
+
+    metadata = {S3ContentIndex.CONTENT_HASH_METADATA_NAME: "ab"}
+    basic_client.upload_file("bucket", "main/daily/mon/reference.7z", file_name, metadata=metadata)
+
+    entries = content_index.load("main")
+    assert entries == {}
+
+    S3ContentIndex.add_entry(entries, "ab", "main/daily/mon/reference.7z", 14)
+    content_index.save("main", entries)
+    entries = content_index.load("main")
+
+    assert content_index.find_key(entries, "ab") == "main/daily/mon/reference.7z"
+    assert content_index.find_key(entries, "cd") is None
+
+    # object removed by rotation can't be used as source of copy
+    basic_client.delete_objects("bucket", ["main/daily/mon/reference.7z"])
+    assert content_index.find_key(entries, "ab") is None
+
+
+def test_only_recent_entries_are_kept():
+    raw_client = FakeS3Client()
+    content_index = S3ContentIndex(loguru.logger, S3BasicBotoClient(loguru.logger, raw_client), "bucket", max_entries=2)
+
+    entries = {
+        "a": {"key": "a.7z", "size": 1, "uploaded": "2020-01-01T00:00:00"},
+        "b": {"key": "b.7z", "size": 1, "uploaded": "2020-01-03T00:00:00"},
+        "c": {"key": "c.7z", "size": 1, "uploaded": "2020-01-02T00:00:00"},
+    }
+    content_index.save("main", entries)
+
+    assert sorted(content_index.load("main").keys()) == ["b", "c"]
+
+
+def test_copy_receives_content_hash_in_metadata():
+    raw_client = FakeS3Client()
+    basic_client = S3BasicBotoClient(loguru.logger, raw_client)
+    raw_client.put_object(Bucket="bucket", Key="main/daily/mon/reference.7z", Body=b"reference data")
+
+    metadata = {S3ContentIndex.CONTENT_HASH_METADATA_NAME: "ab"}
+    basic_client.copy_file_from_one_bucket_to_another(
+        "bucket",
+        "main/daily/mon/reference.7z",
+        "bucket",
+        "main/weekly/01/reference.7z",
+        metadata=metadata
+    )
+
+    assert basic_client.get_object_metadata("bucket", "main/weekly/01/reference.7z") == metadata
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.build_dedup_index import collect_tags_by_prefix  # noqa
+from yabtool.supported_steps.s3_steps_shared import S3DedupIndex  # noqa
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient  # noqa
+
+
+def test_index_is_built_from_tags_of_existing_objects():
+    raw_client = FakeS3Client()
+    client = S3BasicBotoClient(loguru.logger, raw_client)
+    for rule_name in ("mon", "tue"):
+        client.put_object("bucket", "main/weekdays/{}/db.7z".format(rule_name), b"archive")
+        client.put_object("bucket", "main/weekdays/{}/db.7z.sha256".format(rule_name), b"hash")
+        client.set_object_tags("bucket", "main/weekdays/{}/db.7z".format(rule_name), {"flag_" + rule_name: "1"})
+
+    dedup_index = S3DedupIndex(loguru.logger, client, "bucket")
+    assert dedup_index.load("main/weekdays/mon/") is None
+
+    for destination_prefix, entries in collect_tags_by_prefix(client, "bucket", "main/", 2).items():
+        dedup_index.save(destination_prefix, entries)
+
+    raw_client.calls.clear()
+    entries = dedup_index.load("main/weekdays/mon/")
+
+    assert raw_client.calls == ["get_object"]
+    assert S3DedupIndex.find_key(entries, "flag_mon", "1") == "main/weekdays/mon/db.7z"
+    assert S3DedupIndex.find_key(entries, "flag_mon", "2") is None
+    assert S3DedupIndex.find_key(entries, "flag_tue", "1") is None
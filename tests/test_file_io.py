@@ -0,0 +1,54 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.file_io import CACHE_MODES, SequentialFileReader  # noqa
+from yabtool.shared.hashing import hash_file, hash_file_chunks  # noqa
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 123)
+    file_name = str(tmp_path / "data.bin")
+    with open(file_name, "wb") as output_file:
+        output_file.write(data)
+
+    return file_name, data
+
+
+@pytest.mark.parametrize("cache_mode", CACHE_MODES)
+def test_range_of_file_is_read_in_all_modes(data_file, cache_mode):
+    file_name, data = data_file
+    offset, length = 5000, 2 * 1024 * 1024 + 7
+
+    with SequentialFileReader(file_name, offset, length, cache_mode=cache_mode, drop_window_size=4096) as input_file:
+        buffer = bytearray(100003)
+        result = bytearray()
+        while True:
+            read_bytes = input_file.readinto(buffer)
+            if not read_bytes:
+                break
+
+            result += buffer[:read_bytes]
+
+        assert result == data[offset:offset + length]
+
+        input_file.seek(10)
+        assert input_file.read(100) == data[offset + 10:offset + 110]
+
+
+@pytest.mark.parametrize("cache_mode", CACHE_MODES)
+def test_hashes_do_not_depend_on_cache_mode(data_file, cache_mode):
+    file_name, data = data_file
+
+    hasher, hashed_bytes = hash_file(file_name, ["sha256"], buffer_size=1024 * 1024, cache_mode=cache_mode)
+    assert hashed_bytes == len(data)
+    assert hasher.hexdigests()["sha256"] == hashlib.sha256(data).hexdigest()
+
+    chunks = hash_file_chunks(file_name, ["md5"], 1024 * 1024, max_workers=2, cache_mode=cache_mode)
+    assert chunks.chunks_digests[-1]["md5"] == hashlib.md5(data[3 * 1024 * 1024:]).digest()
@@ -0,0 +1,99 @@
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.hashing import (  # noqa
+    CompositeDigestHasher,
+    hash_file,
+    hash_file_chunks,
+    hash_file_with_chunks,
+    HashingReader
+)
+
+CHUNK_SIZE = 64 * 1024
+BUFFER_SIZE = 16 * 1024
+
+
+def create_file(tmp_path, size):
+    data = os.urandom(size)
+    file_name = str(tmp_path / "data.bin")
+    with open(file_name, "wb") as output_file:
+        output_file.write(data)
+
+    return file_name, data
+
+
+@pytest.mark.parametrize("size", [0, CHUNK_SIZE, 3 * CHUNK_SIZE + 17])
+def test_file_is_hashed_as_whole_and_by_chunks_in_single_pass(tmp_path, size):
+    file_name, data = create_file(tmp_path, size)
+
+    result = hash_file_with_chunks(file_name, ["sha256", "md5"], CHUNK_SIZE, buffer_size=10000)
+    parallel_result = hash_file_chunks(file_name, ["sha256", "md5"], CHUNK_SIZE, max_workers=2)
+
+    assert result.file_size == size
+    assert result.full_hexdigests() == {"sha256": hashlib.sha256(data).hexdigest(), "md5": hashlib.md5(data).hexdigest()}
+    assert result.chunks_digests == parallel_result.chunks_digests
+    assert result.composite_digests() == parallel_result.composite_digests()
+
+    chunks_list = result.format_chunks_list("data.bin")
+    assert "# composite MD5 {}\n".format(result.composite_digests()["md5"]) in chunks_list
+
+
+def s3_multipart_etag(data, part_size):
+    digests = b"".join(
+        hashlib.md5(data[offset:offset + part_size]).digest() for offset in range(0, max(len(data), 1), part_size)
+    )
+    return "{}-{}".format(hashlib.md5(digests).hexdigest(), max(1, (len(data) + part_size - 1) // part_size))
+
+
+@pytest.mark.parametrize("size", [0, 1, BUFFER_SIZE, 2 * BUFFER_SIZE, 5 * BUFFER_SIZE + 3])
+@pytest.mark.parametrize("hash_types", [["sha256"], ["md5", "sha1"], ["sha512", "md5", "blake2b"]])
+def test_file_is_hashed_with_double_buffering_like_hashlib(tmp_path, size, hash_types):
+    file_name, data = create_file(tmp_path, size)
+
+    hasher, hashed_bytes = hash_file(file_name, hash_types, buffer_size=BUFFER_SIZE)
+
+    assert hashed_bytes == size
+    assert hasher.hexdigests() == {hash_type: hashlib.new(hash_type, data).hexdigest() for hash_type in hash_types}
+
+
+@pytest.mark.parametrize("size", [1, CHUNK_SIZE - 1, CHUNK_SIZE, 4 * CHUNK_SIZE + 1])
+def test_chunks_digests_are_equal_to_s3_multipart_etag(tmp_path, size):
+    file_name, data = create_file(tmp_path, size)
+
+    result = hash_file_chunks(file_name, ["md5"], CHUNK_SIZE, max_workers=3, buffer_size=BUFFER_SIZE)
+
+    assert result.chunks_count == max(1, (size + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    assert result.composite_digests()["md5"] == s3_multipart_etag(data, CHUNK_SIZE)
+
+
+def test_composite_digest_does_not_depend_on_sizes_of_pieces():
+    data = os.urandom(3 * CHUNK_SIZE + 100)
+
+    for piece_size in [1000, CHUNK_SIZE, CHUNK_SIZE + 1, len(data)]:
+        hasher = CompositeDigestHasher("md5", CHUNK_SIZE)
+        for offset in range(0, len(data), piece_size):
+            hasher.update(data[offset:offset + piece_size])
+
+        assert hasher.hexdigest() == s3_multipart_etag(data, CHUNK_SIZE)
+
+    assert CompositeDigestHasher("md5", CHUNK_SIZE).hexdigest() == s3_multipart_etag(b"", CHUNK_SIZE)
+
+
+def test_data_read_again_is_not_hashed_twice():
+    data = os.urandom(3 * CHUNK_SIZE + 100)
+    reader = HashingReader(io.BytesIO(data), "md5", CHUNK_SIZE)
+
+    while reader.read(CHUNK_SIZE):
+        # retried request reads the same part again
+        reader.seek(-CHUNK_SIZE // 2, 1)
+        reader.read(CHUNK_SIZE // 2)
+
+    assert reader.hexdigest(len(data)) == s3_multipart_etag(data, CHUNK_SIZE)
+    assert reader.hexdigest(len(data) + 1) is None
@@ -0,0 +1,178 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import os
+import sys
+
+import loguru
+import pytest
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.shared.chunking import ContentDefinedChunker  # noqa
+from yabtool.shared.hashing import format_hash_file_content, hash_file_chunks  # noqa
+from yabtool.supported_steps.base import TransmissionError  # noqa
+from yabtool.supported_steps.cdc_chunk_store import ChunkedBackupWriter, dump_manifest, restore_from_manifest  # noqa
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient  # noqa
+from yabtool.yabtool_restore import (  # noqa
+    _restore_into_command,
+    _write_output,
+    create_chunk_codec,
+    create_chunk_store,
+    find_archive_key,
+    find_manifest,
+    load_expected_hashes,
+    load_hashed_chunk_size,
+    ParallelRangeDownloader,
+    restore_object,
+    RestoreSource
+)
+
+
+def _create_downloader(data, part_size=1000, max_threads=4):
+    raw_client = FakeS3Client()
+    raw_client.put_object(Bucket="bucket", Key="main/weekly/02/db.7z", Body=data)
+
+    return ParallelRangeDownloader(raw_client, "bucket", "main/weekly/02/db.7z", len(data), part_size, max_threads)
+
+
+def test_ranges_are_written_in_order():
+    data = os.urandom(10500)
+    downloader = _create_downloader(data)
+
+    output_stream = io.BytesIO()
+    expected_hashes = {"sha256": hashlib.sha256(data).hexdigest()}
+
+    assert restore_object(downloader, output_stream, expected_hashes) == len(data)
+    assert output_stream.getvalue() == data
+
+
+def test_hash_mismatch_fails_restore():
+    downloader = _create_downloader(b"archive data")
+
+    with pytest.raises(TransmissionError):
+        restore_object(downloader, io.BytesIO(), {"sha256": hashlib.sha256(b"other data").hexdigest()})
+
+
+@pytest.mark.parametrize("upload_chunks_list", [True, False])
+def test_archive_with_chunked_hash_file_is_verified(tmp_path, upload_chunks_list):
+    data = os.urandom(2 * 1024 * 1024 + 100)
+    file_name = str(tmp_path / "db.7z")
+    with open(file_name, "wb") as output_file:
+        output_file.write(data)
+
+    # "auto" chunk size of hash step is 8 MiB, so explicit 1 MiB size is known from chunks list only
+    chunk_size = 1024 * 1024 if upload_chunks_list else 8 * 1024 * 1024
+    chunked_result = hash_file_chunks(file_name, ["sha256", "md5"], chunk_size)
+
+    downloader = _create_downloader(data, part_size=300000)
+    raw_client = downloader._client
+    prefix = "main/weekly/02"
+    raw_client.put_object(
+        Bucket="bucket",
+        Key=prefix + "/db.7z.sha256",
+        Body=format_hash_file_content(chunked_result.composite_digests(), "db.7z").encode("utf-8")
+    )
+    if upload_chunks_list:
+        raw_client.put_object(
+            Bucket="bucket",
+            Key=prefix + "/db.7z.sha256.chunks",
+            Body=chunked_result.format_chunks_list("db.7z").encode("utf-8")
+        )
+
+    basic_client = S3BasicBotoClient(loguru.logger, raw_client)
+    archive_key, hash_key = find_archive_key(basic_client, "bucket", prefix, "sha256")
+    assert archive_key == prefix + "/db.7z"
+
+    expected_hashes = load_expected_hashes(basic_client, "bucket", hash_key, "sha256")
+    assert expected_hashes["sha256"] == chunked_result.composite_digests()["sha256"]
+    assert load_hashed_chunk_size(basic_client, "bucket", hash_key, expected_hashes, len(data)) == chunk_size
+
+    output_stream = io.BytesIO()
+    assert restore_object(downloader, output_stream, expected_hashes, chunk_size) == len(data)
+    assert output_stream.getvalue() == data
+
+
+def test_composite_hash_without_chunk_size_is_refused():
+    downloader = _create_downloader(b"archive data")
+
+    with pytest.raises(ValueError):
+        restore_object(downloader, io.BytesIO(), {"sha256": "v106/7c+/S7Gw2rTES3ZM+/tY8Thy//PqI4nWcFE8tg=-1"})
+
+
+def test_chunked_backup_is_restored_from_manifest(tmp_path):
+    data = os.urandom(300000)
+    file_name = str(tmp_path / "db.fbk")
+    with open(file_name, "wb") as output_file:
+        output_file.write(data)
+
+    source = RestoreSource()
+    source.bucket_name = "bucket"
+    source.prefix = "main/cdc/manifests/weekly/02"
+    source.step_context = {"name": "cdc_upload_with_rotation", "chunk_store": "s3", "compression_preset": 0}
+    source.render = lambda template: template
+    assert source.is_chunked
+
+    basic_client = S3BasicBotoClient(loguru.logger, FakeS3Client())
+    store = create_chunk_store(source, basic_client)
+    codec = create_chunk_codec(source)
+
+    chunker = ContentDefinedChunker(min_size=1024, average_size=4096, max_size=16384)
+    writer = ChunkedBackupWriter(loguru.logger, chunker, codec, store, "main/cdc/chunks")
+    manifest, _ = writer.write_file(file_name)
+    store.put_object(source.prefix + "/db.fbk.manifest.json", dump_manifest(manifest))
+
+    manifest_key, loaded_manifest = find_manifest(store, source.prefix)
+    assert manifest_key == source.prefix + "/db.fbk.manifest.json"
+
+    output_stream = io.BytesIO()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        restored_bytes = restore_from_manifest(
+            store,
+            codec,
+            loaded_manifest,
+            output_stream,
+            executor=executor,
+            max_pending_chunks=8
+        )
+
+    assert restored_bytes == len(data)
+    assert output_stream.getvalue() == data
+
+
+def _write_and_fail(output_stream):
+    output_stream.write(b"partial data")
+    output_stream.flush()
+    raise TransmissionError("sha256 of restored 'db.7z' is wrong")
+
+
+def test_output_file_is_not_replaced_when_restore_fails(tmp_path):
+    args = argparse.Namespace(pipe_command=None, output=str(tmp_path))
+    with open(str(tmp_path / "db.7z"), "wb") as output_file:
+        output_file.write(b"previous backup")
+
+    with pytest.raises(TransmissionError):
+        _write_output(loguru.logger, args, "db.7z", _write_and_fail)
+
+    assert os.listdir(str(tmp_path)) == ["db.7z"]
+    with open(str(tmp_path / "db.7z"), "rb") as input_file:
+        assert input_file.read() == b"previous backup"
+
+    assert _write_output(loguru.logger, args, "db.7z", lambda output_stream: output_stream.write(b"backup")) == 6
+    with open(str(tmp_path / "db.7z"), "rb") as input_file:
+        assert input_file.read() == b"backup"
+
+
+@pytest.mark.skipif(os.name != "posix", reason="shell pipeline of test requires posix")
+def test_command_is_terminated_when_restore_fails(tmp_path):
+    output_file_name = str(tmp_path / "restored.fbk")
+    marker_file_name = str(tmp_path / "finished")
+    command = "cat > '{}' && touch '{}'".format(output_file_name, marker_file_name)
+
+    with pytest.raises(TransmissionError):
+        _restore_into_command(loguru.logger, command, _write_and_fail)
+
+    assert not os.path.exists(marker_file_name)
@@ -0,0 +1,273 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import os
+import sys
+import threading
+
+import loguru
+import pytest
+from s3transfer.utils import ChunksizeAdjuster
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.supported_steps import s3boto_client  # noqa
+from yabtool.supported_steps.base import TransmissionError  # noqa
+from yabtool.supported_steps.s3_transfer_manager import S3TransferManager  # noqa
+from yabtool.supported_steps.s3_upload_engine import S3MultipartUploadEngine  # noqa
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient, S3UploadRequest  # noqa
+
+PART_SIZE = 5 * 1024
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def create_file(tmp_path, size):
+    file_name = str(tmp_path / "archive.7z")
+    with open(file_name, "wb") as output_file:
+        output_file.write(os.urandom(size))
+
+    return file_name
+
+
+def create_engine(raw_client, tmp_path):
+    return S3MultipartUploadEngine(
+        loguru.logger,
+        raw_client,
+        str(tmp_path / "checkpoints"),
+        part_size=PART_SIZE,
+        max_threads=1
+    )
+
+
+def test_interrupted_upload_is_resumed_from_checkpoint(tmp_path):
+    file_name = create_file(tmp_path, PART_SIZE * 10 + 17)
+    raw_client = FakeS3Client()
+    raw_client.fail_after_parts = 6
+
+    with pytest.raises(ConnectionError):
+        create_engine(raw_client, tmp_path).upload_file("bucket", "backups/archive.7z", file_name)
+
+    assert len(os.listdir(str(tmp_path / "checkpoints"))) == 1
+
+    raw_client.fail_after_parts = None
+    raw_client.calls.clear()
+    result = create_engine(raw_client, tmp_path).upload_file("bucket", "backups/archive.7z", file_name)
+
+    assert result.resumed
+    assert result.resumed_bytes == PART_SIZE * 6
+    assert raw_client.calls.count("upload_part") == 5
+    assert "create_multipart_upload" not in raw_client.calls
+    with open(file_name, "rb") as input_file:
+        assert raw_client.objects["bucket"]["backups/archive.7z"] == input_file.read()
+    assert os.listdir(str(tmp_path / "checkpoints")) == []
+
+
+def test_upload_is_restarted_when_multipart_upload_was_aborted(tmp_path):
+    file_name = create_file(tmp_path, PART_SIZE * 3 + 1)
+    raw_client = FakeS3Client()
+    raw_client.fail_after_parts = 2
+
+    with pytest.raises(ConnectionError):
+        create_engine(raw_client, tmp_path).upload_file("bucket", "archive.7z", file_name)
+
+    for upload in raw_client.uploads.values():
+        upload["initiated"] -= datetime.timedelta(days=3)
+
+    engine = create_engine(raw_client, tmp_path)
+    assert engine.abort_stale_uploads("bucket", max_age_seconds=24 * 60 * 60) == 1
+    assert raw_client.uploads == {}
+
+    raw_client.fail_after_parts = None
+    result = engine.upload_file("bucket", "archive.7z", file_name)
+
+    assert not result.resumed
+    assert result.parts_count == 4
+
+
+def test_auto_tuned_upload_stays_within_concurrency_limits(tmp_path):
+    file_name = create_file(tmp_path, PART_SIZE * 40 + 3)
+    raw_client = FakeS3Client()
+    engine = S3MultipartUploadEngine(
+        loguru.logger,
+        raw_client,
+        str(tmp_path / "checkpoints"),
+        part_size=PART_SIZE,
+        max_threads=8,
+        auto_tune=True
+    )
+
+    result = engine.upload_file("bucket", "archive.7z", file_name)
+
+    assert result.parts_count == 41
+    assert 1 <= result.concurrency <= result.max_concurrency <= 8
+    with open(file_name, "rb") as input_file:
+        assert raw_client.objects["bucket"]["archive.7z"] == input_file.read()
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.pending_count = 0
+        self.max_pending_count = 0
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        with self._lock:
+            self.pending_count += 1
+            self.max_pending_count = max(self.max_pending_count, self.pending_count)
+
+        future = super().submit(function, *args)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        with self._lock:
+            self.pending_count -= 1
+
+
+def test_parts_are_submitted_into_shared_executor_within_concurrency_limit(tmp_path):
+    file_name = create_file(tmp_path, PART_SIZE * 20 + 3)
+    raw_client = FakeS3Client()
+    executor = CountingExecutor(max_workers=8)
+    engine = S3MultipartUploadEngine(
+        loguru.logger,
+        raw_client,
+        str(tmp_path / "checkpoints"),
+        part_size=PART_SIZE,
+        max_threads=2,
+        executor=executor
+    )
+
+    with executor:
+        result = engine.upload_file("bucket", "archive.7z", file_name)
+
+    assert result.parts_count == 21
+    # slot is returned by part just before its task is finished, so the next part may be submitted earlier
+    assert executor.max_pending_count <= 3
+
+
+def test_several_files_are_uploaded_with_shared_transfer_manager(tmp_path):
+    raw_client = FakeS3Client()
+    transfer_manager = S3TransferManager(raw_client, max_threads=4)
+    basic_client = S3BasicBotoClient(
+        loguru.logger,
+        raw_client,
+        checkpoints_folder=str(tmp_path / "checkpoints"),
+        part_size=PART_SIZE,
+        transfer_manager=transfer_manager
+    )
+
+    archive_file_name = create_file(tmp_path, PART_SIZE * 4 + 3)
+    hash_file_name = str(tmp_path / "archive.7z.sha256")
+    with open(hash_file_name, "w") as output_file:
+        output_file.write("hash")
+
+    results = basic_client.upload_files([
+        S3UploadRequest("bucket", "archive.7z", archive_file_name, None),
+        S3UploadRequest("bucket", "archive.7z.sha256", hash_file_name, None),
+    ])
+    transfer_manager.close()
+
+    assert [item.parts_count for item in results] == [5, 1]
+    assert raw_client.objects["bucket"]["archive.7z.sha256"] == b"hash"
+    with pytest.raises(RuntimeError):
+        _ = transfer_manager.parts_executor  # noqa
+
+
+class CorruptingS3Client(FakeS3Client):
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        super().complete_multipart_upload(Bucket, Key, UploadId, MultipartUpload)
+        return {"ETag": '"{}-{}"'.format("0" * 32, len(MultipartUpload["Parts"]))}
+
+
+def test_etag_of_uploaded_object_is_verified(tmp_path):
+    file_name = create_file(tmp_path, PART_SIZE * 3 + 5)
+
+    result = create_engine(FakeS3Client(), tmp_path).upload_file("bucket", "archive.7z", file_name)
+    assert result.verified
+
+    with pytest.raises(TransmissionError):
+        create_engine(CorruptingS3Client(), tmp_path).upload_file("bucket", "archive.7z", file_name)
+
+
+def test_small_file_is_put_with_single_request(tmp_path):
+    file_name = create_file(tmp_path, PART_SIZE - 1)
+    raw_client = FakeS3Client()
+    basic_client = S3BasicBotoClient(loguru.logger, raw_client, part_size=PART_SIZE)
+
+    results = [
+        create_engine(raw_client, tmp_path).upload_file("bucket", "engine.7z", file_name, metadata={"tag": "a"}),
+        basic_client.upload_file("bucket", "client.7z", file_name, metadata={"tag": "a"})
+    ]
+
+    assert raw_client.calls == ["put_object", "put_object"]
+    for result in results:
+        assert (result.parts_count, result.uploaded_bytes, result.verified) == (1, PART_SIZE - 1, True)
+
+    assert raw_client.objects["bucket"]["engine.7z"] == raw_client.objects["bucket"]["client.7z"]
+    assert raw_client.metadata[("bucket", "client.7z")] == {"tag": "a"}
+
+
+def emulate_s3_transfer(self, source, dest_bucket_name, dest_object_name, transfer_config, progress_reporter, extra_args):
+    # S3Transfer reads parts of seekable file objects sequentially, first part is read again like on retry
+    source.seek(0, 2)
+    size = source.tell()
+    source.seek(0)
+    part_size = ChunksizeAdjuster().adjust_chunksize(transfer_config.multipart_chunksize, size)
+
+    upload_id = self._client.create_multipart_upload(Bucket=dest_bucket_name, Key=dest_object_name)["UploadId"]
+    parts = []
+    for part_number in range(1, (size + part_size - 1) // part_size + 1):
+        data = source.read(part_size)
+        if part_number == 1:
+            source.seek(0)
+            data = source.read(part_size)
+
+        response = self._client.upload_part(
+            Bucket=dest_bucket_name, Key=dest_object_name, UploadId=upload_id, PartNumber=part_number, Body=data
+        )
+        parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+
+    self._client.complete_multipart_upload(
+        Bucket=dest_bucket_name, Key=dest_object_name, UploadId=upload_id, MultipartUpload={"Parts": parts}
+    )
+
+
+def test_transferred_file_is_verified_without_second_read(tmp_path, monkeypatch):
+    file_name = create_file(tmp_path, S3_MIN_PART_SIZE * 2 + 5)
+    raw_client = FakeS3Client()
+    basic_client = S3BasicBotoClient(loguru.logger, raw_client, part_size=PART_SIZE)
+
+    monkeypatch.setattr(S3BasicBotoClient, "_transfer_file", emulate_s3_transfer)
+    monkeypatch.setattr(s3boto_client, "hash_file_chunks", None)
+    result = basic_client.upload_file("bucket", "archive.7z", file_name)
+
+    # S3Transfer increases parts to minimal size allowed by S3
+    assert (result.parts_count, result.part_size, result.verified) == (3, S3_MIN_PART_SIZE, True)
+    with open(file_name, "rb") as input_file:
+        assert raw_client.objects["bucket"]["archive.7z"] == input_file.read()
+
+
+def test_transferred_file_is_hashed_again_when_it_was_not_read_sequentially(tmp_path, monkeypatch):
+    file_name = create_file(tmp_path, PART_SIZE * 3 + 5)
+    raw_client = FakeS3Client()
+    basic_client = S3BasicBotoClient(loguru.logger, raw_client, part_size=PART_SIZE)
+    hashed_files = []
+
+    def transfer_from_second_part(self, source, *args):
+        source.seek(PART_SIZE)
+        source.read()
+        emulate_s3_transfer(self, source, *args)
+
+    def hash_file_chunks(file_name, *args, **kwargs):
+        hashed_files.append(file_name)
+        return original_hash_file_chunks(file_name, *args, **kwargs)
+
+    original_hash_file_chunks = s3boto_client.hash_file_chunks
+    monkeypatch.setattr(S3BasicBotoClient, "_transfer_file", transfer_from_second_part)
+    monkeypatch.setattr(s3boto_client, "hash_file_chunks", hash_file_chunks)
+    result = basic_client.upload_file("bucket", "archive.7z", file_name)
+
+    assert result.verified
+    assert hashed_files == [file_name]
@@ -0,0 +1,156 @@
+import datetime
+import os
+import sys
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.shared.jinja2_helpers import create_rendering_environment  # noqa
+from yabtool.supported_steps.s3_steps_shared import StepS3FileBaseUploader  # noqa
+from yabtool.supported_steps.step_s3_multipart_upload_with_rotation import StepS3MultipartUploadWithRotation  # noqa
+from yabtool.yabtool_flow_orchestrator import get_date_rendering_values, RenderingContext  # noqa
+from yabtool.yabtool_stat import StepExecutionStatisticEntry  # noqa
+
+RULES_NAMES = ["daily", "weekly", "monthly", "yearly", "forever"]
+
+
+class FakeClientRotationUploader(StepS3MultipartUploadWithRotation):
+    def __init__(self, raw_client, **kwargs):
+        super().__init__(**kwargs)
+        self._raw_client = raw_client
+
+    def _crete_s3_client(self):
+        return self._raw_client
+
+
+def _create_step(tmp_path, raw_client, source_files):
+    rendering_context = RenderingContext()
+    rendering_context.root_temporary_folder = str(tmp_path / "temp")
+    rendering_context.unknown_args = []
+    rendering_context.basic_values = {
+        "main_target_name": "main",
+        **get_date_rendering_values(datetime.datetime(2020, 1, 13))
+    }
+
+    step = FakeClientRotationUploader(
+        raw_client,
+        logger=loguru.logger,
+        rendering_context=rendering_context,
+        step_context={
+            "name": "s3_multipart_upload_with_rotation",
+            "prefix_in_bucket": "backups/",
+            "target_prefix_in_bucket": "{{prefix_in_bucket}}{{main_target_name}}",
+            "use_dedup_index": True,
+            "max_concurrent_rules": 3,
+            "max_transmission_threads": 8,
+            "source_files": [{"source_file": item, "add_dedup_tag": True} for item in source_files],
+            "upload_rules": [
+                {
+                    "name": name,
+                    "destination_prefix": "{{target_prefix_in_bucket}}/" + name,
+                    "dedup_tag_name": "flag_{{current_date}}_" + name,
+                    "dedup_tag_value": "uploaded"
+                }
+                for name in RULES_NAMES
+            ]
+        },
+        secret_context={"bucket_name": "bucket", "region": None},
+        rendering_environment=create_rendering_environment()
+    )
+
+    return step, rendering_context
+
+
+def test_concurrent_rules_copy_uploaded_files(tmp_path):
+    source_files = []
+    for name, size in [("db.7z", 3000), ("db.7z.sha256", 64)]:
+        file_name = str(tmp_path / name)
+        with open(file_name, "wb") as output_file:
+            output_file.write(os.urandom(size))
+        source_files.append(file_name)
+
+    raw_client = FakeS3Client()
+    raw_client.put_object(Bucket="bucket", Key="backups/main/weekly/old.7z", Body=b"old")
+
+    step, rendering_context = _create_step(tmp_path, raw_client, source_files)
+    stat_entry = StepExecutionStatisticEntry(step.step_name())
+    try:
+        step.run(stat_entry)
+    finally:
+        rendering_context.flow_resources.close()
+
+    for file_name in source_files:
+        with open(file_name, "rb") as input_file:
+            data = input_file.read()
+
+        for name in RULES_NAMES:
+            assert raw_client.objects["bucket"]["backups/main/{}/{}".format(name, os.path.basename(file_name))] == data
+
+    assert "backups/main/weekly/old.7z" not in raw_client.objects["bucket"]
+
+    # first rule uploads files, others copy them with threads sharing pool of 8 connections
+    metrics = stat_entry.metrics
+    assert metrics.get_metric(StepS3FileBaseUploader.METRIC_UPLOADED_OBJECTS_COUNT).value == 2
+    assert metrics.get_metric(StepS3FileBaseUploader.METRIC_COPIED_OBJECTS_COUNT).value == 8
+    assert raw_client.copy_concurrency == [2] * 8
+
+    for name in RULES_NAMES:
+        metric = metrics.get_metric("Rule Latency ({})".format(name))
+        assert metric.units_name == "seconds"
+        assert metric.value >= 0
+
+    # satisfied rules are detected by dedup index, nothing is transmitted again
+    raw_client.calls.clear()
+    step, rendering_context = _create_step(tmp_path, raw_client, source_files)
+    try:
+        assert step.vote_for_flow_execution_skipping()
+        step.run(StepExecutionStatisticEntry(step.step_name()))
+    finally:
+        rendering_context.flow_resources.close()
+
+    assert "copy" not in raw_client.calls
+    assert "create_multipart_upload" not in raw_client.calls
+    assert "put_object" not in raw_client.calls
+
+
+def test_stale_dedup_index_is_repaired(tmp_path):
+    file_name = str(tmp_path / "db.7z")
+    with open(file_name, "wb") as output_file:
+        output_file.write(b"archive")
+
+    raw_client = FakeS3Client()
+    step, rendering_context = _create_step(tmp_path, raw_client, [file_name])
+    try:
+        step.run(StepExecutionStatisticEntry(step.step_name()))
+    finally:
+        rendering_context.flow_resources.close()
+
+    # object of one rule is moved outside of yabtool with its tags, object of another one is removed
+    tags = raw_client.tags.pop(("bucket", "backups/main/weekly/db.7z"))
+    raw_client.objects["bucket"]["backups/main/weekly/moved.7z"] = raw_client.objects["bucket"].pop(
+        "backups/main/weekly/db.7z"
+    )
+    raw_client.tags[("bucket", "backups/main/weekly/moved.7z")] = tags
+    del raw_client.objects["bucket"]["backups/main/monthly/db.7z"]
+
+    step, rendering_context = _create_step(tmp_path, raw_client, [file_name])
+    assert not step.vote_for_flow_execution_skipping()
+
+    raw_client.calls.clear()
+    try:
+        step.run(StepExecutionStatisticEntry(step.step_name()))
+    finally:
+        rendering_context.flow_resources.close()
+
+    # tagged object is found for stale entry, removed object is transmitted again
+    assert "copy" not in raw_client.calls
+    assert raw_client.objects["bucket"]["backups/main/monthly/db.7z"] == b"archive"
+    assert "backups/main/weekly/db.7z" not in raw_client.objects["bucket"]
+
+    step, rendering_context = _create_step(tmp_path, raw_client, [file_name])
+    raw_client.calls.clear()
+    assert step.vote_for_flow_execution_skipping()
+    assert "get_object_tagging" not in raw_client.calls
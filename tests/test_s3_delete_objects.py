@@ -0,0 +1,28 @@
+import os
+import sys
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient  # noqa
+
+
+def test_objects_are_deleted_in_batches_with_per_key_errors():
+    raw_client = FakeS3Client()
+    client = S3BasicBotoClient(loguru.logger, raw_client)
+    keys = ["old/file_{}".format(index) for index in range(2500)]
+    for key in keys:
+        client.put_object("bucket", key, b"x")
+
+    raw_client.undeletable_keys = {"old/file_7", "old/file_2100"}
+    raw_client.calls.clear()
+
+    deleted_keys, errors = client.delete_objects("bucket", keys, max_threads=2)
+
+    assert raw_client.calls == ["delete_objects"] * 3
+    assert len(deleted_keys) == 2498
+    assert sorted(error.key for error in errors) == ["old/file_2100", "old/file_7"]
+    assert sorted(raw_client.objects["bucket"].keys()) == ["old/file_2100", "old/file_7"]
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient  # noqa
+
+
+def create_client():
+    raw_client = FakeS3Client(max_keys=7)
+    for folder_index in range(5):
+        for file_index in range(30):
+            raw_client.put_object(Bucket="bucket", Key="root/f{}/file_{}".format(folder_index, file_index), Body=b"x")
+
+    raw_client.put_object(Bucket="bucket", Key="root/top_level", Body=b"xy")
+    return S3BasicBotoClient(loguru.logger, raw_client)
+
+
+def test_listing_is_not_truncated_by_page_size():
+    client = create_client()
+
+    keys = client.list_files_in_folder("bucket", "root/")
+
+    assert len(keys) == 151
+    assert client.list_common_prefixes("bucket", "root/") == ["root/f{}/".format(index) for index in range(5)]
+
+
+def test_parallel_listing_returns_all_objects():
+    client = create_client()
+
+    records = list(client.iterate_objects_parallel("bucket", "root/", max_threads=3, queue_size=4))
+
+    assert sorted(record.key for record in records) == sorted(client.list_files_in_folder("bucket", "root/"))
+    assert [record.size for record in records if record.key == "root/top_level"] == [2]
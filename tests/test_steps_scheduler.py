@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+import time
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.jinja2_helpers import create_rendering_environment  # noqa
+from yabtool.yabtool_steps_scheduler import DagStepsExecutor, StepsDependenciesResolver  # noqa
+
+
+def test_dependencies_inferred_from_generated_variables():
+    flow_steps = [
+        {"name": "mkdir", "generates": {"output_folder_name": "{{result}}"}},
+        {"name": "backup", "file_name": "{{output_folder_name}}/db.fbk", "generates": {"backup_file_name": "db.fbk"}},
+        {"name": "hash", "input_file_name": "{{output_folder_name}}/{{backup_file_name}}"},
+        {"name": "compress", "id": "archive", "depends_on": ["backup"]},
+        {"name": "ping"},
+    ]
+
+    dependencies = StepsDependenciesResolver(create_rendering_environment()).resolve(flow_steps)
+
+    assert dependencies == [set(), {0}, {0, 1}, {1}, {0, 1, 2, 3}]
+
+
+def test_independent_steps_are_executed_concurrently():
+    dependencies = [set(), {0}, {0}, {1, 2}]
+    barrier = threading.Barrier(2, timeout=5)
+    completed = []
+
+    def execute_node(node_index):
+        if node_index in (1, 2):
+            barrier.wait()
+
+        time.sleep(0.01)
+        return node_index
+
+    DagStepsExecutor(loguru.logger, max_workers=2).execute(
+        dependencies,
+        execute_node,
+        lambda node_index, result: completed.append(result)
+    )
+
+    assert completed[0] == 0
+    assert sorted(completed[1:3]) == [1, 2]
+    assert completed[3] == 3
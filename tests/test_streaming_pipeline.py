@@ -0,0 +1,200 @@
+import io
+import os
+import sys
+
+import loguru
+import pytest
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.shared.bandwidth_limiter import BandwidthLimiter  # noqa
+from yabtool.shared.transfer_progress import TransferProgressReporter  # noqa
+from yabtool.supported_steps import s3boto_client  # noqa
+from yabtool.supported_steps.base import StreamingExecutionError, TransmissionError  # noqa
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient  # noqa
+from yabtool.supported_steps.streaming import StreamingPipeline  # noqa
+
+PART_SIZE = 64 * 1024
+BLOCK_SIZE = 16 * 1024
+INVERSION_TABLE = bytes(255 - value for value in range(256))
+
+
+class FakeStatEntry(object):
+    def __init__(self):
+        self.execution_start_timestamp = None
+        self.execution_end_timestamp = None
+
+
+class FakeStreamingStep(object):
+    def __init__(self, name, run_stage):
+        self._name = name
+        self._run_stage = run_stage
+
+    @classmethod
+    def supports_streaming(cls):
+        return True
+
+    def step_name(self):
+        return self._name
+
+    def run_stage(self, stat_entry, stage_context):
+        self._run_stage(stage_context)
+
+
+def _producer(data, error=None):
+    def run_stage(stage_context):
+        for offset in range(0, len(data), BLOCK_SIZE):
+            stage_context.output_stream.write(data[offset:offset + BLOCK_SIZE])
+
+        if error is not None:
+            raise error
+
+    return FakeStreamingStep("producer", run_stage)
+
+
+def _inverting_filter():
+    def run_stage(stage_context):
+        while True:
+            block = stage_context.input_stream.read(BLOCK_SIZE)
+            if not block:
+                break
+
+            stage_context.output_stream.write(block.translate(INVERSION_TABLE))
+
+    return FakeStreamingStep("filter", run_stage)
+
+
+def _uploading_consumer(basic_client):
+    def run_stage(stage_context):
+        basic_client.upload_stream(
+            "bucket",
+            "main/db.fbk.xz",
+            stage_context.input_stream,
+            part_size=PART_SIZE,
+            max_threads=2,
+            can_complete=stage_context.wait_for_upstream_success
+        )
+
+    return FakeStreamingStep("consumer", run_stage)
+
+
+def _run_pipeline(*steps):
+    pipeline = StreamingPipeline(loguru.logger)
+    for step in steps:
+        pipeline.add_stage(step, FakeStatEntry())
+
+    pipeline.run()
+    return pipeline
+
+
+def test_data_goes_from_producer_through_filter_to_multipart_upload():
+    raw_client = FakeS3Client()
+    data = os.urandom(5 * PART_SIZE + 100)
+
+    pipeline = _run_pipeline(
+        _producer(data),
+        _inverting_filter(),
+        _uploading_consumer(S3BasicBotoClient(loguru.logger, raw_client))
+    )
+
+    assert raw_client.objects["bucket"]["main/db.fbk.xz"] == data.translate(INVERSION_TABLE)
+    assert raw_client.calls.count("upload_part") == 6
+    assert "complete_multipart_upload" in raw_client.calls
+    assert all(stage.stat_entry.execution_end_timestamp is not None for stage in pipeline.stages)
+
+
+def test_producer_failure_aborts_multipart_upload():
+    raw_client = FakeS3Client()
+    error = RuntimeError("gbak failed")
+
+    # end of stream is reached in the usual way, only the producer state tells that data is incomplete
+    with pytest.raises(RuntimeError) as error_info:
+        _run_pipeline(
+            _producer(os.urandom(3 * PART_SIZE), error=error),
+            _uploading_consumer(S3BasicBotoClient(loguru.logger, raw_client))
+        )
+
+    assert error_info.value is error
+    assert "abort_multipart_upload" in raw_client.calls
+    assert "complete_multipart_upload" not in raw_client.calls
+    assert not raw_client.uploads
+    assert "main/db.fbk.xz" not in raw_client.objects.get("bucket", {})
+
+
+def test_consumer_failure_stops_upstream_stages():
+    def failing_consumer(stage_context):
+        stage_context.input_stream.read(BLOCK_SIZE)
+        raise StreamingExecutionError("upload failed")
+
+    pipeline = StreamingPipeline(loguru.logger)
+    consumer = FakeStreamingStep("consumer", failing_consumer)
+    for step in [_producer(os.urandom(64 * PART_SIZE)), _inverting_filter(), consumer]:
+        pipeline.add_stage(step, FakeStatEntry())
+
+    with pytest.raises(StreamingExecutionError):
+        pipeline.run()
+
+    # closed input of consumer breaks pipes of stages which still write data
+    producer_stage, filter_stage, _ = pipeline.stages
+    assert isinstance(filter_stage.exception, BrokenPipeError)
+    assert isinstance(producer_stage.exception, BrokenPipeError)
+
+
+def test_stream_shorter_than_part_is_put_as_single_object():
+    raw_client = FakeS3Client()
+    data = os.urandom(PART_SIZE - 1)
+
+    _run_pipeline(_producer(data), _uploading_consumer(S3BasicBotoClient(loguru.logger, raw_client)))
+
+    assert raw_client.objects["bucket"]["main/db.fbk.xz"] == data
+    assert "put_object" in raw_client.calls
+    assert "create_multipart_upload" not in raw_client.calls
+
+
+def test_stream_upload_is_throttled_verified_and_reported():
+    raw_client = FakeS3Client()
+    basic_client = S3BasicBotoClient(loguru.logger, raw_client, limiters=[BandwidthLimiter(1024 * 1024 * 1024)])
+    progress_reporter = TransferProgressReporter(loguru.logger, "db.fbk.xz")
+    data = os.urandom(3 * PART_SIZE + 100)
+
+    result = basic_client.upload_stream(
+        "bucket",
+        "main/db.fbk.xz",
+        io.BytesIO(data),
+        part_size=PART_SIZE,
+        max_threads=2,
+        progress_reporter=progress_reporter
+    )
+
+    assert (result.uploaded_bytes, result.parts_count, result.part_size) == (len(data), 4, PART_SIZE)
+    assert result.verified
+    assert result.bandwidth_limit == 1024 * 1024 * 1024
+    assert progress_reporter.transferred_bytes == len(data)
+    assert raw_client.objects["bucket"]["main/db.fbk.xz"] == data
+
+
+class CorruptingS3Client(FakeS3Client):
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        super().complete_multipart_upload(Bucket, Key, UploadId, MultipartUpload)
+        return {"ETag": '"{}-{}"'.format("0" * 32, len(MultipartUpload["Parts"]))}
+
+
+def test_stream_upload_with_wrong_etag_fails():
+    basic_client = S3BasicBotoClient(loguru.logger, CorruptingS3Client())
+
+    with pytest.raises(TransmissionError):
+        basic_client.upload_stream("bucket", "main/db.fbk.xz", io.BytesIO(os.urandom(2 * PART_SIZE)), part_size=PART_SIZE)
+
+
+def test_stream_exceeding_parts_limit_is_aborted(monkeypatch):
+    raw_client = FakeS3Client()
+    basic_client = S3BasicBotoClient(loguru.logger, raw_client)
+    monkeypatch.setattr(s3boto_client, "MAX_PARTS_COUNT", 3)
+
+    with pytest.raises(TransmissionError):
+        basic_client.upload_stream("bucket", "main/db.fbk.xz", io.BytesIO(os.urandom(4 * PART_SIZE)), part_size=PART_SIZE)
+
+    assert "abort_multipart_upload" in raw_client.calls
+    assert not raw_client.uploads
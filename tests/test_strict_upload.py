@@ -0,0 +1,105 @@
+import datetime
+import os
+import sys
+import time
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from fake_s3_client import FakeS3Client  # noqa
+from yabtool.shared.jinja2_helpers import create_rendering_environment  # noqa
+from yabtool.supported_steps.base import intervals_union_length  # noqa
+from yabtool.supported_steps.s3_steps_shared import StepS3FileBaseUploader  # noqa
+from yabtool.supported_steps.s3_upload_engine import UploadResult  # noqa
+from yabtool.supported_steps.step_s3_strict_uploader import StepS3StrictUploader  # noqa
+from yabtool.yabtool_flow_orchestrator import get_date_rendering_values, RenderingContext  # noqa
+from yabtool.yabtool_stat import StepExecutionStatisticEntry  # noqa
+
+PART_SIZE = 64 * 1024
+
+
+def _upload_result(started_at, finished_at):
+    res = UploadResult()
+    res.started_at = started_at
+    res.finished_at = finished_at
+    return res
+
+
+def test_overlapping_uploads_are_counted_once():
+    results = [_upload_result(10.0, 14.0), _upload_result(11.0, 12.0), _upload_result(13.5, 16.0)]
+    results.append(_upload_result(20.0, 21.5))
+
+    assert intervals_union_length([(item.started_at, item.finished_at) for item in results]) == 7.5
+    assert intervals_union_length([(1.0, 1.0), (1.0, 2.0)]) == 1.0
+
+
+class FakeClientStrictUploader(StepS3StrictUploader):
+    def __init__(self, raw_client, **kwargs):
+        super().__init__(**kwargs)
+        self._raw_client = raw_client
+
+    def _crete_s3_client(self):
+        return self._raw_client
+
+
+def _create_file(tmp_path, name, size):
+    file_name = str(tmp_path / name)
+    with open(file_name, "wb") as output_file:
+        output_file.write(os.urandom(size))
+
+    return file_name
+
+
+def test_files_are_uploaded_simultaneously(tmp_path):
+    archive_file_name = _create_file(tmp_path, "db.7z", PART_SIZE * 6 + 11)
+    hash_file_name = _create_file(tmp_path, "db.7z.sha256", 64)
+    large_file_name = _create_file(tmp_path, "db.log.7z", PART_SIZE * 3 + 1)
+
+    rendering_context = RenderingContext()
+    rendering_context.root_temporary_folder = str(tmp_path / "temp")
+    rendering_context.unknown_args = ["--upload-suffix", "manual"]
+    rendering_context.basic_values = {
+        "main_target_name": "main",
+        **get_date_rendering_values(datetime.datetime(2020, 1, 13))
+    }
+
+    raw_client = FakeS3Client()
+    step = FakeClientStrictUploader(
+        raw_client,
+        logger=loguru.logger,
+        rendering_context=rendering_context,
+        step_context={
+            "name": "step_s3_strict_upload",
+            "prefix_in_bucket": "backups/",
+            "target_prefix_in_bucket": "{{prefix_in_bucket}}{{main_target_name}}/{{current_date}}{{execution_suffix}}",
+            "part_size_mib": PART_SIZE / (1024 * 1024),
+            "max_transmission_threads": 4,
+            "max_concurrent_files": 3,
+            "uploads": [{"source_file": item} for item in [archive_file_name, hash_file_name, large_file_name]]
+        },
+        secret_context={"bucket_name": "bucket", "region": None},
+        rendering_environment=create_rendering_environment()
+    )
+    stat_entry = StepExecutionStatisticEntry(step.step_name())
+
+    started_at = time.time()
+    try:
+        step.run(stat_entry)
+    finally:
+        rendering_context.flow_resources.close()
+    elapsed_seconds = time.time() - started_at
+
+    prefix = "backups/main/{}-manual/".format(rendering_context.basic_values["current_date"])
+    for file_name in [archive_file_name, hash_file_name, large_file_name]:
+        with open(file_name, "rb") as input_file:
+            assert raw_client.objects["bucket"][prefix + os.path.basename(file_name)] == input_file.read()
+
+    assert raw_client.calls.count("complete_multipart_upload") == 2
+    assert not raw_client.uploads
+
+    metrics = stat_entry.metrics
+    assert metrics.get_metric(StepS3FileBaseUploader.METRIC_VERIFIED_UPLOADS_COUNT).value == 3
+    assert metrics.get_metric(StepS3FileBaseUploader.METRIC_UPLOADED_SIZE).value > 0
+    assert 0 < metrics.get_metric(StepS3FileBaseUploader.METRIC_TRANSMISSION_TIME).value <= elapsed_seconds
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import loguru
+
+dir_name = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(dir_name, ".."))
+
+from yabtool.shared.transfer_progress import TransferProgressReporter  # noqa
+from yabtool.yabtool_flow_orchestrator import YabtoolFlowOrchestrator  # noqa
+from yabtool.yabtool_stat import StepExecutionStatisticEntry, summarize_progress_samples  # noqa
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_progress_is_sampled_once_per_interval():
+    clock = FakeClock()
+    samples = []
+    reporter = TransferProgressReporter(
+        loguru.logger,
+        "archive.7z",
+        total_bytes=1000,
+        interval_seconds=1.0,
+        on_sample=samples.append,
+        clock=clock
+    )
+
+    for _ in range(10):
+        clock.now += 0.25
+        reporter(50)
+
+    assert len(samples) == 2
+    assert samples[0].transferred_bytes == 200
+    assert samples[1].transferred_bytes == 400
+    assert samples[1].average_rate == 200.0
+    assert samples[1].eta_seconds == 3.0
+
+    # transfer stalled for 3 seconds
+    clock.now += 3.0
+    reporter(500)
+    final_sample = reporter.finish()
+
+    assert final_sample.transferred_bytes == 1000
+    assert final_sample.eta_seconds == 0
+    assert reporter.longest_stall_seconds == 3.0
+    assert len(samples) == 4
+
+
+def test_samples_are_summarized_in_report():
+    clock = FakeClock()
+    stat_entry = StepExecutionStatisticEntry("s3_strict_upload", step_human_readable_name="Upload")
+    reporter = TransferProgressReporter(
+        loguru.logger,
+        "archive.7z",
+        interval_seconds=1.0,
+        on_sample=lambda sample: stat_entry.add_time_series_sample("Progress (archive.7z)", sample),
+        clock=clock
+    )
+
+    for amount in [100, 300, 0, 0, 200]:
+        clock.now += 1.0
+        reporter(amount)
+    reporter.finish()
+
+    summary = summarize_progress_samples(stat_entry.time_series["Progress (archive.7z)"])
+    assert (summary.samples_count, summary.min_rate, summary.max_rate) == (6, 0.0, 300.0)
+    assert summary.average_rate == 120.0
+    assert summary.stalled_seconds == 2.0
+    assert summarize_progress_samples([]) is None
+
+    report = YabtoolFlowOrchestrator(loguru.logger).produce_time_series_report([stat_entry])
+    assert len(report) == 1
+    assert report[0][0] == "Upload (s3_strict_upload)"
+    assert "Progress (archive.7z)" in report[0][1]
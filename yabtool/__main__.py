@@ -1,4 +1,5 @@
 import datetime
+import sys
 
 from .supported_steps.base import pretty_time_delta, time_interval
 from .yabtool_application import YabtoolApplication
@@ -8,9 +9,12 @@ if __name__ == "__main__":
     timestamp_start = datetime.datetime.utcnow()
 
     app = YabtoolApplication()
-    app.run(args=None)
+    succeeded = app.run(args=None)
 
     timestamp_end = datetime.datetime.utcnow()
     seconds_spent = time_interval(timestamp_start, timestamp_end)
 
     app.logger.info("app finished @ {}".format(pretty_time_delta(seconds_spent)))
+
+    # schedulers detect failed flows by exit code
+    sys.exit(0 if succeeded else 1)
@@ -0,0 +1,87 @@
+"""Builds dedup index for objects uploaded into bucket by versions without index support.
+
+    python -m yabtool.build_dedup_index --bucket backups --prefix main/ --region eu-central-1
+
+Credentials are taken from command line or from default boto3 credentials chain.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+
+import loguru
+from yabtool.shared.boto_clients_registry import get_boto_clients_registry
+from yabtool.supported_steps.s3_steps_shared import S3DedupIndex
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient
+
+
+def get_cli_args(args=None):
+    parser = argparse.ArgumentParser(description="Build dedup index for existing uploads")
+
+    parser.add_argument("--bucket", "-b", action="store", required=True, help="Bucket name")
+    parser.add_argument("--prefix", "-p", action="store", default="", help="Prefix of uploads in bucket")
+    parser.add_argument("--region", "-r", action="store", help="Bucket region")
+    parser.add_argument("--aws-access-key-id", action="store", help="AWS access key id")
+    parser.add_argument("--aws-secret-access-key", action="store", help="AWS secret access key")
+    parser.add_argument("--endpoint-url", action="store", help="Endpoint URL for S3 compatible storages")
+    parser.add_argument("--workers", "-w", action="store", type=int, default=8, help="Count of threads")
+    parser.add_argument(
+        "--dry-run",
+        "-d",
+        action="store_true",
+        default=False,
+        help="Print indexes without saving them"
+    )
+
+    return parser.parse_args(args=args)
+
+
+def collect_tags_by_prefix(basic_client, bucket_name, prefix, workers):
+    keys = [
+        record.key
+        for record in basic_client.iterate_objects(bucket_name, prefix)
+        if not record.key.startswith(S3DedupIndex.INDEX_PREFIX)
+    ]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tags = executor.map(lambda key: basic_client.get_object_tags(bucket_name, key), keys)
+
+        res = {}
+        for key, object_tags in zip(keys, tags):
+            entries = res.setdefault(os.path.dirname(key) + "/", {})
+            for tag_name, tag_value in object_tags.items():
+                entries[tag_name] = {"value": tag_value, "key": key}
+
+    return res
+
+
+def build_dedup_index(args=None, logger=None):
+    args = get_cli_args(args)
+    logger = logger if logger else loguru.logger
+
+    raw_client = get_boto_clients_registry().get_client(
+        "s3",
+        region_name=args.region,
+        aws_access_key_id=args.aws_access_key_id,
+        aws_secret_access_key=args.aws_secret_access_key,
+        endpoint_url=args.endpoint_url,
+        max_pool_connections=args.workers
+    )
+    basic_client = S3BasicBotoClient(logger, raw_client)
+    dedup_index = S3DedupIndex(logger, basic_client, args.bucket)
+
+    entries_by_prefix = collect_tags_by_prefix(basic_client, args.bucket, args.prefix, args.workers)
+    for destination_prefix, entries in sorted(entries_by_prefix.items()):
+        if not entries:
+            continue
+
+        logger.info("index for '{}': {}".format(destination_prefix, entries))
+        if not args.dry_run:
+            dedup_index.save(destination_prefix, entries)
+
+    logger.info("indexes built: {}".format(len([item for item in entries_by_prefix.values() if item])))
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if build_dedup_index() else 1)
@@ -0,0 +1,117 @@
+/*
+ * Native boundary search of content defined chunking (see yabtool/shared/chunking.py).
+ *
+ * Produces the same boundaries as pure Python implementation, GIL is released while
+ * data is scanned, so compression and upload threads aren't blocked by chunking.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+
+#define GEAR_TABLE_SIZE 256
+
+static Py_ssize_t scan(
+    const unsigned char *data,
+    Py_ssize_t position,
+    Py_ssize_t normal_end,
+    Py_ssize_t limit,
+    const uint32_t *gear_table,
+    uint32_t hash_mask,
+    uint32_t strict_mask,
+    uint32_t relaxed_mask)
+{
+    uint32_t fingerprint = 0;
+
+    for (; position < normal_end; position++) {
+        fingerprint = ((fingerprint << 1) + gear_table[data[position]]) & hash_mask;
+        if (!(fingerprint & strict_mask)) {
+            return position + 1;
+        }
+    }
+
+    for (; position < limit; position++) {
+        fingerprint = ((fingerprint << 1) + gear_table[data[position]]) & hash_mask;
+        if (!(fingerprint & relaxed_mask)) {
+            return position + 1;
+        }
+    }
+
+    return limit;
+}
+
+static PyObject *find_boundary(PyObject *self, PyObject *args)
+{
+    Py_buffer data;
+    Py_buffer table;
+    Py_ssize_t position, normal_end, limit;
+    unsigned long hash_mask, strict_mask, relaxed_mask;
+    Py_ssize_t res;
+
+    (void)self;
+    if (!PyArg_ParseTuple(
+            args,
+            "y*y*nnnkkk:find_boundary",
+            &data,
+            &table,
+            &position,
+            &normal_end,
+            &limit,
+            &hash_mask,
+            &strict_mask,
+            &relaxed_mask)) {
+        return NULL;
+    }
+
+    if (table.len != GEAR_TABLE_SIZE * (Py_ssize_t)sizeof(uint32_t)) {
+        PyErr_SetString(PyExc_ValueError, "gear table should contain 256 uint32 values");
+        res = -1;
+    } else if (position < 0 || position > normal_end || normal_end > limit || limit > data.len) {
+        PyErr_SetString(PyExc_ValueError, "scan range is out of data");
+        res = -1;
+    } else {
+        Py_BEGIN_ALLOW_THREADS
+        res = scan(
+            (const unsigned char *)data.buf,
+            position,
+            normal_end,
+            limit,
+            (const uint32_t *)table.buf,
+            (uint32_t)hash_mask,
+            (uint32_t)strict_mask,
+            (uint32_t)relaxed_mask);
+        Py_END_ALLOW_THREADS
+    }
+
+    PyBuffer_Release(&data);
+    PyBuffer_Release(&table);
+
+    if (res < 0) {
+        return NULL;
+    }
+
+    return PyLong_FromSsize_t(res);
+}
+
+static PyMethodDef methods[] = {
+    {
+        "find_boundary",
+        find_boundary,
+        METH_VARARGS,
+        "find_boundary(data, gear_table, position, normal_end, limit, hash_mask, strict_mask, relaxed_mask)\n"
+        "Returns end offset of chunk, `gear_table` contains 256 native uint32 values."
+    },
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef module = {
+    PyModuleDef_HEAD_INIT,
+    "_gear_chunking",
+    "Native boundary search of content defined chunking.",
+    -1,
+    methods
+};
+
+PyMODINIT_FUNC PyInit__gear_chunking(void)
+{
+    return PyModule_Create(&module);
+}
@@ -0,0 +1,130 @@
+import threading
+import time
+
+BYTES_IN_MEGABYTE = 1024 * 1024
+DEFAULT_PORTION_SIZE = 256 * 1024
+
+
+class BandwidthLimiter(object):
+    """Token bucket limiting rate of transmitted bytes.
+
+    Requests are served in FIFO order and large requests are split into small portions,
+    so several uploads sharing the limiter receive equal part of bandwidth.
+    """
+
+    def __init__(self, rate, portion_size=DEFAULT_PORTION_SIZE, clock=time.monotonic):
+        assert rate > 0
+        self.rate = float(rate)
+        self.portion_size = max(1, min(int(portion_size), int(self.rate)))
+        self._clock = clock
+
+        self._condition = threading.Condition()
+        self._tokens = float(self.portion_size)
+        self._last_refill = self._clock()
+        self._next_ticket = 0
+        self._serving_ticket = 0
+
+        self.consumed_bytes = 0
+        self.waited_seconds = 0.0
+
+    def consume(self, amount):
+        """Blocks until `amount` bytes may be transmitted, returns seconds spent waiting."""
+        res = 0.0
+        while amount > 0:
+            portion = min(amount, self.portion_size)
+            res += self._consume_portion(portion)
+            amount -= portion
+
+        return res
+
+    def _consume_portion(self, amount):
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            begin = self._clock()
+
+            while True:
+                timeout = None
+                if ticket == self._serving_ticket:
+                    self._refill()
+                    if self._tokens >= amount:
+                        break
+
+                    timeout = (amount - self._tokens) / self.rate
+
+                self._condition.wait(timeout)
+
+            self._tokens -= amount
+            self._serving_ticket += 1
+            self.consumed_bytes += amount
+
+            waited = self._clock() - begin
+            self.waited_seconds += waited
+            self._condition.notify_all()
+
+        return waited
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(float(self.portion_size), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+def consume_bandwidth(limiters, amount):
+    """Consumes `amount` bytes from each limiter, returns seconds spent waiting."""
+    return sum(limiter.consume(amount) for limiter in limiters)
+
+
+def get_bandwidth_limit(limiters):
+    """Returns the most strict rate of `limiters` in bytes per second or None."""
+    return min(limiter.rate for limiter in limiters) if limiters else None
+
+
+class ThrottledReader(object):
+    """File object wrapper which limits rate of reading."""
+
+    def __init__(self, file_object, limiters):
+        self._file_object = file_object
+        self._limiters = list(limiters)
+        self.waited_seconds = 0.0
+
+    def read(self, size=-1):
+        data = self._file_object.read(size)
+        if data:
+            self.waited_seconds += consume_bandwidth(self._limiters, len(data))
+
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._file_object.seek(offset, whence)
+
+    def tell(self):
+        return self._file_object.tell()
+
+    def __getattr__(self, name):
+        return getattr(self._file_object, name)
+
+
+_limiters = dict()
+_limiters_lock = threading.Lock()
+
+
+def get_bandwidth_limiter(name, rate_mib):
+    """Returns process wide limiter with `name`, so all transmissions with same name share bandwidth.
+
+    >>> get_bandwidth_limiter("doctest", 2) is get_bandwidth_limiter("doctest", 2)
+    True
+    >>> get_bandwidth_limiter("doctest", 0) is None
+    True
+    """
+    if not rate_mib or float(rate_mib) <= 0:
+        return None
+
+    rate = float(rate_mib) * BYTES_IN_MEGABYTE
+    with _limiters_lock:
+        res = _limiters.get(name)
+        if res is None or res.rate != rate:
+            res = BandwidthLimiter(rate)
+            _limiters[name] = res
+
+    return res
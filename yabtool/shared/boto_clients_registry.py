@@ -0,0 +1,132 @@
+import threading
+
+import boto3
+from botocore.config import Config
+from yabtool.shared.base import AttrsToStringMixin
+
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+
+class BotoClientsStatistics(AttrsToStringMixin):
+    def __init__(self):
+        self.clients_created = 0
+        self.clients_reused = 0
+        # None when pools of connections of clients can't be inspected
+        self.connections_created = None
+        self.requests_sent = 0
+
+    @property
+    def connections_reused(self):
+        if self.connections_created is None:
+            return None
+
+        return max(0, self.requests_sent - self.connections_created)
+
+
+def get_created_connections_count(client):
+    """Returns count of HTTP connections opened by pools of boto3 `client`, None if it's unknown.
+
+    botocore doesn't expose its connections, so private attributes are read: checked with
+    botocore 1.2x - 1.4x (`URLLib3Session._manager` and `_proxy_managers` are urllib3 `PoolManager`
+    objects) and urllib3 1.26 - 2.x (`HTTPConnectionPool.num_connections`). When layout of
+    these internals changes, statistics of connections are not reported.
+    """
+    try:
+        http_session = client._endpoint.http_session
+        managers = [http_session._manager] + list(http_session._proxy_managers.values())
+
+        res = 0
+        for manager in managers:
+            for key in list(manager.pools.keys()):
+                res += int(manager.pools[key].num_connections)
+
+        return res
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class BotoClientsRegistry(object):
+    """Process wide registry of boto3 clients.
+
+    Clients are thread safe, so one client per (service, region, credentials, endpoint, pool size)
+    is shared by all steps, votes and notifications of all flows executed in the process,
+    endpoint resolution, credentials parsing and TLS connections are reused.
+    """
+
+    def __init__(self):
+        self._clients = dict()
+        self._lock = threading.Lock()
+        self._session = None
+        self._clients_created = 0
+        self._clients_reused = 0
+        self._requests_sent = 0
+
+    def get_client(
+        self,
+        service_name,
+        region_name=None,
+        aws_access_key_id=None,
+        aws_secret_access_key=None,
+        endpoint_url=None,
+        max_pool_connections=None
+    ):
+        max_pool_connections = max_pool_connections if max_pool_connections else DEFAULT_MAX_POOL_CONNECTIONS
+        client_key = (
+            service_name,
+            region_name,
+            aws_access_key_id,
+            aws_secret_access_key,
+            endpoint_url,
+            max_pool_connections
+        )
+
+        # creation of clients is not thread safe
+        with self._lock:
+            res = self._clients.get(client_key)
+            if res is not None:
+                self._clients_reused += 1
+                return res
+
+            if self._session is None:
+                self._session = boto3.session.Session()
+
+            res = self._session.client(
+                service_name,
+                region_name=region_name,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                endpoint_url=endpoint_url,
+                config=Config(max_pool_connections=max_pool_connections)
+            )
+            # requests are counted with public events API, unlike connections
+            res.meta.events.register("request-created", self._on_request_created)
+            self._clients[client_key] = res
+            self._clients_created += 1
+
+        return res
+
+    def get_statistics(self):
+        res = BotoClientsStatistics()
+
+        with self._lock:
+            res.clients_created = self._clients_created
+            res.clients_reused = self._clients_reused
+            res.requests_sent = self._requests_sent
+            clients = list(self._clients.values())
+
+        connections_counts = [get_created_connections_count(client) for client in clients]
+        if None not in connections_counts:
+            res.connections_created = sum(connections_counts)
+
+        return res
+
+    def _on_request_created(self, **kwargs):
+        with self._lock:
+            self._requests_sent += 1
+
+
+_registry = BotoClientsRegistry()
+
+
+def get_boto_clients_registry():
+    return _registry
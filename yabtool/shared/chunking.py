@@ -0,0 +1,144 @@
+import hashlib
+import struct
+
+try:
+    # optional extension is built by setup.py when compiler is available
+    from yabtool.shared import _gear_chunking
+except ImportError:
+    _gear_chunking = None
+
+DEFAULT_MIN_CHUNK_SIZE = 512 * 1024
+DEFAULT_AVERAGE_CHUNK_SIZE = 1024 * 1024
+DEFAULT_MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+# fingerprint and its shifted value fit into single digit of Python integers, so arithmetic stays cheap
+_HASH_BITS = 28
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+
+def _create_gear_table():
+    # table is derived from fixed data, so boundaries are the same for all versions and processes
+    return [
+        int.from_bytes(hashlib.sha256(bytes([value])).digest()[:4], "little") & _HASH_MASK
+        for value in range(256)
+    ]
+
+
+_GEAR_TABLE = _create_gear_table()
+_GEAR_TABLE_DATA = struct.pack("={}I".format(len(_GEAR_TABLE)), *_GEAR_TABLE)
+
+NATIVE_CHUNKING_AVAILABLE = _gear_chunking is not None
+
+
+def _create_mask(bits_count):
+    # gear hash accumulates influence of previous bytes in high bits, so mask takes them
+    return ((1 << bits_count) - 1) << (_HASH_BITS - bits_count)
+
+
+class ContentDefinedChunker(object):
+    """Splits data into chunks with boundaries defined by content (gear rolling hash, FastCDC).
+
+    Insertion or removal of data changes only chunks around modified place, so chunks of
+    similar files (e.g. backups of the same database made on different days) are mostly equal.
+    Boundaries are not looked for in the first `min_size` bytes of chunk, strict mask is used
+    before `average_size` and relaxed one after it, so sizes are concentrated around average.
+    Native extension (when it's built) and pure Python loop produce the same boundaries.
+
+    >>> chunker = ContentDefinedChunker(min_size=64, average_size=256, max_size=1024)
+    >>> data = bytes(range(256)) * 40
+    >>> chunks = list(chunker.iterate_chunks(data))
+    >>> b"".join(chunks) == data, all(64 <= len(chunk) <= 1024 for chunk in chunks[:-1])
+    (True, True)
+    """
+
+    DEFAULT_READ_SIZE = 8 * 1024 * 1024
+
+    def __init__(
+        self,
+        min_size=DEFAULT_MIN_CHUNK_SIZE,
+        average_size=DEFAULT_AVERAGE_CHUNK_SIZE,
+        max_size=DEFAULT_MAX_CHUNK_SIZE,
+        use_native=True
+    ):
+        if not (0 < min_size <= average_size <= max_size):
+            raise ValueError("chunk sizes should satisfy 0 < min_size <= average_size <= max_size")
+
+        self.min_size = int(min_size)
+        self.average_size = int(average_size)
+        self.max_size = int(max_size)
+
+        bits_count = max(3, int(self.average_size).bit_length() - 1)
+        if bits_count + 2 > _HASH_BITS:
+            raise ValueError("average chunk size should be less than {} bytes".format(1 << (_HASH_BITS - 1)))
+
+        self._strict_mask = _create_mask(bits_count + 2)
+        self._relaxed_mask = _create_mask(bits_count - 2)
+        self.is_native = bool(use_native) and NATIVE_CHUNKING_AVAILABLE
+
+    def find_boundary(self, data, start, end):
+        """Returns end offset of chunk which starts at `start`, `data[start:end]` is available data."""
+        if end - start <= self.min_size:
+            return end
+
+        normal_end = min(start + self.average_size, end)
+        limit = min(start + self.max_size, end)
+
+        if self.is_native:
+            return _gear_chunking.find_boundary(
+                data,
+                _GEAR_TABLE_DATA,
+                start + self.min_size,
+                normal_end,
+                limit,
+                _HASH_MASK,
+                self._strict_mask,
+                self._relaxed_mask
+            )
+
+        # loop is the hottest place of chunking, so it iterates over slice and uses locals only
+        gear_table = _GEAR_TABLE
+        fingerprint = 0
+        position = start + self.min_size
+        for mask, scan_end in ((self._strict_mask, normal_end), (self._relaxed_mask, limit)):
+            for position, value in enumerate(data[position:scan_end], position + 1):
+                fingerprint = ((fingerprint << 1) + gear_table[value]) & _HASH_MASK
+                if not fingerprint & mask:
+                    return position
+
+        return limit
+
+    def iterate_chunks(self, data):
+        """Yields chunks of bytes-like object."""
+        start = 0
+        while start < len(data):
+            end = self.find_boundary(data, start, len(data))
+            yield bytes(data[start:end])
+            start = end
+
+    def iterate_stream_chunks(self, stream, read_size=DEFAULT_READ_SIZE):
+        """Yields chunks of file object, only a few chunks are kept in memory."""
+        read_size = max(int(read_size), self.max_size)
+        buffer = bytearray()
+        start = 0
+        end_of_stream = False
+
+        while True:
+            # boundary may be looked for only when chunk of maximal size is available
+            while not end_of_stream and len(buffer) - start < self.max_size:
+                if start:
+                    del buffer[:start]
+                    start = 0
+
+                data = stream.read(read_size)
+                if not data:
+                    end_of_stream = True
+                    break
+
+                buffer.extend(data)
+
+            if start >= len(buffer):
+                return
+
+            end = self.find_boundary(buffer, start, len(buffer))
+            yield bytes(buffer[start:end])
+            start = end
@@ -0,0 +1,224 @@
+"""Sequential reading of large files (backups, archives) without pollution of page cache.
+
+Backups are made on the host of database server, so pages of backup files read through page cache
+evict hot pages of database. In "drop" mode kernel is advised that file is read sequentially (larger
+read ahead) and pages behind read position are dropped from cache. In "direct" mode file is read
+with O_DIRECT into page aligned buffer, so its data doesn't go through page cache at all.
+"""
+import ctypes
+import io
+import mmap
+import os
+import sys
+
+CACHE_MODE_NORMAL = "normal"
+CACHE_MODE_DROP = "drop"
+CACHE_MODE_DIRECT = "direct"
+CACHE_MODES = [CACHE_MODE_NORMAL, CACHE_MODE_DROP, CACHE_MODE_DIRECT]
+
+DIRECT_IO_ALIGNMENT = 4096
+DEFAULT_DIRECT_BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_DROP_WINDOW_SIZE = 8 * 1024 * 1024
+
+_SYNC_FILE_RANGE_WAIT_BEFORE = 1
+_SYNC_FILE_RANGE_WRITE = 2
+_SYNC_FILE_RANGE_WAIT_AFTER = 4
+_LIBC = ctypes.CDLL(None, use_errno=True) if sys.platform.startswith("linux") else None
+
+
+def normalize_cache_mode(cache_mode):
+    """Returns cache mode from value of step parameter, raises ValueError for unknown values.
+
+    >>> normalize_cache_mode(None), normalize_cache_mode("Drop")
+    ('normal', 'drop')
+    """
+    res = str(cache_mode).strip().lower() if cache_mode else CACHE_MODE_NORMAL
+    if res not in CACHE_MODES:
+        raise ValueError("unknown read cache mode '{}', supported modes: {}".format(cache_mode, CACHE_MODES))
+
+    return res
+
+
+def _advise(fd, offset, length, advice_name):
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+
+def _open_direct(path, flags):
+    return os.open(path, flags | os.O_DIRECT)
+
+
+def _write_back(fd, offset, length):
+    # dirty pages (e.g. of backup which was just written) aren't dropped, so they're written first
+    sync_file_range = getattr(_LIBC, "sync_file_range", None)
+    if sync_file_range is None:
+        return
+
+    sync_file_range(
+        ctypes.c_int(fd),
+        ctypes.c_int64(offset),
+        ctypes.c_int64(length),
+        ctypes.c_uint(_SYNC_FILE_RANGE_WAIT_BEFORE | _SYNC_FILE_RANGE_WRITE | _SYNC_FILE_RANGE_WAIT_AFTER)
+    )
+
+
+class SequentialFileReader(io.RawIOBase):
+    """Reads range [`offset`, `offset` + `length`) of file with requested cache mode.
+
+    Modes which aren't supported by platform or file system fall back to "drop" and "normal"
+    ones, effective mode is available in `cache_mode` attribute.
+    """
+
+    def __init__(
+        self,
+        file_name,
+        offset=0,
+        length=None,
+        cache_mode=CACHE_MODE_NORMAL,
+        direct_buffer_size=DEFAULT_DIRECT_BUFFER_SIZE,
+        drop_window_size=DEFAULT_DROP_WINDOW_SIZE
+    ):
+        super().__init__()
+        self.name = file_name
+        self.cache_mode = normalize_cache_mode(cache_mode)
+        self._file = None
+        self._direct_buffer = None
+        self._drop_window_size = max(int(drop_window_size), mmap.PAGESIZE)
+
+        self._file = self._open(file_name)
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        self._start = min(int(offset), self._file_size)
+        self._end = self._file_size if length is None else min(self._start + int(length), self._file_size)
+        self._position = self._start
+        self._dropped_until = self._start
+
+        if self.cache_mode == CACHE_MODE_DIRECT:
+            # anonymous mapping is page aligned, O_DIRECT requires aligned memory, offsets and sizes
+            self._direct_buffer = mmap.mmap(-1, max(int(direct_buffer_size), 2 * DIRECT_IO_ALIGNMENT))
+        else:
+            self._file.seek(self._start)
+            if self.cache_mode == CACHE_MODE_DROP:
+                _advise(self._file.fileno(), self._start, self._end - self._start, "POSIX_FADV_SEQUENTIAL")
+
+    def _open(self, file_name):
+        if self.cache_mode == CACHE_MODE_DIRECT:
+            if hasattr(os, "O_DIRECT"):
+                try:
+                    return open(file_name, "rb", buffering=0, opener=_open_direct)
+                except OSError:
+                    # file systems like tmpfs don't support O_DIRECT
+                    pass
+
+            self.cache_mode = CACHE_MODE_DROP
+
+        return open(file_name, "rb", buffering=0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position - self._start
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            offset += self._end - self._start
+
+        self._position = self._start + min(max(0, offset), self._end - self._start)
+        if self._direct_buffer is None:
+            self._file.seek(self._position)
+
+        return self.tell()
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        size = min(len(view), self._end - self._position)
+        if size <= 0:
+            return 0
+
+        if self._direct_buffer is not None:
+            read_bytes = self._read_direct(view, size)
+        else:
+            read_bytes = self._file.readinto(view[:size])
+
+        self._position += read_bytes
+        self._drop_cache_behind(force=False)
+        return read_bytes
+
+    def read(self, size=-1):
+        """Returns `size` bytes (less at the end of range only), unlike raw files short reads aren't returned."""
+        remaining = self._end - self._position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+
+        res = bytearray(size)
+        view = memoryview(res)
+        filled = 0
+        while filled < size:
+            read_bytes = self.readinto(view[filled:])
+            if not read_bytes:
+                break
+
+            filled += read_bytes
+
+        view.release()
+        return bytes(res[:filled])
+
+    def readall(self):
+        return self.read()
+
+    def _read_direct(self, view, size):
+        aligned_position = self._position - self._position % DIRECT_IO_ALIGNMENT
+        skip = self._position - aligned_position
+        size = min(size, len(self._direct_buffer) - skip)
+        aligned_size = (skip + size + DIRECT_IO_ALIGNMENT - 1) // DIRECT_IO_ALIGNMENT * DIRECT_IO_ALIGNMENT
+
+        direct_view = memoryview(self._direct_buffer)
+        try:
+            self._file.seek(aligned_position)
+            read_bytes = self._file.readinto(direct_view[:aligned_size])
+            count = max(0, min(read_bytes - skip, size))
+            view[:count] = direct_view[skip:skip + count]
+        finally:
+            direct_view.release()
+
+        return count
+
+    def _drop_cache_behind(self, force):
+        # pages cached before O_DIRECT reading started are dropped as well
+        if self.cache_mode == CACHE_MODE_NORMAL:
+            return
+
+        # partially read page is kept until it's read completely or reader is closed
+        drop_until = self._position if force else self._position - self._position % mmap.PAGESIZE
+        if drop_until - self._dropped_until < (1 if force else self._drop_window_size):
+            return
+
+        # zero length means "till the end of file", so the last partial page is dropped as well
+        length = 0 if drop_until >= self._file_size else drop_until - self._dropped_until
+        _write_back(self._file.fileno(), self._dropped_until, length)
+        _advise(self._file.fileno(), self._dropped_until, length, "POSIX_FADV_DONTNEED")
+        self._dropped_until = drop_until
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._drop_cache_behind(force=True)
+            finally:
+                self._file.close()
+                self._file = None
+
+        if self._direct_buffer is not None:
+            self._direct_buffer.close()
+            self._direct_buffer = None
+
+        super().close()
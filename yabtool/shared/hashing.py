@@ -0,0 +1,510 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import re
+import threading
+import time
+
+from yabtool.shared.file_io import CACHE_MODE_NORMAL, SequentialFileReader
+
+DEFAULT_HASHING_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def normalize_hash_types(hash_type):
+    """Returns list of lower case hash algorithms names from string or list value of `hash_type`.
+
+    >>> normalize_hash_types("SHA256")
+    ['sha256']
+    >>> normalize_hash_types(["sha256", "md5", "sha256"])
+    ['sha256', 'md5']
+    """
+    items = [hash_type] if isinstance(hash_type, str) else list(hash_type)
+
+    res = []
+    for item in items:
+        item = str(item).strip().lower()
+        if item not in res:
+            res.append(item)
+
+    return res
+
+
+def format_hash_file_content(hash_values, file_name):
+    """Returns content of validation file.
+
+    Single algorithm produces file compatible with `sha256sum -c`, several algorithms
+    produce BSD style tagged lines supported by `sha256sum -c` and `md5sum -c` as well.
+
+    >>> format_hash_file_content({"sha256": "ab"}, "db.fbk")
+    'ab *db.fbk\\n'
+    >>> print(format_hash_file_content({"sha256": "ab", "md5": "cd"}, "db.fbk"), end="")
+    SHA256 (db.fbk) = ab
+    MD5 (db.fbk) = cd
+    """
+    if len(hash_values) == 1:
+        return "{} *{}\n".format(list(hash_values.values())[0], file_name)
+
+    return "".join(
+        "{} ({}) = {}\n".format(hash_type.upper(), file_name, hash_value)
+        for hash_type, hash_value in hash_values.items()
+    )
+
+
+_HEX_VALUE_REGEX = re.compile(r"^[0-9a-fA-F]+(-[0-9]+)?$")
+_CHUNKS_LIST_HEADER_REGEX = re.compile(r"^# ([0-9]+) chunks of ([0-9]+) bytes of ")
+
+
+def _normalize_hash_value(value):
+    # composite checksums are base64 encoded, so only hex values are case insensitive
+    return value.lower() if _HEX_VALUE_REGEX.match(value) else value
+
+
+def parse_hash_file_content(hash_file_content, default_hash_type=None):
+    """Returns list of (hash type, value) from validation file produced by `format_hash_file_content`.
+
+    Files with single hash don't contain algorithm name, `default_hash_type` is used for them.
+    Hex values are lower cased, composite checksums (base64) are returned as is.
+
+    >>> parse_hash_file_content("AB *db.fbk\\n", "sha256")
+    [('sha256', 'ab')]
+    >>> parse_hash_file_content("SHA256 (db.fbk) = ab\\nMD5 (db.fbk) = cd\\n")
+    [('sha256', 'ab'), ('md5', 'cd')]
+    >>> parse_hash_file_content("Ab+c= *db.7z\\n", "sha256")
+    [('sha256', 'Ab+c=')]
+    """
+    res = []
+    for line in hash_file_content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if " = " in line:
+            description, value = line.rsplit(" = ", 1)
+            res.append((description.split(" ", 1)[0].lower(), _normalize_hash_value(value.strip())))
+        else:
+            res.append((default_hash_type, _normalize_hash_value(line.split()[0])))
+
+    return res
+
+
+def parse_content_hash(hash_file_content):
+    """Returns content hash from validation file produced by `format_hash_file_content`.
+
+    Several hashes are joined with "-" in order of lines, so the value identifies content
+    and may be used as key of index or object metadata.
+
+    >>> parse_content_hash("ab *db.fbk\\n")
+    'ab'
+    >>> parse_content_hash("SHA256 (db.fbk) = ab\\nMD5 (db.fbk) = cd\\n")
+    'ab-cd'
+    >>> parse_content_hash("") is None
+    True
+    """
+    values = [value for _, value in parse_hash_file_content(hash_file_content)]
+    return "-".join(values) if values else None
+
+
+class MultiHasher(object):
+    """Feeds same data into several hashers.
+
+    hashlib releases GIL for large buffers, so with several algorithms each of them is
+    updated in its own thread and all of them process data simultaneously.
+    """
+
+    def __init__(self, hash_types, executor=None):
+        self.hash_types = normalize_hash_types(hash_types)
+        self._hashers = [hashlib.new(hash_type) for hash_type in self.hash_types]
+        self._seconds_spent = [0.0] * len(self._hashers)
+        self._executor = executor
+
+    def update(self, data):
+        if len(self._hashers) == 1 or self._executor is None:
+            for index in range(len(self._hashers)):
+                self._update_hasher(index, data)
+
+            return
+
+        futures = [self._executor.submit(self._update_hasher, index, data) for index in range(len(self._hashers))]
+        for future in futures:
+            future.result()
+
+    def digests(self):
+        return {hash_type: hasher.digest() for hash_type, hasher in zip(self.hash_types, self._hashers)}
+
+    def hexdigests(self):
+        return {hash_type: hasher.hexdigest() for hash_type, hasher in zip(self.hash_types, self._hashers)}
+
+    def seconds_spent(self):
+        return dict(zip(self.hash_types, self._seconds_spent))
+
+    def _update_hasher(self, index, data):
+        begin = time.perf_counter()
+        self._hashers[index].update(data)
+        self._seconds_spent[index] += time.perf_counter() - begin
+
+
+def hash_file(file_name, hash_types, buffer_size=DEFAULT_HASHING_BUFFER_SIZE, cache_mode=CACHE_MODE_NORMAL):
+    """Calculates hashes of file with all requested algorithms reading the file only once.
+
+    File is read with `readinto` into two preallocated buffers: while hashers process
+    one buffer the next block is read into another one, so no bytes objects are allocated
+    per block and reading overlaps with hashing. `cache_mode` is mode of SequentialFileReader.
+
+    Returns tuple of MultiHasher and count of hashed bytes.
+    """
+    hash_types = normalize_hash_types(hash_types)
+    with ThreadPoolExecutor(max_workers=len(hash_types) + 1, thread_name_prefix="yabtool-hash") as executor:
+        hasher = MultiHasher(hash_types, executor=executor if len(hash_types) > 1 else None)
+        hashed_bytes = _feed_file(file_name, hasher.update, executor, buffer_size, cache_mode)
+
+    return hasher, hashed_bytes
+
+
+def _feed_file(file_name, update_function, executor, buffer_size, cache_mode):
+    """Passes blocks of file into `update_function` on `executor` while the next block is read,
+    returns count of read bytes.
+    """
+    buffers = [bytearray(buffer_size), bytearray(buffer_size)]
+    views = [memoryview(item) for item in buffers]
+
+    res = 0
+    with SequentialFileReader(file_name, cache_mode=cache_mode) as input_file:
+        pending_update = None
+        current = 0
+        while True:
+            read_bytes = input_file.readinto(buffers[current])
+            if pending_update is not None:
+                pending_update.result()
+                pending_update = None
+
+            if not read_bytes:
+                break
+
+            pending_update = executor.submit(update_function, views[current][:read_bytes])
+            res += read_bytes
+            current = 1 - current
+
+    return res
+
+
+def composite_digest(hash_type, chunks_digests):
+    """Returns digest of concatenated binary digests of chunks in format used by S3 for multipart objects.
+
+    MD5 produces value of multipart ETag, other algorithms produce value of composite checksum.
+
+    >>> composite_digest("md5", [hashlib.md5(b"a").digest(), hashlib.md5(b"b").digest()])
+    '96e024ba2074fe77e8e965ba43a704be-2'
+    >>> composite_digest("sha256", [hashlib.sha256(b"a").digest()])
+    'v106/7c+/S7Gw2rTES3ZM+/tY8Thy//PqI4nWcFE8tg=-1'
+    """
+    hasher = hashlib.new(hash_type)
+    for item in chunks_digests:
+        hasher.update(item)
+
+    if hash_type == "md5":
+        value = hasher.hexdigest()
+    else:
+        value = base64.b64encode(hasher.digest()).decode("ascii")
+
+    return "{}-{}".format(value, len(chunks_digests))
+
+
+def parse_composite_value(value):
+    """Returns count of chunks of composite digest produced by `composite_digest` or None for plain digest.
+
+    >>> parse_composite_value("v106/7c+/S7Gw2rTES3ZM+/tY8Thy//PqI4nWcFE8tg=-1"), parse_composite_value("ab")
+    (1, None)
+    """
+    value, separator, chunks_count = value.rpartition("-")
+    return int(chunks_count) if separator and value and chunks_count.isdigit() else None
+
+
+def parse_chunks_list_header(chunks_list_content):
+    """Returns tuple of chunks count and chunk size from content produced by `format_chunks_list`.
+
+    >>> parse_chunks_list_header("# 2 chunks of 8388608 bytes of 'db.7z'\\nMD5 0 8388608 ab\\n")
+    (2, 8388608)
+    """
+    match = _CHUNKS_LIST_HEADER_REGEX.match(chunks_list_content)
+    if match is None:
+        raise ValueError("unsupported format of chunks list")
+
+    return int(match.group(1)), int(match.group(2))
+
+
+class CompositeDigestHasher(object):
+    """Calculates digest in format of `composite_digest` from data passed by pieces of any size."""
+
+    def __init__(self, hash_type, chunk_size):
+        assert chunk_size > 0
+        self.hash_type = hash_type
+        self.chunk_size = chunk_size
+        self._chunks_digests = []
+        self._hasher = hashlib.new(hash_type)
+        self._chunk_filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while len(view):
+            size = min(len(view), self.chunk_size - self._chunk_filled)
+            self._hasher.update(view[:size])
+            self._chunk_filled += size
+            view = view[size:]
+
+            if self._chunk_filled == self.chunk_size:
+                self._complete_chunk()
+
+    def hexdigest(self):
+        """Returns composite value, hasher may be updated further."""
+        digests = list(self._chunks_digests)
+        if self._chunk_filled or not digests:
+            digests.append(self._hasher.copy().digest())
+
+        return composite_digest(self.hash_type, digests)
+
+    def _complete_chunk(self):
+        self._chunks_digests.append(self._hasher.digest())
+        self._hasher = hashlib.new(self.hash_type)
+        self._chunk_filled = 0
+
+
+class HashingReader(object):
+    """File object wrapper which calculates digest of data while it's read by somebody else.
+
+    Digest is calculated by `chunk_size` pieces in format of `composite_digest` or as plain digest
+    when `chunk_size` isn't specified. Ranges read again (retries of requests) aren't hashed twice,
+    reading beyond hashed data makes digest unknown.
+
+    >>> import io
+    >>> reader = HashingReader(io.BytesIO(b"ab"), "md5", chunk_size=1)
+    >>> reader.read(1), reader.seek(0), reader.read(), reader.read()
+    (b'a', 0, b'ab', b'')
+    >>> reader.hexdigest(2)
+    '96e024ba2074fe77e8e965ba43a704be-2'
+    >>> reader = HashingReader(io.BytesIO(b"ab"), "md5")
+    >>> reader.seek(1), reader.read(), reader.hexdigest(2)
+    (1, b'b', None)
+    """
+
+    def __init__(self, file_object, hash_type, chunk_size=None):
+        self._file_object = file_object
+        self._hasher = CompositeDigestHasher(hash_type, chunk_size) if chunk_size else hashlib.new(hash_type)
+        self._hashed_size = 0
+        self._continuous = True
+        self._lock = threading.Lock()
+
+    def read(self, size=-1):
+        with self._lock:
+            position = self._file_object.tell()
+            data = self._file_object.read(size)
+            if position > self._hashed_size:
+                self._continuous = False
+            elif self._continuous and position + len(data) > self._hashed_size:
+                self._hasher.update(memoryview(data)[self._hashed_size - position:])
+                self._hashed_size = position + len(data)
+
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._file_object.seek(offset, whence)
+
+    def tell(self):
+        return self._file_object.tell()
+
+    def hexdigest(self, total_size):
+        """Returns digest or None when first `total_size` bytes weren't read completely."""
+        with self._lock:
+            if not self._continuous or self._hashed_size != total_size:
+                return None
+
+            return self._hasher.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file_object, name)
+
+
+class ChunkedMultiHasher(object):
+    """Feeds same data into hashers of the whole data and into hashers of its fixed size chunks.
+
+    The whole data is hashed in thread of `executor` while chunks are hashed by caller.
+    """
+
+    def __init__(self, hash_types, chunk_size, executor=None):
+        assert chunk_size > 0
+        self.hash_types = normalize_hash_types(hash_types)
+        self.chunk_size = chunk_size
+        self.full_hasher = MultiHasher(self.hash_types)
+        self.chunks_digests = []
+        self._chunk_hasher = MultiHasher(self.hash_types)
+        self._chunk_filled = 0
+        self._chunks_seconds_spent = dict.fromkeys(self.hash_types, 0.0)
+        self._executor = executor
+
+    def update(self, data):
+        pending_update = self._executor.submit(self.full_hasher.update, data) if self._executor else None
+        if pending_update is None:
+            self.full_hasher.update(data)
+
+        view = memoryview(data)
+        while len(view):
+            size = min(len(view), self.chunk_size - self._chunk_filled)
+            self._chunk_hasher.update(view[:size])
+            self._chunk_filled += size
+            view = view[size:]
+
+            if self._chunk_filled == self.chunk_size:
+                self._complete_chunk()
+
+        if pending_update is not None:
+            pending_update.result()
+
+    def finish(self):
+        """Completes the last chunk, empty data has single empty chunk."""
+        if self._chunk_filled or not self.chunks_digests:
+            self._complete_chunk()
+
+    def seconds_spent(self):
+        return {
+            hash_type: seconds_spent + self._chunks_seconds_spent[hash_type]
+            for hash_type, seconds_spent in self.full_hasher.seconds_spent().items()
+        }
+
+    def _complete_chunk(self):
+        self.chunks_digests.append(self._chunk_hasher.digests())
+        for hash_type, seconds_spent in self._chunk_hasher.seconds_spent().items():
+            self._chunks_seconds_spent[hash_type] += seconds_spent
+
+        self._chunk_hasher = MultiHasher(self.hash_types)
+        self._chunk_filled = 0
+
+
+class ChunkedHashResult(object):
+    def __init__(self, hash_types, chunk_size, file_size):
+        self.hash_types = hash_types
+        self.chunk_size = chunk_size
+        self.file_size = file_size
+        self.chunks_digests = []
+        self.full_digests = {}
+        self.seconds_spent = {hash_type: 0.0 for hash_type in hash_types}
+
+    @property
+    def chunks_count(self):
+        return len(self.chunks_digests)
+
+    def composite_digests(self):
+        return {
+            hash_type: composite_digest(hash_type, [digests[hash_type] for digests in self.chunks_digests])
+            for hash_type in self.hash_types
+        }
+
+    def full_hexdigests(self):
+        """Returns digests of the whole file, they're calculated by `hash_file_with_chunks` only."""
+        return {hash_type: digest.hex() for hash_type, digest in self.full_digests.items()}
+
+    def format_chunks_list(self, file_name):
+        """Returns header with chunks count and size, composite digests and digests of every chunk.
+
+        >>> res = ChunkedHashResult(["md5"], 1, 2)
+        >>> res.chunks_digests = [{"md5": hashlib.md5(b"a").digest()}, {"md5": hashlib.md5(b"b").digest()}]
+        >>> print(res.format_chunks_list("ab.txt"), end="")
+        # 2 chunks of 1 bytes of 'ab.txt'
+        # composite MD5 96e024ba2074fe77e8e965ba43a704be-2
+        MD5 0 1 0cc175b9c0f1b6a831c399e269772661
+        MD5 1 1 92eb5ffee6ae2fec3ad71c777531578f
+        """
+        lines = ["# {} chunks of {} bytes of '{}'\n".format(self.chunks_count, self.chunk_size, file_name)]
+        for hash_type, value in self.composite_digests().items():
+            lines.append("# composite {} {}\n".format(hash_type.upper(), value))
+
+        for index, digests in enumerate(self.chunks_digests):
+            offset = index * self.chunk_size
+            length = min(self.chunk_size, self.file_size - offset)
+            for hash_type in self.hash_types:
+                lines.append("{} {} {} {}\n".format(hash_type.upper(), offset, length, digests[hash_type].hex()))
+
+        return "".join(lines)
+
+
+def hash_file_chunks(
+    file_name,
+    hash_types,
+    chunk_size,
+    max_workers=None,
+    buffer_size=DEFAULT_HASHING_BUFFER_SIZE,
+    cache_mode=CACHE_MODE_NORMAL
+):
+    """Calculates digests of fixed size chunks of file on thread pool.
+
+    Every worker reads its chunk with own file handle, so chunks are hashed on all cores
+    simultaneously (hashlib releases GIL).
+    """
+    assert chunk_size > 0
+    hash_types = normalize_hash_types(hash_types)
+    file_size = os.path.getsize(file_name)
+    chunks_count = max(1, (file_size + chunk_size - 1) // chunk_size)
+    max_workers = max_workers if max_workers else (os.cpu_count() or 1)
+    res = ChunkedHashResult(hash_types, chunk_size, file_size)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="yabtool-hash") as executor:
+        futures = [
+            executor.submit(
+                _hash_file_chunk,
+                file_name,
+                hash_types,
+                index * chunk_size,
+                chunk_size,
+                buffer_size,
+                cache_mode
+            )
+            for index in range(chunks_count)
+        ]
+
+        for future in futures:
+            hasher = future.result()
+            res.chunks_digests.append(hasher.digests())
+            for hash_type, seconds_spent in hasher.seconds_spent().items():
+                res.seconds_spent[hash_type] += seconds_spent
+
+    return res
+
+
+def hash_file_with_chunks(
+    file_name,
+    hash_types,
+    chunk_size,
+    buffer_size=DEFAULT_HASHING_BUFFER_SIZE,
+    cache_mode=CACHE_MODE_NORMAL
+):
+    """Calculates digests of the whole file and of its fixed size chunks reading the file only once.
+
+    Unlike `hash_file_chunks` chunks aren't hashed on all cores, but plain digests of file are produced too.
+    """
+    hash_types = normalize_hash_types(hash_types)
+    res = ChunkedHashResult(hash_types, chunk_size, os.path.getsize(file_name))
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="yabtool-hash") as executor:
+        hasher = ChunkedMultiHasher(hash_types, chunk_size, executor=executor)
+        res.file_size = _feed_file(file_name, hasher.update, executor, buffer_size, cache_mode)
+
+    hasher.finish()
+    res.chunks_digests = hasher.chunks_digests
+    res.full_digests = hasher.full_hasher.digests()
+    res.seconds_spent = hasher.seconds_spent()
+    return res
+
+
+def _hash_file_chunk(file_name, hash_types, offset, length, buffer_size, cache_mode):
+    hasher = MultiHasher(hash_types)
+    buffer = bytearray(min(buffer_size, length) if length else 1)
+    view = memoryview(buffer)
+
+    with SequentialFileReader(file_name, offset, length, cache_mode=cache_mode) as input_file:
+        while True:
+            read_bytes = input_file.readinto(buffer)
+            if not read_bytes:
+                break
+
+            hasher.update(view[:read_bytes])
+
+    return hasher
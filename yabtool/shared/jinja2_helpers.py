@@ -1,7 +1,11 @@
+from collections import ChainMap, OrderedDict
 import os
+import threading
 
 from jinja2 import BaseLoader, Environment, StrictUndefined
 
+DEFAULT_TEMPLATES_CACHE_SIZE = 1024
+
 
 def jinja2_custom_filter_extract_year_four_digits(value):
     return value.strftime("%Y")
@@ -15,9 +19,55 @@ def jinja2_custom_filter_extract_day_two_digits(value):
     return value.strftime("%d")
 
 
+class CachingEnvironment(Environment):
+    """Environment which keeps compiled templates created with `from_string` in LRU cache keyed by source."""
+
+    def __init__(self, *args, templates_cache_size=DEFAULT_TEMPLATES_CACHE_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._templates_cache_size = templates_cache_size
+        self._templates_cache = OrderedDict()
+        self._templates_cache_lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class or not isinstance(source, str):
+            return super().from_string(source, globals=globals, template_class=template_class)
+
+        with self._templates_cache_lock:
+            res = self._templates_cache.get(source)
+            if res is not None:
+                self._templates_cache.move_to_end(source)
+                return res
+
+        res = super().from_string(source)
+
+        with self._templates_cache_lock:
+            self._templates_cache[source] = res
+            while len(self._templates_cache) > self._templates_cache_size:
+                self._templates_cache.popitem(last=False)
+
+        return res
+
+
+def render_template(template, context):
+    """Renders template with any mapping as context.
+
+    Unlike `Template.render` context is not copied into new dict, so only variables
+    referenced by template are looked up.
+
+    >>> render_template(create_rendering_environment().from_string("{{a}}-{{b}}"), ChainMap({"a": 1}, {"b": 2}))
+    '1-2'
+    """
+    jinja2_context = template.new_context(ChainMap(context, template.globals), shared=True)
+
+    try:
+        return template.environment.concat(template.root_render_func(jinja2_context))
+    except Exception:
+        return template.environment.handle_exception()
+
+
 def create_rendering_environment():
 
-    env = Environment(loader=BaseLoader, undefined=StrictUndefined)
+    env = CachingEnvironment(loader=BaseLoader, undefined=StrictUndefined)
 
     env.filters["extract_year_four_digits"] = jinja2_custom_filter_extract_year_four_digits
     env.filters["extract_month_two_digits"] = jinja2_custom_filter_extract_month_two_digits
@@ -0,0 +1,320 @@
+"""CPU and I/O priority of external commands and of in-process worker threads.
+
+On Linux niceness, I/O priority (`ioprio_set`) and CPU affinity are attributes of thread, they are
+applied to process group of command right after its start (command is started in its own session)
+and inherited by threads and children created afterwards, threads created by thread with lowered
+priority inherit it as well. Nothing is executed in child between `fork` and `exec`, since it's
+unsafe in multithreaded process. On Windows priority class and affinity mask of
+child process are set, I/O priority is lowered by idle priority class and background mode of threads.
+"""
+import ctypes
+import os
+import platform
+import sys
+import threading
+import time
+
+from yabtool.shared.base import AttrsToStringMixin
+
+IO_CLASS_REALTIME = "realtime"
+IO_CLASS_BEST_EFFORT = "best-effort"
+IO_CLASS_IDLE = "idle"
+IO_CLASSES = {IO_CLASS_REALTIME: 1, IO_CLASS_BEST_EFFORT: 2, IO_CLASS_IDLE: 3}
+
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_WHO_PGRP = 2
+_IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "amd64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "arm64": 30,
+    "riscv64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+    "s390x": 282,
+}
+
+_WINDOWS_IDLE_PRIORITY_CLASS = 0x00000040
+_WINDOWS_BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+_WINDOWS_THREAD_PRIORITY_BELOW_NORMAL = -1
+_WINDOWS_THREAD_PRIORITY_IDLE = -15
+_WINDOWS_THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+_WINDOWS_IDLE_NICE = 15
+
+_IS_LINUX = sys.platform.startswith("linux")
+# library is loaded in parent process, so nothing is loaded by child between fork and exec
+_LIBC = ctypes.CDLL(None, use_errno=True) if _IS_LINUX else None
+
+
+def _ioprio_set(who, target_id, io_class, io_level):
+    syscall_number = _IOPRIO_SET_SYSCALLS.get(platform.machine().lower())
+    if _LIBC is None or syscall_number is None:
+        return False
+
+    value = (IO_CLASSES[io_class] << _IOPRIO_CLASS_SHIFT) | (io_level if io_level is not None else 4)
+    if _LIBC.syscall(syscall_number, who, target_id, value) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, "ioprio_set failed: {}".format(os.strerror(errno)))
+
+    return True
+
+
+def get_load_per_cpu():
+    """Returns 1 minute load average divided by count of CPUs or None when it isn't available."""
+    if not hasattr(os, "getloadavg"):
+        return None
+
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+class ProcessPriority(AttrsToStringMixin):
+    """Priority settings from `process_priority` parameter of step.
+
+    >>> priority = ProcessPriority.from_config({"nice": 10, "io_class": "idle", "load_threshold": 0.5})
+    >>> priority.for_load(0.2).nice, priority.for_load(0.9).nice
+    (10, 19)
+    >>> ProcessPriority.from_config({}) is None
+    True
+    >>> ProcessPriority.from_config({"nice": 10, "load_threshold": 0}).for_load(0.1).nice
+    19
+    """
+
+    DEFAULT_HIGH_LOAD_NICE = 19
+
+    def __init__(
+        self,
+        nice=None,
+        io_class=None,
+        io_level=None,
+        cpu_affinity=None,
+        load_threshold=None,
+        high_load_nice=DEFAULT_HIGH_LOAD_NICE,
+        high_load_io_class=IO_CLASS_IDLE
+    ):
+        self.nice = nice
+        self.io_class = io_class
+        self.io_level = io_level
+        self.cpu_affinity = cpu_affinity
+        self.load_threshold = load_threshold
+        self.high_load_nice = high_load_nice
+        self.high_load_io_class = high_load_io_class
+
+    @classmethod
+    def from_config(cls, config):
+        """Returns ProcessPriority or None when nothing is configured, raises ValueError on invalid values."""
+        if not config:
+            return None
+
+        unknown_names = set(config) - {
+            "nice", "io_class", "io_level", "cpu_affinity", "load_threshold", "high_load_nice", "high_load_io_class"
+        }
+        if unknown_names:
+            raise ValueError("unknown process priority parameters: {}".format(sorted(unknown_names)))
+
+        res = cls(
+            nice=cls._get_int(config, "nice", -20, 19),
+            io_class=cls._get_io_class(config, "io_class"),
+            io_level=cls._get_int(config, "io_level", 0, 7),
+            load_threshold=float(config["load_threshold"]) if config.get("load_threshold") is not None else None,
+            high_load_nice=cls._get_int(config, "high_load_nice", 0, 19, cls.DEFAULT_HIGH_LOAD_NICE),
+            high_load_io_class=cls._get_io_class(config, "high_load_io_class", IO_CLASS_IDLE)
+        )
+
+        if config.get("cpu_affinity"):
+            res.cpu_affinity = sorted({int(item) for item in config["cpu_affinity"]})
+            if any(item < 0 or item >= (os.cpu_count() or 1) for item in res.cpu_affinity):
+                raise ValueError("cpu_affinity should contain numbers of CPUs from 0 to {}".format(os.cpu_count() - 1))
+
+        return res
+
+    @staticmethod
+    def _get_int(config, name, min_value, max_value, default_value=None):
+        value = config.get(name)
+        if value is None:
+            return default_value
+
+        value = int(value)
+        if not (min_value <= value <= max_value):
+            raise ValueError("'{}' should be in range [{}, {}]".format(name, min_value, max_value))
+
+        return value
+
+    @staticmethod
+    def _get_io_class(config, name, default_value=None):
+        value = config.get(name, default_value)
+        if value is not None and value not in IO_CLASSES:
+            raise ValueError("'{}' should be one of {}".format(name, sorted(IO_CLASSES)))
+
+        return value
+
+    @property
+    def is_adaptive(self):
+        return self.load_threshold is not None
+
+    def is_high_load(self, load_per_cpu):
+        return self.is_adaptive and load_per_cpu is not None and load_per_cpu > self.load_threshold
+
+    def for_load(self, load_per_cpu):
+        """Returns priority which should be used when host has `load_per_cpu`."""
+        if not self.is_high_load(load_per_cpu):
+            return self
+
+        return ProcessPriority(
+            nice=max(self.nice or 0, self.high_load_nice),
+            io_class=self.high_load_io_class,
+            io_level=self.io_level,
+            cpu_affinity=self.cpu_affinity
+        )
+
+    def apply_to_current_thread(self):
+        """Returns False when priority of separate thread can't be changed on current platform."""
+        if os.name == "nt":
+            return self._apply_to_windows_thread()
+
+        if not _IS_LINUX:
+            return False
+
+        # on Linux these calls with id 0 change calling thread only
+        self._apply_posix(0, os.PRIO_PROCESS, _IOPRIO_WHO_PROCESS)
+        return True
+
+    def apply_to_process_group(self, process_group_id):
+        """Lowers priority of all processes (and their threads) of running command, I/O priority on Linux only."""
+        if os.name != "posix":
+            return False
+
+        self._apply_posix(process_group_id, os.PRIO_PGRP, _IOPRIO_WHO_PGRP, apply_affinity=False)
+        return True
+
+    def apply_to_started_process(self, process_id):
+        """Applies priority to just started leader of process group and its group, returns False on Windows."""
+        if not self.apply_to_process_group(process_id):
+            return False
+
+        # affinity can't be set for process group, children of leader inherit it
+        if self.cpu_affinity and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(process_id, self.cpu_affinity)
+
+        return True
+
+    def _apply_posix(self, target_id, priority_kind, ioprio_who, apply_affinity=True):
+        # priority is never raised, unprivileged process isn't allowed to do it anyway
+        if self.nice is not None and self.nice > os.getpriority(priority_kind, target_id):
+            os.setpriority(priority_kind, target_id, self.nice)
+
+        if self.io_class is not None:
+            _ioprio_set(ioprio_who, target_id, self.io_class, self.io_level)
+
+        if apply_affinity and self.cpu_affinity and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(target_id, self.cpu_affinity)
+
+    def get_windows_creation_flags(self):
+        if self.io_class == IO_CLASS_IDLE or (self.nice or 0) >= _WINDOWS_IDLE_NICE:
+            return _WINDOWS_IDLE_PRIORITY_CLASS
+
+        if (self.nice or 0) > 0:
+            return _WINDOWS_BELOW_NORMAL_PRIORITY_CLASS
+
+        return 0
+
+    def apply_to_windows_process(self, process_handle):
+        if self.cpu_affinity:
+            ctypes.windll.kernel32.SetProcessAffinityMask(
+                ctypes.c_void_p(int(process_handle)),
+                ctypes.c_size_t(self._get_affinity_mask())
+            )
+
+    def _apply_to_windows_thread(self):
+        kernel32 = ctypes.windll.kernel32
+        thread_handle = ctypes.c_void_p(kernel32.GetCurrentThread())
+
+        if self.io_class == IO_CLASS_IDLE:
+            # background mode lowers both CPU and I/O priority of thread
+            kernel32.SetThreadPriority(thread_handle, _WINDOWS_THREAD_MODE_BACKGROUND_BEGIN)
+        elif (self.nice or 0) >= _WINDOWS_IDLE_NICE:
+            kernel32.SetThreadPriority(thread_handle, _WINDOWS_THREAD_PRIORITY_IDLE)
+        elif (self.nice or 0) > 0:
+            kernel32.SetThreadPriority(thread_handle, _WINDOWS_THREAD_PRIORITY_BELOW_NORMAL)
+
+        if self.cpu_affinity:
+            kernel32.SetThreadAffinityMask(thread_handle, ctypes.c_size_t(self._get_affinity_mask()))
+
+        return True
+
+    def _get_affinity_mask(self):
+        return sum(1 << item for item in self.cpu_affinity)
+
+
+class AdaptivePriorityMonitor(object):
+    """Lowers priority of running command when load average of host exceeds threshold.
+
+    Priority isn't raised back when load decreases, since unprivileged process can't do it.
+    """
+
+    CHECK_INTERVAL_SECONDS = 5.0
+
+    def __init__(self, priority, process_group_id, logger=None, get_load=get_load_per_cpu, clock=time.monotonic):
+        self._priority = priority
+        self._process_group_id = process_group_id
+        self._logger = logger
+        self._get_load = get_load
+        self._clock = clock
+        self._next_check = self._clock() + AdaptivePriorityMonitor.CHECK_INTERVAL_SECONDS
+        self.is_lowered = False
+
+    def check(self):
+        if self.is_lowered or self._clock() < self._next_check:
+            return
+
+        self._next_check = self._clock() + AdaptivePriorityMonitor.CHECK_INTERVAL_SECONDS
+        load_per_cpu = self._get_load()
+        if not self._priority.is_high_load(load_per_cpu):
+            return
+
+        self.is_lowered = True
+        try:
+            if self._priority.for_load(load_per_cpu).apply_to_process_group(self._process_group_id) and self._logger:
+                self._logger.info("load average per CPU is {:.2f}, priority of command is lowered".format(load_per_cpu))
+        except OSError as e:
+            if self._logger is not None:
+                self._logger.warning("can't lower priority of command: {}".format(e))
+
+
+def call_with_priority(priority, logger, function, *args, **kwargs):
+    """Calls function in separate thread with lowered priority, threads started by the function inherit it on Linux.
+
+    Priority of calling thread stays unchanged, since it can't be raised back. Function is called with normal
+    priority when it can't be lowered (warning is logged with `logger`).
+    """
+    if priority is None:
+        return function(*args, **kwargs)
+
+    priority = priority.for_load(get_load_per_cpu())
+    result = dict()
+
+    def _target():
+        try:
+            priority.apply_to_current_thread()
+        except OSError as e:
+            if logger is not None:
+                logger.warning("can't lower priority: {}".format(e))
+
+        try:
+            result["value"] = function(*args, **kwargs)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=_target, name="yabtool-low-priority", daemon=True)
+    thread.start()
+    thread.join()
+
+    if "error" in result:
+        raise result["error"]
+
+    return result.get("value")
@@ -0,0 +1,198 @@
+"""Resources consumed by child processes (CPU time, peak memory, I/O).
+
+On Linux exited child is detected with `waitid(WNOWAIT)`, so its `/proc/<pid>/io` (which includes
+I/O of its own waited children, e.g. tools started by shell) is read before it's reaped by `wait4`,
+which returns CPU time and peak RSS. On Windows counters are read from process handle.
+"""
+import ctypes
+import os
+import sys
+
+from yabtool.shared.base import AttrsToStringMixin
+
+
+class ProcessResourceUsage(AttrsToStringMixin):
+    def __init__(self):
+        self.user_cpu_seconds = None
+        self.system_cpu_seconds = None
+        self.peak_rss_bytes = None
+        self.storage_read_bytes = None
+        self.storage_written_bytes = None
+        self.read_bytes = None
+        self.written_bytes = None
+        self.elapsed_seconds = None
+
+    @property
+    def cpu_seconds(self):
+        if self.user_cpu_seconds is None:
+            return None
+
+        return self.user_cpu_seconds + (self.system_cpu_seconds or 0.0)
+
+
+def parse_proc_io(content):
+    """Parses content of `/proc/<pid>/io` into dict.
+
+    >>> parse_proc_io("rchar: 100\\nwchar: 50\\nread_bytes: 4096\\nwrite_bytes: 0\\n")["read_bytes"]
+    4096
+    """
+    res = dict()
+    for line in content.splitlines():
+        name, _, value = line.partition(":")
+        if value.strip().isdigit():
+            res[name.strip()] = int(value.strip())
+
+    return res
+
+
+def _exit_status_to_code(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+
+def _read_proc_io(pid):
+    try:
+        with open("/proc/{}/io".format(pid), "r") as input_file:
+            return parse_proc_io(input_file.read())
+    except (IOError, OSError):
+        return dict()
+
+
+def _get_max_rss_bytes(max_rss):
+    # ru_maxrss is in bytes on macOS and in kilobytes on other systems
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class _PosixProcessReaper(object):
+    def __init__(self, process):
+        self._process = process
+
+    def poll(self):
+        """Returns return code or None when process is still running, usage is collected on exit."""
+        if self._process.returncode is not None:
+            return self._process.returncode, None
+
+        pid = self._process.pid
+        try:
+            if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+                return None, None
+        except ChildProcessError:
+            return self._process.poll(), None
+
+        usage = ProcessResourceUsage()
+        io_counters = _read_proc_io(pid)
+        usage.storage_read_bytes = io_counters.get("read_bytes")
+        usage.storage_written_bytes = io_counters.get("write_bytes")
+        usage.read_bytes = io_counters.get("rchar")
+        usage.written_bytes = io_counters.get("wchar")
+
+        _, status, rusage = os.wait4(pid, 0)
+        usage.user_cpu_seconds = rusage.ru_utime
+        usage.system_cpu_seconds = rusage.ru_stime
+        usage.peak_rss_bytes = _get_max_rss_bytes(rusage.ru_maxrss)
+
+        self._process.returncode = _exit_status_to_code(status)
+        return self._process.returncode, usage
+
+
+class _FileTime(ctypes.Structure):
+    _fields_ = [("low", ctypes.c_uint32), ("high", ctypes.c_uint32)]
+
+    def to_seconds(self):
+        return ((self.high << 32) + self.low) / 10000000.0
+
+
+class _IoCounters(ctypes.Structure):
+    _fields_ = [
+        ("read_operations", ctypes.c_uint64),
+        ("write_operations", ctypes.c_uint64),
+        ("other_operations", ctypes.c_uint64),
+        ("read_transfer", ctypes.c_uint64),
+        ("write_transfer", ctypes.c_uint64),
+        ("other_transfer", ctypes.c_uint64),
+    ]
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+    _fields_ = [
+        ("cb", ctypes.c_uint32),
+        ("page_fault_count", ctypes.c_uint32),
+        ("peak_working_set_size", ctypes.c_size_t),
+        ("working_set_size", ctypes.c_size_t),
+        ("quota_peak_paged_pool_usage", ctypes.c_size_t),
+        ("quota_paged_pool_usage", ctypes.c_size_t),
+        ("quota_peak_non_paged_pool_usage", ctypes.c_size_t),
+        ("quota_non_paged_pool_usage", ctypes.c_size_t),
+        ("pagefile_usage", ctypes.c_size_t),
+        ("peak_pagefile_usage", ctypes.c_size_t),
+    ]
+
+
+class _WindowsProcessReaper(object):
+    """Counters of exited process are read from its handle, they don't include children of the process."""
+
+    def __init__(self, process):
+        self._process = process
+
+    def poll(self):
+        if self._process.poll() is None:
+            return None, None
+
+        # handle stays open until Popen object is destroyed, so counters of exited process are available
+        return self._process.returncode, self._read_usage(ctypes.c_void_p(int(self._process._handle)))
+
+    @staticmethod
+    def _read_usage(handle):
+        res = ProcessResourceUsage()
+        try:
+            kernel32 = ctypes.windll.kernel32
+
+            creation_time, exit_time, kernel_time, user_time = _FileTime(), _FileTime(), _FileTime(), _FileTime()
+            if kernel32.GetProcessTimes(
+                handle,
+                ctypes.byref(creation_time),
+                ctypes.byref(exit_time),
+                ctypes.byref(kernel_time),
+                ctypes.byref(user_time)
+            ):
+                res.user_cpu_seconds = user_time.to_seconds()
+                res.system_cpu_seconds = kernel_time.to_seconds()
+
+            io_counters = _IoCounters()
+            if kernel32.GetProcessIoCounters(handle, ctypes.byref(io_counters)):
+                res.read_bytes = io_counters.read_transfer
+                res.written_bytes = io_counters.write_transfer
+
+            memory_counters = _ProcessMemoryCounters()
+            memory_counters.cb = ctypes.sizeof(_ProcessMemoryCounters)
+            if ctypes.windll.psapi.GetProcessMemoryInfo(
+                handle,
+                ctypes.byref(memory_counters),
+                memory_counters.cb
+            ):
+                res.peak_rss_bytes = memory_counters.peak_working_set_size
+        except (AttributeError, OSError):
+            pass
+
+        return res
+
+
+class _GenericProcessReaper(object):
+    def __init__(self, process):
+        self._process = process
+
+    def poll(self):
+        return self._process.poll(), None
+
+
+def create_process_reaper(process):
+    """Returns object which `poll()` returns tuple of return code and ProcessResourceUsage (or None)."""
+    if hasattr(os, "waitid") and hasattr(os, "WNOWAIT") and hasattr(os, "wait4"):
+        return _PosixProcessReaper(process)
+
+    if os.name == "nt":
+        return _WindowsProcessReaper(process)
+
+    return _GenericProcessReaper(process)
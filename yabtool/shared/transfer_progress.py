@@ -0,0 +1,124 @@
+from collections import namedtuple
+import threading
+import time
+
+BYTES_IN_MEGABYTE = 1024 * 1024
+DEFAULT_INTERVAL_SECONDS = 5.0
+
+TransferProgressSample = namedtuple(
+    "TransferProgressSample",
+    ["seconds_elapsed", "transferred_bytes", "instant_rate", "average_rate", "eta_seconds"]
+)
+
+
+def format_progress_sample(name, sample, total_bytes=None):
+    """Formats sample as human readable line.
+
+    >>> mib = BYTES_IN_MEGABYTE
+    >>> format_progress_sample("db.7z", TransferProgressSample(10.0, 50 * mib, 4 * mib, 5 * mib, 10.0), 100 * mib)
+    "'db.7z' transmitted: 50.0% (50.00 MiB), 4.00 MiB/s (average 5.00 MiB/s), ETA 10 s"
+    """
+    transferred = "{:.2f} MiB".format(sample.transferred_bytes / BYTES_IN_MEGABYTE)
+    if total_bytes:
+        transferred = "{}% ({})".format(round(sample.transferred_bytes * 100.0 / total_bytes, 2), transferred)
+
+    res = "'{}' transmitted: {}, {:.2f} MiB/s (average {:.2f} MiB/s)".format(
+        name,
+        transferred,
+        sample.instant_rate / BYTES_IN_MEGABYTE,
+        sample.average_rate / BYTES_IN_MEGABYTE
+    )
+    if sample.eta_seconds is not None:
+        res += ", ETA {} s".format(int(round(sample.eta_seconds)))
+
+    return res
+
+
+class TransferProgressReporter(object):
+    """Progress callback for transfers which logs progress once per `interval_seconds`.
+
+    Callback is invoked by transfer threads for every transmitted block, so it only updates
+    counters under short lock; rates and ETA are calculated and logged when interval is passed.
+    Samples are passed to `on_sample`, gaps between transmitted blocks are tracked as stalls.
+    """
+
+    def __init__(
+        self,
+        logger,
+        name,
+        total_bytes=None,
+        interval_seconds=DEFAULT_INTERVAL_SECONDS,
+        on_sample=None,
+        clock=time.monotonic
+    ):
+        self._logger = logger
+        self.name = name
+        self.total_bytes = total_bytes
+        self.interval_seconds = float(interval_seconds)
+        self._on_sample = on_sample
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._start_timestamp = self._clock()
+        self._last_progress_timestamp = self._start_timestamp
+        self._next_sample_timestamp = self._start_timestamp + self.interval_seconds
+        self._last_sample = (self._start_timestamp, 0)
+        self._transferred_bytes = 0
+        self._finished = False
+
+        self.longest_stall_seconds = 0.0
+        self.samples = []
+
+    @property
+    def transferred_bytes(self):
+        return self._transferred_bytes
+
+    def __call__(self, bytes_amount):
+        now = self._clock()
+        with self._lock:
+            self._transferred_bytes += bytes_amount
+            self.longest_stall_seconds = max(self.longest_stall_seconds, now - self._last_progress_timestamp)
+            self._last_progress_timestamp = now
+
+            if now < self._next_sample_timestamp:
+                return
+
+            self._next_sample_timestamp = now + self.interval_seconds
+            sample = self._create_sample(now)
+
+        self._report(sample)
+
+    def finish(self):
+        """Reports final sample, returns it."""
+        now = self._clock()
+        with self._lock:
+            if self._finished:
+                return self.samples[-1] if self.samples else None
+
+            self._finished = True
+            self.longest_stall_seconds = max(self.longest_stall_seconds, now - self._last_progress_timestamp)
+            sample = self._create_sample(now)
+
+        self._report(sample)
+        return sample
+
+    def _create_sample(self, now):
+        last_timestamp, last_transferred_bytes = self._last_sample
+        self._last_sample = (now, self._transferred_bytes)
+
+        seconds_elapsed = now - self._start_timestamp
+        instant_rate = (self._transferred_bytes - last_transferred_bytes) / max(now - last_timestamp, 1e-6)
+        average_rate = self._transferred_bytes / max(seconds_elapsed, 1e-6)
+
+        eta_seconds = None
+        if self.total_bytes and average_rate > 0:
+            eta_seconds = max(0, self.total_bytes - self._transferred_bytes) / average_rate
+
+        res = TransferProgressSample(seconds_elapsed, self._transferred_bytes, instant_rate, average_rate, eta_seconds)
+        self.samples.append(res)
+        return res
+
+    def _report(self, sample):
+        self._logger.info(format_progress_sample(self.name, sample, self.total_bytes))
+        if self._on_sample is not None:
+            self._on_sample(sample)
@@ -6,9 +6,9 @@ import mimetypes
 import os
 import socket
 
-import boto3
 from botocore.exceptions import ClientError
 from yabtool.shared.base import AttrsToStringMixin
+from yabtool.shared.boto_clients_registry import get_boto_clients_registry
 from yabtool.shared.jinja2_helpers import create_rendering_environment
 from yabtool.supported_steps.base import pretty_time_delta, time_interval
 from yabtool.version import __version__
@@ -49,11 +49,12 @@ class EmailSender(object):
         aws_secret_access_key = connection_data.get("aws_secret_access_key")
         assert aws_secret_access_key
 
-        client = boto3.client(
+        client = get_boto_clients_registry().get_client(
             "ses",
             region_name=region,
             aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key
+            aws_secret_access_key=aws_secret_access_key,
+            endpoint_url=connection_data.get("endpoint_url")
         )
 
         msg = MIMEMultipart()
@@ -1,9 +1,12 @@
 from .factory import create_steps_factory
 
 from .step_calculate_file_hash_and_save_to_file import StepCalculateFileHashAndSaveToFile
+from .step_cdc_upload_with_rotation import StepCdcUploadWithRotation
 from .step_compress_file_with_7z import StepCompressFileWith7Z
+from .step_compress_stream import StepCompressStream
 from .step_make_directory_for_backup import StepMakeDirectoryForBackup
 from .step_make_firebird_database_backup import StepMakeFirebirdDatabaseBackup
 from .step_s3_multipart_upload_with_rotation import StepS3MultipartUploadWithRotation
 from .step_validate_7z_archive import StepValidate7ZArchive
 from .step_s3_strict_uploader import StepS3StrictUploader
+from .step_s3_stream_upload_with_rotation import StepS3StreamUploadWithRotation
@@ -1,6 +1,13 @@
+from collections import ChainMap
 import datetime
 import os
 
+from yabtool.shared.file_io import normalize_cache_mode
+from yabtool.shared.jinja2_helpers import render_template
+from yabtool.shared.process_priority import ProcessPriority
+
+from .shared import ThirdPartyCommandsExecutor
+
 
 class DryRunExecutionError(Exception):
     pass
@@ -14,6 +21,10 @@ class WrongParameterTypeError(Exception):
     pass
 
 
+class StreamingExecutionError(Exception):
+    pass
+
+
 class StepContextData(object):
     def __init__(self):
         self.name = None
@@ -53,9 +64,43 @@ def time_interval(timestamp_start, timestamp_end):
     return res
 
 
+def intervals_union_length(intervals):
+    """Returns length of time covered by (start, end) intervals, overlapping parts are counted once.
+
+    >>> intervals_union_length([(0.0, 2.0), (1.0, 3.0), (5.0, 6.0)])
+    4.0
+    >>> intervals_union_length([])
+    0.0
+    """
+    res = 0.0
+    current_start, current_end = None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                res += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+
+    if current_end is not None:
+        res += current_end - current_start
+
+    return res
+
+
 class BaseFlowStep(object):
     BYTES_IN_MEGABYTE = 1024 * 1024
 
+    METRIC_COMMANDS_TIME = "Commands Time"
+    METRIC_CPU_USER_TIME = "CPU User Time"
+    METRIC_CPU_SYSTEM_TIME = "CPU System Time"
+    METRIC_CPU_UTILIZATION = "CPU Utilization"
+    METRIC_PEAK_RSS = "Peak RSS"
+    METRIC_STORAGE_READ = "Storage Read"
+    METRIC_STORAGE_WRITTEN = "Storage Written"
+    METRIC_IO_READ = "I/O Read"
+    METRIC_IO_WRITTEN = "I/O Written"
+
     def __init__(
         self,
         logger,
@@ -75,6 +120,10 @@ class BaseFlowStep(object):
     def step_name(cls):
         pass
 
+    @classmethod
+    def supports_streaming(cls):
+        return False
+
     @property
     def mixed_context(self):
         return self._get_mixed_context()
@@ -88,6 +137,12 @@ class BaseFlowStep(object):
     def vote_for_flow_execution_skipping(self):
         return None
 
+    def prepare_stage(self):
+        return self._generate_output_variables()
+
+    def run_stage(self, stat_entry, stage_context):
+        raise StreamingExecutionError("step '{}' can't be executed as streaming stage".format(self.step_name()))
+
     def _render_parameter(self, parameter_name, context=None):
         if not context:
             context = self.mixed_context
@@ -101,13 +156,10 @@ class BaseFlowStep(object):
         return res
 
     def _get_mixed_context(self):
-        mixed_context = self.rendering_context.to_context()
-        mixed_context = {**mixed_context, **self._get_step_context()}
-
-        return mixed_context
+        return self.rendering_context.to_context().new_child(self.secret_context).new_child(self.step_context)
 
     def _get_step_context(self):
-        return {**self.secret_context, **self.step_context}
+        return ChainMap(self.step_context, self.secret_context)
 
     def _render_result(self, template, additional_context=None):
         if not template:
@@ -116,13 +168,13 @@ class BaseFlowStep(object):
         mixed_context = self.mixed_context
 
         if additional_context:
-            mixed_context = {**mixed_context, **additional_context}
+            mixed_context = mixed_context.new_child(additional_context)
 
         return self._render_from_template_and_context(template, mixed_context)
 
     def _render_from_template_and_context(self, template, context):
         jinja2_template = self.rendering_environment.from_string(template)
-        return jinja2_template.render(**context)
+        return render_template(jinja2_template, context)
 
     def _generate_output_variables(self):
         res = dict()
@@ -135,6 +187,95 @@ class BaseFlowStep(object):
 
         return res
 
+    def _execute_command(self, command, stat_entry=None, **kwargs):
+        """Executes command with output streamed into step log, `command_timeout_seconds` limits its duration.
+
+        Command is killed when flow is cancelled (e.g. concurrent step failed), it's executed with
+        `process_priority` of step. Resources consumed by command are added to metrics of `stat_entry`
+        when it's passed.
+        """
+        timeout = self._get_step_context().get("command_timeout_seconds")
+
+        result = ThirdPartyCommandsExecutor.execute(
+            command,
+            logger=self.logger,
+            timeout=float(timeout) if timeout else None,
+            cancel_event=self._get_cancel_event(),
+            priority=self._get_process_priority(),
+            **kwargs
+        )
+
+        if stat_entry is not None:
+            self._update_resource_usage_metrics(stat_entry, result.resource_usage)
+
+        return result
+
+    def _update_resource_usage_metrics(self, stat_entry, resource_usage):
+        """Accumulates resources of external commands, e.g. CPU utilization close to 1.0 (or to number
+        of threads) means that command is CPU-bound, low one with large storage I/O - disk-bound.
+        """
+        if resource_usage is None:
+            return
+
+        self.logger.debug("resource usage of command: {}".format(resource_usage))
+
+        if resource_usage.cpu_seconds is not None and resource_usage.elapsed_seconds:
+            self._increment_metric(stat_entry, BaseFlowStep.METRIC_COMMANDS_TIME, resource_usage.elapsed_seconds, "s")
+            self._increment_metric(stat_entry, BaseFlowStep.METRIC_CPU_USER_TIME, resource_usage.user_cpu_seconds, "s")
+            self._increment_metric(
+                stat_entry,
+                BaseFlowStep.METRIC_CPU_SYSTEM_TIME,
+                resource_usage.system_cpu_seconds or 0.0,
+                "s"
+            )
+
+            commands_time = self._get_metric_by_name(stat_entry, BaseFlowStep.METRIC_COMMANDS_TIME).value
+            cpu_time = sum(
+                self._get_metric_by_name(stat_entry, metric_name).value
+                for metric_name in (BaseFlowStep.METRIC_CPU_USER_TIME, BaseFlowStep.METRIC_CPU_SYSTEM_TIME)
+            )
+            metric = self._get_metric_by_name(stat_entry, BaseFlowStep.METRIC_CPU_UTILIZATION, units_name="cores")
+            metric.value = round(cpu_time / commands_time, 2)
+
+        if resource_usage.peak_rss_bytes is not None:
+            peak_rss = round(resource_usage.peak_rss_bytes / BaseFlowStep.BYTES_IN_MEGABYTE, 2)
+            metric = self._get_metric_by_name(
+                stat_entry,
+                BaseFlowStep.METRIC_PEAK_RSS,
+                initial_value=0,
+                units_name="MiB"
+            )
+            metric.value = max(metric.value, peak_rss)
+
+        sizes = [
+            (BaseFlowStep.METRIC_STORAGE_READ, resource_usage.storage_read_bytes),
+            (BaseFlowStep.METRIC_STORAGE_WRITTEN, resource_usage.storage_written_bytes),
+            (BaseFlowStep.METRIC_IO_READ, resource_usage.read_bytes),
+            (BaseFlowStep.METRIC_IO_WRITTEN, resource_usage.written_bytes),
+        ]
+        for metric_name, size in sizes:
+            if size is not None:
+                self._increment_metric(stat_entry, metric_name, size / BaseFlowStep.BYTES_IN_MEGABYTE, "MiB")
+
+    def _increment_metric(self, stat_entry, metric_name, delta, units_name):
+        metric = self._get_metric_by_name(stat_entry, metric_name, initial_value=0, units_name=units_name)
+        metric.increment(round(delta, 3))
+
+    def _get_process_priority(self):
+        try:
+            return ProcessPriority.from_config(self._get_step_context().get("process_priority"))
+        except (TypeError, ValueError) as e:
+            raise DryRunExecutionError("invalid 'process_priority' of step '{}': {}".format(self.step_name(), e))
+
+    def _get_read_cache_mode(self):
+        try:
+            return normalize_cache_mode(self._get_step_context().get("read_cache_mode"))
+        except ValueError as e:
+            raise DryRunExecutionError("invalid 'read_cache_mode' of step '{}': {}".format(self.step_name(), e))
+
+    def _get_cancel_event(self):
+        return getattr(self.rendering_context, "cancel_event", None)
+
     def _get_metric_by_name(self, stat_entry, metric_name, initial_value=None, units_name=None):
         return stat_entry.metrics.get_metric(metric_name, initial_value=initial_value, units_name=units_name)
 
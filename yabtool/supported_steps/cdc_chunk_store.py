@@ -0,0 +1,468 @@
+"""Content addressed storage of backups split into content defined chunks.
+
+Chunk is compressed (and optionally encrypted) separately and stored under key derived from
+its content, so chunks shared by several backups are stored once. Each backup is described by
+manifest with ordered list of chunk ids, rotation manipulates manifests only. Chunks which are
+not referenced by any live manifest are removed by mark and sweep.
+"""
+from collections import deque
+import datetime
+import hashlib
+import hmac
+import json
+import lzma
+import os
+import re
+import threading
+
+from yabtool.shared.bandwidth_limiter import consume_bandwidth
+from yabtool.shared.base import AttrsToStringMixin
+
+from .base import TransmissionError
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+
+class ChunkCodec(object):
+    """Compresses and encrypts chunks, calculates their ids.
+
+    With password chunks are encrypted with AES-256-GCM (requires "cryptography" package) and
+    ids are HMAC of content, so ids don't reveal content of chunks to the storage.
+    """
+
+    COMPRESSION_XZ = "xz"
+    ENCRYPTION_AES_GCM = "aes-256-gcm"
+    DEFAULT_COMPRESSION_PRESET = 3
+    KEY_DERIVATION_SALT = b"yabtool-chunk-store"
+    KEY_DERIVATION_ITERATIONS = 200000
+    NONCE_SIZE = 12
+
+    def __init__(self, compression_preset=DEFAULT_COMPRESSION_PRESET, password=None):
+        self.compression_preset = int(compression_preset)
+        self._cipher = None
+        self._id_key = None
+
+        if password:
+            if AESGCM is None:
+                raise ValueError("encryption of chunks requires 'cryptography' package")
+
+            key_material = hashlib.pbkdf2_hmac(
+                "sha256",
+                str(password).encode("utf-8"),
+                ChunkCodec.KEY_DERIVATION_SALT,
+                ChunkCodec.KEY_DERIVATION_ITERATIONS,
+                dklen=64
+            )
+            self._cipher = AESGCM(key_material[:32])
+            self._id_key = key_material[32:]
+
+    @property
+    def encryption(self):
+        return ChunkCodec.ENCRYPTION_AES_GCM if self._cipher is not None else None
+
+    def get_chunk_id(self, data):
+        """Returns id of chunk.
+
+        >>> ChunkCodec().get_chunk_id(b"abc")
+        'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'
+        """
+        if self._id_key is not None:
+            return hmac.new(self._id_key, data, hashlib.sha256).hexdigest()
+
+        return hashlib.sha256(data).hexdigest()
+
+    def pack(self, chunk_id, data):
+        res = lzma.compress(data, format=lzma.FORMAT_XZ, preset=self.compression_preset)
+        if self._cipher is None:
+            return res
+
+        # id is authenticated together with data, so chunk can't be substituted by another one
+        nonce = os.urandom(ChunkCodec.NONCE_SIZE)
+        return nonce + self._cipher.encrypt(nonce, res, chunk_id.encode("ascii"))
+
+    def unpack(self, chunk_id, blob):
+        if self._cipher is not None:
+            nonce, blob = blob[:ChunkCodec.NONCE_SIZE], blob[ChunkCodec.NONCE_SIZE:]
+            blob = self._cipher.decrypt(nonce, blob, chunk_id.encode("ascii"))
+
+        res = lzma.decompress(blob, format=lzma.FORMAT_XZ)
+        if self.get_chunk_id(res) != chunk_id:
+            raise TransmissionError("content of chunk '{}' doesn't match its id".format(chunk_id))
+
+        return res
+
+
+_CHUNK_ID_REGEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+def get_chunk_key(chunks_prefix, chunk_id):
+    """Returns key of chunk, chunks are spread over nested prefixes.
+
+    >>> get_chunk_key("backups/main/chunks/", "ab12cd")
+    'backups/main/chunks/ab/ab12cd'
+    """
+    return "{}/{}/{}".format(str(chunks_prefix).replace("\\", "/").rstrip("/"), chunk_id[:2], chunk_id)
+
+
+class LocalChunkStore(object):
+    """Chunk store in local folder (or mounted network share), keys are relative paths."""
+
+    def __init__(self, root_folder):
+        self.root_folder = os.path.abspath(root_folder)
+
+    @property
+    def location(self):
+        return "file://{}".format(self.root_folder.replace("\\", "/"))
+
+    def put_object(self, key, data):
+        file_name = self._get_file_name(key)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+        # object appears under final name only when it's completely written
+        temporary_file_name = "{}.{}.tmp".format(file_name, threading.get_ident())
+        with open(temporary_file_name, "wb") as output_file:
+            output_file.write(data)
+
+        os.replace(temporary_file_name, file_name)
+
+    def get_object(self, key):
+        file_name = self._get_file_name(key)
+        if not os.path.exists(file_name):
+            return None
+
+        with open(file_name, "rb") as input_file:
+            return input_file.read()
+
+    def list_keys(self, prefix):
+        folder = self._get_file_name(prefix)
+        if not os.path.isdir(folder):
+            return []
+
+        res = []
+        for root, _, files in os.walk(folder):
+            for file_name in files:
+                relative_name = os.path.relpath(os.path.join(root, file_name), self.root_folder)
+                res.append(relative_name.replace("\\", "/"))
+
+        return sorted(res)
+
+    def delete_keys(self, keys):
+        for key in keys:
+            file_name = self._get_file_name(key)
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def _get_file_name(self, key):
+        return os.path.join(self.root_folder, *str(key).replace("\\", "/").strip("/").split("/"))
+
+
+class S3ChunkStore(object):
+    """Chunk store in S3 bucket, uploads consume bandwidth of `limiters`."""
+
+    def __init__(self, basic_client, bucket_name, limiters=None):
+        self.basic_client = basic_client
+        self.bucket_name = bucket_name
+        self._limiters = list(limiters) if limiters else []
+
+    @property
+    def location(self):
+        return "s3://{}".format(self.bucket_name)
+
+    def put_object(self, key, data):
+        consume_bandwidth(self._limiters, len(data))
+        self.basic_client.put_object(self.bucket_name, key, data)
+
+    def get_object(self, key):
+        return self.basic_client.get_object_data(self.bucket_name, key)
+
+    def list_keys(self, prefix):
+        return self.basic_client.list_files_in_folder(self.bucket_name, str(prefix).rstrip("/") + "/")
+
+    def delete_keys(self, keys):
+        _, errors = self.basic_client.delete_objects(self.bucket_name, keys)
+        if errors:
+            raise TransmissionError("can't delete {} objects, first error: {}".format(len(errors), errors[0]))
+
+
+class LocalChunkIndex(object):
+    """Ids of chunks known to be stored, kept in local file per store and chunks prefix.
+
+    Chunks present in index are skipped without requests to the store, ids of chunks removed
+    from store should be discarded from index. New ids are appended to the file, one per line.
+    """
+
+    def __init__(self, index_folder, store_location, chunks_prefix):
+        location_hash = hashlib.sha256("{}/{}".format(store_location, chunks_prefix).encode("utf-8")).hexdigest()
+        self.file_name = os.path.join(index_folder, "{}.idx".format(location_hash[:32]))
+        self._known_ids = set()
+        self._new_ids = []
+
+    def load(self):
+        self._known_ids = set()
+        if os.path.exists(self.file_name):
+            with open(self.file_name, "r") as input_file:
+                self._known_ids.update(line.strip() for line in input_file if line.strip())
+
+        return len(self._known_ids)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._known_ids
+
+    def add(self, chunk_id):
+        if chunk_id not in self._known_ids:
+            self._known_ids.add(chunk_id)
+            self._new_ids.append(chunk_id)
+
+    def discard(self, chunk_ids):
+        """Removes ids of chunks which were removed from store, file is rewritten."""
+        removed_ids = self._known_ids.intersection(chunk_ids)
+        if not removed_ids:
+            return
+
+        self._known_ids -= removed_ids
+        self._new_ids = []
+
+        os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        temporary_file_name = "{}.tmp".format(self.file_name)
+        with open(temporary_file_name, "w") as output_file:
+            output_file.writelines("{}\n".format(chunk_id) for chunk_id in sorted(self._known_ids))
+
+        os.replace(temporary_file_name, self.file_name)
+
+    def save(self):
+        if not self._new_ids:
+            return
+
+        os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+        with open(self.file_name, "a") as output_file:
+            output_file.writelines("{}\n".format(chunk_id) for chunk_id in self._new_ids)
+
+        self._new_ids = []
+
+
+class ChunkingStatistics(AttrsToStringMixin):
+    def __init__(self):
+        self.chunks_count = 0
+        self.new_chunks_count = 0
+        self.total_bytes = 0
+        self.new_bytes = 0
+        self.stored_bytes = 0
+
+    @property
+    def deduplicated_bytes(self):
+        return self.total_bytes - self.new_bytes
+
+
+class ChunkedBackupWriter(object):
+    """Splits file into chunks, stores new ones and returns manifest of the file.
+
+    Chunks are packed and stored by `executor` while next chunks are looked for, count of
+    chunks in flight is limited by `max_pending_chunks`.
+    """
+
+    MANIFEST_VERSION = 1
+    DEFAULT_MAX_PENDING_CHUNKS = 16
+
+    def __init__(
+        self,
+        logger,
+        chunker,
+        codec,
+        store,
+        chunks_prefix,
+        chunk_index=None,
+        executor=None,
+        max_pending_chunks=DEFAULT_MAX_PENDING_CHUNKS
+    ):
+        self.logger = logger
+        self._chunker = chunker
+        self._codec = codec
+        self._store = store
+        self.chunks_prefix = chunks_prefix
+        self._chunk_index = chunk_index
+        self._executor = executor
+        self.max_pending_chunks = max(1, int(max_pending_chunks))
+
+    def write_file(self, file_name, progress_callback=None):
+        """Returns tuple of manifest (dict) and ChunkingStatistics."""
+        statistics = ChunkingStatistics()
+        file_hash = hashlib.sha256()
+        chunks = []
+        pending = deque()
+        scheduled_ids = set()
+
+        with open(file_name, "rb") as input_file:
+            for data in self._chunker.iterate_stream_chunks(input_file):
+                file_hash.update(data)
+                chunk_id = self._codec.get_chunk_id(data)
+                chunks.append([chunk_id, len(data)])
+
+                statistics.chunks_count += 1
+                statistics.total_bytes += len(data)
+
+                # the same chunk may repeat in the file, it's stored once
+                if chunk_id not in scheduled_ids and not self._is_chunk_known(chunk_id):
+                    scheduled_ids.add(chunk_id)
+                    statistics.new_chunks_count += 1
+                    statistics.new_bytes += len(data)
+                    pending.append((chunk_id, self._submit(self._store_chunk, chunk_id, data)))
+
+                while len(pending) >= self.max_pending_chunks:
+                    self._complete_pending(pending, statistics)
+
+                if progress_callback is not None:
+                    progress_callback(len(data))
+
+        while pending:
+            self._complete_pending(pending, statistics)
+
+        if self._chunk_index is not None:
+            self._chunk_index.save()
+
+        manifest = {
+            "version": ChunkedBackupWriter.MANIFEST_VERSION,
+            "file_name": os.path.basename(file_name),
+            "size": statistics.total_bytes,
+            "sha256": file_hash.hexdigest(),
+            "created": datetime.datetime.utcnow().isoformat(),
+            "compression": ChunkCodec.COMPRESSION_XZ,
+            "encryption": self._codec.encryption,
+            "chunks_prefix": self.chunks_prefix,
+            "chunks": chunks
+        }
+        return manifest, statistics
+
+    def _is_chunk_known(self, chunk_id):
+        return self._chunk_index is not None and chunk_id in self._chunk_index
+
+    def _submit(self, function, *args):
+        if self._executor is None:
+            return _CompletedFuture(function(*args))
+
+        return self._executor.submit(function, *args)
+
+    def _store_chunk(self, chunk_id, data):
+        blob = self._codec.pack(chunk_id, data)
+        self._store.put_object(get_chunk_key(self.chunks_prefix, chunk_id), blob)
+        return len(blob)
+
+    def _complete_pending(self, pending, statistics):
+        chunk_id, future = pending.popleft()
+        statistics.stored_bytes += future.result()
+
+        # chunk is added into index only when it's stored
+        if self._chunk_index is not None:
+            self._chunk_index.add(chunk_id)
+
+
+class _CompletedFuture(object):
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
+
+
+def dump_manifest(manifest):
+    return json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+
+
+def load_manifest(data):
+    res = json.loads(data.decode("utf-8"))
+    if res.get("version") != ChunkedBackupWriter.MANIFEST_VERSION:
+        raise ValueError("unsupported manifest version: {}".format(res.get("version")))
+
+    return res
+
+
+def list_manifest_keys(store, prefix, manifest_suffix):
+    return [key for key in store.list_keys(prefix) if key.endswith(manifest_suffix)]
+
+
+def remove_unreferenced_chunks(store, chunks_prefix, manifest_keys, chunk_index=None):
+    """Removes chunks which aren't referenced by manifests with `manifest_keys`, returns removed keys.
+
+    Nothing is removed when any manifest can't be loaded, since its chunks would be lost.
+    """
+    referenced_ids = set()
+    for key in manifest_keys:
+        data = store.get_object(key)
+        if data is None:
+            raise TransmissionError("manifest '{}' disappeared, unreferenced chunks aren't removed".format(key))
+
+        manifest = load_manifest(data)
+        if manifest["chunks_prefix"].rstrip("/") == str(chunks_prefix).rstrip("/"):
+            referenced_ids.update(chunk_id for chunk_id, _ in manifest["chunks"])
+
+    unreferenced_keys = []
+    for key in store.list_keys(chunks_prefix):
+        # temporary files of chunks which are being written aren't chunks yet
+        chunk_id = key.rsplit("/", 1)[-1]
+        if _CHUNK_ID_REGEX.match(chunk_id) and chunk_id not in referenced_ids:
+            unreferenced_keys.append(key)
+
+    if not unreferenced_keys:
+        return []
+
+    # chunks are removed from index first, so they're uploaded again if removal fails in the middle
+    if chunk_index is not None:
+        chunk_index.discard(key.rsplit("/", 1)[-1] for key in unreferenced_keys)
+
+    store.delete_keys(unreferenced_keys)
+    return unreferenced_keys
+
+
+def _load_chunk(store, codec, chunks_prefix, chunk_id, size):
+    blob = store.get_object(get_chunk_key(chunks_prefix, chunk_id))
+    if blob is None:
+        raise TransmissionError("chunk '{}' is missing in store".format(chunk_id))
+
+    data = codec.unpack(chunk_id, blob)
+    if len(data) != size:
+        raise TransmissionError("size of chunk '{}' is {}, but {} is expected".format(chunk_id, len(data), size))
+
+    return data
+
+
+def restore_from_manifest(store, codec, manifest, output_stream, executor=None, max_pending_chunks=1):
+    """Writes content described by manifest into `output_stream`, returns count of written bytes.
+
+    Chunks are downloaded and unpacked by `executor` ahead of writing, count of chunks in flight
+    is limited by `max_pending_chunks`, chunks are written in order of manifest.
+    """
+    file_hash = hashlib.sha256()
+    pending = deque()
+    chunks = iter(manifest["chunks"])
+    res = 0
+
+    def submit_next():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+
+        arguments = (store, codec, manifest["chunks_prefix"], chunk[0], chunk[1])
+        if executor is None:
+            pending.append(_CompletedFuture(_load_chunk(*arguments)))
+        else:
+            pending.append(executor.submit(_load_chunk, *arguments))
+
+        return True
+
+    while len(pending) < max(1, int(max_pending_chunks)) and submit_next():
+        pass
+
+    while pending:
+        data = pending.popleft().result()
+        submit_next()
+
+        output_stream.write(data)
+        file_hash.update(data)
+        res += len(data)
+
+    if file_hash.hexdigest() != manifest["sha256"]:
+        raise TransmissionError("sha256 of restored '{}' doesn't match manifest".format(manifest["file_name"]))
+
+    return res
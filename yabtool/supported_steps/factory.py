@@ -1,10 +1,13 @@
 from .step_calculate_file_hash_and_save_to_file import StepCalculateFileHashAndSaveToFile
+from .step_cdc_upload_with_rotation import StepCdcUploadWithRotation
 from .step_compress_file_with_7z import StepCompressFileWith7Z
+from .step_compress_stream import StepCompressStream
 from .step_make_directory_for_backup import StepMakeDirectoryForBackup
 from .step_make_firebird_database_backup import StepMakeFirebirdDatabaseBackup, StepMakeFirebirdLinuxDatabaseBackup
 from .step_make_healthchecks_ping import StepMakeHealthchecksPing
 from .step_make_pg_win_database_backup import StepMakePgDatabaseWinBackup
 from .step_s3_multipart_upload_with_rotation import StepS3MultipartUploadWithRotation
+from .step_s3_stream_upload_with_rotation import StepS3StreamUploadWithRotation
 from .step_s3_strict_uploader import StepS3StrictUploader
 from .step_validate_7z_archive import StepValidate7ZArchive
 
@@ -37,5 +40,8 @@ def create_steps_factory():
     factory.register_class(StepS3StrictUploader)
     factory.register_class(StepMakePgDatabaseWinBackup)
     factory.register_class(StepMakeHealthchecksPing)
+    factory.register_class(StepCompressStream)
+    factory.register_class(StepS3StreamUploadWithRotation)
+    factory.register_class(StepCdcUploadWithRotation)
 
     return factory
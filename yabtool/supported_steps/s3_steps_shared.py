@@ -1,10 +1,17 @@
 import copy
+import datetime
+import json
 import os
 
-import boto3
+from yabtool.shared.bandwidth_limiter import get_bandwidth_limiter
 from yabtool.shared.base import AttrsToStringMixin
+from yabtool.shared.boto_clients_registry import get_boto_clients_registry
+from yabtool.shared.hashing import parse_content_hash
+from yabtool.shared.transfer_progress import DEFAULT_INTERVAL_SECONDS, TransferProgressReporter
 
-from .base import BaseFlowStep, TransmissionError
+from .base import BaseFlowStep, intervals_union_length, TransmissionError
+from .s3_transfer_manager import S3TransferManager
+from .s3boto_client import S3BasicBotoClient, S3UploadRequest
 
 
 class UploadTarget(AttrsToStringMixin):
@@ -12,6 +19,138 @@ class UploadTarget(AttrsToStringMixin):
         self.source_file = None
         self.add_dedup_tag = False
         self.os_file_name = None
+        self.from_stream = False
+        self.content_hash_file = None
+
+
+class S3DedupIndex(object):
+    """Small JSON object per destination prefix with dedup tags of objects uploaded into the prefix.
+
+    Index allows to check whether upload rule is already satisfied with one request instead of
+    reading tags of each object in the prefix. Index objects are stored outside of destination
+    prefixes, so they are not removed by rotation.
+    """
+
+    INDEX_PREFIX = ".yabtool/dedup_index/"
+    INDEX_VERSION = 1
+
+    def __init__(self, logger, basic_client, bucket_name):
+        self.logger = logger
+        self._basic_client = basic_client
+        self._bucket_name = bucket_name
+
+    @staticmethod
+    def get_index_key(destination_prefix):
+        """Returns key of index object for destination prefix.
+
+        >>> S3DedupIndex.get_index_key("backups/main/weekdays/mon/")
+        '.yabtool/dedup_index/backups/main/weekdays/mon.json'
+        """
+        return "{}{}.json".format(S3DedupIndex.INDEX_PREFIX, str(destination_prefix).replace("\\", "/").strip("/"))
+
+    def load(self, destination_prefix):
+        """Returns entries {tag_name: {"value": tag_value, "key": object_key}} or None when index is absent."""
+        data = self._basic_client.get_object_data(self._bucket_name, self.get_index_key(destination_prefix))
+        if data is None:
+            return None
+
+        try:
+            index_data = json.loads(data.decode("utf-8"))
+        except ValueError as e:
+            self.logger.warning("dedup index for '{}' is broken and will be ignored: {}".format(destination_prefix, e))
+            return None
+
+        return index_data.get("entries", {})
+
+    def save(self, destination_prefix, entries):
+        index_data = {"version": S3DedupIndex.INDEX_VERSION, "prefix": destination_prefix, "entries": entries}
+        self._basic_client.put_object(
+            self._bucket_name,
+            self.get_index_key(destination_prefix),
+            json.dumps(index_data, indent=2, sort_keys=True).encode("utf-8")
+        )
+
+    @staticmethod
+    def find_key(entries, tag_name, tag_value):
+        entry = entries.get(tag_name)
+        if entry is None or entry.get("value") != tag_value:
+            return None
+
+        return entry.get("key")
+
+
+class S3ContentIndex(object):
+    """JSON object per target with content hashes of recently uploaded files.
+
+    Uploaded objects carry content hash in metadata, so file with the same content is
+    materialised by server side copy of existing object instead of transmission.
+    """
+
+    INDEX_PREFIX = ".yabtool/content_index/"
+    INDEX_VERSION = 1
+    CONTENT_HASH_METADATA_NAME = "yabtool-content-hash"
+    DEFAULT_MAX_ENTRIES = 32
+
+    def __init__(self, logger, basic_client, bucket_name, max_entries=DEFAULT_MAX_ENTRIES):
+        self.logger = logger
+        self._basic_client = basic_client
+        self._bucket_name = bucket_name
+        self.max_entries = max_entries
+
+    @staticmethod
+    def get_index_key(target_prefix):
+        """Returns key of index object for target prefix.
+
+        >>> S3ContentIndex.get_index_key("backups/main")
+        '.yabtool/content_index/backups/main.json'
+        """
+        return "{}{}.json".format(S3ContentIndex.INDEX_PREFIX, str(target_prefix).replace("\\", "/").strip("/"))
+
+    def load(self, target_prefix):
+        """Returns entries {content_hash: {"key": object_key, "size": size, "uploaded": timestamp}}."""
+        data = self._basic_client.get_object_data(self._bucket_name, self.get_index_key(target_prefix))
+        if data is None:
+            return {}
+
+        try:
+            index_data = json.loads(data.decode("utf-8"))
+        except ValueError as e:
+            self.logger.warning("content index for '{}' is broken and will be ignored: {}".format(target_prefix, e))
+            return {}
+
+        return index_data.get("entries", {})
+
+    def save(self, target_prefix, entries):
+        # only recent entries are kept, older objects are removed by rotation anyway
+        recent_items = sorted(entries.items(), key=lambda item: item[1].get("uploaded", ""), reverse=True)
+        index_data = {
+            "version": S3ContentIndex.INDEX_VERSION,
+            "prefix": target_prefix,
+            "entries": dict(recent_items[:self.max_entries])
+        }
+        self._basic_client.put_object(
+            self._bucket_name,
+            self.get_index_key(target_prefix),
+            json.dumps(index_data, indent=2, sort_keys=True).encode("utf-8")
+        )
+
+    @staticmethod
+    def add_entry(entries, content_hash, key, size):
+        entries[content_hash] = {"key": key, "size": size, "uploaded": datetime.datetime.utcnow().isoformat()}
+
+    def find_key(self, entries, content_hash):
+        """Returns key of existing object with `content_hash` or None."""
+        entry = entries.get(content_hash)
+        if entry is None:
+            return None
+
+        # object may be removed by rotation or overwritten since it was indexed
+        metadata = self._basic_client.get_object_metadata(self._bucket_name, entry["key"])
+        if metadata is None or metadata.get(S3ContentIndex.CONTENT_HASH_METADATA_NAME) != content_hash:
+            self.logger.info("indexed object '{}' is not available for content hash".format(entry["key"]))
+            return None
+
+        return entry["key"]
 
 
 class StepS3FileBaseUploader(BaseFlowStep):
@@ -23,6 +162,17 @@ class StepS3FileBaseUploader(BaseFlowStep):
     METRIC_TRANSMISSION_SPEED = "Transmission Speed"
     METRIC_COPIED_OBJECTS_COUNT = "Copied Objects Count"
     METRIC_DELETED_OBJECTS_COUNT = "Deleted Objects Count"
+    METRIC_FAILED_DELETES_COUNT = "Failed Deletes Count"
+    METRIC_ABORTED_STALE_UPLOADS_COUNT = "Aborted Stale Uploads"
+    METRIC_CONFIGURED_BANDWIDTH_LIMIT = "Configured Bandwidth Limit"
+    METRIC_THROTTLED_TIME = "Throttled Time"
+    METRIC_ACTUAL_UPLOAD_RATE = "Actual Upload Rate"
+    METRIC_LONGEST_STALL = "Longest Stall"
+    METRIC_SKIPPED_UPLOADS_COUNT = "Skipped Unchanged Uploads"
+    METRIC_BYTES_SAVED = "Bytes Saved"
+    METRIC_VERIFIED_UPLOADS_COUNT = "Verified Uploads"
+
+    DEFAULT_STALE_UPLOADS_MAX_AGE_HOURS = 48
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -32,12 +182,154 @@ class StepS3FileBaseUploader(BaseFlowStep):
         region = self.secret_context.get("region")
         self.logger.debug("S3 region: '{}'".format(region))
 
-        return boto3.client(
+        return get_boto_clients_registry().get_client(
             "s3",
             region_name=region,
             aws_access_key_id=self.secret_context["aws_access_key_id"],
-            aws_secret_access_key=self.secret_context["aws_secret_access_key"]
+            aws_secret_access_key=self.secret_context["aws_secret_access_key"],
+            endpoint_url=self.secret_context.get("endpoint_url"),
+            max_pool_connections=self._get_max_pool_connections()
+        )
+
+    def _get_max_pool_connections(self):
+        # pool is large enough for all threads of transfer
+        step_context = self._get_step_context()
+        max_pool_connections = step_context.get(
+            "max_pool_connections",
+            step_context.get("max_transmission_threads", S3BasicBotoClient.DEFAULT_TRANSMISSION_MAX_THREADS)
+        )
+
+        return int(max_pool_connections)
+
+    def _create_basic_client(self, raw_client):
+        checkpoints_folder = None
+        if self.step_context.get("resumable_uploads", True) and self.rendering_context.root_temporary_folder:
+            checkpoints_folder = os.path.join(self.rendering_context.root_temporary_folder, "checkpoints")
+
+        # transmission settings may be specified per target in secrets file
+        step_context = self._get_step_context()
+
+        part_size = step_context.get("part_size_mib", "auto")
+        part_size = None if str(part_size) == "auto" else int(float(part_size) * BaseFlowStep.BYTES_IN_MEGABYTE)
+
+        max_threads = step_context.get("max_transmission_threads")
+        max_threads = int(max_threads) if max_threads else None
+
+        return S3BasicBotoClient(
+            self.logger,
+            raw_client,
+            checkpoints_folder=checkpoints_folder,
+            part_size=part_size,
+            max_threads=max_threads,
+            auto_tune=bool(step_context.get("auto_tune_concurrency", False)),
+            limiters=self._get_bandwidth_limiters(),
+            transfer_manager=self._get_transfer_manager(raw_client, max_threads),
+            verify_uploads=bool(step_context.get("verify_uploads", True)),
+            read_cache_mode=self._get_read_cache_mode()
+        )
+
+    def _get_transfer_manager(self, raw_client, max_threads):
+        # threads are shared by all uploads of the flow which use the same client
+        max_threads = max_threads if max_threads else S3BasicBotoClient.DEFAULT_TRANSMISSION_MAX_THREADS
+        max_concurrent_files = int(
+            self.step_context.get("max_concurrent_files", S3TransferManager.DEFAULT_MAX_CONCURRENT_FILES)
+        )
+
+        return self.rendering_context.flow_resources.get_or_create(
+            ("s3_transfer_manager", id(raw_client), max_threads, max_concurrent_files),
+            lambda: S3TransferManager(raw_client, max_threads, max_concurrent_files)
+        )
+
+    def _get_bandwidth_limiters(self):
+        # global limit is shared by all targets executed in the process, target limit - by steps of the target
+        parameters = self.rendering_context.config_context.get("parameters", dict())
+        res = [
+            get_bandwidth_limiter("global", parameters.get("max_upload_bandwidth_mib")),
+            get_bandwidth_limiter(
+                "target:{}".format(self.rendering_context.target_name),
+                self._get_step_context().get("max_upload_bandwidth_mib")
+            ),
+        ]
+
+        return [limiter for limiter in res if limiter is not None]
+
+    def _update_upload_settings_metrics(self, stat_entry, upload_result):
+        if upload_result.verified:
+            metric = self._get_metric_by_name(
+                stat_entry,
+                StepS3FileBaseUploader.METRIC_VERIFIED_UPLOADS_COUNT,
+                initial_value=0,
+                units_name="items"
+            )
+            metric.increment(1)
+
+        if upload_result.part_size:
+            metric = self._get_metric_by_name(stat_entry, "Part Size", initial_value=0, units_name="MiB")
+            metric.value = max(metric.value, round(upload_result.part_size / BaseFlowStep.BYTES_IN_MEGABYTE, 2))
+
+        if upload_result.max_concurrency:
+            metric = self._get_metric_by_name(stat_entry, "Upload Concurrency", initial_value=0, units_name="threads")
+            metric.value = max(metric.value, upload_result.max_concurrency)
+
+        if upload_result.throughput:
+            metric = self._get_metric_by_name(stat_entry, "Max File Throughput", initial_value=0, units_name="MiB/s")
+            metric.value = max(metric.value, round(upload_result.throughput / BaseFlowStep.BYTES_IN_MEGABYTE, 2))
+
+        if upload_result.bandwidth_limit:
+            metric = self._get_metric_by_name(
+                stat_entry,
+                StepS3FileBaseUploader.METRIC_CONFIGURED_BANDWIDTH_LIMIT,
+                units_name="MiB/s"
+            )
+            metric.value = round(upload_result.bandwidth_limit / BaseFlowStep.BYTES_IN_MEGABYTE, 2)
+
+            metric = self._get_metric_by_name(
+                stat_entry,
+                StepS3FileBaseUploader.METRIC_THROTTLED_TIME,
+                initial_value=0.0,
+                units_name="seconds"
+            )
+            metric.increment(round(upload_result.throttled_seconds, 3))
+
+    def _create_progress_reporter(self, stat_entry, file_name, from_stream=False):
+        series_name = "Progress ({})".format(os.path.basename(file_name))
+
+        return TransferProgressReporter(
+            self.logger,
+            file_name,
+            total_bytes=None if from_stream else os.path.getsize(file_name),
+            interval_seconds=float(self.step_context.get("progress_interval_seconds", DEFAULT_INTERVAL_SECONDS)),
+            on_sample=lambda sample: stat_entry.add_time_series_sample(series_name, sample)
+        )
+
+    def _update_progress_metrics(self, stat_entry, progress_reporter):
+        # long gaps between progress notifications are visible in report, samples are kept in time series;
+        # resumable uploads notify about completed parts only, so for them it's the longest gap between parts
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_LONGEST_STALL,
+            initial_value=0.0,
+            units_name="seconds"
         )
+        metric.value = max(metric.value, round(progress_reporter.longest_stall_seconds, 3))
+
+    def _abort_stale_uploads(self, stat_entry, basic_client, bucket_name, prefix):
+        if not basic_client.checkpoints_folder:
+            return
+
+        max_age_hours = self.step_context.get(
+            "stale_uploads_max_age_hours",
+            StepS3FileBaseUploader.DEFAULT_STALE_UPLOADS_MAX_AGE_HOURS
+        )
+        aborted_count = basic_client.abort_stale_uploads(bucket_name, prefix, float(max_age_hours) * 60 * 60)
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_ABORTED_STALE_UPLOADS_COUNT,
+            initial_value=0,
+            units_name="items"
+        )
+        metric.increment(aborted_count)
 
     def _get_tagged_object_key(
         self,
@@ -45,11 +337,57 @@ class StepS3FileBaseUploader(BaseFlowStep):
         bucket_name,
         destination_prefix,
         validation_tag_name,
-        validation_tag_value
+        validation_tag_value,
+        update_index=False
     ):
-        objects_for_prefix = basic_client.list_files_in_folder(bucket_name, destination_prefix)
+        dedup_index = self._get_dedup_index(basic_client, bucket_name)
+        entries = dedup_index.load(destination_prefix) if dedup_index is not None else None
+        if entries is not None:
+            self.logger.debug("dedup index for '{}': {}".format(destination_prefix, entries))
+            res = S3DedupIndex.find_key(entries, validation_tag_name, validation_tag_value)
+
+            # indexed object may be removed outside of yabtool, then index is stale
+            if res is None or basic_client.is_object_exists(bucket_name, res):
+                return res
+
+            self.logger.warning("indexed object '{}' doesn't exist, looking for tagged object".format(res))
+
+        res = self._scan_for_tagged_object_key(
+            basic_client,
+            bucket_name,
+            destination_prefix,
+            validation_tag_name,
+            validation_tag_value
+        )
+
+        # prefixes uploaded without index receive it on first lookup, stale entries are repaired
+        if update_index and dedup_index is not None and (res or entries is not None):
+            self.logger.info("updating dedup index for '{}'".format(destination_prefix))
+            entries = entries if entries is not None else {}
+            entries.pop(validation_tag_name, None)
+            if res:
+                entries[validation_tag_name] = {"value": validation_tag_value, "key": res}
+
+            dedup_index.save(destination_prefix, entries)
+
+        return res
 
-        for object_key in objects_for_prefix:
+    def _get_dedup_index(self, basic_client, bucket_name):
+        if not self.step_context.get("use_dedup_index", True):
+            return None
+
+        return S3DedupIndex(self.logger, basic_client, bucket_name)
+
+    def _scan_for_tagged_object_key(
+        self,
+        basic_client,
+        bucket_name,
+        destination_prefix,
+        validation_tag_name,
+        validation_tag_value
+    ):
+        for object_record in basic_client.iterate_objects(bucket_name, destination_prefix):
+            object_key = object_record.key
             object_tags = basic_client.get_object_tags(bucket_name, object_key)
 
             self.logger.debug("tags for key '{}': {}".format(object_key, object_tags))
@@ -71,12 +409,145 @@ class StepS3FileBaseUploader(BaseFlowStep):
             source_file_name = new_target.source_file
             source_file_name = self._render_result(source_file_name)
             self.logger.debug("source_file: {}".format(source_file_name))
-            if not os.path.exists(source_file_name):
+            if (not new_target.from_stream) and (not os.path.exists(source_file_name)):
                 msg = "Can't find source file '{}'".format(source_file_name)
                 self.logger.error(msg)
                 raise TransmissionError(msg)
 
             new_target.os_file_name = source_file_name
+            if new_target.content_hash_file:
+                new_target.content_hash_file = self._render_result(new_target.content_hash_file)
+
             res.append(new_target)
 
         return res
+
+    def _finalize_transmission_metrics(self, stat_entry):
+        uploaded_size_metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_UPLOADED_SIZE
+        )
+
+        upload_time_metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_TRANSMISSION_TIME
+        )
+
+        if uploaded_size_metric.value and upload_time_metric.value:
+            transmission_speed_metric = self._get_metric_by_name(
+                stat_entry,
+                StepS3FileBaseUploader.METRIC_TRANSMISSION_SPEED,
+                units_name="MiB/s"
+            )
+
+            if upload_time_metric.value:
+                transmission_speed_metric.value = round(uploaded_size_metric.value / upload_time_metric.value, 2)
+            else:
+                transmission_speed_metric.value = "N/A"
+
+            # rate with throttling taken into account, compare it with configured limit
+            if StepS3FileBaseUploader.METRIC_CONFIGURED_BANDWIDTH_LIMIT in stat_entry.metrics.get_all_metrics():
+                actual_rate_metric = self._get_metric_by_name(
+                    stat_entry,
+                    StepS3FileBaseUploader.METRIC_ACTUAL_UPLOAD_RATE,
+                    units_name="MiB/s"
+                )
+                actual_rate_metric.value = transmission_speed_metric.value
+
+        if uploaded_size_metric.value:
+            uploaded_size_metric.value = round(uploaded_size_metric.value, 2)
+
+        if upload_time_metric.value:
+            upload_time_metric.value = round(upload_time_metric.value, 3)
+
+    def _upload_files(self, stat_entry, basic_client, upload_requests):
+        """Uploads files simultaneously, transmission time is measured as union of upload intervals."""
+        upload_results = basic_client.upload_files(upload_requests)
+
+        for upload_request, upload_result in zip(upload_requests, upload_results):
+            self._update_upload_settings_metrics(stat_entry, upload_result)
+            self._update_progress_metrics(stat_entry, upload_request.progress_reporter)
+            self._update_transmission_metrics(stat_entry, self._get_file_size_in_mibs(upload_request.file_name), 0.0)
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_TRANSMISSION_TIME,
+            initial_value=0.0,
+            units_name="seconds"
+        )
+        metric.increment(intervals_union_length([(item.started_at, item.finished_at) for item in upload_results]))
+
+        return upload_results
+
+    def _create_upload_request(self, stat_entry, bucket_name, dest_key_name, file_name, metadata=None):
+        return S3UploadRequest(
+            bucket_name,
+            dest_key_name,
+            file_name,
+            self._create_progress_reporter(stat_entry, file_name),
+            metadata
+        )
+
+    def _get_content_index(self, basic_client, bucket_name):
+        if not self.step_context.get("skip_unchanged_content", False):
+            return None
+
+        return S3ContentIndex(self.logger, basic_client, bucket_name)
+
+    def _get_content_hash(self, upload_target):
+        if not upload_target.content_hash_file:
+            return None
+
+        if not os.path.exists(upload_target.content_hash_file):
+            self.logger.warning("content hash file '{}' is not found".format(upload_target.content_hash_file))
+            return None
+
+        with open(upload_target.content_hash_file, "r", encoding="utf-8") as input_file:
+            return parse_content_hash(input_file.read())
+
+    @staticmethod
+    def _create_content_metadata(content_hash):
+        """Returns user metadata of uploaded or copied object with `content_hash` (None without hash)."""
+        return {S3ContentIndex.CONTENT_HASH_METADATA_NAME: content_hash} if content_hash else None
+
+    def _update_skipped_upload_metrics(self, stat_entry, file_name):
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_SKIPPED_UPLOADS_COUNT,
+            initial_value=0,
+            units_name="items"
+        )
+        metric.increment(1)
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_BYTES_SAVED,
+            initial_value=0.0,
+            units_name="MiB"
+        )
+        metric.increment(round(self._get_file_size_in_mibs(file_name), 2))
+
+    def _update_transmission_metrics(self, stat_entry, size_in_mibs, transmission_time):
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_UPLOADED_OBJECTS_COUNT,
+            initial_value=0,
+            units_name="items"
+        )
+        metric.increment(1)
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_UPLOADED_SIZE,
+            initial_value=0.0,
+            units_name="MiB"
+        )
+        metric.increment(size_in_mibs)
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_TRANSMISSION_TIME,
+            initial_value=0.0,
+            units_name="seconds"
+        )
+        metric.increment(transmission_time)
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from boto3.s3.transfer import create_transfer_manager
+
+
+class S3TransferManager(object):
+    """Long lived threads for uploads of one S3 client, shared by all files and steps of flow.
+
+    Parts of resumable uploads are transmitted by `parts_executor`, S3Transfer uploads are executed
+    by s3transfer managers created once per transfer config. Files submitted together are uploaded
+    simultaneously by `files_executor`. Manager is closed by orchestrator at the end of flow.
+    """
+
+    DEFAULT_MAX_CONCURRENT_FILES = 2
+
+    def __init__(self, raw_client, max_threads, max_concurrent_files=None):
+        self._client = raw_client
+        self.max_threads = max_threads
+        self.max_concurrent_files = (
+            max_concurrent_files if max_concurrent_files else S3TransferManager.DEFAULT_MAX_CONCURRENT_FILES
+        )
+
+        self._lock = threading.Lock()
+        self._parts_executor = None
+        self._files_executor = None
+        self._transfer_managers = dict()
+        self._closed = False
+
+    @property
+    def parts_executor(self):
+        with self._lock:
+            self._check_not_closed()
+            if self._parts_executor is None:
+                self._parts_executor = ThreadPoolExecutor(
+                    max_workers=self.max_threads,
+                    thread_name_prefix="yabtool-upload"
+                )
+
+            return self._parts_executor
+
+    @property
+    def files_executor(self):
+        with self._lock:
+            self._check_not_closed()
+            if self._files_executor is None:
+                self._files_executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrent_files,
+                    thread_name_prefix="yabtool-file"
+                )
+
+            return self._files_executor
+
+    def get_transfer_manager(self, transfer_config):
+        key = (
+            transfer_config.multipart_threshold,
+            transfer_config.multipart_chunksize,
+            transfer_config.max_request_concurrency,
+            transfer_config.num_download_attempts
+        )
+
+        with self._lock:
+            self._check_not_closed()
+            res = self._transfer_managers.get(key)
+            if res is None:
+                res = create_transfer_manager(self._client, transfer_config)
+                self._transfer_managers[key] = res
+
+        return res
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            executors = [self._files_executor, self._parts_executor]
+            transfer_managers = list(self._transfer_managers.values())
+
+        # files are uploaded with threads of parts executor, so it's stopped last
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+        for transfer_manager in transfer_managers:
+            transfer_manager.shutdown()
+
+    def _check_not_closed(self):
+        if self._closed:
+            raise RuntimeError("transfer manager is closed")
@@ -0,0 +1,733 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor, wait
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+from boto3.s3.transfer import MB
+from botocore.exceptions import ClientError
+from yabtool.shared.bandwidth_limiter import consume_bandwidth, get_bandwidth_limit
+from yabtool.shared.base import AttrsToStringMixin
+from yabtool.shared.file_io import CACHE_MODE_NORMAL, SequentialFileReader
+from yabtool.shared.hashing import composite_digest
+
+from .base import TransmissionError
+
+
+MIN_PART_SIZE = 8 * MB
+MAX_PART_SIZE = 5 * 1024 * MB
+MAX_PARTS_COUNT = 10000
+
+
+def calculate_part_size(file_size, min_part_size=MIN_PART_SIZE, max_parts_count=MAX_PARTS_COUNT):
+    """Returns the smallest power of two MiB part size (not less than `min_part_size`) which splits
+    file into at most `max_parts_count` parts.
+
+    >>> calculate_part_size(100 * MB) // MB
+    8
+    >>> calculate_part_size(500 * 1024 * MB) // MB
+    64
+    >>> calculate_part_size(10000 * 8 * MB + 1) // MB
+    16
+    """
+    part_size = MB
+    while part_size < min_part_size:
+        part_size *= 2
+
+    while (file_size + part_size - 1) // part_size > max_parts_count and part_size < MAX_PART_SIZE:
+        part_size *= 2
+
+    return min(part_size, MAX_PART_SIZE)
+
+
+def calculate_stream_part_size(part_number, initial_part_size, max_parts_count=MAX_PARTS_COUNT):
+    """Returns size of part `part_number` of stream of unknown length.
+
+    Size is doubled after every tenth of `max_parts_count` parts, so stream of 1023 tenths of
+    initial parts fits into allowed count of parts, while memory usage of usual streams stays the same.
+
+    >>> [calculate_stream_part_size(item, 8 * MB) // MB for item in (1, 1000, 1001, 2001, 10000)]
+    [8, 8, 16, 32, 4096]
+    """
+    doublings = (part_number - 1) // max(1, max_parts_count // 10)
+    return min(initial_part_size * 2 ** doublings, MAX_PART_SIZE)
+
+
+def normalize_etag(etag):
+    """
+    >>> normalize_etag('"96e024ba2074fe77e8e965ba43a704be-2"')
+    '96e024ba2074fe77e8e965ba43a704be-2'
+    """
+    return str(etag).strip().strip('"').lower() if etag else None
+
+
+def is_etag_md5_based(response):
+    """ETags of objects encrypted with SSE-KMS or SSE-C are not derived from MD5 of content."""
+    if response.get("SSECustomerAlgorithm"):
+        return False
+
+    return not str(response.get("ServerSideEncryption", "")).startswith("aws:kms")
+
+
+def get_content_md5(data):
+    """Returns MD5 digest of `data` and its base64 form for Content-MD5 header."""
+    digest = hashlib.md5(data).digest()
+    return digest, base64.b64encode(digest).decode("ascii")
+
+
+def verify_etag(response, expected_etag, object_name):
+    """Raises TransmissionError when ETag of uploaded object differs from expected one.
+
+    Returns False when ETag can't be compared with MD5 based value (encrypted objects).
+    """
+    if not is_etag_md5_based(response):
+        return False
+
+    actual_etag = normalize_etag(response.get("ETag"))
+    if actual_etag != expected_etag:
+        raise TransmissionError(
+            "ETag of uploaded '{}' is '{}', but '{}' is expected".format(object_name, actual_etag, expected_etag)
+        )
+
+    return True
+
+
+class AimdConcurrencyController(object):
+    """Limits count of parts transmitted simultaneously and tunes the limit with AIMD.
+
+    Throughput is measured for windows of completed parts: limit is increased by one while
+    throughput grows, and halved when throughput drops noticeably or transmission fails.
+    """
+
+    INCREASE_THRESHOLD = 1.05
+    DECREASE_THRESHOLD = 0.7
+
+    def __init__(self, initial_limit, min_limit=1, max_limit=None, auto_tune=True):
+        self.max_limit = max_limit if max_limit else initial_limit
+        self.min_limit = min(min_limit, self.max_limit)
+        self.limit = max(self.min_limit, min(initial_limit, self.max_limit))
+        self.auto_tune = auto_tune
+        self.max_reached_limit = self.limit
+
+        self._active = 0
+        self._condition = threading.Condition()
+        self._best_throughput = 0.0
+        self._window_start = None
+        self._window_bytes = 0
+        self._window_parts = 0
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+
+            self._active += 1
+            if self._window_start is None:
+                self._window_start = time.monotonic()
+
+    def release(self, transmitted_bytes, failed=False):
+        with self._condition:
+            self._active -= 1
+
+            if failed:
+                self._set_limit(self.limit // 2)
+            else:
+                self._window_bytes += transmitted_bytes
+                self._window_parts += 1
+                if self._window_parts >= max(self.limit, 2):
+                    self._evaluate_window()
+
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Returns slot taken by `acquire` when nothing was transmitted with it."""
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def _evaluate_window(self):
+        elapsed = time.monotonic() - self._window_start
+        throughput = (self._window_bytes / elapsed) if elapsed > 0 else 0.0
+
+        if throughput >= self._best_throughput * AimdConcurrencyController.INCREASE_THRESHOLD:
+            self._best_throughput = throughput
+            self._set_limit(self.limit + 1)
+        elif throughput < self._best_throughput * AimdConcurrencyController.DECREASE_THRESHOLD:
+            self._set_limit(self.limit // 2)
+
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_parts = 0
+
+    def _set_limit(self, limit):
+        if not self.auto_tune:
+            return
+
+        self.limit = max(self.min_limit, min(limit, self.max_limit))
+        self.max_reached_limit = max(self.max_reached_limit, self.limit)
+
+
+class UploadCheckpoint(AttrsToStringMixin):
+    """State of multipart upload persisted after each transmitted part."""
+
+    def __init__(self):
+        self.bucket_name = None
+        self.key = None
+        self.upload_id = None
+        self.file_name = None
+        self.file_size = None
+        self.file_mtime = None
+        self.part_size = None
+        self.parts = dict()
+        self.parts_md5 = dict()
+        self.created_timestamp = None
+
+    def is_compatible(self, bucket_name, key, file_name, file_size, file_mtime):
+        return (self.bucket_name, self.key, self.file_name, self.file_size, self.file_mtime) == (
+            bucket_name,
+            key,
+            file_name,
+            file_size,
+            file_mtime
+        )
+
+    def to_dict(self):
+        return {
+            "bucket_name": self.bucket_name,
+            "key": self.key,
+            "upload_id": self.upload_id,
+            "file_name": self.file_name,
+            "file_size": self.file_size,
+            "file_mtime": self.file_mtime,
+            "part_size": self.part_size,
+            "parts": {str(part_number): etag for part_number, etag in self.parts.items()},
+            "parts_md5": {str(part_number): value for part_number, value in self.parts_md5.items()},
+            "created_timestamp": self.created_timestamp,
+        }
+
+    @staticmethod
+    def from_dict(data):
+        res = UploadCheckpoint()
+        for name in ["bucket_name", "key", "upload_id", "file_name", "file_size", "file_mtime", "part_size",
+                     "created_timestamp"]:
+            setattr(res, name, data.get(name))
+
+        res.parts = {int(part_number): etag for part_number, etag in data.get("parts", {}).items()}
+        res.parts_md5 = {int(part_number): value for part_number, value in data.get("parts_md5", {}).items()}
+        return res
+
+
+class UploadCheckpointsStorage(object):
+    """Stores checkpoints as JSON files, file is replaced atomically so it's never left half written."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def get_file_name(self, bucket_name, key, file_name):
+        digest = hashlib.sha1("{}\n{}\n{}".format(bucket_name, key, file_name).encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, "{}.json".format(digest))
+
+    def load(self, bucket_name, key, file_name):
+        checkpoint_file_name = self.get_file_name(bucket_name, key, file_name)
+        if not os.path.exists(checkpoint_file_name):
+            return None
+
+        try:
+            with open(checkpoint_file_name, "r", encoding="utf-8") as input_file:
+                return UploadCheckpoint.from_dict(json.load(input_file))
+        except ValueError:
+            return None
+
+    def save(self, checkpoint):
+        os.makedirs(self.folder, exist_ok=True)
+
+        checkpoint_file_name = self.get_file_name(checkpoint.bucket_name, checkpoint.key, checkpoint.file_name)
+        temporary_file_name = "{}.tmp".format(checkpoint_file_name)
+        with open(temporary_file_name, "w", encoding="utf-8") as output_file:
+            json.dump(checkpoint.to_dict(), output_file)
+
+        os.replace(temporary_file_name, checkpoint_file_name)
+
+    def remove(self, checkpoint):
+        checkpoint_file_name = self.get_file_name(checkpoint.bucket_name, checkpoint.key, checkpoint.file_name)
+        if os.path.exists(checkpoint_file_name):
+            os.remove(checkpoint_file_name)
+
+    def iterate_checkpoints(self):
+        if not os.path.isdir(self.folder):
+            return
+
+        for file_name in sorted(os.listdir(self.folder)):
+            if not file_name.endswith(".json"):
+                continue
+
+            try:
+                with open(os.path.join(self.folder, file_name), "r", encoding="utf-8") as input_file:
+                    yield UploadCheckpoint.from_dict(json.load(input_file))
+            except ValueError:
+                continue
+
+
+class UploadResult(AttrsToStringMixin):
+    def __init__(self):
+        self.uploaded_bytes = 0
+        self.resumed_bytes = 0
+        self.parts_count = 0
+        self.part_size = None
+        self.resumed = False
+        self.etag = None
+        self.concurrency = None
+        self.max_concurrency = None
+        self.seconds_spent = None
+        self.throttled_seconds = 0.0
+        self.bandwidth_limit = None
+
+        # time.monotonic() values, they allow to measure time of simultaneous uploads
+        self.started_at = None
+        self.finished_at = None
+
+        # ETag of stored object was compared with value calculated from local file
+        self.verified = False
+
+    @property
+    def throughput(self):
+        """Bytes per second transmitted by this upload."""
+        if not self.seconds_spent:
+            return None
+
+        return self.uploaded_bytes / self.seconds_spent
+
+
+def put_small_file(
+    s3_client,
+    bucket_name,
+    key,
+    file_name,
+    file_size,
+    limiters=None,
+    read_cache_mode=CACHE_MODE_NORMAL,
+    verify_upload=True,
+    callback=None,
+    extra_args=None
+):
+    """Uploads file which fits into single part with single put_object request, returns UploadResult."""
+    with SequentialFileReader(file_name, cache_mode=read_cache_mode) as input_file:
+        data = input_file.read(file_size)
+
+    return put_small_data(s3_client, bucket_name, key, data, limiters, verify_upload, callback, extra_args)
+
+
+def put_small_data(
+    s3_client,
+    bucket_name,
+    key,
+    data,
+    limiters=None,
+    verify_upload=True,
+    callback=None,
+    extra_args=None
+):
+    """Uploads data which fits into single part with single put_object request, returns UploadResult."""
+    res = UploadResult()
+    res.bandwidth_limit = get_bandwidth_limit(limiters)
+    start_timestamp = time.monotonic()
+
+    res.throttled_seconds = consume_bandwidth(limiters, len(data)) if limiters else 0.0
+    digest, content_md5 = get_content_md5(data)
+    response = s3_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=data,
+        ContentMD5=content_md5,
+        **(extra_args if extra_args else {})
+    )
+    if callback is not None:
+        callback(len(data))
+
+    res.uploaded_bytes = len(data)
+    res.parts_count = 1
+    res.concurrency = res.max_concurrency = 1
+    res.etag = response.get("ETag")
+    if verify_upload:
+        res.verified = verify_etag(response, digest.hex(), key)
+
+    res.seconds_spent = time.monotonic() - start_timestamp
+    return res
+
+
+class S3MultipartUploadEngine(object):
+    """Uploads files with multipart upload which may be resumed after failure.
+
+    Upload id, part size and ETags of transmitted parts are persisted into checkpoint after
+    each part, so next attempt uploads only missing parts. Parts listed in checkpoint are
+    verified with `list_parts`, upload is started from scratch when it was aborted or expired.
+
+    MD5 of each part is calculated while it's read for transmission and sent as Content-MD5,
+    so ETag of completed object is verified without download of the object.
+    """
+
+    DEFAULT_MAX_THREADS = 20
+    DEFAULT_STALE_UPLOAD_AGE_SECONDS = 48 * 60 * 60
+    READ_BLOCK_SIZE = 256 * 1024
+
+    def __init__(
+        self,
+        logger,
+        s3_client,
+        checkpoints_folder,
+        part_size=None,
+        max_threads=None,
+        auto_tune=False,
+        limiters=None,
+        executor=None,
+        verify_uploads=True,
+        read_cache_mode=CACHE_MODE_NORMAL
+    ):
+        """`part_size` is calculated from size of each file when it's not specified.
+
+        With `auto_tune` count of parts transmitted simultaneously starts from a quarter
+        of `max_threads` and is adjusted according to measured throughput. Reading of file
+        is throttled by bandwidth `limiters`. Parts are transmitted by threads of `executor` when it's
+        specified, so several files uploaded simultaneously share the same threads. Parts of file
+        are read with `read_cache_mode` of SequentialFileReader.
+        """
+        self.logger = logger
+        self._client = s3_client
+        self._checkpoints_storage = UploadCheckpointsStorage(checkpoints_folder)
+        self.part_size = part_size
+        self.max_threads = max_threads if max_threads else S3MultipartUploadEngine.DEFAULT_MAX_THREADS
+        self.auto_tune = auto_tune
+        self.limiters = list(limiters) if limiters else []
+        self._executor = executor
+        self.verify_uploads = verify_uploads
+        self.read_cache_mode = read_cache_mode
+        self._throttled_seconds = 0.0
+        self._throttled_seconds_lock = threading.Lock()
+
+    def upload_file(self, bucket_name, key, file_name, callback=None, metadata=None):
+        """Uploads file, user `metadata` is assigned to created object."""
+        file_name = os.path.abspath(file_name)
+        extra_args = {"Metadata": metadata} if metadata else {}
+        file_size = os.path.getsize(file_name)
+        part_size = self.part_size if self.part_size else calculate_part_size(file_size)
+        res = UploadResult()
+        res.bandwidth_limit = get_bandwidth_limit(self.limiters)
+        start_timestamp = time.monotonic()
+        self._throttled_seconds = 0.0
+
+        if file_size <= part_size:
+            res = put_small_file(
+                self._client,
+                bucket_name,
+                key,
+                file_name,
+                file_size,
+                limiters=self.limiters,
+                read_cache_mode=self.read_cache_mode,
+                verify_upload=self.verify_uploads,
+                callback=callback,
+                extra_args=extra_args
+            )
+            res.part_size = part_size
+            return res
+
+        checkpoint = self._get_checkpoint(bucket_name, key, file_name, file_size, part_size, extra_args)
+        res.part_size = checkpoint.part_size
+        res.resumed = bool(checkpoint.parts)
+        res.resumed_bytes = sum(
+            self._get_part_length(checkpoint, part_number) for part_number in checkpoint.parts.keys()
+        )
+        self._notify(callback, res.resumed_bytes)
+
+        parts_count = (file_size + checkpoint.part_size - 1) // checkpoint.part_size
+        missing_parts = [
+            part_number for part_number in range(1, parts_count + 1) if part_number not in checkpoint.parts
+        ]
+        self.logger.info(
+            "uploading {} of {} parts of '{}' into '{}' (upload id '{}')".format(
+                len(missing_parts),
+                parts_count,
+                file_name,
+                key,
+                checkpoint.upload_id
+            )
+        )
+
+        controller = self._create_concurrency_controller()
+        self._upload_parts(checkpoint, missing_parts, callback, controller)
+        res.concurrency = controller.limit
+        res.max_concurrency = controller.max_reached_limit
+        res.throttled_seconds = self._throttled_seconds
+
+        parts = [
+            {"PartNumber": part_number, "ETag": checkpoint.parts[part_number]}
+            for part_number in sorted(checkpoint.parts.keys())
+        ]
+        response = self._client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=checkpoint.upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+        self._checkpoints_storage.remove(checkpoint)
+
+        res.uploaded_bytes = file_size - res.resumed_bytes
+        res.parts_count = parts_count
+        res.etag = response.get("ETag")
+        if self.verify_uploads:
+            res.verified = verify_etag(response, self._get_expected_etag(checkpoint, parts_count), key)
+
+        res.seconds_spent = time.monotonic() - start_timestamp
+        self.logger.info("'{}' uploaded: part size {} MiB, concurrency {} (max {}), {:.2f} MiB/s".format(
+            key,
+            res.part_size // MB,
+            res.concurrency,
+            res.max_concurrency,
+            (res.throughput or 0) / MB
+        ))
+        return res
+
+    def abort_stale_uploads(self, bucket_name, prefix="", max_age_seconds=None):
+        """Aborts incomplete multipart uploads older than `max_age_seconds` and removes their checkpoints.
+
+        Returns count of aborted uploads.
+        """
+        if not max_age_seconds:
+            max_age_seconds = S3MultipartUploadEngine.DEFAULT_STALE_UPLOAD_AGE_SECONDS
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        aborted_uploads_ids = set()
+
+        paginator = self._client.get_paginator("list_multipart_uploads")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for upload in page.get("Uploads", []):
+                initiated = upload["Initiated"]
+                if initiated.tzinfo is None:
+                    initiated = initiated.replace(tzinfo=datetime.timezone.utc)
+
+                if (now - initiated).total_seconds() < max_age_seconds:
+                    continue
+
+                self.logger.info("aborting stale multipart upload '{}' of '{}' initiated @ {}".format(
+                    upload["UploadId"],
+                    upload["Key"],
+                    initiated
+                ))
+                self._client.abort_multipart_upload(Bucket=bucket_name, Key=upload["Key"], UploadId=upload["UploadId"])
+                aborted_uploads_ids.add(upload["UploadId"])
+
+        for checkpoint in list(self._checkpoints_storage.iterate_checkpoints()):
+            if checkpoint.upload_id in aborted_uploads_ids:
+                self._checkpoints_storage.remove(checkpoint)
+
+        return len(aborted_uploads_ids)
+
+    def _create_concurrency_controller(self):
+        if not self.auto_tune:
+            return AimdConcurrencyController(self.max_threads, auto_tune=False)
+
+        return AimdConcurrencyController(max(1, self.max_threads // 4), min_limit=1, max_limit=self.max_threads)
+
+    def _get_checkpoint(self, bucket_name, key, file_name, file_size, part_size, extra_args):
+        file_mtime = os.path.getmtime(file_name)
+
+        checkpoint = self._checkpoints_storage.load(bucket_name, key, file_name)
+        if checkpoint is not None and checkpoint.is_compatible(bucket_name, key, file_name, file_size, file_mtime):
+            uploaded_parts = self._list_uploaded_parts(checkpoint)
+            if uploaded_parts is not None:
+                # only parts confirmed by S3 are reused
+                checkpoint.parts = {
+                    part_number: etag
+                    for part_number, etag in checkpoint.parts.items()
+                    if uploaded_parts.get(part_number) == etag
+                }
+                self.logger.info("resuming multipart upload '{}' for '{}', {} parts already uploaded".format(
+                    checkpoint.upload_id,
+                    key,
+                    len(checkpoint.parts)
+                ))
+                return checkpoint
+
+            self.logger.warning("multipart upload '{}' can't be resumed".format(checkpoint.upload_id))
+
+        if checkpoint is not None:
+            self._checkpoints_storage.remove(checkpoint)
+
+        response = self._client.create_multipart_upload(Bucket=bucket_name, Key=key, **extra_args)
+
+        checkpoint = UploadCheckpoint()
+        checkpoint.bucket_name = bucket_name
+        checkpoint.key = key
+        checkpoint.upload_id = response["UploadId"]
+        checkpoint.file_name = file_name
+        checkpoint.file_size = file_size
+        checkpoint.file_mtime = file_mtime
+        checkpoint.part_size = part_size
+        checkpoint.created_timestamp = datetime.datetime.utcnow().isoformat()
+        self._checkpoints_storage.save(checkpoint)
+
+        return checkpoint
+
+    def _list_uploaded_parts(self, checkpoint):
+        res = dict()
+
+        try:
+            paginator = self._client.get_paginator("list_parts")
+            for page in paginator.paginate(
+                Bucket=checkpoint.bucket_name,
+                Key=checkpoint.key,
+                UploadId=checkpoint.upload_id
+            ):
+                for part in page.get("Parts", []):
+                    res[part["PartNumber"]] = part["ETag"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+                return None
+
+            raise
+
+        return res
+
+    def _upload_parts(self, checkpoint, parts_numbers, callback, controller):
+        checkpoint_lock = threading.Lock()
+        failed_event = threading.Event()
+
+        def upload_part(part_number):
+            if failed_event.is_set():
+                controller.cancel()
+                return
+
+            try:
+                data = self._read_part(checkpoint, part_number)
+                digest, content_md5 = get_content_md5(data)
+
+                # S3 rejects part which was corrupted on the way
+                response = self._client.upload_part(
+                    Bucket=checkpoint.bucket_name,
+                    Key=checkpoint.key,
+                    UploadId=checkpoint.upload_id,
+                    PartNumber=part_number,
+                    Body=data,
+                    ContentMD5=content_md5
+                )
+                if self.verify_uploads:
+                    verify_etag(response, digest.hex(), "{}#{}".format(checkpoint.key, part_number))
+            except BaseException:
+                failed_event.set()
+                controller.release(0, failed=True)
+                raise
+
+            # slot is returned after checkpoint is saved, so the next part isn't submitted while thread is busy
+            try:
+                with checkpoint_lock:
+                    checkpoint.parts[part_number] = response["ETag"]
+                    checkpoint.parts_md5[part_number] = digest.hex()
+                    self._checkpoints_storage.save(checkpoint)
+
+                self._notify(callback, len(data))
+            except BaseException:
+                failed_event.set()
+                raise
+            finally:
+                controller.release(len(data))
+
+        if self._executor is not None:
+            futures = self._submit_parts(self._executor, upload_part, parts_numbers, controller, failed_event)
+            wait(futures)
+        else:
+            max_workers = max(1, min(controller.max_limit, len(parts_numbers)))
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="yabtool-upload") as executor:
+                futures = self._submit_parts(executor, upload_part, parts_numbers, controller, failed_event)
+
+        self._check_uploaded_parts(checkpoint, futures)
+
+    def _check_uploaded_parts(self, checkpoint, futures):
+        exceptions = [future.exception() for future in futures if future.exception() is not None]
+        if exceptions:
+            self.logger.error("multipart upload '{}' interrupted, {} parts uploaded, it may be resumed".format(
+                checkpoint.upload_id,
+                len(checkpoint.parts)
+            ))
+            raise exceptions[0]
+
+        if len(checkpoint.parts) != (checkpoint.file_size + checkpoint.part_size - 1) // checkpoint.part_size:
+            raise TransmissionError("not all parts of '{}' were uploaded".format(checkpoint.file_name))
+
+    @staticmethod
+    def _submit_parts(executor, upload_part, parts_numbers, controller, failed_event):
+        """Submits parts when `controller` grants slot for them, so parts waiting for slot
+        don't occupy threads of shared executor. Submission stops when `failed_event` is set.
+        """
+        res = []
+        for part_number in parts_numbers:
+            controller.acquire()
+            if failed_event.is_set():
+                controller.cancel()
+                break
+
+            try:
+                res.append(executor.submit(upload_part, part_number))
+            except BaseException:
+                controller.cancel()
+                raise
+
+        return res
+
+    def _read_part(self, checkpoint, part_number):
+        part_length = self._get_part_length(checkpoint, part_number)
+
+        with SequentialFileReader(
+            checkpoint.file_name,
+            (part_number - 1) * checkpoint.part_size,
+            part_length,
+            cache_mode=self.read_cache_mode
+        ) as input_file:
+            if not self.limiters:
+                return input_file.read(part_length)
+
+            # part is read by small blocks, so parts transmitted simultaneously share bandwidth evenly
+            res = bytearray()
+            throttled_seconds = 0.0
+            while len(res) < part_length:
+                block = input_file.read(min(S3MultipartUploadEngine.READ_BLOCK_SIZE, part_length - len(res)))
+                if not block:
+                    break
+
+                throttled_seconds += consume_bandwidth(self.limiters, len(block))
+                res += block
+
+        with self._throttled_seconds_lock:
+            self._throttled_seconds += throttled_seconds
+
+        return bytes(res)
+
+    def _get_expected_etag(self, checkpoint, parts_count):
+        digests = []
+        for part_number in range(1, parts_count + 1):
+            value = checkpoint.parts_md5.get(part_number)
+            if value is None:
+                # checkpoints created by previous versions don't contain MD5 of parts
+                with SequentialFileReader(
+                    checkpoint.file_name,
+                    (part_number - 1) * checkpoint.part_size,
+                    self._get_part_length(checkpoint, part_number),
+                    cache_mode=self.read_cache_mode
+                ) as input_file:
+                    value = hashlib.md5(input_file.read()).hexdigest()
+
+            digests.append(bytes.fromhex(value))
+
+        return composite_digest("md5", digests)
+
+    @staticmethod
+    def _get_part_length(checkpoint, part_number):
+        offset = (part_number - 1) * checkpoint.part_size
+        return min(checkpoint.part_size, checkpoint.file_size - offset)
+
+    @staticmethod
+    def _notify(callback, bytes_amount):
+        if callback is not None and bytes_amount:
+            callback(bytes_amount)
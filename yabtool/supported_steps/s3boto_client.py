@@ -1,30 +1,93 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import os
+import queue
 import threading
+import time
 
-from boto3.s3.transfer import MB, S3Transfer, TransferConfig
+from boto3.s3.transfer import MB, ProgressCallbackInvoker, S3Transfer, TransferConfig
 from botocore.exceptions import ClientError
+from s3transfer.utils import ChunksizeAdjuster
+from yabtool.shared.bandwidth_limiter import consume_bandwidth, get_bandwidth_limit, ThrottledReader
+from yabtool.shared.file_io import CACHE_MODE_NORMAL, SequentialFileReader
+from yabtool.shared.hashing import composite_digest, hash_file, hash_file_chunks, HashingReader
+from yabtool.shared.transfer_progress import TransferProgressReporter
+
+from .base import StreamingExecutionError, TransmissionError, WrongParameterTypeError
+from .s3_transfer_manager import S3TransferManager
+from .s3_upload_engine import (
+    calculate_part_size,
+    calculate_stream_part_size,
+    get_content_md5,
+    is_etag_md5_based,
+    MAX_PARTS_COUNT,
+    put_small_data,
+    put_small_file,
+    S3MultipartUploadEngine,
+    UploadResult,
+    verify_etag
+)
+from .streaming import read_exactly
+
+
+S3ObjectRecord = namedtuple("S3ObjectRecord", ["key", "size", "etag", "last_modified"])
+S3DeleteError = namedtuple("S3DeleteError", ["key", "code", "message"])
+S3UploadRequest = namedtuple("S3UploadRequest", ["bucket_name", "key", "file_name", "progress_reporter", "metadata"])
+S3UploadRequest.__new__.__defaults__ = (None, None)
+
+
+class _PrefixesParallelLister(object):
+    _END_MARKER = object()
+
+    def __init__(self, basic_client, bucket_name, prefixes, max_threads, queue_size):
+        self._basic_client = basic_client
+        self._bucket_name = bucket_name
+        self._prefixes = prefixes
+        self._max_threads = max_threads
+        self._records_queue = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+
+    def iterate(self):
+        with ThreadPoolExecutor(max_workers=self._max_threads, thread_name_prefix="yabtool-listing") as executor:
+            try:
+                for prefix in self._prefixes:
+                    executor.submit(self._list_prefix, prefix)
+
+                finished_prefixes = 0
+                while finished_prefixes < len(self._prefixes):
+                    item = self._records_queue.get()
+                    if item is _PrefixesParallelLister._END_MARKER:
+                        finished_prefixes += 1
+                    elif isinstance(item, BaseException):
+                        raise item
+                    else:
+                        yield item
+            finally:
+                # consumer may stop iteration before all prefixes are listed
+                self._stop_event.set()
+
+    def _list_prefix(self, prefix):
+        if self._stop_event.is_set():
+            return
 
-from .base import WrongParameterTypeError
-
-
-class ProgressPercentage(object):
-    def __init__(self, logger, filename):
-        self._filename = filename
-        self._bytes_to_transmit = float(os.path.getsize(filename))
-        self._transmitted_bytes_count = 0
-        self._lock = threading.Lock()
-        self._logger = logger
+        try:
+            for record in self._basic_client.iterate_objects(self._bucket_name, prefix):
+                if not self._put_item(record):
+                    return
+        except BaseException as e:
+            self._put_item(e)
+        finally:
+            self._put_item(_PrefixesParallelLister._END_MARKER)
 
-    def __call__(self, bytes_amount):
-        with self._lock:
-            self._transmitted_bytes_count += bytes_amount
-            percentage = (self._transmitted_bytes_count / self._bytes_to_transmit) * 100
-            percentage = round(percentage, 2)
-            self._logger.info("transmitted: {}%".format(percentage))
+    def _put_item(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self._records_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
 
-    @staticmethod
-    def _get_file_size(file_name):
-        return os.path.getsize(file_name)
+        return False
 
 
 class S3BasicBotoClient(object):
@@ -32,10 +95,44 @@ class S3BasicBotoClient(object):
     DEFAULT_NOTIFICATION_THRESHHOLD = 1 * MB
     DEFAULT_TRANSMISSION_MAX_THREADS = 20
     DEFAULT_MAX_TRANSMISSION_ATTEMPTS = 5
-
-    def __init__(self, logger, s3_client):
+    DEFAULT_STREAM_PART_SIZE = 64 * MB
+    DEFAULT_COPY_MULTIPART_THRESHOLD = 64 * MB
+    DEFAULT_COPY_CHUNK_SIZE = 64 * MB
+    DEFAULT_STREAM_MAX_THREADS = 4
+    DEFAULT_LISTING_MAX_THREADS = 8
+    DEFAULT_LISTING_QUEUE_SIZE = 10000
+    MAX_KEYS_PER_DELETE_REQUEST = 1000
+    DEFAULT_DELETE_MAX_THREADS = 4
+
+    def __init__(
+        self,
+        logger,
+        s3_client,
+        checkpoints_folder=None,
+        part_size=None,
+        max_threads=None,
+        auto_tune=False,
+        limiters=None,
+        transfer_manager=None,
+        verify_uploads=True,
+        read_cache_mode=CACHE_MODE_NORMAL
+    ):
+        """`part_size` is calculated from file size when it's not specified, uploads of files
+        are throttled by bandwidth `limiters`. Threads of `transfer_manager` (S3TransferManager)
+        are used for uploads when it's specified, otherwise threads are created for each upload.
+        With `verify_uploads` ETag of uploaded object is compared with value calculated from local file.
+        Uploaded files are read with `read_cache_mode` of SequentialFileReader.
+        """
         self.logger = logger
         self._client = s3_client
+        self.checkpoints_folder = checkpoints_folder
+        self.part_size = part_size
+        self.max_threads = max_threads if max_threads else S3BasicBotoClient.DEFAULT_TRANSMISSION_MAX_THREADS
+        self.auto_tune = auto_tune
+        self.limiters = list(limiters) if limiters else []
+        self.transfer_manager = transfer_manager
+        self.verify_uploads = verify_uploads
+        self.read_cache_mode = read_cache_mode
 
     def create_bucket(self, bucket_name, region=None):
         try:
@@ -62,6 +159,16 @@ class S3BasicBotoClient(object):
 
         return True
 
+    def get_object_metadata(self, bucket_name, key):
+        """Returns user metadata of object or None when object doesn't exist."""
+        try:
+            response = self._client.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            self.logger.debug(e)
+            return None
+
+        return response.get("Metadata", {})
+
     def is_bucket_exists(self, bucket_name):
         try:
             _ = self._client.head_bucket(Bucket=bucket_name)  # noqa
@@ -76,27 +183,473 @@ class S3BasicBotoClient(object):
         dest_bucket_name,
         dest_object_name,
         source_file_name,
-        transfer_config=None
+        transfer_config=None,
+        progress_reporter=None,
+        metadata=None
     ):
+        """Uploads file, returns UploadResult with settings used for transmission.
+
+        Progress is reported by `progress_reporter` (TransferProgressReporter), it's finished after upload.
+        User `metadata` is assigned to uploaded object.
+        """
+        file_size = os.path.getsize(source_file_name)
+        if progress_reporter is None:
+            progress_reporter = TransferProgressReporter(self.logger, source_file_name, total_bytes=file_size)
+
+        started_at = time.monotonic()
+        res = self._upload_file(
+            dest_bucket_name,
+            dest_object_name,
+            source_file_name,
+            file_size,
+            transfer_config,
+            progress_reporter,
+            {"Metadata": metadata} if metadata else {}
+        )
+        progress_reporter.finish()
+
+        res.started_at = started_at
+        res.finished_at = time.monotonic()
+        return res
+
+    def _upload_file(
+        self,
+        dest_bucket_name,
+        dest_object_name,
+        source_file_name,
+        file_size,
+        transfer_config,
+        progress_reporter,
+        extra_args
+    ):
+        # files which fit into single part are sent with single request without multipart machinery
+        part_size = self.part_size if self.part_size else calculate_part_size(file_size)
+        if file_size <= part_size and transfer_config is None:
+            return put_small_file(
+                self._client,
+                dest_bucket_name,
+                dest_object_name,
+                source_file_name,
+                file_size,
+                limiters=self.limiters,
+                read_cache_mode=self.read_cache_mode,
+                verify_upload=self.verify_uploads,
+                callback=progress_reporter,
+                extra_args=extra_args
+            )
+
+        if self.checkpoints_folder and transfer_config is None:
+            engine = self._create_upload_engine()
+            return engine.upload_file(
+                dest_bucket_name,
+                dest_object_name,
+                source_file_name,
+                callback=progress_reporter,
+                metadata=extra_args.get("Metadata")
+            )
+
         if transfer_config is None:
             transfer_config = TransferConfig(
-                multipart_threshold=S3BasicBotoClient.DEFAULT_NOTIFICATION_THRESHHOLD,
-                max_concurrency=S3BasicBotoClient.DEFAULT_TRANSMISSION_MAX_THREADS,
-                multipart_chunksize=S3BasicBotoClient.DEFAULT_TRANSMISSION_CHUNK_SIZE,
+                multipart_threshold=part_size,
+                max_concurrency=self.max_threads,
+                multipart_chunksize=part_size,
                 num_download_attempts=S3BasicBotoClient.DEFAULT_MAX_TRANSMISSION_ATTEMPTS,
                 use_threads=True
             )
 
-        transfer = S3Transfer(self._client, config=transfer_config)
+        res = UploadResult()
+        res.bandwidth_limit = get_bandwidth_limit(self.limiters)
+        res.part_size = ChunksizeAdjuster().adjust_chunksize(transfer_config.multipart_chunksize, file_size)
+        start_timestamp = time.monotonic()
+        if self.limiters or self.verify_uploads or self.read_cache_mode != CACHE_MODE_NORMAL:
+            expected_etag = self._transfer_file_object(
+                res,
+                source_file_name,
+                file_size,
+                dest_bucket_name,
+                dest_object_name,
+                transfer_config,
+                progress_reporter,
+                extra_args
+            )
+        else:
+            expected_etag = None
+            self._transfer_file(
+                source_file_name,
+                dest_bucket_name,
+                dest_object_name,
+                transfer_config,
+                progress_reporter,
+                extra_args
+            )
+
+        res.uploaded_bytes = file_size
+        res.parts_count = max(1, (file_size + res.part_size - 1) // res.part_size)
+        res.concurrency = res.max_concurrency = transfer_config.max_concurrency
+        if self.verify_uploads:
+            res.verified = self._verify_transferred_file(
+                dest_bucket_name,
+                dest_object_name,
+                source_file_name,
+                file_size,
+                transfer_config,
+                res.part_size,
+                expected_etag
+            )
+
+        res.seconds_spent = time.monotonic() - start_timestamp
+
+        return res
+
+    def _transfer_file_object(
+        self,
+        res,
+        source_file_name,
+        file_size,
+        dest_bucket_name,
+        dest_object_name,
+        transfer_config,
+        progress_reporter,
+        extra_args
+    ):
+        """Uploads file through file object which controls reading, returns ETag calculated while
+        S3Transfer read the file or None when it's unknown.
+        """
+        # S3Transfer opens file by name itself, so file object is passed to throttle, hash and cache reading
+        with SequentialFileReader(source_file_name, cache_mode=self.read_cache_mode) as input_file:
+            reader = ThrottledReader(input_file, self.limiters) if self.limiters else input_file
+            hashing_reader = None
+            if self.verify_uploads:
+                is_multipart = file_size >= transfer_config.multipart_threshold
+                hashing_reader = HashingReader(reader, "md5", res.part_size if is_multipart else None)
+
+            self._transfer_file(
+                hashing_reader if hashing_reader is not None else reader,
+                dest_bucket_name,
+                dest_object_name,
+                transfer_config,
+                progress_reporter,
+                extra_args
+            )
+
+        if self.limiters:
+            res.throttled_seconds = reader.waited_seconds
 
-        transfer.upload_file(
+        return hashing_reader.hexdigest(file_size) if hashing_reader is not None else None
+
+    def _verify_transferred_file(
+        self,
+        dest_bucket_name,
+        dest_object_name,
+        source_file_name,
+        file_size,
+        transfer_config,
+        part_size,
+        expected_etag=None
+    ):
+        response = self._client.head_object(Bucket=dest_bucket_name, Key=dest_object_name)
+        if not is_etag_md5_based(response):
+            return False
+
+        if expected_etag is None:
+            # file wasn't read sequentially during upload, so expected ETag is calculated by separate local pass
+            self.logger.debug("ETag of '{}' is calculated by separate read of file".format(source_file_name))
+            expected_etag = self._hash_transferred_file(source_file_name, file_size, transfer_config, part_size)
+
+        return verify_etag(response, expected_etag, dest_object_name)
+
+    def _hash_transferred_file(self, source_file_name, file_size, transfer_config, part_size):
+        if file_size < transfer_config.multipart_threshold:
+            hasher, _ = hash_file(source_file_name, ["md5"], cache_mode=self.read_cache_mode)
+            return hasher.hexdigests()["md5"]
+
+        chunks = hash_file_chunks(
             source_file_name,
+            ["md5"],
+            part_size,
+            self.max_threads,
+            cache_mode=self.read_cache_mode
+        )
+        return chunks.composite_digests()["md5"]
+
+    def upload_files(self, upload_requests):
+        """Uploads several files simultaneously, returns list of UploadResult in order of `upload_requests`."""
+        if len(upload_requests) < 2:
+            return [self._upload_requested_file(item) for item in upload_requests]
+
+        if self.transfer_manager is not None:
+            futures = [
+                self.transfer_manager.files_executor.submit(self._upload_requested_file, item)
+                for item in upload_requests
+            ]
+            return [future.result() for future in futures]
+
+        max_workers = min(len(upload_requests), S3TransferManager.DEFAULT_MAX_CONCURRENT_FILES)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="yabtool-file") as executor:
+            return list(executor.map(self._upload_requested_file, upload_requests))
+
+    def _upload_requested_file(self, upload_request):
+        return self.upload_file(
+            upload_request.bucket_name,
+            upload_request.key,
+            upload_request.file_name,
+            progress_reporter=upload_request.progress_reporter,
+            metadata=upload_request.metadata
+        )
+
+    def _transfer_file(
+        self,
+        source,
+        dest_bucket_name,
+        dest_object_name,
+        transfer_config,
+        progress_reporter,
+        extra_args
+    ):
+        """Uploads file name or file object `source` with S3Transfer."""
+        if self.transfer_manager is None:
+            if isinstance(source, str):
+                transfer = S3Transfer(self._client, config=transfer_config)
+                transfer.upload_file(
+                    source,
+                    dest_bucket_name,
+                    dest_object_name,
+                    callback=progress_reporter,
+                    extra_args=extra_args
+                )
+            else:
+                self._client.upload_fileobj(
+                    source,
+                    dest_bucket_name,
+                    dest_object_name,
+                    ExtraArgs=extra_args,
+                    Config=transfer_config,
+                    Callback=progress_reporter
+                )
+
+            return
+
+        future = self.transfer_manager.get_transfer_manager(transfer_config).upload(
+            source,
             dest_bucket_name,
             dest_object_name,
-            callback=ProgressPercentage(self.logger, source_file_name),
+            extra_args=extra_args,
+            subscribers=[ProgressCallbackInvoker(progress_reporter)]
+        )
+        future.result()
+
+    def abort_stale_uploads(self, bucket_name, prefix="", max_age_seconds=None):
+        return self._create_upload_engine().abort_stale_uploads(bucket_name, prefix, max_age_seconds)
+
+    def _create_upload_engine(self):
+        return S3MultipartUploadEngine(
+            self.logger,
+            self._client,
+            self.checkpoints_folder,
+            part_size=self.part_size,
+            max_threads=self.max_threads,
+            auto_tune=self.auto_tune,
+            limiters=self.limiters,
+            executor=self.transfer_manager.parts_executor if self.transfer_manager is not None else None,
+            verify_uploads=self.verify_uploads,
+            read_cache_mode=self.read_cache_mode
         )
 
-        return True
+    def upload_stream(
+        self,
+        dest_bucket_name,
+        dest_object_name,
+        input_stream,
+        part_size=None,
+        max_threads=None,
+        can_complete=None,
+        progress_reporter=None
+    ):
+        """Uploads stream of unknown length with multipart upload, parts are sent as soon as they are read.
+
+        `can_complete` is called after end of stream is reached; upload is aborted when it returns False.
+        Parts grow after every thousand of parts, so long streams don't exceed limit of parts count.
+        Uploads are throttled by limiters and verified like uploads of files, progress is reported by
+        `progress_reporter` (TransferProgressReporter). Returns UploadResult.
+        """
+        part_size = part_size if part_size else S3BasicBotoClient.DEFAULT_STREAM_PART_SIZE
+        max_threads = max_threads if max_threads else S3BasicBotoClient.DEFAULT_STREAM_MAX_THREADS
+        if progress_reporter is None:
+            progress_reporter = TransferProgressReporter(self.logger, dest_object_name)
+
+        started_at = time.monotonic()
+        first_part = read_exactly(input_stream, part_size)
+        if len(first_part) < part_size:
+            self._check_stream_can_be_completed(can_complete)
+            res = put_small_data(
+                self._client,
+                dest_bucket_name,
+                dest_object_name,
+                first_part,
+                limiters=self.limiters,
+                verify_upload=self.verify_uploads,
+                callback=progress_reporter
+            )
+        else:
+            res = self._upload_stream_multipart(
+                dest_bucket_name,
+                dest_object_name,
+                input_stream,
+                first_part,
+                max_threads,
+                can_complete,
+                progress_reporter
+            )
+
+        progress_reporter.finish()
+        res.started_at = started_at
+        res.finished_at = time.monotonic()
+        res.seconds_spent = res.finished_at - started_at
+        return res
+
+    def _upload_stream_multipart(
+        self,
+        dest_bucket_name,
+        dest_object_name,
+        input_stream,
+        first_part,
+        max_threads,
+        can_complete,
+        progress_reporter
+    ):
+        response = self._client.create_multipart_upload(Bucket=dest_bucket_name, Key=dest_object_name)
+        upload_id = response["UploadId"]
+        self.logger.debug("multipart upload '{}' created for '{}'".format(upload_id, dest_object_name))
+
+        res = UploadResult()
+        res.part_size = len(first_part)
+        res.bandwidth_limit = get_bandwidth_limit(self.limiters)
+        res.concurrency = res.max_concurrency = max_threads
+        try:
+            parts = self._upload_stream_parts(
+                dest_bucket_name,
+                dest_object_name,
+                upload_id,
+                input_stream,
+                first_part,
+                max_threads,
+                progress_reporter,
+                res
+            )
+
+            self._check_stream_can_be_completed(can_complete)
+            response = self._client.complete_multipart_upload(
+                Bucket=dest_bucket_name,
+                Key=dest_object_name,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": item["PartNumber"], "ETag": item["ETag"]} for item in parts]}
+            )
+        except BaseException:
+            self.logger.warning("aborting multipart upload '{}' for '{}'".format(upload_id, dest_object_name))
+            self._client.abort_multipart_upload(Bucket=dest_bucket_name, Key=dest_object_name, UploadId=upload_id)
+            raise
+
+        res.parts_count = len(parts)
+        res.etag = response.get("ETag")
+        if self.verify_uploads:
+            expected_etag = composite_digest("md5", [item["digest"] for item in parts])
+            res.verified = verify_etag(response, expected_etag, dest_object_name)
+
+        return res
+
+    def _upload_stream_parts(
+        self,
+        dest_bucket_name,
+        dest_object_name,
+        upload_id,
+        input_stream,
+        first_part,
+        max_threads,
+        progress_reporter,
+        upload_result
+    ):
+        # limits count of parts kept in memory while they are transmitted
+        parts_in_flight = threading.BoundedSemaphore(max_threads)
+        failures = []
+        throttled_seconds_lock = threading.Lock()
+
+        def upload_part(part_number, data):
+            try:
+                throttled_seconds = consume_bandwidth(self.limiters, len(data)) if self.limiters else 0.0
+                digest, content_md5 = get_content_md5(data)
+                response = self._client.upload_part(
+                    Bucket=dest_bucket_name,
+                    Key=dest_object_name,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=data,
+                    ContentMD5=content_md5
+                )
+                if self.verify_uploads:
+                    verify_etag(response, digest.hex(), "{}#{}".format(dest_object_name, part_number))
+
+                self.logger.debug("part #{} transmitted ({} bytes)".format(part_number, len(data)))
+                with throttled_seconds_lock:
+                    upload_result.throttled_seconds += throttled_seconds
+
+                progress_reporter(len(data))
+                return {"PartNumber": part_number, "ETag": response["ETag"], "digest": digest}
+            except BaseException as e:
+                failures.append(e)
+                raise
+            finally:
+                parts_in_flight.release()
+
+        futures = []
+        initial_part_size = len(first_part)
+        with ThreadPoolExecutor(max_workers=max_threads) as executor:
+            data = first_part
+            part_number = 1
+            while data:
+                parts_in_flight.acquire()
+                if failures:
+                    raise failures[0]
+
+                futures.append(executor.submit(upload_part, part_number, data))
+                upload_result.uploaded_bytes += len(data)
+
+                if len(data) < calculate_stream_part_size(part_number, initial_part_size):
+                    break
+
+                part_number += 1
+                data = self._read_stream_part(input_stream, part_number, initial_part_size, upload_result)
+
+            return [future.result() for future in futures]
+
+    def _read_stream_part(self, input_stream, part_number, initial_part_size, upload_result):
+        part_size = calculate_stream_part_size(part_number, initial_part_size)
+        data = read_exactly(input_stream, part_size)
+        if data and part_number > MAX_PARTS_COUNT:
+            raise TransmissionError("stream exceeds {} parts of multipart upload".format(MAX_PARTS_COUNT))
+
+        if part_size > upload_result.part_size:
+            self.logger.info("part size of stream is increased to {} bytes from part #{}".format(
+                part_size,
+                part_number
+            ))
+            upload_result.part_size = part_size
+
+        return data
+
+    @staticmethod
+    def _check_stream_can_be_completed(can_complete):
+        if (can_complete is not None) and (not can_complete()):
+            raise StreamingExecutionError("stream producer failed, upload can't be completed")
+
+    @staticmethod
+    def create_copy_transfer_config(max_concurrency=None):
+        """Creates settings of server side copy with `max_concurrency` parts copied in parallel."""
+        return TransferConfig(
+            multipart_threshold=S3BasicBotoClient.DEFAULT_COPY_MULTIPART_THRESHOLD,
+            max_concurrency=max_concurrency if max_concurrency else S3BasicBotoClient.DEFAULT_TRANSMISSION_MAX_THREADS,
+            multipart_chunksize=S3BasicBotoClient.DEFAULT_COPY_CHUNK_SIZE,
+            use_threads=True
+        )
 
     def copy_file_from_one_bucket_to_another(
         self,
@@ -104,12 +657,23 @@ class S3BasicBotoClient(object):
         src_object_name,
         dest_bucket_name,
         dest_object_name,
+        transfer_config=None,
+        metadata=None
     ):
+        """Performs server side copy, large objects are copied with parts copied in parallel.
+
+        User `metadata` replaces metadata of source object, old s3transfer versions don't copy
+        metadata into objects copied by parts, so it has to be passed explicitly when it's needed.
+        """
+        if transfer_config is None:
+            transfer_config = S3BasicBotoClient.create_copy_transfer_config()
+
         copy_source = {
             "Bucket": src_bucket_name,
             "Key": src_object_name
         }
-        self._client.copy(copy_source, dest_bucket_name, dest_object_name)
+        extra_args = {"Metadata": metadata, "MetadataDirective": "REPLACE"} if metadata else None
+        self._client.copy(copy_source, dest_bucket_name, dest_object_name, ExtraArgs=extra_args, Config=transfer_config)
 
     def put_object(self, dest_bucket_name, dest_object_name, src_data):
         """Add an object to an Amazon S3 bucket
@@ -144,12 +708,133 @@ class S3BasicBotoClient(object):
                 object_data.close()
 
     def list_files_in_folder(self, bucket_name, folder=""):
-        response = self._client.list_objects(Bucket=bucket_name, Prefix=folder)
-        return [content.get("Key") for content in response.get("Contents", [])]
+        return [record.key for record in self.iterate_objects(bucket_name, folder)]
+
+    def iterate_objects(self, bucket_name, prefix="", delimiter=None, page_size=None):
+        """Yields S3ObjectRecord for each object with prefix, all pages of listing are requested lazily.
+
+        With `delimiter` only objects on the first level after prefix are yielded,
+        use `list_common_prefixes` to get nested "folders".
+        """
+        for page in self._iterate_listing_pages(bucket_name, prefix, delimiter, page_size):
+            for record in self._page_to_records(page):
+                yield record
+
+    def list_common_prefixes(self, bucket_name, prefix="", delimiter="/"):
+        res = []
+        for page in self._iterate_listing_pages(bucket_name, prefix, delimiter):
+            res.extend(item["Prefix"] for item in page.get("CommonPrefixes", []))
+
+        return res
+
+    def iterate_objects_parallel(
+        self,
+        bucket_name,
+        prefix="",
+        delimiter="/",
+        max_threads=None,
+        queue_size=None
+    ):
+        """Yields S3ObjectRecord for each object with prefix, nested prefixes are listed in parallel.
+
+        Records are passed through bounded queue, so memory usage does not depend on count of objects.
+        Order of records is not defined.
+        """
+        max_threads = max_threads if max_threads else S3BasicBotoClient.DEFAULT_LISTING_MAX_THREADS
+        queue_size = queue_size if queue_size else S3BasicBotoClient.DEFAULT_LISTING_QUEUE_SIZE
+
+        common_prefixes = []
+        for page in self._iterate_listing_pages(bucket_name, prefix, delimiter):
+            common_prefixes.extend(item["Prefix"] for item in page.get("CommonPrefixes", []))
+            for record in self._page_to_records(page):
+                yield record
+
+        if not common_prefixes:
+            return
+
+        lister = _PrefixesParallelLister(self, bucket_name, common_prefixes, max_threads, queue_size)
+        for record in lister.iterate():
+            yield record
+
+    def _iterate_listing_pages(self, bucket_name, prefix="", delimiter=None, page_size=None):
+        paginator = self._client.get_paginator("list_objects_v2")
+
+        parameters = {"Bucket": bucket_name, "Prefix": prefix}
+        if delimiter:
+            parameters["Delimiter"] = delimiter
+        if page_size:
+            parameters["PaginationConfig"] = {"PageSize": page_size}
+
+        for page in paginator.paginate(**parameters):
+            yield page
+
+    @staticmethod
+    def _page_to_records(page):
+        return [
+            S3ObjectRecord(
+                key=content["Key"],
+                size=content.get("Size"),
+                etag=content.get("ETag"),
+                last_modified=content.get("LastModified")
+            )
+            for content in page.get("Contents", [])
+        ]
+
+    def get_object_data(self, bucket_name, key):
+        """Returns content of object or None when object does not exist."""
+        try:
+            response = self._client.get_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+
+            raise
+
+        return response["Body"].read()
 
     def delete_object(self, bucket_name, key):
         self._client.delete_object(Bucket=bucket_name, Key=key)
 
+    def delete_objects(self, bucket_name, keys, max_threads=None):
+        """Deletes objects with `delete_objects` requests (up to 1000 keys each) sent in parallel.
+
+        Returns tuple of list of deleted keys and list of S3DeleteError for keys which were not deleted.
+        """
+        keys = list(keys)
+        if not keys:
+            return [], []
+
+        max_threads = max_threads if max_threads else S3BasicBotoClient.DEFAULT_DELETE_MAX_THREADS
+        batch_size = S3BasicBotoClient.MAX_KEYS_PER_DELETE_REQUEST
+        batches = [keys[index:index + batch_size] for index in range(0, len(keys), batch_size)]
+
+        deleted_keys = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(max_threads, len(batches))) as executor:
+            for batch_deleted_keys, batch_errors in executor.map(
+                lambda batch: self._delete_objects_batch(bucket_name, batch),
+                batches
+            ):
+                deleted_keys.extend(batch_deleted_keys)
+                errors.extend(batch_errors)
+
+        return deleted_keys, errors
+
+    def _delete_objects_batch(self, bucket_name, keys):
+        response = self._client.delete_objects(
+            Bucket=bucket_name,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+        )
+
+        errors = [
+            S3DeleteError(key=item.get("Key"), code=item.get("Code"), message=item.get("Message"))
+            for item in response.get("Errors", [])
+        ]
+        failed_keys = set(item.key for item in errors)
+
+        # in quiet mode response contains only errors
+        return [key for key in keys if key not in failed_keys], errors
+
     def get_object_tags(self, bucket_name, key):
         ret = {}
 
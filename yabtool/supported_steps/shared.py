@@ -1,12 +1,285 @@
+from collections import deque
+import os
+import signal
 import subprocess
+import threading
+import time
+
+from yabtool.shared.process_priority import AdaptivePriorityMonitor, get_load_per_cpu
+from yabtool.shared.process_resources import create_process_reaper
+
+
+class CommandCancelledError(Exception):
+    pass
+
+
+class OutputTail(object):
+    """Ring buffer with last lines of command output, used in error messages.
+
+    >>> tail = OutputTail(max_lines=2, max_line_length=4)
+    >>> for line in [b"first\\n", b"second\\n", b"third\\n"]:
+    ...     tail.add_line(line)
+    >>> tail.get_data(), tail.lines_count
+    (b'seco\\nthir\\n', 3)
+    """
+
+    DEFAULT_MAX_LINES = 200
+    DEFAULT_MAX_LINE_LENGTH = 4096
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, max_line_length=DEFAULT_MAX_LINE_LENGTH):
+        self.max_line_length = max_line_length
+        self._lines = deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        self.lines_count = 0
+
+    def add_line(self, line):
+        line = line.rstrip(b"\r\n")[:self.max_line_length] + b"\n"
+        with self._lock:
+            self._lines.append(line)
+            self.lines_count += 1
+
+    def get_data(self):
+        with self._lock:
+            return b"".join(self._lines)
+
+
+class _OutputPump(threading.Thread):
+    """Reads pipe line by line and passes lines to tail, file and logger, so output is never kept in memory."""
+
+    def __init__(self, pipe, tail, output_file=None, logger=None, log_level="info", stream_name="stdout"):
+        super().__init__(name="yabtool-{}".format(stream_name), daemon=True)
+        self._pipe = pipe
+        self._tail = tail
+        self._output_file = output_file
+        self._log = getattr(logger, log_level) if logger is not None else None
+        self._stream_name = stream_name
+
+    def run(self):
+        try:
+            for line in iter(lambda: self._pipe.readline(self._tail.max_line_length), b""):
+                self._tail.add_line(line)
+
+                if self._output_file is not None:
+                    self._output_file.write(line)
+
+                if self._log is not None:
+                    self._log("{}: {}".format(self._stream_name, line.decode("utf-8", errors="replace").rstrip()))
+        finally:
+            self._pipe.close()
 
 
 class ThirdPartyCommandsExecutor(object):
+    INITIAL_POLL_INTERVAL_SECONDS = 0.01
+    POLL_INTERVAL_SECONDS = 0.2
+    TERMINATION_GRACE_SECONDS = 5.0
+    PUMP_JOIN_TIMEOUT_SECONDS = 5.0
+
+    @staticmethod
+    def execute(
+        command,
+        shell: bool = True,
+        logger=None,
+        log_level="info",
+        stdout_file=None,
+        stderr_file=None,
+        timeout=None,
+        cancel_event=None,
+        max_tail_lines=OutputTail.DEFAULT_MAX_LINES,
+        priority=None,
+        env=None
+    ):
+        """Executes command, stdout and stderr are streamed line by line into logger and/or files.
+
+        Only last `max_tail_lines` of each stream are kept in memory and returned in `stdout` and
+        `stderr` of result. Command (with its children) is killed when `timeout` is expired
+        (`subprocess.TimeoutExpired` is raised) or `cancel_event` is set (`CommandCancelledError`).
+        Resources consumed by command are available in `resource_usage` attribute of result.
+        `priority` (ProcessPriority) is applied to command and its children. Command receives `env`
+        as environment when it's specified (environment of the process is shared by all targets
+        executed simultaneously, so it's never changed for a single command).
+        """
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=shell,
+            env=env,
+            **ThirdPartyCommandsExecutor._get_process_arguments(priority)
+        )
+        monitor = ThirdPartyCommandsExecutor._start_priority_control(process, priority, logger)
+
+        start_timestamp = time.monotonic()
+        stdout_tail = OutputTail(max_lines=max_tail_lines)
+        stderr_tail = OutputTail(max_lines=max_tail_lines)
+        pumps = [
+            _OutputPump(process.stdout, stdout_tail, stdout_file, logger, log_level, "stdout"),
+            _OutputPump(process.stderr, stderr_tail, stderr_file, logger, log_level, "stderr"),
+        ]
+        for pump in pumps:
+            pump.start()
+
+        try:
+            returncode, resource_usage = ThirdPartyCommandsExecutor._wait(
+                process,
+                command,
+                timeout,
+                cancel_event,
+                monitor
+            )
+        finally:
+            for pump in pumps:
+                pump.join(ThirdPartyCommandsExecutor.PUMP_JOIN_TIMEOUT_SECONDS)
+
+        result = subprocess.CompletedProcess(
+            command,
+            returncode,
+            stdout=stdout_tail.get_data(),
+            stderr=stderr_tail.get_data()
+        )
+        result.resource_usage = ThirdPartyCommandsExecutor._set_elapsed_time(resource_usage, start_timestamp)
+        if returncode and logger is not None:
+            logger.error(
+                "command failed with return code {}, last lines of output:\n{}{}".format(
+                    returncode,
+                    result.stdout.decode("utf-8", errors="replace"),
+                    result.stderr.decode("utf-8", errors="replace")
+                )
+            )
+
+        return result
+
     @staticmethod
-    def execute(command, shell: bool = True):
-        result = subprocess.run(command, stdout=subprocess.PIPE, stdin=subprocess.PIPE, shell=shell)
+    def execute_stage(
+        command,
+        stdin=None,
+        stdout=None,
+        stderr=None,
+        shell: bool = True,
+        timeout=None,
+        cancel_event=None,
+        priority=None,
+        logger=None,
+        env=None
+    ):
+        """Executes command which reads from and/or writes to streams of streaming pipeline.
 
-        result.stdout = result.stdout if result.stdout is not None else bytes()
-        result.stderr = result.stderr if result.stderr is not None else bytes()
+        Streams are passed to the child process as is, so data never goes through the Python process.
+        """
+        start_timestamp = time.monotonic()
+        process = subprocess.Popen(
+            command,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            shell=shell,
+            env=env,
+            **ThirdPartyCommandsExecutor._get_process_arguments(priority)
+        )
+        monitor = ThirdPartyCommandsExecutor._start_priority_control(process, priority, logger)
+        returncode, resource_usage = ThirdPartyCommandsExecutor._wait(process, command, timeout, cancel_event, monitor)
 
+        result = subprocess.CompletedProcess(command, returncode, stdout=bytes(), stderr=bytes())
+        result.resource_usage = ThirdPartyCommandsExecutor._set_elapsed_time(resource_usage, start_timestamp)
         return result
+
+    @staticmethod
+    def _set_elapsed_time(resource_usage, start_timestamp):
+        if resource_usage is not None:
+            resource_usage.elapsed_seconds = time.monotonic() - start_timestamp
+
+        return resource_usage
+
+    @staticmethod
+    def _get_process_arguments(priority):
+        # command is started in its own process group, so children of shell are killed together with it
+        if os.name == "posix":
+            return {"start_new_session": True}
+
+        creation_flags = subprocess.CREATE_NEW_PROCESS_GROUP
+        if priority is not None:
+            creation_flags |= priority.for_load(get_load_per_cpu()).get_windows_creation_flags()
+
+        return {"creationflags": creation_flags}
+
+    @staticmethod
+    def _start_priority_control(process, priority, logger):
+        """Applies priority which can't be set before start of process, returns monitor for adaptive mode."""
+        if priority is None:
+            return None
+
+        if os.name == "nt":
+            priority.apply_to_windows_process(process._handle)
+        else:
+            # priority is applied to process group right after start instead of `preexec_fn`, which isn't
+            # safe with threads; commands are started by shell or loader, so their children get it too
+            try:
+                priority.for_load(get_load_per_cpu()).apply_to_started_process(process.pid)
+            except OSError as e:
+                if logger is not None:
+                    logger.warning("can't change priority of command: {}".format(e))
+
+        if priority.is_adaptive and os.name == "posix":
+            return AdaptivePriorityMonitor(priority, process.pid, logger=logger)
+
+        return None
+
+    @staticmethod
+    def _wait(process, command, timeout, cancel_event, monitor=None):
+        """Returns tuple of return code and ProcessResourceUsage (None when it's not available)."""
+        deadline = (time.monotonic() + float(timeout)) if timeout else None
+        reaper = create_process_reaper(process)
+
+        # polling interval grows, so short commands don't wait for the whole interval
+        poll_interval = ThirdPartyCommandsExecutor.INITIAL_POLL_INTERVAL_SECONDS
+        try:
+            while True:
+                returncode, resource_usage = reaper.poll()
+                if returncode is not None:
+                    return returncode, resource_usage
+
+                if cancel_event is not None and cancel_event.is_set():
+                    ThirdPartyCommandsExecutor._terminate(process)
+                    raise CommandCancelledError("command '{}' is cancelled".format(command))
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    ThirdPartyCommandsExecutor._terminate(process)
+                    raise subprocess.TimeoutExpired(command, timeout)
+
+                if monitor is not None:
+                    monitor.check()
+
+                time.sleep(poll_interval)
+                poll_interval = min(poll_interval * 2, ThirdPartyCommandsExecutor.POLL_INTERVAL_SECONDS)
+        except KeyboardInterrupt:
+            # children in separate process group don't receive Ctrl+C
+            ThirdPartyCommandsExecutor._terminate(process)
+            raise
+
+    @staticmethod
+    def _terminate(process):
+        if process.poll() is not None:
+            return
+
+        if os.name == "posix":
+            ThirdPartyCommandsExecutor._signal_process_group(process, signal.SIGTERM)
+            try:
+                process.wait(timeout=ThirdPartyCommandsExecutor.TERMINATION_GRACE_SECONDS)
+                return
+            except subprocess.TimeoutExpired:
+                ThirdPartyCommandsExecutor._signal_process_group(process, signal.SIGKILL)
+        else:
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+
+        process.wait()
+
+    @staticmethod
+    def _signal_process_group(process, signal_number):
+        try:
+            os.killpg(process.pid, signal_number)
+        except ProcessLookupError:
+            pass
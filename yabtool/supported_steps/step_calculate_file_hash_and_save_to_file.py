@@ -1,74 +1,233 @@
 import codecs
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import hashlib
 import os
 
-from .base import BaseFlowStep, DryRunExecutionError
+from yabtool.shared.hashing import (
+    format_hash_file_content,
+    hash_file,
+    hash_file_with_chunks,
+    MultiHasher,
+    normalize_hash_types
+)
+from yabtool.shared.process_priority import call_with_priority, get_load_per_cpu
+
+from .base import BaseFlowStep, DryRunExecutionError, StreamingExecutionError
+from .s3_upload_engine import calculate_part_size
 
 
 class StepCalculateFileHashAndSaveToFile(BaseFlowStep):
-    def run(self, stat_entry, dry_run=False):
-        input_file_name = self._render_parameter("input_file_name")
-        self.step_context["input_file_name"] = input_file_name
+    STREAM_BLOCK_SIZE = 1024 * 1024
 
-        output_file_name = self._render_parameter("output_file_name")
-        self.step_context["output_file_name"] = output_file_name
+    HASH_MODE_FULL = "full"
+    HASH_MODE_CHUNKED = "chunked"
+    HASH_MODES = [HASH_MODE_FULL, HASH_MODE_CHUNKED]
 
-        hash_type = self.step_context["hash_type"]
-        algorithms_available = [str(item).lower() for item in hashlib.algorithms_available]
-        self.logger.debug(f"algorithms_available: {algorithms_available}")
+    def run(self, stat_entry, dry_run=False):
+        input_file_name, output_file_name, hash_types = self._render_hashing_parameters()
 
-        if hash_type not in algorithms_available:
-            raise DryRunExecutionError(f"unsupported hash type '{hash_type}'")
+        if not dry_run and self._get_hash_mode() == StepCalculateFileHashAndSaveToFile.HASH_MODE_CHUNKED:
+            self._hash_file_chunks(stat_entry, input_file_name, output_file_name, hash_types)
 
-        if not dry_run:
-            self.logger.info(f"calculating hash ('{hash_type}') for '{input_file_name}'")
+        elif not dry_run:
+            self.logger.info(f"calculating hash ({hash_types}) for '{input_file_name}'")
 
             hashing_begin_timestamp = datetime.datetime.utcnow()
-            hash_value = self._hash_file(input_file_name, hash_type)
+            hasher, hashed_bytes = call_with_priority(
+                self._get_process_priority(),
+                self.logger,
+                hash_file,
+                input_file_name,
+                hash_types,
+                cache_mode=self._get_read_cache_mode()
+            )
             hashing_end_timestamp = datetime.datetime.utcnow()
 
             metric = self._get_metric_by_name(stat_entry, "Hashed File")
             metric.value = os.path.basename(input_file_name)
 
             metric = self._get_metric_by_name(stat_entry, "Hash Type")
-            metric.value = os.path.basename(hash_type)
+            metric.value = ", ".join(hash_types)
 
             metric = self._get_metric_by_name(stat_entry, "File Size", units_name="MiB")
-            size_in_mibs = self._get_file_size_in_mibs(input_file_name)
+            size_in_mibs = hashed_bytes / BaseFlowStep.BYTES_IN_MEGABYTE
             metric.value = f"{size_in_mibs:.2f}"
 
-            metric = self._get_metric_by_name(stat_entry, "Hash Speed", units_name="MiB/s")
             spent_time = (hashing_end_timestamp - hashing_begin_timestamp).total_seconds()
+            self._update_hash_speed_metrics(stat_entry, "Hash Speed", hasher, size_in_mibs, spent_time)
 
-            megs_per_second = (size_in_mibs / spent_time) if spent_time else "N/A"
-
-            if megs_per_second != "N/A":
-                metric.value = f"{megs_per_second:.2f}"
-
-            output_data = f"{hash_value} *{os.path.basename(input_file_name)}\n"
+            output_data = format_hash_file_content(hasher.hexdigests(), os.path.basename(input_file_name))
             self._save_data(output_file_name, output_data)
 
         return super().run(dry_run)
 
+    @classmethod
+    def supports_streaming(cls):
+        return True
+
+    def prepare_stage(self):
+        self._render_hashing_parameters()
+        if self._get_hash_mode() != StepCalculateFileHashAndSaveToFile.HASH_MODE_FULL:
+            raise StreamingExecutionError(f"hash mode '{self._get_hash_mode()}' can't be used for streams")
+
+        return super().prepare_stage()
+
+    def run_stage(self, stat_entry, stage_context):
+        input_file_name = self.step_context["input_file_name"]
+        output_file_name = self.step_context["output_file_name"]
+        hash_types = normalize_hash_types(self.step_context["hash_type"])
+
+        self.logger.info(f"calculating hash ({hash_types}) for stream '{input_file_name}'")
+
+        # stage is executed in its own thread, hashing threads started below inherit its priority
+        priority = self._get_process_priority()
+        if priority is not None:
+            try:
+                priority.for_load(get_load_per_cpu()).apply_to_current_thread()
+            except OSError as e:
+                self.logger.warning(f"can't lower priority of hashing: {e}")
+
+        hashing_executor = ThreadPoolExecutor(max_workers=len(hash_types), thread_name_prefix="yabtool-hash")
+        hasher = MultiHasher(hash_types, executor=hashing_executor if len(hash_types) > 1 else None)
+        buffer = bytearray(StepCalculateFileHashAndSaveToFile.STREAM_BLOCK_SIZE)
+        view = memoryview(buffer)
+
+        hashing_begin_timestamp = datetime.datetime.utcnow()
+        streamed_bytes = 0
+        with hashing_executor:
+            while True:
+                read_bytes = stage_context.input_stream.readinto(buffer)
+                if not read_bytes:
+                    break
+
+                hasher.update(view[:read_bytes])
+                stage_context.output_stream.write(view[:read_bytes])
+                streamed_bytes += read_bytes
+
+        stage_context.output_stream.flush()
+        hashing_end_timestamp = datetime.datetime.utcnow()
+
+        metric = self._get_metric_by_name(stat_entry, "Hashed File")
+        metric.value = os.path.basename(input_file_name)
+
+        metric = self._get_metric_by_name(stat_entry, "Hash Type")
+        metric.value = ", ".join(hash_types)
+
+        size_in_mibs = streamed_bytes / BaseFlowStep.BYTES_IN_MEGABYTE
+        metric = self._get_metric_by_name(stat_entry, "File Size", units_name="MiB")
+        metric.value = f"{size_in_mibs:.2f}"
+
+        spent_time = (hashing_end_timestamp - hashing_begin_timestamp).total_seconds()
+        self._update_hash_speed_metrics(stat_entry, "Stream Speed", hasher, size_in_mibs, spent_time)
+
+        output_data = format_hash_file_content(hasher.hexdigests(), os.path.basename(input_file_name))
+        self._save_data(output_file_name, output_data)
+
+    def _hash_file_chunks(self, stat_entry, input_file_name, output_file_name, hash_types):
+        chunk_size = self.step_context.get("chunk_size_mib", "auto")
+        if str(chunk_size) == "auto":
+            # same part size is used by S3 uploads, so composite digest may be compared with ETag
+            chunk_size = calculate_part_size(os.path.getsize(input_file_name))
+        else:
+            chunk_size = int(float(chunk_size) * BaseFlowStep.BYTES_IN_MEGABYTE)
+        self.logger.info(f"calculating chunked hash ({hash_types}), chunk size: {chunk_size} for '{input_file_name}'")
+
+        hashing_begin_timestamp = datetime.datetime.utcnow()
+        result = call_with_priority(
+            self._get_process_priority(),
+            self.logger,
+            hash_file_with_chunks,
+            input_file_name,
+            hash_types,
+            chunk_size,
+            cache_mode=self._get_read_cache_mode()
+        )
+        hashing_end_timestamp = datetime.datetime.utcnow()
+
+        metric = self._get_metric_by_name(stat_entry, "Hashed File")
+        metric.value = os.path.basename(input_file_name)
+
+        metric = self._get_metric_by_name(stat_entry, "Hash Type")
+        metric.value = "{} (chunked)".format(", ".join(hash_types))
+
+        metric = self._get_metric_by_name(stat_entry, "Chunks Count")
+        metric.value = result.chunks_count
+
+        size_in_mibs = result.file_size / BaseFlowStep.BYTES_IN_MEGABYTE
+        metric = self._get_metric_by_name(stat_entry, "File Size", units_name="MiB")
+        metric.value = f"{size_in_mibs:.2f}"
+
+        spent_time = (hashing_end_timestamp - hashing_begin_timestamp).total_seconds()
+        if spent_time:
+            metric = self._get_metric_by_name(stat_entry, "Hash Speed", units_name="MiB/s")
+            metric.value = f"{(size_in_mibs / spent_time):.2f}"
+
+        # validation file keeps digests of the whole file (so it's checked by sha256sum -c),
+        # composite digests comparable with ETag are saved into chunks list
+        file_name = os.path.basename(input_file_name)
+        self._save_data(output_file_name, format_hash_file_content(result.full_hexdigests(), file_name))
+
+        chunks_file_name = self.step_context["chunks_file_name"]
+        self._save_data(chunks_file_name, result.format_chunks_list(file_name))
+
+    def _get_hash_mode(self):
+        hash_mode = self.step_context.get("hash_mode", StepCalculateFileHashAndSaveToFile.HASH_MODE_FULL)
+        if hash_mode not in StepCalculateFileHashAndSaveToFile.HASH_MODES:
+            raise DryRunExecutionError(f"unsupported hash mode '{hash_mode}'")
+
+        return hash_mode
+
+    def _update_hash_speed_metrics(self, stat_entry, metric_name, hasher, size_in_mibs, spent_time):
+        if spent_time:
+            metric = self._get_metric_by_name(stat_entry, metric_name, units_name="MiB/s")
+            metric.value = f"{(size_in_mibs / spent_time):.2f}"
+
+        if len(hasher.hash_types) < 2:
+            return
+
+        for hash_type, seconds_spent in hasher.seconds_spent().items():
+            if not seconds_spent:
+                continue
+
+            metric = self._get_metric_by_name(stat_entry, f"Hash Speed ({hash_type})", units_name="MiB/s")
+            metric.value = f"{(size_in_mibs / seconds_spent):.2f}"
+
+    def _render_hashing_parameters(self):
+        input_file_name = self._render_parameter("input_file_name")
+        self.step_context["input_file_name"] = input_file_name
+
+        output_file_name = self._render_parameter("output_file_name")
+        self.step_context["output_file_name"] = output_file_name
+
+        hash_types = normalize_hash_types(self.step_context["hash_type"])
+        algorithms_available = [str(item).lower() for item in hashlib.algorithms_available]
+        self.logger.debug(f"algorithms_available: {algorithms_available}")
+
+        if not hash_types:
+            raise DryRunExecutionError("at least one hash type should be specified")
+
+        # invalid priority and cache mode are reported by dry run
+        self._get_process_priority()
+        self._get_read_cache_mode()
+
+        for hash_type in hash_types:
+            if hash_type not in algorithms_available:
+                raise DryRunExecutionError(f"unsupported hash type '{hash_type}'")
+
+        if self._get_hash_mode() == StepCalculateFileHashAndSaveToFile.HASH_MODE_CHUNKED:
+            if "chunks_file_name" not in self.step_context:
+                self.step_context["chunks_file_name"] = output_file_name + ".chunks"
+
+            self.step_context["chunks_file_name"] = self._render_parameter("chunks_file_name")
+
+        return input_file_name, output_file_name, hash_types
+
     @staticmethod
     def _save_data(file_name, data, codepage="utf-8"):
         with codecs.open(file_name, "w", codepage) as output_file:
             output_file.write(data)
 
-    @staticmethod
-    def _hash_file(file_name, hash_type):
-        BLOCKSIZE = 65536
-
-        hasher = hashlib.new(hash_type)
-        with open(file_name, "rb") as afile:
-            buf = afile.read(BLOCKSIZE)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = afile.read(BLOCKSIZE)
-
-        return str(hasher.hexdigest())
-
     @classmethod
     def step_name(cls):
         return "calculate_file_hash_and_save_in_file"
@@ -0,0 +1,364 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+
+from yabtool.shared.base import AttrsToStringMixin
+from yabtool.shared.chunking import (
+    ContentDefinedChunker,
+    DEFAULT_AVERAGE_CHUNK_SIZE,
+    DEFAULT_MAX_CHUNK_SIZE,
+    DEFAULT_MIN_CHUNK_SIZE
+)
+
+from .base import DryRunExecutionError, time_interval, TransmissionError
+from .cdc_chunk_store import (
+    ChunkCodec,
+    ChunkedBackupWriter,
+    dump_manifest,
+    list_manifest_keys,
+    load_manifest,
+    LocalChunkIndex,
+    LocalChunkStore,
+    remove_unreferenced_chunks,
+    S3ChunkStore
+)
+from .s3_steps_shared import StepS3FileBaseUploader
+
+
+class ManifestSlot(AttrsToStringMixin):
+    """Destination of manifest for upload rule, dedup tag marks the iteration which filled it."""
+
+    def __init__(self, rule_name, destination_prefix, tag_name, tag_value):
+        self.rule_name = rule_name
+        self.destination_prefix = destination_prefix
+        self.tag_name = tag_name
+        self.tag_value = tag_value
+
+
+class StepCdcUploadWithRotation(StepS3FileBaseUploader):
+    """Stores backup as content defined chunks, upload rules receive manifests only.
+
+    Chunks already present in store (according to local chunk index) are not transmitted,
+    so daily backups which differ slightly from previous ones upload only changed chunks.
+    Like rotation of archives, rule which already has manifest with its dedup tag is skipped.
+    Chunks which aren't referenced by manifests under `manifests_prefix` are removed.
+    """
+
+    CHUNK_STORE_S3 = "s3"
+    CHUNK_STORE_LOCAL = "local"
+    MANIFEST_SUFFIX = ".manifest.json"
+    DEFAULT_MAX_CHUNK_THREADS = 8
+    DEFAULT_MANIFESTS_PREFIX = "{{target_prefix_in_bucket}}/manifests"
+
+    METRIC_CHUNKS_COUNT = "Chunks Count"
+    METRIC_NEW_CHUNKS_COUNT = "New Chunks"
+    METRIC_SOURCE_SIZE = "Source Size"
+    METRIC_NEW_DATA_SIZE = "New Data Size"
+    METRIC_STORED_SIZE = "Stored Size"
+    METRIC_DEDUPLICATED_SIZE = "Deduplicated Size"
+    METRIC_CHUNKING_SPEED = "Chunking Speed"
+    METRIC_MANIFESTS_COUNT = "Written Manifests"
+    METRIC_REMOVED_CHUNKS_COUNT = "Removed Chunks"
+
+    def vote_for_flow_execution_skipping(self):
+        self.logger.debug("checking if need skip flow execution for step '{}'".format(self.step_name()))
+
+        additional_context = self._render_prefixes()
+        if self._get_store_type() == StepCdcUploadWithRotation.CHUNK_STORE_S3:
+            bucket_name = self.secret_context["bucket_name"]
+            client = self._create_basic_client(self._crete_s3_client())
+            if not client.is_bucket_exists(bucket_name):
+                self.logger.debug("Step can't be skipped, because bucket is not exists")
+                return False
+
+            store = S3ChunkStore(client, bucket_name)
+        else:
+            store = LocalChunkStore(self._render_parameter("local_chunk_store_folder"))
+
+        return not self._get_pending_rules(store, additional_context)
+
+    def run(self, stat_entry, dry_run=False):
+        store_type = self._get_store_type()
+        additional_context = self._render_prefixes()
+
+        chunks_prefix = self._render_result(self.step_context["chunks_prefix"], additional_context)
+        self.logger.debug("chunks_prefix: '{}'".format(chunks_prefix))
+
+        # codec is created during dry run too, so missing encryption support is detected early
+        codec = self._create_codec()
+
+        if store_type == StepCdcUploadWithRotation.CHUNK_STORE_S3:
+            store = self._create_s3_store(dry_run)
+        else:
+            store = LocalChunkStore(self._render_parameter("local_chunk_store_folder"))
+
+        if dry_run:
+            return super().run(stat_entry, dry_run)
+
+        # like rotation of archives, the first backup of week or month is kept in the slot of rule
+        pending_rules = self._get_pending_rules(store, additional_context)
+        if not pending_rules:
+            self.logger.info("manifests of all rules are already written for this iteration")
+            return super().run(stat_entry, dry_run)
+
+        source_file_name = self._render_parameter("source_file")
+        if not os.path.exists(source_file_name):
+            raise TransmissionError("Can't find source file '{}'".format(source_file_name))
+
+        chunk_index = self._create_chunk_index(store, chunks_prefix)
+        manifest = self._store_chunks(stat_entry, store, codec, chunks_prefix, chunk_index, source_file_name)
+
+        for slot in pending_rules:
+            self.logger.info("processing upload rule '{}'".format(slot.rule_name))
+            self._write_manifest_for_rule(stat_entry, store, slot, manifest)
+
+        if self.step_context.get("remove_unreferenced_chunks", True):
+            self._remove_unreferenced_chunks(stat_entry, store, chunks_prefix, chunk_index, additional_context)
+
+        return super().run(stat_entry, dry_run)
+
+    def _get_store_type(self):
+        store_type = self.step_context.get("chunk_store", StepCdcUploadWithRotation.CHUNK_STORE_S3)
+        if store_type not in (StepCdcUploadWithRotation.CHUNK_STORE_S3, StepCdcUploadWithRotation.CHUNK_STORE_LOCAL):
+            raise ValueError("unknown chunk store '{}'".format(store_type))
+
+        return store_type
+
+    def _render_prefixes(self):
+        prefix_in_bucket = self._render_parameter("prefix_in_bucket")
+        self.logger.debug("prefix_in_bucket: '{}'".format(prefix_in_bucket))
+        self.step_context["prefix_in_bucket"] = prefix_in_bucket
+
+        target_prefix_in_bucket = self._render_parameter("target_prefix_in_bucket")
+        self.logger.debug("target_prefix_in_bucket: '{}'".format(target_prefix_in_bucket))
+
+        return {"target_prefix_in_bucket": target_prefix_in_bucket}
+
+    def _get_pending_rules(self, store, additional_context):
+        """Returns ManifestSlot for each rule which doesn't have manifest with its dedup tag yet."""
+        res = []
+        for rule in self.mixed_context["upload_rules"]:
+            slot = ManifestSlot(
+                rule["name"],
+                self._render_result(rule["destination_prefix"], additional_context),
+                self._render_result(rule["dedup_tag_name"], additional_context),
+                self._render_result(rule.get("dedup_tag_value"), additional_context)
+            )
+
+            tagged_key = self._find_tagged_manifest(store, slot)
+            if tagged_key:
+                self.logger.info("tag for iteration already exists: '{}'".format(tagged_key))
+                continue
+
+            res.append(slot)
+
+        return res
+
+    def _find_tagged_manifest(self, store, slot):
+        self.logger.debug("looking for manifest with tag '{}' and tag value '{}'".format(slot.tag_name, slot.tag_value))
+        if isinstance(store, S3ChunkStore):
+            return self._get_tagged_object_key(
+                store.basic_client,
+                store.bucket_name,
+                slot.destination_prefix,
+                slot.tag_name,
+                slot.tag_value,
+                update_index=True
+            )
+
+        # local store has no object tags, they're kept in manifests
+        for key in list_manifest_keys(store, slot.destination_prefix, StepCdcUploadWithRotation.MANIFEST_SUFFIX):
+            data = store.get_object(key)
+            if data is not None and load_manifest(data).get("tags", {}).get(slot.tag_name) == slot.tag_value:
+                return key
+
+        return None
+
+    def _create_codec(self):
+        step_context = self._get_step_context()
+        password = self._render_result(step_context.get("encryption_password"))
+
+        return ChunkCodec(
+            compression_preset=int(step_context.get("compression_preset", ChunkCodec.DEFAULT_COMPRESSION_PRESET)),
+            password=password if password else None
+        )
+
+    def _create_s3_store(self, dry_run):
+        bucket_name = self.secret_context["bucket_name"]
+        self.logger.debug("bucket_name: '{}'".format(bucket_name))
+
+        if dry_run:
+            pattern = re.compile(StepS3FileBaseUploader.S3_BUCKET_NAME_REGEX)
+            if not pattern.match(bucket_name):
+                raise DryRunExecutionError(
+                    "base bucket name should match regex '{}'".format(StepS3FileBaseUploader.S3_BUCKET_NAME_REGEX)
+                )
+
+        raw_client = self._crete_s3_client()
+        client = self._create_basic_client(raw_client)
+
+        if dry_run:
+            self.logger.debug("checking that bucket exists to perform dry run")
+            client.is_bucket_exists(bucket_name)
+        elif not client.is_bucket_exists(bucket_name):
+            self.logger.info("creating bucker '{}'".format(bucket_name))
+            client.create_bucket(bucket_name, region=self.secret_context["region"])
+
+        return S3ChunkStore(client, bucket_name, limiters=self._get_bandwidth_limiters())
+
+    def _create_chunker(self):
+        step_context = self._get_step_context()
+
+        return ContentDefinedChunker(
+            min_size=self._get_size_parameter(step_context, "min_chunk_size_kib", DEFAULT_MIN_CHUNK_SIZE),
+            average_size=self._get_size_parameter(step_context, "average_chunk_size_kib", DEFAULT_AVERAGE_CHUNK_SIZE),
+            max_size=self._get_size_parameter(step_context, "max_chunk_size_kib", DEFAULT_MAX_CHUNK_SIZE)
+        )
+
+    @staticmethod
+    def _get_size_parameter(step_context, parameter_name, default_value):
+        value = step_context.get(parameter_name)
+        return int(float(value) * 1024) if value else default_value
+
+    def _create_chunk_index(self, store, chunks_prefix):
+        index_folder = self.step_context.get("chunk_index_folder")
+        if index_folder:
+            index_folder = self._render_result(index_folder)
+        elif self.rendering_context.root_temporary_folder:
+            index_folder = os.path.join(self.rendering_context.root_temporary_folder, "chunk_index")
+        else:
+            return None
+
+        res = LocalChunkIndex(index_folder, store.location, chunks_prefix)
+        self.logger.info("loaded {} chunk ids from index '{}'".format(res.load(), res.file_name))
+        return res
+
+    def _store_chunks(self, stat_entry, store, codec, chunks_prefix, chunk_index, source_file_name):
+        max_threads = int(
+            self._get_step_context().get("max_chunk_threads", StepCdcUploadWithRotation.DEFAULT_MAX_CHUNK_THREADS)
+        )
+        progress_reporter = self._create_progress_reporter(stat_entry, source_file_name)
+
+        chunker = self._create_chunker()
+        if not chunker.is_native:
+            self.logger.warning("native chunking extension isn't built, chunking is done by slow pure Python loop")
+
+        self.logger.info("storing chunks of '{}' into '{}'".format(source_file_name, chunks_prefix))
+        begin_timestamp = self._get_current_timestamp()
+
+        # chunks are compressed and stored by threads while next boundaries are looked for
+        with ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="yabtool-chunk") as executor:
+            writer = ChunkedBackupWriter(
+                self.logger,
+                chunker,
+                codec,
+                store,
+                chunks_prefix,
+                chunk_index=chunk_index,
+                executor=executor,
+                max_pending_chunks=max_threads * 2
+            )
+            manifest, statistics = writer.write_file(source_file_name, progress_callback=progress_reporter)
+
+        progress_reporter.finish()
+        seconds_spent = time_interval(begin_timestamp, self._get_current_timestamp())
+        self.logger.info("chunking statistics: {}".format(statistics))
+
+        self._update_chunking_metrics(stat_entry, statistics, seconds_spent)
+        self._update_progress_metrics(stat_entry, progress_reporter)
+        return manifest
+
+    def _update_chunking_metrics(self, stat_entry, statistics, seconds_spent):
+        metric = self._get_metric_by_name(stat_entry, StepCdcUploadWithRotation.METRIC_CHUNKS_COUNT, units_name="items")
+        metric.value = statistics.chunks_count
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepCdcUploadWithRotation.METRIC_NEW_CHUNKS_COUNT,
+            units_name="items"
+        )
+        metric.value = statistics.new_chunks_count
+
+        sizes = [
+            (StepCdcUploadWithRotation.METRIC_SOURCE_SIZE, statistics.total_bytes),
+            (StepCdcUploadWithRotation.METRIC_NEW_DATA_SIZE, statistics.new_bytes),
+            (StepCdcUploadWithRotation.METRIC_STORED_SIZE, statistics.stored_bytes),
+            (StepCdcUploadWithRotation.METRIC_DEDUPLICATED_SIZE, statistics.deduplicated_bytes),
+        ]
+        for metric_name, size in sizes:
+            metric = self._get_metric_by_name(stat_entry, metric_name, units_name="MiB")
+            metric.value = round(size / StepS3FileBaseUploader.BYTES_IN_MEGABYTE, 2)
+
+        if seconds_spent:
+            metric = self._get_metric_by_name(
+                stat_entry,
+                StepCdcUploadWithRotation.METRIC_CHUNKING_SPEED,
+                units_name="MiB/s"
+            )
+            metric.value = round(statistics.total_bytes / StepS3FileBaseUploader.BYTES_IN_MEGABYTE / seconds_spent, 2)
+
+    def _write_manifest_for_rule(self, stat_entry, store, slot, manifest):
+        manifest_key = "{}/{}{}".format(
+            slot.destination_prefix.rstrip("/"),
+            manifest["file_name"],
+            StepCdcUploadWithRotation.MANIFEST_SUFFIX
+        )
+        self.logger.info("writing manifest '{}'".format(manifest_key))
+
+        # previous manifests of the rule are removed after new one is written, chunks are removed by sweep
+        existing_keys = [key for key in store.list_keys(slot.destination_prefix) if key != manifest_key]
+        store.put_object(manifest_key, dump_manifest({**manifest, "tags": {slot.tag_name: slot.tag_value}}))
+
+        if isinstance(store, S3ChunkStore):
+            store.basic_client.set_object_tags(store.bucket_name, manifest_key, {slot.tag_name: slot.tag_value})
+            dedup_index = self._get_dedup_index(store.basic_client, store.bucket_name)
+            if dedup_index is not None:
+                entries = {slot.tag_name: {"value": slot.tag_value, "key": manifest_key}}
+                dedup_index.save(slot.destination_prefix, entries)
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepCdcUploadWithRotation.METRIC_MANIFESTS_COUNT,
+            initial_value=0,
+            units_name="items"
+        )
+        metric.increment(1)
+
+        if not existing_keys:
+            return
+
+        self.logger.info("removing previous manifests: {}".format(existing_keys))
+        store.delete_keys(existing_keys)
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_DELETED_OBJECTS_COUNT,
+            initial_value=0,
+            units_name="items"
+        )
+        metric.increment(len(existing_keys))
+
+    def _remove_unreferenced_chunks(self, stat_entry, store, chunks_prefix, chunk_index, additional_context):
+        # manifests of all slots (including ones of other weeks and months) keep their chunks alive
+        manifests_prefix = self._render_result(
+            self.step_context.get("manifests_prefix", StepCdcUploadWithRotation.DEFAULT_MANIFESTS_PREFIX),
+            additional_context
+        )
+        manifest_keys = list_manifest_keys(store, manifests_prefix, StepCdcUploadWithRotation.MANIFEST_SUFFIX)
+        self.logger.info("removing chunks which aren't referenced by {} manifests of '{}'".format(
+            len(manifest_keys),
+            manifests_prefix
+        ))
+
+        removed_keys = remove_unreferenced_chunks(store, chunks_prefix, manifest_keys, chunk_index)
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepCdcUploadWithRotation.METRIC_REMOVED_CHUNKS_COUNT,
+            initial_value=0,
+            units_name="items"
+        )
+        metric.increment(len(removed_keys))
+
+    @classmethod
+    def step_name(cls):
+        return "cdc_upload_with_rotation"
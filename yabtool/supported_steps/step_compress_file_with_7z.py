@@ -1,5 +1,4 @@
 from .base import BaseFlowStep, time_interval
-from .shared import ThirdPartyCommandsExecutor
 
 
 class StepCompressFileWith7Z(BaseFlowStep):
@@ -18,19 +17,15 @@ class StepCompressFileWith7Z(BaseFlowStep):
         if not dry_run:
             self.logger.info("Compressing file with 7Z archive")
             self.logger.debug("going to execute: {}".format(command))
-            result = ThirdPartyCommandsExecutor.execute(command)
+            result = self._execute_command(command, stat_entry=stat_entry)
         else:
             self.logger.debug("going to execute: {}".format(dry_run_command))
-            result = ThirdPartyCommandsExecutor.execute(dry_run_command)
+            result = self._execute_command(dry_run_command, log_level="debug")
 
         self.logger.info("return code: {}".format(result.returncode))
 
         timestamp_execution_end = self._get_current_timestamp()
 
-        if not dry_run:
-            self.logger.info("stderr:\n{}".format(result.stderr.decode("utf-8")))
-            self.logger.info("stdout:\n{}".format(result.stdout.decode("utf-8")))
-
         if not dry_run:
             result.check_returncode()
 
@@ -0,0 +1,64 @@
+from .base import BaseFlowStep, StreamingExecutionError
+from .shared import ThirdPartyCommandsExecutor
+
+
+class StepCompressStream(BaseFlowStep):
+    """Compresses (and optionally encrypts) data passing through streaming pipeline.
+
+    Command from `command_template` should read data from stdin and write result into stdout.
+    """
+
+    def run(self, stat_entry, dry_run=False):
+        self._render_commands()
+
+        if not dry_run:
+            raise StreamingExecutionError(
+                "step '{}' can be executed only as stage of streaming pipeline".format(self.step_name())
+            )
+
+        dry_run_command = self.step_context["dry_run_command"]
+        self.logger.debug("going to execute: {}".format(dry_run_command))
+        result = self._execute_command(dry_run_command, log_level="debug")
+        self.logger.info("return code: {}".format(result.returncode))
+
+        return super().run(dry_run)
+
+    @classmethod
+    def supports_streaming(cls):
+        return True
+
+    def prepare_stage(self):
+        self._render_commands()
+        return super().prepare_stage()
+
+    def run_stage(self, stat_entry, stage_context):
+        command = self.step_context["command"]
+
+        self.logger.info("Compressing stream")
+        self.logger.debug("going to execute: {}".format(command))
+        result = ThirdPartyCommandsExecutor.execute_stage(
+            command,
+            stdin=stage_context.input_stream,
+            stdout=stage_context.output_stream,
+            cancel_event=self._get_cancel_event(),
+            priority=self._get_process_priority(),
+            logger=self.logger
+        )
+        self.logger.info("return code: {}".format(result.returncode))
+        self._update_resource_usage_metrics(stat_entry, result.resource_usage)
+
+        result.check_returncode()
+
+    def _render_commands(self):
+        output_archive_name = self._render_parameter("output_archive_name")
+        self.step_context["output_archive_name"] = output_archive_name
+
+        command = self._render_parameter("command_template")
+        self.step_context["command"] = command
+
+        dry_run_command = self._render_parameter("dry_run_command")
+        self.step_context["dry_run_command"] = dry_run_command
+
+    @classmethod
+    def step_name(cls):
+        return "stream_compress"
@@ -4,6 +4,47 @@ from .shared import ThirdPartyCommandsExecutor
 
 class StepMakeFirebirdDatabaseBackup(BaseFlowStep):
     def run(self, stat_entry, dry_run=False):
+        command, dry_run_command = self._render_commands()
+
+        if not dry_run:
+            self.logger.info("Making backup of Firebird database")
+            self.logger.debug("going to execute: {}".format(command))
+            result = self._execute_command(command, stat_entry=stat_entry)
+        else:
+            self.logger.debug("going to execute: {}".format(dry_run_command))
+            result = self._execute_command(dry_run_command, log_level="debug")
+
+        if not dry_run:
+            result.check_returncode()
+
+        return super().run(dry_run)
+
+    @classmethod
+    def supports_streaming(cls):
+        return True
+
+    def prepare_stage(self):
+        self._render_commands()
+        return super().prepare_stage()
+
+    def run_stage(self, stat_entry, stage_context):
+        command = self.step_context["command"]
+
+        self.logger.info("Making backup of Firebird database into stream")
+        self.logger.debug("going to execute: {}".format(command))
+        result = ThirdPartyCommandsExecutor.execute_stage(
+            command,
+            stdout=stage_context.output_stream,
+            cancel_event=self._get_cancel_event(),
+            priority=self._get_process_priority(),
+            logger=self.logger
+        )
+        self.logger.info("return code: {}".format(result.returncode))
+        self._update_resource_usage_metrics(stat_entry, result.resource_usage)
+
+        result.check_returncode()
+
+    def _render_commands(self):
         backup_log_name = self._render_parameter("backup_log_name")
         self.step_context["backup_log_name"] = backup_log_name
 
@@ -16,18 +57,7 @@ class StepMakeFirebirdDatabaseBackup(BaseFlowStep):
         dry_run_command = self._render_parameter("dry_run_command")
         self.step_context["dry_run_command"] = dry_run_command
 
-        if not dry_run:
-            self.logger.info("Making backup of Firebird database")
-            self.logger.debug("going to execute: {}".format(command))
-            result = ThirdPartyCommandsExecutor.execute(command)
-        else:
-            self.logger.debug("going to execute: {}".format(dry_run_command))
-            result = ThirdPartyCommandsExecutor.execute(dry_run_command)
-
-        if not dry_run:
-            result.check_returncode()
-
-        return super().run(dry_run)
+        return command, dry_run_command
 
     @classmethod
     def step_name(cls):
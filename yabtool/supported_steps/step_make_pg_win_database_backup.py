@@ -6,40 +6,81 @@ from .shared import ThirdPartyCommandsExecutor
 
 class StepMakePgDatabaseWinBackup(BaseFlowStep):
     def run(self, stat_entry, dry_run=False):
-        os.environ["PGPASSWORD"] = self._render_parameter("db_password")
-
-        backup_file_name = self._render_parameter("backup_file_name")
-        self.step_context["backup_file_name"] = backup_file_name
-
-        command = self._render_parameter("command_template")
-        self.step_context["command"] = command
-
-        dry_run_command = self._render_parameter("dry_run_command")
-        self.step_context["dry_run_command"] = dry_run_command
+        command, dry_run_command = self._render_commands()
+        env = self._get_command_environment()
 
         if not dry_run:
-            self.logger.info("Making backup of Firebird database")
+            backup_log_name = self._render_parameter("backup_log_name")
+            self.logger.info("Making backup of PostgreSQL database")
             self.logger.debug("going to execute: {}".format(command))
-            result = ThirdPartyCommandsExecutor.execute(command)
+            self.logger.debug(f"Saving log file from PG backup tool into {backup_log_name}")
+
+            # verbose output of pg_dump is written into log file as it's produced
+            with open(backup_log_name, "wb") as backup_log_file:
+                result = self._execute_command(
+                    command,
+                    stat_entry=stat_entry,
+                    log_level="debug",
+                    stderr_file=backup_log_file,
+                    env=env
+                )
         else:
             self.logger.debug("going to execute: {}".format(dry_run_command))
-            result = ThirdPartyCommandsExecutor.execute(dry_run_command)
-
-        del os.environ["PGPASSWORD"]
+            result = self._execute_command(dry_run_command, log_level="debug", env=env)
 
         if not dry_run:
-            backup_log_name = self._render_parameter("backup_log_name")
-            self.logger.debug(f"Saving log file from PG backup tool into {backup_log_name}")
-            self._save_backup_log(backup_log_name, result.stderr)
-
             result.check_returncode()
 
         return super().run(dry_run)
 
-    @staticmethod
-    def _save_backup_log(backup_log_name: str, content: bytes):
-        with open(backup_log_name, "wb") as output_file:
-            output_file.write(content)
+    @classmethod
+    def supports_streaming(cls):
+        return True
+
+    def prepare_stage(self):
+        self._render_commands()
+        self.step_context["backup_log_name"] = self._render_parameter("backup_log_name")
+
+        return super().prepare_stage()
+
+    def run_stage(self, stat_entry, stage_context):
+        command = self.step_context["command"]
+        backup_log_name = self.step_context["backup_log_name"]
+
+        self.logger.info("Making backup of PostgreSQL database into stream")
+        self.logger.debug("going to execute: {}".format(command))
+        self.logger.debug(f"Saving log file from PG backup tool into {backup_log_name}")
+
+        with open(backup_log_name, "wb") as backup_log_file:
+            result = ThirdPartyCommandsExecutor.execute_stage(
+                command,
+                stdout=stage_context.output_stream,
+                stderr=backup_log_file,
+                cancel_event=self._get_cancel_event(),
+                priority=self._get_process_priority(),
+                logger=self.logger,
+                env=self._get_command_environment()
+            )
+
+        self.logger.info("return code: {}".format(result.returncode))
+        self._update_resource_usage_metrics(stat_entry, result.resource_usage)
+        result.check_returncode()
+
+    def _get_command_environment(self):
+        # password is passed to pg_dump only, environment of the process is shared by concurrent targets
+        return {**os.environ, "PGPASSWORD": self._render_parameter("db_password")}
+
+    def _render_commands(self):
+        backup_file_name = self._render_parameter("backup_file_name")
+        self.step_context["backup_file_name"] = backup_file_name
+
+        command = self._render_parameter("command_template")
+        self.step_context["command"] = command
+
+        dry_run_command = self._render_parameter("dry_run_command")
+        self.step_context["dry_run_command"] = dry_run_command
+
+        return command, dry_run_command
 
     @classmethod
     def step_name(cls):
@@ -1,14 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
 import os
 import re
 
 from .base import DryRunExecutionError, time_interval
-from .s3_steps_shared import StepS3FileBaseUploader, UploadTarget
-from .s3boto_client import S3BasicBotoClient
+from .s3_steps_shared import S3ContentIndex, StepS3FileBaseUploader, UploadTarget
 
 
 class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
+    DEFAULT_MAX_CONCURRENT_RULES = 4
+
     def __init__(self, **kwargs):
         self._first_uploads_key_name_per_files = {}
+        self._copy_transfer_config = None
         super().__init__(**kwargs)
 
     def vote_for_flow_execution_skipping(self):
@@ -18,7 +21,7 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
         self.logger.debug("bucket_name: '{}'".format(bucket_name))
 
         raw_client = self._crete_s3_client()
-        client = S3BasicBotoClient(self.logger, raw_client)
+        client = self._create_basic_client(raw_client)
 
         prefix_in_bucket = self._render_parameter("prefix_in_bucket")
         self.logger.debug("prefix_in_bucket: '{}'".format(prefix_in_bucket))
@@ -61,7 +64,7 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
         region = self.secret_context["region"]
 
         raw_client = self._crete_s3_client()
-        client = S3BasicBotoClient(self.logger, raw_client)
+        client = self._create_basic_client(raw_client)
 
         prefix_in_bucket = self._render_parameter("prefix_in_bucket")
         self.logger.debug("prefix_in_bucket: '{}'".format(prefix_in_bucket))
@@ -84,50 +87,106 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
             self.logger.info("creating bucker '{}'".format(bucket_name))
             client.create_bucket(bucket_name, region=region)
 
+        self._abort_stale_uploads(stat_entry, client, bucket_name, target_prefix_in_bucket)
+
         targets = self._get_real_source_file_names_for_targets(targets)
 
         self.logger.info("going to upload these files:\n\t{}".format(targets))
 
-        for rule in upload_rules:
-            self.logger.info("processing upload rule '{}'".format(rule["name"]))
-            self._upload_for_rule(
+        self._upload_for_rules(stat_entry, client, bucket_name, upload_rules, targets, additional_context)
+
+        self._finalize_transmission_metrics(stat_entry)
+
+        return super().run(dry_run)
+
+    def _upload_for_rules(
+        self,
+        stat_entry,
+        basic_client,
+        bucket_name,
+        upload_rules,
+        upload_targets,
+        additional_context=None
+    ):
+        pending_rules = list(upload_rules)
+
+        max_concurrent_rules = self.step_context.get(
+            "max_concurrent_rules",
+            StepS3MultipartUploadWithRotation.DEFAULT_MAX_CONCURRENT_RULES
+        )
+        max_concurrent_rules = max(int(max_concurrent_rules), 1)
+
+        # copies of concurrent rules share connections pool of the client, so they don't wait for free connections
+        copy_threads = max(self._get_max_pool_connections() // max_concurrent_rules, 1)
+        self._copy_transfer_config = basic_client.create_copy_transfer_config(copy_threads)
+
+        # rules are processed one by one until each file is uploaded, all other rules only copy objects
+        while pending_rules and not self._all_targets_uploaded(upload_targets):
+            self._upload_for_rule_with_latency(
                 stat_entry,
-                client,
+                basic_client,
                 bucket_name,
-                rule,
-                targets,
+                pending_rules.pop(0),
+                upload_targets,
                 additional_context
             )
 
-        uploaded_size_metric = self._get_metric_by_name(
-            stat_entry,
-            StepS3FileBaseUploader.METRIC_UPLOADED_SIZE
-        )
+        if not pending_rules:
+            return
 
-        upload_time_metric = self._get_metric_by_name(
-            stat_entry,
-            StepS3FileBaseUploader.METRIC_TRANSMISSION_TIME
+        self.logger.info(
+            "processing {} rules with {} threads, {} copy threads per rule".format(
+                len(pending_rules),
+                max_concurrent_rules,
+                copy_threads
+            )
         )
 
-        if uploaded_size_metric.value and upload_time_metric.value:
-            transmission_speed_metric = self._get_metric_by_name(
-                stat_entry,
-                StepS3FileBaseUploader.METRIC_TRANSMISSION_SPEED,
-                units_name="MiB/s"
-            )
+        with ThreadPoolExecutor(max_workers=max_concurrent_rules, thread_name_prefix="yabtool-rule") as executor:
+            futures = [
+                executor.submit(
+                    self._upload_for_rule_with_latency,
+                    stat_entry,
+                    basic_client,
+                    bucket_name,
+                    rule,
+                    upload_targets,
+                    additional_context
+                )
+                for rule in pending_rules
+            ]
 
-            if upload_time_metric.value:
-                transmission_speed_metric.value = round(uploaded_size_metric.value / upload_time_metric.value, 2)
-            else:
-                transmission_speed_metric.value = "N/A"
+        exceptions = [future.exception() for future in futures if future.exception() is not None]
+        if exceptions:
+            raise exceptions[0]
 
-        if uploaded_size_metric.value:
-            uploaded_size_metric.value = round(uploaded_size_metric.value, 2)
+    def _all_targets_uploaded(self, upload_targets):
+        return all(target.os_file_name in self._first_uploads_key_name_per_files for target in upload_targets)
 
-        if upload_time_metric.value:
-            upload_time_metric.value = round(upload_time_metric.value, 3)
+    def _upload_for_rule_with_latency(
+        self,
+        stat_entry,
+        basic_client,
+        bucket_name,
+        rule,
+        upload_targets,
+        additional_context=None
+    ):
+        self.logger.info("processing upload rule '{}'".format(rule["name"]))
 
-        return super().run(dry_run)
+        rule_start_timestamp = self._get_current_timestamp()
+        self._upload_for_rule(
+            stat_entry,
+            basic_client,
+            bucket_name,
+            rule,
+            upload_targets,
+            additional_context
+        )
+        rule_end_timestamp = self._get_current_timestamp()
+
+        metric = self._get_metric_by_name(stat_entry, "Rule Latency ({})".format(rule["name"]), units_name="seconds")
+        metric.value = round(time_interval(rule_start_timestamp, rule_end_timestamp), 3)
 
     def _get_upload_targets(self):
         raw_data = self.mixed_context["source_files"]
@@ -137,6 +196,8 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
             res_item = UploadTarget()
             res_item.source_file = raw_item["source_file"]
             res_item.add_dedup_tag = raw_item.get("add_dedup_tag", False)
+            res_item.from_stream = raw_item.get("from_stream", False)
+            res_item.content_hash_file = raw_item.get("content_hash_file")
 
             res.append(res_item)
 
@@ -206,7 +267,8 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
             bucket_name,
             destination_prefix,
             dedup_tag_name,
-            dedup_tag_value
+            dedup_tag_value,
+            update_index=True
         )
         self.logger.debug("tagged_key = '{}'".format(tagged_key))
 
@@ -220,12 +282,19 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
             destination_prefix
         )
 
-        for upload_target in upload_targets:
-            assert os.path.exists(upload_target.os_file_name)
-
-            dest_key_name = os.path.join(destination_prefix, os.path.basename(upload_target.os_file_name))
-            dest_key_name = str(dest_key_name).replace("\\", "/")
+        # files which are not uploaded yet are uploaded simultaneously, others are copied
+        self._upload_fresh_targets(
+            stat_entry,
+            basic_client,
+            bucket_name,
+            destination_prefix,
+            upload_targets,
+            additional_context["target_prefix_in_bucket"] if additional_context else destination_prefix
+        )
 
+        dedup_index_entries = {}
+        for upload_target in upload_targets:
+            dest_key_name = self._get_dest_key_name(destination_prefix, upload_target)
             self.logger.info("dest_key_name: '{}'".format(dest_key_name))
 
             first_upload_key_name = self._first_uploads_key_name_per_files.get(upload_target.os_file_name, None)
@@ -236,44 +305,8 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
                 )
             )
 
-            if not first_upload_key_name:
-                self.logger.info("no previous uploads available - FRESH UPLOAD")
-                self.logger.info("bucket_name: '{}', dest_key_name: '{}'".format(bucket_name, dest_key_name))
-
-                transmission_start_timestamp = self._get_current_timestamp()
-                basic_client.upload_file(
-                    bucket_name,
-                    dest_key_name,
-                    upload_target.os_file_name
-                )
-                transmission_end_timestamp = self._get_current_timestamp()
-
-                metric = self._get_metric_by_name(
-                    stat_entry,
-                    StepS3FileBaseUploader.METRIC_UPLOADED_OBJECTS_COUNT,
-                    initial_value=0,
-                    units_name="items"
-                )
-                metric.increment(1)
-
-                metric = self._get_metric_by_name(
-                    stat_entry,
-                    StepS3FileBaseUploader.METRIC_UPLOADED_SIZE,
-                    initial_value=0.0,
-                    units_name="MiB"
-                )
-                size_in_mibs = self._get_file_size_in_mibs(upload_target.os_file_name)
-                metric.increment(size_in_mibs)
-
-                metric = self._get_metric_by_name(
-                    stat_entry,
-                    StepS3FileBaseUploader.METRIC_TRANSMISSION_TIME,
-                    initial_value=0.0,
-                    units_name="seconds"
-                )
-                metric.increment(time_interval(transmission_start_timestamp, transmission_end_timestamp))
-
-                self._first_uploads_key_name_per_files[upload_target.os_file_name] = dest_key_name
+            if first_upload_key_name == dest_key_name:
+                self.logger.info("object already uploaded into '{}'".format(dest_key_name))
             else:
                 self.logger.info(
                     "previous upload available in key '{}' will COPY to key '{}'".format(
@@ -286,7 +319,9 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
                     bucket_name,
                     first_upload_key_name,
                     bucket_name,
-                    dest_key_name
+                    dest_key_name,
+                    transfer_config=self._copy_transfer_config,
+                    metadata=self._create_content_metadata(self._get_content_hash(upload_target))
                 )
 
                 metric = self._get_metric_by_name(
@@ -302,9 +337,109 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
 
             if upload_target.add_dedup_tag:
                 basic_client.set_object_tags(bucket_name, dest_key_name, marking_tags)
+                dedup_index_entries[dedup_tag_name] = {"value": dedup_tag_value, "key": dest_key_name}
+
+        dedup_index = self._get_dedup_index(basic_client, bucket_name)
+        if dedup_index_entries and dedup_index is not None:
+            dedup_index.save(destination_prefix, dedup_index_entries)
 
         self._remove_files_existing_for_rule(stat_entry, basic_client, bucket_name, existing_files_for_rule)
 
+    def _upload_fresh_targets(
+        self,
+        stat_entry,
+        basic_client,
+        bucket_name,
+        destination_prefix,
+        upload_targets,
+        target_prefix_in_bucket
+    ):
+        fresh_targets = [
+            item for item in upload_targets if item.os_file_name not in self._first_uploads_key_name_per_files
+        ]
+        if not fresh_targets:
+            return
+
+        content_index = self._get_content_index(basic_client, bucket_name)
+        content_index_entries = content_index.load(target_prefix_in_bucket) if content_index is not None else {}
+
+        upload_requests = []
+        content_hashes = dict()
+        for upload_target in fresh_targets:
+            assert os.path.exists(upload_target.os_file_name)
+
+            dest_key_name = self._get_dest_key_name(destination_prefix, upload_target)
+            content_hash = self._get_content_hash(upload_target)
+
+            # unchanged content is copied from the object uploaded previously
+            if content_hash and content_index is not None:
+                existing_key = content_index.find_key(content_index_entries, content_hash)
+                if existing_key:
+                    self.logger.info(
+                        "content of '{}' is unchanged, COPY from '{}' to '{}'".format(
+                            upload_target.os_file_name,
+                            existing_key,
+                            dest_key_name
+                        )
+                    )
+                    basic_client.copy_file_from_one_bucket_to_another(
+                        bucket_name,
+                        existing_key,
+                        bucket_name,
+                        dest_key_name,
+                        metadata=self._create_content_metadata(content_hash)
+                    )
+                    self._update_skipped_upload_metrics(stat_entry, upload_target.os_file_name)
+                    self._first_uploads_key_name_per_files[upload_target.os_file_name] = dest_key_name
+
+                    # copy receives content hash in metadata and lives longer than the object it's copied from
+                    content_hashes[upload_target.os_file_name] = content_hash
+                    S3ContentIndex.add_entry(
+                        content_index_entries,
+                        content_hash,
+                        dest_key_name,
+                        os.path.getsize(upload_target.os_file_name)
+                    )
+                    continue
+
+            self.logger.info("no previous uploads available - FRESH UPLOAD")
+            self.logger.info("bucket_name: '{}', dest_key_name: '{}'".format(bucket_name, dest_key_name))
+
+            metadata = self._create_content_metadata(content_hash)
+            content_hashes[upload_target.os_file_name] = content_hash
+            upload_requests.append(
+                self._create_upload_request(
+                    stat_entry,
+                    bucket_name,
+                    dest_key_name,
+                    upload_target.os_file_name,
+                    metadata=metadata
+                )
+            )
+
+        if upload_requests:
+            self._upload_files(stat_entry, basic_client, upload_requests)
+
+        for upload_request in upload_requests:
+            self._first_uploads_key_name_per_files[upload_request.file_name] = upload_request.key
+
+            content_hash = content_hashes.get(upload_request.file_name)
+            if content_hash and content_index is not None:
+                S3ContentIndex.add_entry(
+                    content_index_entries,
+                    content_hash,
+                    upload_request.key,
+                    os.path.getsize(upload_request.file_name)
+                )
+
+        if content_index is not None and any(content_hashes.values()):
+            content_index.save(target_prefix_in_bucket, content_index_entries)
+
+    @staticmethod
+    def _get_dest_key_name(destination_prefix, upload_target):
+        dest_key_name = os.path.join(destination_prefix, os.path.basename(upload_target.os_file_name))
+        return str(dest_key_name).replace("\\", "/")
+
     def _load_already_existing_files_for_rule(self, basic_client, bucket_name, destination_prefix):
         self.logger.debug("checking for files that already exists in bucket")
         existing_files_for_rule = basic_client.list_files_in_folder(bucket_name, destination_prefix)
@@ -316,17 +451,33 @@ class StepS3MultipartUploadWithRotation(StepS3FileBaseUploader):
         existing_files_base_names = [os.path.basename(item) for item in existing_files_for_rule]
         self.logger.info("some files already exists in folder for rule: {}".format(existing_files_base_names))
 
-        for existing_file in existing_files_for_rule:
-            self.logger.info("removing item '{}'".format(existing_file))
-            basic_client.delete_object(bucket_name, existing_file)
+        if not existing_files_for_rule:
+            return
 
-            metric = self._get_metric_by_name(
-                stat_entry,
-                StepS3FileBaseUploader.METRIC_DELETED_OBJECTS_COUNT,
-                initial_value=0,
-                units_name="items"
-            )
-            metric.increment(1)
+        self.logger.info("removing items: {}".format(existing_files_for_rule))
+        deleted_keys, errors = basic_client.delete_objects(bucket_name, existing_files_for_rule)
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_DELETED_OBJECTS_COUNT,
+            initial_value=0,
+            units_name="items"
+        )
+        metric.increment(len(deleted_keys))
+
+        if not errors:
+            return
+
+        for error in errors:
+            self.logger.warning("can't remove item '{}': {} ({})".format(error.key, error.message, error.code))
+
+        metric = self._get_metric_by_name(
+            stat_entry,
+            StepS3FileBaseUploader.METRIC_FAILED_DELETES_COUNT,
+            initial_value=0,
+            units_name="items"
+        )
+        metric.increment(len(errors))
 
     @classmethod
     def step_name(cls):
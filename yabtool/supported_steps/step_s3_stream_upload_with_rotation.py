@@ -0,0 +1,109 @@
+import os
+
+from .base import BaseFlowStep, StreamingExecutionError, time_interval
+from .step_s3_multipart_upload_with_rotation import StepS3MultipartUploadWithRotation
+from .streaming import drain_stream
+
+
+class StepS3StreamUploadWithRotation(StepS3MultipartUploadWithRotation):
+    """Consumer stage of streaming pipeline which uploads stream into S3 and performs rotation.
+
+    Stream is uploaded into destination of the first rule that is not satisfied yet, all other
+    rules receive server side copies, exactly like for files uploaded by parent step.
+    """
+
+    @classmethod
+    def supports_streaming(cls):
+        return True
+
+    def run(self, stat_entry, dry_run=False):
+        if not dry_run:
+            raise StreamingExecutionError(
+                "step '{}' can be executed only as stage of streaming pipeline".format(self.step_name())
+            )
+
+        return super().run(stat_entry, dry_run=dry_run)
+
+    def prepare_stage(self):
+        self.step_context["prefix_in_bucket"] = self._render_parameter("prefix_in_bucket")
+        return super().prepare_stage()
+
+    def run_stage(self, stat_entry, stage_context):
+        bucket_name = self.secret_context["bucket_name"]
+        region = self.secret_context["region"]
+
+        raw_client = self._crete_s3_client()
+        client = self._create_basic_client(raw_client)
+
+        target_prefix_in_bucket = self._render_parameter("target_prefix_in_bucket")
+        self.logger.debug("target_prefix_in_bucket: '{}'".format(target_prefix_in_bucket))
+
+        additional_context = {"target_prefix_in_bucket": target_prefix_in_bucket}
+        upload_rules = self.mixed_context["upload_rules"]
+
+        # files produced by other stages will exist only when stream is finished
+        targets = self._get_upload_targets()
+        stream_targets = [target for target in targets if target.from_stream]
+        if len(stream_targets) != 1:
+            raise StreamingExecutionError("exactly one source file should be marked with 'from_stream' flag")
+
+        stream_file_name = self._render_result(stream_targets[0].source_file)
+
+        if not client.is_bucket_exists(bucket_name):
+            self.logger.info("creating bucker '{}'".format(bucket_name))
+            client.create_bucket(bucket_name, region=region)
+
+        self._abort_stale_uploads(stat_entry, client, bucket_name, target_prefix_in_bucket)
+
+        destination_prefix = self._get_destination_prefix_for_stream(client, bucket_name, upload_rules,
+                                                                     additional_context)
+        if destination_prefix is None:
+            self.logger.info("all upload rules already satisfied, stream will be skipped")
+            drain_stream(stage_context.input_stream)
+            return
+
+        dest_key_name = os.path.join(destination_prefix, os.path.basename(stream_file_name))
+        dest_key_name = str(dest_key_name).replace("\\", "/")
+        self.logger.info("uploading stream into bucket_name: '{}', dest_key_name: '{}'".format(
+            bucket_name,
+            dest_key_name
+        ))
+
+        stream_part_size = self.step_context.get("stream_part_size_mib")
+        stream_part_size = int(stream_part_size * BaseFlowStep.BYTES_IN_MEGABYTE) if stream_part_size else None
+
+        progress_reporter = self._create_progress_reporter(stat_entry, stream_file_name, from_stream=True)
+        transmission_start_timestamp = self._get_current_timestamp()
+        upload_result = client.upload_stream(
+            bucket_name,
+            dest_key_name,
+            stage_context.input_stream,
+            part_size=stream_part_size,
+            can_complete=stage_context.wait_for_upstream_success,
+            progress_reporter=progress_reporter
+        )
+        transmission_end_timestamp = self._get_current_timestamp()
+
+        self._update_upload_settings_metrics(stat_entry, upload_result)
+        self._update_progress_metrics(stat_entry, progress_reporter)
+        self._update_transmission_metrics(
+            stat_entry,
+            upload_result.uploaded_bytes / BaseFlowStep.BYTES_IN_MEGABYTE,
+            time_interval(transmission_start_timestamp, transmission_end_timestamp)
+        )
+        self._first_uploads_key_name_per_files[stream_file_name] = dest_key_name
+
+        targets = self._get_real_source_file_names_for_targets(targets)
+        self._upload_for_rules(stat_entry, client, bucket_name, upload_rules, targets, additional_context)
+        self._finalize_transmission_metrics(stat_entry)
+
+    def _get_destination_prefix_for_stream(self, basic_client, bucket_name, upload_rules, additional_context):
+        for rule in upload_rules:
+            if not self._can_skip_execution_for_rule(basic_client, bucket_name, rule, additional_context):
+                return self._render_result(rule["destination_prefix"], additional_context)
+
+        return None
+
+    @classmethod
+    def step_name(cls):
+        return "s3_stream_upload_with_rotation"
@@ -2,9 +2,8 @@ import argparse
 import os
 import re
 
-from .base import DryRunExecutionError, time_interval
+from .base import DryRunExecutionError
 from .s3_steps_shared import StepS3FileBaseUploader, UploadTarget
-from .s3boto_client import S3BasicBotoClient
 
 
 class StepS3StrictUploader(StepS3FileBaseUploader):
@@ -31,7 +30,7 @@ class StepS3StrictUploader(StepS3FileBaseUploader):
         region = self.secret_context["region"]
 
         raw_client = self._crete_s3_client()
-        client = S3BasicBotoClient(self.logger, raw_client)
+        client = self._create_basic_client(raw_client)
 
         prefix_in_bucket = self._render_parameter("prefix_in_bucket")
         self.logger.debug("prefix_in_bucket: '{}'".format(prefix_in_bucket))
@@ -55,46 +54,20 @@ class StepS3StrictUploader(StepS3FileBaseUploader):
             self.logger.info("creating bucker '{}'".format(bucket_name))
             client.create_bucket(bucket_name, region=region)
 
+        # each execution uploads into new prefix, so stale uploads are looked up in the whole prefix
+        self._abort_stale_uploads(stat_entry, client, bucket_name, prefix_in_bucket)
+
         uploads = self._get_real_source_file_names_for_targets(uploads)
         self.logger.info("going to upload these files:\n\t{}".format(uploads))
 
-        for upload_target in uploads:
-            self.logger.info("processing upload rule '{}'".format(upload_target))
-            self._upload_file(
-                stat_entry,
-                client,
-                bucket_name,
-                target_prefix_in_bucket,
-                upload_target
-            )
-
-        uploaded_size_metric = self._get_metric_by_name(
-            stat_entry,
-            StepS3FileBaseUploader.METRIC_UPLOADED_SIZE
-        )
-
-        upload_time_metric = self._get_metric_by_name(
-            stat_entry,
-            StepS3FileBaseUploader.METRIC_TRANSMISSION_TIME
-        )
-
-        if uploaded_size_metric.value and upload_time_metric.value:
-            transmission_speed_metric = self._get_metric_by_name(
-                stat_entry,
-                StepS3FileBaseUploader.METRIC_TRANSMISSION_SPEED,
-                units_name="MiB/s"
-            )
-
-            if upload_time_metric.value:
-                transmission_speed_metric.value = round(uploaded_size_metric.value / upload_time_metric.value, 2)
-            else:
-                transmission_speed_metric.value = "N/A"
-
-        if uploaded_size_metric.value:
-            uploaded_size_metric.value = round(uploaded_size_metric.value, 2)
+        # files are uploaded simultaneously, count of files in flight is limited by "max_concurrent_files"
+        upload_requests = [
+            self._create_strict_upload_request(stat_entry, bucket_name, target_prefix_in_bucket, upload_target)
+            for upload_target in uploads
+        ]
+        self._upload_files(stat_entry, client, upload_requests)
 
-        if upload_time_metric.value:
-            upload_time_metric.value = round(upload_time_metric.value, 3)
+        self._finalize_transmission_metrics(stat_entry)
 
         return super().run(dry_run)
 
@@ -109,53 +82,15 @@ class StepS3StrictUploader(StepS3FileBaseUploader):
 
         return res
 
-    def _upload_file(
-        self,
-        stat_entry,
-        basic_client,
-        bucket_name,
-        target_prefix_in_bucket,
-        upload_target
-    ):
+    def _create_strict_upload_request(self, stat_entry, bucket_name, target_prefix_in_bucket, upload_target):
         assert os.path.exists(upload_target.os_file_name)
+        self.logger.info("processing upload rule '{}'".format(upload_target))
 
         dest_key_name = os.path.join(target_prefix_in_bucket, os.path.basename(upload_target.os_file_name))
         dest_key_name = str(dest_key_name).replace("\\", "/")
 
         self.logger.info("bucket_name: '{}', dest_key_name: '{}'".format(bucket_name, dest_key_name))
-
-        transmission_start_timestamp = self._get_current_timestamp()
-        basic_client.upload_file(
-            bucket_name,
-            dest_key_name,
-            upload_target.os_file_name
-        )
-        transmission_end_timestamp = self._get_current_timestamp()
-
-        metric = self._get_metric_by_name(
-            stat_entry,
-            StepS3FileBaseUploader.METRIC_UPLOADED_OBJECTS_COUNT,
-            initial_value=0,
-            units_name="items"
-        )
-        metric.increment(1)
-
-        metric = self._get_metric_by_name(
-            stat_entry,
-            StepS3FileBaseUploader.METRIC_UPLOADED_SIZE,
-            initial_value=0.0,
-            units_name="MiB"
-        )
-        size_in_mibs = self._get_file_size_in_mibs(upload_target.os_file_name)
-        metric.increment(size_in_mibs)
-
-        metric = self._get_metric_by_name(
-            stat_entry,
-            StepS3FileBaseUploader.METRIC_TRANSMISSION_TIME,
-            initial_value=0.0,
-            units_name="seconds"
-        )
-        metric.increment(time_interval(transmission_start_timestamp, transmission_end_timestamp))
+        return self._create_upload_request(stat_entry, bucket_name, dest_key_name, upload_target.os_file_name)
 
     def _get_upload_suffix(self):
         unknown_args = self.rendering_context.unknown_args
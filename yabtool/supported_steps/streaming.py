@@ -0,0 +1,153 @@
+import datetime
+import os
+import threading
+
+from .base import StreamingExecutionError
+
+
+def read_exactly(input_stream, size):
+    """Reads up to `size` bytes from stream, returns less only when end of stream reached.
+
+    >>> import io
+    >>> read_exactly(io.BytesIO(b"abcdef"), 4)
+    b'abcd'
+    >>> read_exactly(io.BytesIO(b"ab"), 4)
+    b'ab'
+    """
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = input_stream.read(remaining)
+        if not chunk:
+            break
+
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def drain_stream(input_stream, block_size=1024 * 1024):
+    drained_bytes = 0
+
+    while True:
+        chunk = input_stream.read(block_size)
+        if not chunk:
+            break
+
+        drained_bytes += len(chunk)
+
+    return drained_bytes
+
+
+class StreamingStageContext(object):
+    def __init__(self, pipeline, index, input_stream, output_stream):
+        self._pipeline = pipeline
+        self._index = index
+        self.input_stream = input_stream
+        self.output_stream = output_stream
+
+    def wait_for_upstream_success(self):
+        """Blocks until all upstream stages are finished. Returns True when all of them succeeded.
+
+        Consumers should call it before committing data, because end of stream also happens
+        when producer fails in the middle of output generation.
+        """
+        return self._pipeline.wait_for_stages(self._index)
+
+
+class StreamingStage(object):
+    def __init__(self, step_object, stat_entry):
+        self.step_object = step_object
+        self.stat_entry = stat_entry
+        self.exception = None
+        self.failure_timestamp = None
+        self.finished = threading.Event()
+
+
+class StreamingPipeline(object):
+    """Executes steps as producer/filter/consumer stages connected with OS pipes.
+
+    First stage produces data, last stage consumes it and all stages in between
+    read data from previous stage and write data for next one.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self._stages = []
+
+    def add_stage(self, step_object, stat_entry):
+        if not step_object.supports_streaming():
+            raise StreamingExecutionError("step '{}' does not support streaming".format(step_object.step_name()))
+
+        self._stages.append(StreamingStage(step_object, stat_entry))
+
+    @property
+    def stages(self):
+        return list(self._stages)
+
+    def run(self):
+        if len(self._stages) < 2:
+            raise StreamingExecutionError("streaming pipeline requires at least producer and consumer stages")
+
+        stages_count = len(self._stages)
+        pipes = [os.pipe() for _ in range(stages_count - 1)]
+
+        input_streams = [None] + [os.fdopen(read_fd, "rb") for read_fd, _ in pipes]
+        output_streams = [os.fdopen(write_fd, "wb") for _, write_fd in pipes] + [None]
+
+        threads = []
+        for index, stage in enumerate(self._stages):
+            stage_context = StreamingStageContext(self, index, input_streams[index], output_streams[index])
+            thread = threading.Thread(
+                target=self._run_stage,
+                args=(stage, stage_context),
+                name="yabtool-stage-{}".format(stage.step_object.step_name()),
+                daemon=True
+            )
+            threads.append(thread)
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        failed_stages = [stage for stage in self._stages if stage.exception is not None]
+        if failed_stages:
+            first_failed_stage = min(failed_stages, key=lambda item: item.failure_timestamp)
+            raise first_failed_stage.exception
+
+    def wait_for_stages(self, stage_index):
+        for stage in self._stages[:stage_index]:
+            stage.finished.wait()
+
+        return all(stage.exception is None for stage in self._stages[:stage_index])
+
+    def _run_stage(self, stage, stage_context):
+        step_name = stage.step_object.step_name()
+        stage.stat_entry.execution_start_timestamp = datetime.datetime.utcnow()
+
+        try:
+            self.logger.info("streaming stage '{}' started".format(step_name))
+            stage.step_object.run_stage(stage.stat_entry, stage_context)
+            self.logger.info("streaming stage '{}' finished".format(step_name))
+        except BaseException as e:
+            stage.failure_timestamp = datetime.datetime.utcnow()
+            stage.exception = e
+            self.logger.error("streaming stage '{}' failed: {}".format(step_name, e))
+        finally:
+            self._close_stream(stage_context.input_stream)
+            self._close_stream(stage_context.output_stream)
+
+            stage.stat_entry.execution_end_timestamp = datetime.datetime.utcnow()
+            stage.finished.set()
+
+    def _close_stream(self, stream):
+        if stream is None:
+            return
+
+        try:
+            stream.close()
+        except (OSError, ValueError) as e:
+            self.logger.debug("error closing stream: {}".format(e))
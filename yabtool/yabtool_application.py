@@ -1,7 +1,9 @@
 import argparse
+import datetime
 import os
 import shutil
 import sys
+import threading
 
 import loguru
 from loguru._defaults import LOGURU_FORMAT
@@ -9,6 +11,7 @@ from yabtool.supported_notifications.email_notifications import EmailRenderer, E
 from yabtool.version import __version__
 
 
+from .yabtool_batch import BatchTargetsExecutor, get_batch_targets, produce_batch_report, TargetExecutionResult
 from .yabtool_flow_orchestrator import YabtoolFlowOrchestrator
 
 
@@ -97,6 +100,29 @@ def get_cli_args(args=None):
         help="Add session log file"
     )
 
+    parser.add_argument(
+        "--all-targets",
+        "-a",
+        action="store_true",
+        default=False,
+        help="Execute flows for all targets from secrets file in one process"
+    )
+
+    parser.add_argument(
+        "--targets",
+        "-g",
+        action="store",
+        help="Comma separated list of targets from secrets file to execute in one process"
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-w",
+        action="store",
+        type=int,
+        help="Count of targets executed simultaneously in batch mode"
+    )
+
     return parser.parse_known_args(args=args)
 
 
@@ -104,22 +130,92 @@ class YabtoolApplication(object):
     def __init__(self):
         self.logger = None
         self.rendering_context = None
-        self._session_log_path = None
+        self._main_log_added = False
+        self._logs_lock = threading.Lock()
 
     def run(self, args=None):
+        """Executes flow of target or batch of targets, returns False when any of targets failed."""
         args, unknown_args = get_cli_args(args=args)
         self._initialize_logger(args)
         self.logger.debug(f"Unknown command line arguments: {unknown_args}")
 
-        flow_orchestrator = YabtoolFlowOrchestrator(self.logger)
+        if args.all_targets or args.targets:
+            results = self._run_batch(args, unknown_args)
+        else:
+            results = [self._run_target(args, unknown_args)]
+
+        failed_targets = [str(item.target_name) for item in results if not item.succeeded]
+        if failed_targets:
+            self.logger.error("failed targets: {}".format(", ".join(failed_targets)))
+            return False
+
+        return True
+
+    def _run_batch(self, args, unknown_args):
+        loaded_configuration = YabtoolFlowOrchestrator(self.logger).load_configuration(args)
+        secrets_context = loaded_configuration.secrets_context
+
+        targets_names = None
+        if args.targets:
+            targets_names = [item.strip() for item in str(args.targets).split(",") if item.strip()]
+
+        try:
+            targets = get_batch_targets(secrets_context["targets"], targets_names, args.flow)
+        except ValueError as e:
+            self.logger.error("batch can't be started: {}".format(e))
+            raise
+
+        parameters = {
+            **loaded_configuration.config_context.get("parameters", {}),
+            **secrets_context.get("parameters", {})
+        }
+        max_workers = args.workers if args.workers else int(parameters.get("batch_max_workers", 1))
+        max_concurrent_flows = parameters.get("batch_max_concurrent_flows", {})
+
+        self.logger.info(
+            "executing {} targets with {} workers, concurrent flows limits: {}".format(
+                len(targets),
+                max_workers,
+                max_concurrent_flows
+            )
+        )
+
+        executor = BatchTargetsExecutor(self.logger, max_workers, max_concurrent_flows)
+        results = executor.execute(
+            targets,
+            lambda target_name: self._run_target(
+                args,
+                unknown_args,
+                target_name=target_name,
+                loaded_configuration=loaded_configuration
+            )
+        )
+
+        self.logger.info("Batch execution statistics:\n{}".format(produce_batch_report(results)))
+        return results
+
+    def _run_target(self, args, unknown_args, target_name=None, loaded_configuration=None):
+        result = TargetExecutionResult(target_name)
+        result.execution_start_timestamp = datetime.datetime.utcnow()
+
+        logger = self.logger.bind(target=target_name) if target_name else self.logger
+        flow_orchestrator = YabtoolFlowOrchestrator(logger)
 
         if args.disable_voting:
             flow_orchestrator.skip_voting_enabled = False
 
         only_dry_run = None
         folder_name = None
+        session_log = (None, None)
         try:
-            flow_orchestrator.initialize(args, unknown_args)
+            flow_orchestrator.initialize(
+                args,
+                unknown_args,
+                target_name=target_name,
+                loaded_configuration=loaded_configuration
+            )
+            result.target_name = flow_orchestrator.target_name
+            result.flow_name = flow_orchestrator.flow_name
 
             folder_name = flow_orchestrator.rendering_context.temporary_folder
             root_temporary_folder = flow_orchestrator.rendering_context.root_temporary_folder
@@ -131,36 +227,66 @@ class YabtoolApplication(object):
 
             if args.add_session_log:
                 session_logs_folder = os.path.join(root_temporary_folder, "logs", "session")
-                self._add_session_log(session_logs_folder, flow_orchestrator.backup_start_timestamp, args)
+                session_log = self._add_session_log(
+                    session_logs_folder,
+                    flow_orchestrator.backup_start_timestamp,
+                    args,
+                    target_name=target_name
+                )
 
             flow_orchestrator.dry_run()
-            self.logger.info("dry run for flow '{}' performed".format(flow_name))
+            logger.info("dry run for flow '{}' performed".format(flow_name))
 
             only_dry_run = True
             if not args.dry_run:
-                self.logger.info("flow '{}' started".format(flow_name))
+                logger.info("flow '{}' started".format(flow_name))
                 flow_orchestrator.run()
                 only_dry_run = False
 
             flow_orchestrator.print_stat()
-            self._send_notifications(flow_orchestrator, only_dry_run=only_dry_run)
+            self._send_notifications(flow_orchestrator, only_dry_run=only_dry_run, session_log_path=session_log[0])
+            result.succeeded = True
 
         except BaseException as e:
-            self.logger.exception("Error performing flow. Exception: {}".format(e))
-            self._send_notifications(flow_orchestrator, succeeded=False, exception=e, only_dry_run=only_dry_run)
+            logger.exception("Error performing flow. Exception: {}".format(e))
+            result.exception = e
+            self._send_notifications(
+                flow_orchestrator,
+                succeeded=False,
+                exception=e,
+                only_dry_run=only_dry_run,
+                session_log_path=session_log[0]
+            )
 
         finally:
             if flow_orchestrator.rendering_context.remove_temporary_folder and folder_name:
                 if folder_name and os.path.exists(folder_name) and os.path.isdir(folder_name):
-                    self.logger.info("going to remove temporary folder: {}".format(folder_name))
+                    logger.info("going to remove temporary folder: {}".format(folder_name))
                     self._remove_temporary_folder(folder_name)
 
             else:
-                self.logger.info("output folder removal disabled. folder name: '{}'".format(folder_name))
-
-        return True
+                logger.info("output folder removal disabled. folder name: '{}'".format(folder_name))
+
+            if session_log[1] is not None:
+                self.logger.remove(session_log[1])
+
+        result.only_dry_run = only_dry_run
+        result.execution_end_timestamp = datetime.datetime.utcnow()
+
+        return result
+
+    def _send_notifications(
+        self,
+        flow_orchestrator,
+        succeeded=True,
+        exception=None,
+        only_dry_run=False,
+        session_log_path=None
+    ):
+        if flow_orchestrator.target_name is None:
+            self.logger.info("target is unknown, notifications can't be sent")
+            return
 
-    def _send_notifications(self, flow_orchestrator, succeeded=True, exception=None, only_dry_run=False):
         enabled_notifications = self._get_enabled_notifications(flow_orchestrator)
         if not enabled_notifications:
             self.logger.info("no enabled notifications")
@@ -178,8 +304,8 @@ class YabtoolApplication(object):
                 email_notifier.only_dry_run = only_dry_run
 
                 rendered_data = email_notifier.render()
-                if self._session_log_path:
-                    rendered_data.attachments.append(self._session_log_path)
+                if session_log_path:
+                    rendered_data.attachments.append(session_log_path)
 
                 sender = EmailSender(self.logger, notification_data)
                 sender.send(rendered_data)
@@ -216,20 +342,34 @@ class YabtoolApplication(object):
         self.logger.add(sys.stdout, format=LOGURU_FORMAT, level=args.log_level)
 
     def _add_main_log(self, logs_folder, args):
-        if not os.path.exists(logs_folder):
-            os.makedirs(logs_folder)
+        with self._logs_lock:
+            if self._main_log_added:
+                return
+
+            os.makedirs(logs_folder, exist_ok=True)
 
-        path = os.path.join(logs_folder, "main_log.log")
-        self.logger.add(path, rotation="10 Mb", retention="60 days", compression="zip", level=args.log_level)
+            path = os.path.join(logs_folder, "main_log.log")
+            self.logger.add(path, rotation="10 Mb", retention="60 days", compression="zip", level=args.log_level)
+            self._main_log_added = True
 
-    def _add_session_log(self, logs_folder, timestamp_begin, args):
-        if not os.path.exists(logs_folder):
-            os.makedirs(logs_folder)
+    def _add_session_log(self, logs_folder, timestamp_begin, args, target_name=None):
+        with self._logs_lock:
+            os.makedirs(logs_folder, exist_ok=True)
 
         session_log_suffix = timestamp_begin.strftime("%Y-%m-%dT%H%M%S")
-        path = os.path.join(logs_folder, "session_{}.log".format(session_log_suffix))
-        self._session_log_path = path
-        self.logger.add(path, level=args.log_level)
+        if not target_name:
+            path = os.path.join(logs_folder, "session_{}.log".format(session_log_suffix))
+            return path, self.logger.add(path, level=args.log_level)
+
+        # in batch mode session log receives only records of its own target
+        path = os.path.join(logs_folder, "session_{}_{}.log".format(target_name, session_log_suffix))
+        handler_id = self.logger.add(
+            path,
+            level=args.log_level,
+            filter=lambda record: record["extra"].get("target") == target_name
+        )
+
+        return path, handler_id
 
     def _remove_temporary_folder(self, folder_name):
         try:
@@ -0,0 +1,136 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import terminaltables
+from yabtool.shared.base import AttrsToStringMixin
+
+from .supported_steps.base import pretty_time_delta, time_interval
+
+
+class TargetExecutionResult(AttrsToStringMixin):
+    def __init__(self, target_name):
+        self.target_name = target_name
+        self.flow_name = None
+        self.succeeded = False
+        self.only_dry_run = None
+        self.execution_start_timestamp = None
+        self.execution_end_timestamp = None
+        self.exception = None
+
+
+def get_batch_targets(targets_context, targets_names=None, flow_name=None):
+    """Returns list of (target_name, flow_name) for targets from secrets, all targets by default.
+
+    Names are validated before any flow is started, so typo in --targets doesn't abort batch in the middle.
+
+    >>> get_batch_targets({"db1": {"flow_type": "fb"}, "db2": {"flow_type": "pg"}}, ["db2"])
+    [('db2', 'pg')]
+    """
+    if targets_names is None:
+        targets_names = list(targets_context.keys())
+
+    unknown_names = [name for name in targets_names if name not in targets_context]
+    if unknown_names:
+        raise ValueError("unknown targets: {}, targets of secrets file: {}".format(
+            ", ".join(unknown_names),
+            ", ".join(targets_context.keys())
+        ))
+
+    if not flow_name:
+        names_without_flow = [name for name in targets_names if not targets_context[name].get("flow_type")]
+        if names_without_flow:
+            raise ValueError("'flow_type' is not specified for targets: {}".format(", ".join(names_without_flow)))
+
+    return [(name, flow_name if flow_name else targets_context[name]["flow_type"]) for name in targets_names]
+
+
+class BatchTargetsExecutor(object):
+    """Executes flows for many targets on bounded thread pool.
+
+    Besides total count of workers, count of simultaneously executed flows may be limited
+    per flow type, so CPU heavy flows don't oversubscribe host.
+    """
+
+    def __init__(self, logger, max_workers, max_concurrent_flows=None):
+        assert max_workers >= 1
+        self.logger = logger
+        self.max_workers = max_workers
+        self.max_concurrent_flows = max_concurrent_flows if max_concurrent_flows else dict()
+
+    def execute(self, targets, run_target):
+        """Executes `run_target(target_name)` for each item of `targets` (list of (target_name, flow_name)).
+
+        Returns list of values returned by `run_target` in order of `targets`.
+        """
+        pending_targets = list(enumerate(targets))
+        running_flows = dict()
+        running_futures = dict()
+        res = [None] * len(targets)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="yabtool-target") as executor:
+            while pending_targets or running_futures:
+                for pending_item in list(pending_targets):
+                    if len(running_futures) >= self.max_workers:
+                        break
+
+                    index, (target_name, flow_name) = pending_item
+                    if not self._can_start_flow(flow_name, running_flows):
+                        continue
+
+                    pending_targets.remove(pending_item)
+                    running_flows[flow_name] = running_flows.get(flow_name, 0) + 1
+
+                    self.logger.info("starting flow '{}' for target '{}'".format(flow_name, target_name))
+                    future = executor.submit(run_target, target_name)
+                    running_futures[future] = (index, flow_name)
+
+                done_futures, _ = wait(list(running_futures.keys()), return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    index, flow_name = running_futures.pop(future)
+                    running_flows[flow_name] -= 1
+                    res[index] = future.result()
+
+        return res
+
+    def _can_start_flow(self, flow_name, running_flows):
+        limit = self.max_concurrent_flows.get(flow_name)
+        if not limit:
+            return True
+
+        return running_flows.get(flow_name, 0) < int(limit)
+
+
+def produce_batch_report(results):
+    header = ["Target", "Flow", "Status", "Execution start timestamp", "Time elapsed", "Error"]
+    data = [header]
+
+    print_format = "%Y-%m-%d %H:%M:%S"
+    for result in results:
+        if not result.succeeded:
+            status = "failed"
+        elif result.only_dry_run:
+            status = "dry run"
+        else:
+            status = "succeeded"
+
+        time_elapsed = ""
+        if result.execution_start_timestamp and result.execution_end_timestamp:
+            time_elapsed = pretty_time_delta(
+                time_interval(result.execution_start_timestamp, result.execution_end_timestamp)
+            )
+
+        data.append(
+            [
+                result.target_name,
+                result.flow_name if result.flow_name else "",
+                status,
+                result.execution_start_timestamp.strftime(print_format) if result.execution_start_timestamp else "",
+                time_elapsed,
+                str(result.exception) if result.exception is not None else ""
+            ]
+        )
+
+    succeeded_count = len([result for result in results if result.succeeded])
+    data.append(["Total", "", "{} of {} succeeded".format(succeeded_count, len(results)), "", "", ""])
+
+    table = terminaltables.AsciiTable(data)
+    return table.table
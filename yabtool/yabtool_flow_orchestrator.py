@@ -1,16 +1,28 @@
 import codecs
+from collections import ChainMap
 import copy
 import datetime
 import os
+import threading
 import uuid
 
 import terminaltables
+from yabtool.shared.base import AttrsToStringMixin
+from yabtool.shared.boto_clients_registry import get_boto_clients_registry
 from yabtool.shared.jinja2_helpers import create_rendering_environment
+from yabtool.shared.transfer_progress import BYTES_IN_MEGABYTE
 from yaml import safe_load
 
 from .supported_steps import create_steps_factory
 from .supported_steps.base import pretty_time_delta, time_interval
-from .yabtool_stat import StepExecutionStatisticEntry
+from .supported_steps.streaming import StreamingPipeline
+from .yabtool_stat import (
+    calculate_critical_path,
+    calculate_wall_clock_time,
+    StepExecutionStatisticEntry,
+    summarize_progress_samples
+)
+from .yabtool_steps_scheduler import DagStepsExecutor, get_unique_steps_ids, StepsDependenciesResolver
 
 DEFAULT_CONFIG_RELATIVE_NAME = "./config/config.yaml"
 
@@ -19,6 +31,65 @@ class ConfigurationValidationException(BaseException):
     pass
 
 
+def get_date_rendering_values(timestamp):
+    """Returns rendering values which depend on backup date, they define prefixes of rotation rules.
+
+    >>> values = get_date_rendering_values(datetime.datetime(2020, 1, 15, 10, 30))
+    >>> values["week_day_short_name"], values["week_number"], values["current_date"]
+    ('Wed', '02', '2020-01-15')
+    """
+    res = dict()
+
+    res["week_day_short_name"] = timestamp.strftime("%a")
+    res["week_number"] = timestamp.strftime("%U")
+    res["month_short_name"] = timestamp.strftime("%b")
+    res["month_two_digit_number"] = timestamp.strftime("%m")
+    res["backup_start_timestamp"] = timestamp
+
+    res["current_year"] = timestamp.strftime("%Y")
+    res["current_month"] = res["month_two_digit_number"]
+    res["current_day_of_month"] = timestamp.strftime("%d")
+
+    res["current_date"] = timestamp.strftime("%Y-%m-%d")
+    res["current_time"] = timestamp.strftime("%H%M%S")
+
+    res["lower"] = str.lower
+    res["upper"] = str.upper
+
+    return res
+
+
+class FlowResources(object):
+    """Resources shared by steps of flow (e.g. transfer threads), they are closed at the end of flow."""
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self._resources = dict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, factory):
+        """Returns resource for `key`, resource is created by `factory` on first request."""
+        with self._lock:
+            res = self._resources.get(key)
+            if res is None:
+                res = factory()
+                self._resources[key] = res
+
+        return res
+
+    def close(self):
+        with self._lock:
+            resources = list(self._resources.values())
+            self._resources = dict()
+
+        for resource in reversed(resources):
+            try:
+                resource.close()
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.warning("can't close flow resource: {}".format(e))
+
+
 class RenderingContext(object):
     def __init__(self):
         self.config_file_name = None
@@ -29,76 +100,90 @@ class RenderingContext(object):
         self.target_name = None
         self.flow_name = None
 
-        self.basic_values = dict()
-        self.previous_steps_values = list()
+        self._basic_values = dict()
+        self._previous_steps_values = list()
+        self._context = ChainMap(self._basic_values)
+        self._context_lock = threading.Lock()
         self.temporary_folder = None
         self.root_temporary_folder = None
 
         self.remove_temporary_folder = None
         self.perform_dry_run = None
         self.unknown_args = None
+        self.flow_resources = FlowResources()
+        # set when flow fails, commands of running steps are killed
+        self.cancel_event = threading.Event()
+
+    @property
+    def basic_values(self):
+        return self._basic_values
+
+    @basic_values.setter
+    def basic_values(self, value):
+        with self._context_lock:
+            self._basic_values = value
+            self._context = ChainMap(*reversed(self._previous_steps_values), self._basic_values)
+
+    @property
+    def previous_steps_values(self):
+        return list(self._previous_steps_values)
+
+    def add_step_values(self, values):
+        """Adds values produced by finished step as new top layer of rendering context."""
+        with self._context_lock:
+            self._previous_steps_values.append(values)
+
+            # layers are never modified, so contexts taken by running steps remain consistent
+            if values:
+                self._context = self._context.new_child(dict(values))
+
+    def reset_steps_values(self):
+        with self._context_lock:
+            self._previous_steps_values = list()
+            self._context = ChainMap(self._basic_values)
 
     def to_context(self):
-        res = self.basic_values
-        for item in self.previous_steps_values:
-            res = {**res, **item}
+        return self._context
 
-        return res
+
+class LoadedConfiguration(AttrsToStringMixin):
+    def __init__(self):
+        self.config_file_name = None
+        self.config_context = None
+        self.secrets_file_name = None
+        self.secrets_context = None
 
 
 class YabtoolFlowOrchestrator(object):
     def __init__(self, logger):
         self.rendering_context = RenderingContext()
+        self.rendering_context.flow_resources.logger = logger
         self.logger = logger
         self._steps_factory = None
         self._backup_start_timestamp = datetime.datetime.utcnow()
         self._skip_flow_execution_voting_result = None
+        self._rendering_environment = None
         self.skip_voting_enabled = True
 
         self.dry_run_statistics = []
         self.active_run_statistics = []
 
-    def initialize(self, args, unknown_args):
-        self.rendering_context.config_file_name = self._get_config_file_name(args)
-        self.logger.debug(
-            "config_file_name: '{}'".format(self.rendering_context.config_file_name)
-        )
-
-        if not self.rendering_context.config_file_name:
-            raise ConfigurationValidationException("No configuration file specified")
+    def initialize(self, args, unknown_args, target_name=None, loaded_configuration=None):
+        if loaded_configuration is None:
+            loaded_configuration = self.load_configuration(args)
 
-        if not os.path.exists(self.rendering_context.config_file_name):
-            raise ConfigurationValidationException(
-                "Configuration file does not exists. Path: '{}'".format(
-                    self.rendering_context.config_file_name
-                )
-            )
+        self.rendering_context.config_file_name = loaded_configuration.config_file_name
 
-        self.rendering_context.config_context = self._load_yaml_file(
-            self.rendering_context.config_file_name
-        )
+        # configuration is patched for target and steps save rendered values into it,
+        # so each orchestrator works with own copy
+        self.rendering_context.config_context = copy.deepcopy(loaded_configuration.config_context)
 
         self.rendering_context.unknown_args = unknown_args
 
-        self.rendering_context.secrets_file_name = self._get_secrets_file_name(args)
-        if not self.rendering_context.secrets_file_name:
-            raise ConfigurationValidationException(
-                "Secrets file is not specified"
-            )
-
-        if not os.path.exists(self.rendering_context.secrets_file_name):
-            raise ConfigurationValidationException(
-                "Secrets file does not exists. Path: '{}'".format(
-                    self.rendering_context.secrets_file_name
-                )
-            )
-
-        self.logger.debug("loading secrets from: '{}'".format(self.rendering_context.secrets_file_name))
-        self.rendering_context.secrets_context = self._load_yaml_file(
-            self.rendering_context.secrets_file_name
-        )
+        self.rendering_context.secrets_file_name = loaded_configuration.secrets_file_name
+        self.rendering_context.secrets_context = loaded_configuration.secrets_context
 
-        self.rendering_context.target_name = self._get_target_name(args)
+        self.rendering_context.target_name = target_name if target_name else self._get_target_name(args)
         self.logger.debug("target_name: '{}'".format(self.target_name))
 
         self.rendering_context.flow_name = self._get_flow_name(args)
@@ -131,6 +216,44 @@ class YabtoolFlowOrchestrator(object):
 
         return True
 
+    def load_configuration(self, args):
+        res = LoadedConfiguration()
+
+        res.config_file_name = self._get_config_file_name(args)
+        self.logger.debug(
+            "config_file_name: '{}'".format(res.config_file_name)
+        )
+
+        if not res.config_file_name:
+            raise ConfigurationValidationException("No configuration file specified")
+
+        if not os.path.exists(res.config_file_name):
+            raise ConfigurationValidationException(
+                "Configuration file does not exists. Path: '{}'".format(
+                    res.config_file_name
+                )
+            )
+
+        res.config_context = self._load_yaml_file(res.config_file_name)
+
+        res.secrets_file_name = self._get_secrets_file_name(args)
+        if not res.secrets_file_name:
+            raise ConfigurationValidationException(
+                "Secrets file is not specified"
+            )
+
+        if not os.path.exists(res.secrets_file_name):
+            raise ConfigurationValidationException(
+                "Secrets file does not exists. Path: '{}'".format(
+                    res.secrets_file_name
+                )
+            )
+
+        self.logger.debug("loading secrets from: '{}'".format(res.secrets_file_name))
+        res.secrets_context = self._load_yaml_file(res.secrets_file_name)
+
+        return res
+
     def dry_run(self):
         self.logger.warning("performing dry run")
         if self.rendering_context.perform_dry_run:
@@ -151,13 +274,28 @@ class YabtoolFlowOrchestrator(object):
         if self.active_run_statistics:
             stat_data = self.produce_exeuction_stat(self.active_run_statistics)
             self.logger.info("{}:\n{}".format("Execution statistics:", stat_data))
+            if any(item.depends_on is not None for item in self.active_run_statistics):
+                critical_path_report = self.produce_critical_path_report(self.active_run_statistics)
+                self.logger.info("Critical path: {}".format(critical_path_report))
             metrics_data_list = self.produce_execution_metrics(self.active_run_statistics)
             for step_name, metrics_data_item in metrics_data_list:
                 self.logger.info("Metrics for '{}':\n{}".format(step_name, metrics_data_item))
+            for step_name, time_series_item in self.produce_time_series_report(self.active_run_statistics):
+                self.logger.info("Transfer rates of '{}':\n{}".format(step_name, time_series_item))
 
         if (not self.dry_run_statistics) and (not self.active_run_statistics):
             self.logger.info("No execution statistics")
 
+        boto_statistics = get_boto_clients_registry().get_statistics()
+        self.logger.info(
+            "AWS clients: created {}, reused {}; connections: created {}, reused {}".format(
+                boto_statistics.clients_created,
+                boto_statistics.clients_reused,
+                "n/a" if boto_statistics.connections_created is None else boto_statistics.connections_created,
+                "n/a" if boto_statistics.connections_reused is None else boto_statistics.connections_reused
+            )
+        )
+
     def produce_exeuction_stat(self, stat_source):
         header = ["Step Name", "Exexcution start timestamp", "Execution end timestamp", "Time elapsed "]
         data = [header]
@@ -190,9 +328,28 @@ class YabtoolFlowOrchestrator(object):
         data_row.append(pretty_time_delta(total_time_elapsed_seconds))
         data.append(data_row)
 
+        if any(item.depends_on is not None for item in stat_source):
+            wall_clock_seconds = calculate_wall_clock_time(stat_source)
+
+            data_row = [""] * (max_length - 2)
+            data_row.append("Wall clock")
+            data_row.append(pretty_time_delta(wall_clock_seconds))
+            data.append(data_row)
+
+            data_row = [""] * (max_length - 2)
+            data_row.append("Saved by concurrency")
+            data_row.append(pretty_time_delta(total_time_elapsed_seconds - wall_clock_seconds))
+            data.append(data_row)
+
         table = terminaltables.AsciiTable(data)
         return table.table
 
+    def produce_critical_path_report(self, stat_source):
+        critical_path, critical_path_seconds = calculate_critical_path(stat_source)
+
+        steps_ids = " -> ".join([item.step_id for item in critical_path])
+        return "{} ({})".format(steps_ids, pretty_time_delta(critical_path_seconds))
+
     def produce_execution_metrics(self, stat_source):
         res = []
         for statistics_item in stat_source:
@@ -222,6 +379,34 @@ class YabtoolFlowOrchestrator(object):
 
         return res
 
+    def produce_time_series_report(self, stat_source):
+        """Returns summaries of progress samples collected by steps, rates are rates of sampling intervals."""
+        res = []
+        for statistics_item in stat_source:
+            if not statistics_item.time_series:
+                continue
+
+            step_name = "{} ({})".format(statistics_item.step_human_readable_name, statistics_item.step_name)
+            data = [["Series", "Samples", "Min Rate", "Max Rate", "Average Rate", "Stalled"]]
+            for series_name, samples in sorted(statistics_item.time_series.items()):
+                summary = summarize_progress_samples(samples)
+                if summary is None:
+                    continue
+
+                data.append([
+                    series_name,
+                    summary.samples_count,
+                    "{:.2f} MiB/s".format(summary.min_rate / BYTES_IN_MEGABYTE),
+                    "{:.2f} MiB/s".format(summary.max_rate / BYTES_IN_MEGABYTE),
+                    "{:.2f} MiB/s".format(summary.average_rate / BYTES_IN_MEGABYTE),
+                    pretty_time_delta(summary.stalled_seconds)
+                ])
+
+            table = terminaltables.AsciiTable(data)
+            res.append((step_name, table.table))
+
+        return res
+
     def _get_config_file_name(self, args):
         config_file_name = args.config
 
@@ -256,12 +441,16 @@ class YabtoolFlowOrchestrator(object):
 
         self.logger.info("flow_description: '{}'".format(flow_description))
 
-        self.rendering_context.previous_steps_values = []
+        self.rendering_context.reset_steps_values()
 
-        rendering_environment = create_rendering_environment()
+        rendering_environment = self._get_rendering_environment()
         secret_targets_context = self.rendering_context.secrets_context["targets"][self.target_name]
+        self.rendering_context.cancel_event.clear()
 
-        self._execute_steps(dry_run, flow_data, rendering_environment, secret_targets_context)
+        try:
+            self._execute_steps(dry_run, flow_data, rendering_environment, secret_targets_context)
+        finally:
+            self.rendering_context.flow_resources.close()
 
     def _execute_steps(self, dry_run, flow_data, rendering_environment, secret_targets_context):
         assert self._steps_factory
@@ -273,50 +462,46 @@ class YabtoolFlowOrchestrator(object):
             self.logger.warning("Want skip flow execution")
             return
 
+        flow_steps = flow_data["steps"]
+        max_concurrent_steps = self._get_max_concurrent_steps(flow_data)
+        if (not dry_run) and (max_concurrent_steps > 1):
+            if any(step_context.get("streaming", False) for step_context in flow_steps):
+                self.logger.warning("concurrent steps execution is not supported for flows with streaming steps")
+            else:
+                self._execute_steps_concurrently(
+                    flow_steps,
+                    max_concurrent_steps,
+                    statistics_list,
+                    rendering_environment,
+                    secret_targets_context
+                )
+                return
+
         positive_votes_for_flow_execution_skipping = []
-        for step_context in flow_data["steps"]:
+        step_index = 0
+        while step_index < len(flow_steps):
+            step_context = flow_steps[step_index]
+
+            if (not dry_run) and step_context.get("streaming", False):
+                streaming_steps = self._get_streaming_steps_group(flow_steps, step_index)
+                self._execute_streaming_steps(
+                    streaming_steps,
+                    statistics_list,
+                    rendering_environment,
+                    secret_targets_context
+                )
+                step_index += len(streaming_steps)
+                continue
+
             step_name = step_context["name"]
             step_human_readable_name = step_context.get("human_readable_name", step_name)
 
-            step_description = step_context.get("description", "<no description>")
-
-            self.logger.debug(
-                "validating step '{}': {}".format(step_name, step_description)
-            )
-
-            if not self._steps_factory.is_step_known(step_name):
-                raise ConfigurationValidationException(
-                    "Unknown step '{}'".format(step_name)
-                )
-
             if dry_run:
                 self.logger.debug("performing dry run for step '{}'".format(step_name))
             else:
                 self.logger.debug("performing active run for step '{}'".format(step_name))
 
-            secret_context = dict()
-            relative_secrets = step_context.get("relative_secrets", [])
-            required_secrets = [step_name]
-            required_secrets.extend(relative_secrets)
-
-            for required_secret in required_secrets:
-                if (
-                    ("steps_configuration" in secret_targets_context) and  # noqa
-                    (required_secret in secret_targets_context["steps_configuration"])
-                ):
-                    secret_context = {
-                        **secret_context,
-                        **secret_targets_context["steps_configuration"][required_secret]
-                    }
-
-            step_object = self._steps_factory.create_object(
-                step_name,
-                logger=self.logger,
-                rendering_context=self.rendering_context,
-                step_context=step_context,
-                secret_context=secret_context,
-                rendering_environment=rendering_environment,
-            )
+            step_object = self._create_step_object(step_context, rendering_environment, secret_targets_context)
 
             if dry_run:
                 self.logger.info("initializing dry run for step: '{}'".format(step_name))
@@ -337,7 +522,8 @@ class YabtoolFlowOrchestrator(object):
 
             self.logger.debug("additional_variables: {}".format(additional_variables))
 
-            self.rendering_context.previous_steps_values.append(additional_variables)
+            self.rendering_context.add_step_values(additional_variables)
+            step_index += 1
 
         if dry_run and positive_votes_for_flow_execution_skipping:
             self.logger.info(
@@ -347,6 +533,152 @@ class YabtoolFlowOrchestrator(object):
             )
             self._skip_flow_execution_voting_result = True
 
+    def _get_max_concurrent_steps(self, flow_data):
+        if "max_concurrent_steps" in flow_data:
+            return int(flow_data["max_concurrent_steps"])
+
+        return int(self.config_context["parameters"].get("max_concurrent_steps", 1))
+
+    def _execute_steps_concurrently(
+        self,
+        flow_steps,
+        max_concurrent_steps,
+        statistics_list,
+        rendering_environment,
+        secret_targets_context
+    ):
+        steps_ids = get_unique_steps_ids(flow_steps)
+        dependencies = StepsDependenciesResolver(rendering_environment).resolve(flow_steps)
+        for step_id, step_dependencies in zip(steps_ids, dependencies):
+            self.logger.debug(
+                "step '{}' depends on: {}".format(step_id, [steps_ids[index] for index in sorted(step_dependencies)])
+            )
+
+        self.logger.info("executing flow steps with up to {} concurrent steps".format(max_concurrent_steps))
+
+        stat_entries = [None] * len(flow_steps)
+
+        def execute_step(step_index):
+            step_context = flow_steps[step_index]
+            step_name = step_context["name"]
+
+            step_object = self._create_step_object(step_context, rendering_environment, secret_targets_context)
+            self.logger.info("initializing active run for step: '{}'".format(step_name))
+
+            stat_entry = StepExecutionStatisticEntry(
+                step_name=step_name,
+                step_human_readable_name=step_context.get("human_readable_name", step_name),
+                execution_start_timestamp=datetime.datetime.utcnow(),
+                step_id=steps_ids[step_index],
+                depends_on=[steps_ids[index] for index in sorted(dependencies[step_index])]
+            )
+            stat_entries[step_index] = stat_entry
+
+            additional_variables = step_object.run(stat_entry, dry_run=False)
+            stat_entry.execution_end_timestamp = datetime.datetime.utcnow()
+
+            return additional_variables
+
+        def on_step_completed(step_index, additional_variables):
+            self.logger.debug("additional_variables: {}".format(additional_variables))
+            self.rendering_context.add_step_values(additional_variables)
+
+        try:
+            DagStepsExecutor(self.logger, max_concurrent_steps).execute(
+                dependencies,
+                execute_step,
+                on_step_completed,
+                cancel_event=self.rendering_context.cancel_event
+            )
+        finally:
+            statistics_list.extend(
+                [item for item in stat_entries if (item is not None) and item.execution_end_timestamp]
+            )
+
+    def _get_rendering_environment(self):
+        # compiled templates are shared by dry run and active run
+        if self._rendering_environment is None:
+            self._rendering_environment = create_rendering_environment()
+
+        return self._rendering_environment
+
+    def _create_step_object(self, step_context, rendering_environment, secret_targets_context):
+        step_name = step_context["name"]
+        step_description = step_context.get("description", "<no description>")
+
+        self.logger.debug(
+            "validating step '{}': {}".format(step_name, step_description)
+        )
+
+        if not self._steps_factory.is_step_known(step_name):
+            raise ConfigurationValidationException(
+                "Unknown step '{}'".format(step_name)
+            )
+
+        secret_context = dict()
+        relative_secrets = step_context.get("relative_secrets", [])
+        required_secrets = [step_name]
+        required_secrets.extend(relative_secrets)
+
+        for required_secret in required_secrets:
+            if (
+                ("steps_configuration" in secret_targets_context) and  # noqa
+                (required_secret in secret_targets_context["steps_configuration"])
+            ):
+                secret_context = {
+                    **secret_context,
+                    **secret_targets_context["steps_configuration"][required_secret]
+                }
+
+        return self._steps_factory.create_object(
+            step_name,
+            logger=self.logger,
+            rendering_context=self.rendering_context,
+            step_context=step_context,
+            secret_context=secret_context,
+            rendering_environment=rendering_environment,
+        )
+
+    @staticmethod
+    def _get_streaming_steps_group(flow_steps, first_step_index):
+        res = []
+
+        for step_context in flow_steps[first_step_index:]:
+            if not step_context.get("streaming", False):
+                break
+
+            res.append(step_context)
+
+        return res
+
+    def _execute_streaming_steps(self, streaming_steps, statistics_list, rendering_environment, secret_targets_context):
+        steps_names = [step_context["name"] for step_context in streaming_steps]
+        self.logger.info("initializing streaming pipeline for steps: {}".format(steps_names))
+
+        pipeline = StreamingPipeline(self.logger)
+        for step_context in streaming_steps:
+            step_name = step_context["name"]
+            step_object = self._create_step_object(step_context, rendering_environment, secret_targets_context)
+
+            if not step_object.supports_streaming():
+                raise ConfigurationValidationException(
+                    "Step '{}' can't be used as streaming stage".format(step_name)
+                )
+
+            stat_entry = StepExecutionStatisticEntry(
+                step_name=step_name,
+                step_human_readable_name=step_context.get("human_readable_name", step_name)
+            )
+
+            additional_variables = step_object.prepare_stage()
+            self.logger.debug("additional_variables: {}".format(additional_variables))
+            self.rendering_context.add_step_values(additional_variables)
+
+            pipeline.add_stage(step_object, stat_entry)
+            statistics_list.append(stat_entry)
+
+        pipeline.run()
+
     def _check_for_flow_execution_skipping(self, step_object, positive_votes_for_flow_execution_skipping):
         step_name = step_object.step_name()
 
@@ -482,30 +814,16 @@ class YabtoolFlowOrchestrator(object):
         res = self._get_additional_rendering_variables()
 
         res["main_target_name"] = self.rendering_context.target_name
-        res["week_day_short_name"] = self._backup_start_timestamp.strftime("%a")
-        res["week_number"] = self._backup_start_timestamp.strftime("%U")
-        res["month_short_name"] = self._backup_start_timestamp.strftime("%b")
-        res["month_two_digit_number"] = self._backup_start_timestamp.strftime("%m")
-        res["backup_start_timestamp"] = self._backup_start_timestamp
+        res.update(get_date_rendering_values(self._backup_start_timestamp))
         res["flow_name"] = self.flow_name
         res["yabtool_exec_folder"] = self.rendering_context.temporary_folder
 
-        res["current_year"] = self._backup_start_timestamp.strftime("%Y")
-        res["current_month"] = res["month_two_digit_number"]
-        res["current_day_of_month"] = self._backup_start_timestamp.strftime("%d")
-
-        res["current_date"] = self._backup_start_timestamp.strftime("%Y-%m-%d")
-        res["current_time"] = self._backup_start_timestamp.strftime("%H%M%S")
-
-        res["lower"] = str.lower
-        res["upper"] = str.upper
-
         return res
 
     def _get_additional_rendering_variables(self):
         targets_context = self.rendering_context.secrets_context["targets"][self.target_name]
 
-        res = targets_context.get("additional_variables", {})
+        res = dict(targets_context.get("additional_variables", {}))
         self.logger.info("additional variables: {}".format(res))
 
         return res
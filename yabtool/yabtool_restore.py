@@ -0,0 +1,484 @@
+"""Restores backup uploaded by rotation step, object is located with rules from configuration.
+
+    python -m yabtool.yabtool_restore --secrets secrets.yaml --target main_db --rule weekly --date 2020-01-15 \
+        --pipe-command "7z x -si -so -p{password} | gbak -c stdin /data/restored.fdb"
+
+Object is downloaded with parallel ranged requests, chunks are written in order into output file
+or into stdin of command and hashed on the way, so decompression starts immediately and result
+is verified against hash file uploaded alongside of archive without second pass.
+
+Backups stored by "cdc_upload_with_rotation" step are restored from manifest of the rule, its
+chunks are downloaded in parallel and result is verified with sha256 from manifest.
+"""
+import argparse
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import hashlib
+import os
+import subprocess
+import sys
+import time
+
+import loguru
+from yabtool.shared.boto_clients_registry import get_boto_clients_registry
+from yabtool.shared.hashing import (
+    CompositeDigestHasher,
+    parse_chunks_list_header,
+    parse_composite_value,
+    parse_hash_file_content
+)
+from yabtool.shared.jinja2_helpers import create_rendering_environment, render_template
+from yabtool.supported_steps.base import TransmissionError
+from yabtool.supported_steps.cdc_chunk_store import (
+    ChunkCodec,
+    load_manifest,
+    LocalChunkStore,
+    restore_from_manifest,
+    S3ChunkStore
+)
+from yabtool.supported_steps.s3_upload_engine import calculate_part_size
+from yabtool.supported_steps.s3boto_client import S3BasicBotoClient
+from yabtool.supported_steps.shared import ThirdPartyCommandsExecutor
+from yabtool.supported_steps.step_cdc_upload_with_rotation import StepCdcUploadWithRotation
+from yabtool.yabtool_flow_orchestrator import get_date_rendering_values, YabtoolFlowOrchestrator
+
+DEFAULT_ROTATION_STEP_NAME = "s3_multipart_upload_with_rotation"
+DEFAULT_HASH_FILE_EXTENSION = "sha256"
+CHUNKS_LIST_EXTENSION = "chunks"
+DEFAULT_PART_SIZE_MIB = 16
+DEFAULT_WORKERS = 8
+BYTES_IN_MEGABYTE = 1024 * 1024
+
+
+def get_cli_args(args=None):
+    parser = argparse.ArgumentParser(description="Restore backup uploaded with rotation")
+
+    parser.add_argument("--secrets", "-s", action="store", required=True, help="Path to file with secrets")
+    parser.add_argument("--config", "-c", action="store", help="Path to main configuration file")
+    parser.add_argument("--target", "-t", action="store", required=True, help="Target name")
+    parser.add_argument("--rule", "-r", action="store", required=True, help="Upload rule name (weekdays, weekly, ...)")
+    parser.add_argument("--date", "-d", action="store", help="Date of backup (YYYY-MM-DD), today by default")
+    parser.add_argument(
+        "--step",
+        action="store",
+        default=DEFAULT_ROTATION_STEP_NAME,
+        help="Name of upload step with rotation rules, e.g. cdc_upload_with_rotation for chunked backups"
+    )
+    parser.add_argument("--output", "-o", action="store", help="Output file or folder for archive")
+    parser.add_argument("--pipe-command", "-p", action="store", help="Command which receives archive in stdin")
+    parser.add_argument(
+        "--hash-extension",
+        action="store",
+        default=DEFAULT_HASH_FILE_EXTENSION,
+        help="Extension of hash file uploaded alongside of archive"
+    )
+    parser.add_argument("--workers", "-w", action="store", type=int, default=DEFAULT_WORKERS, help="Count of threads")
+    parser.add_argument(
+        "--part-size-mib",
+        action="store",
+        type=int,
+        default=DEFAULT_PART_SIZE_MIB,
+        help="Size of ranged requests"
+    )
+    parser.add_argument(
+        "--skip-verification",
+        action="store_true",
+        default=False,
+        help="Don't verify archive with hash file"
+    )
+
+    res = parser.parse_args(args=args)
+    if not (res.output or res.pipe_command):
+        parser.error("--output or --pipe-command should be specified")
+
+    return res
+
+
+class RestoreSource(object):
+    def __init__(self):
+        self.secret_context = None
+        self.bucket_name = None
+        self.prefix = None
+        self.step_context = None
+        self.render = None
+
+    @property
+    def is_chunked(self):
+        """True when backup is stored as content defined chunks described by manifests."""
+        return self.step_context["name"] == StepCdcUploadWithRotation.step_name()
+
+
+def resolve_restore_source(loaded_configuration, target_name, step_name, rule_name, date):
+    """Renders destination prefix of upload rule for `date` with values of target."""
+    targets_context = loaded_configuration.secrets_context["targets"][target_name]
+    flow_data = loaded_configuration.config_context["flows"][targets_context["flow_type"]]
+
+    steps = [item for item in flow_data["steps"] if item["name"] == step_name]
+    if not steps:
+        raise ValueError("step '{}' is not found in flow '{}'".format(step_name, targets_context["flow_type"]))
+
+    step_context = steps[0]
+    rules = [item for item in step_context["upload_rules"] if item["name"] == rule_name]
+    if not rules:
+        raise ValueError("upload rule '{}' is not found in step '{}'".format(rule_name, step_name))
+
+    # the same secrets as in flow: values of step itself and of its relative secrets
+    secret_context = dict()
+    for secret_name in [step_name] + list(step_context.get("relative_secrets", [])):
+        secret_context.update(targets_context.get("steps_configuration", {}).get(secret_name, {}))
+
+    basic_values = dict(targets_context.get("additional_variables", {}))
+    basic_values["main_target_name"] = target_name
+    basic_values.update(get_date_rendering_values(date))
+
+    environment = create_rendering_environment()
+    context = ChainMap(step_context, secret_context, basic_values)
+
+    def render(template):
+        return render_template(environment.from_string(template), context)
+
+    context = context.new_child({"prefix_in_bucket": render(context.get("prefix_in_bucket", ""))})
+    context = context.new_child({"target_prefix_in_bucket": render(context["target_prefix_in_bucket"])})
+
+    res = RestoreSource()
+    res.secret_context = secret_context
+    res.bucket_name = secret_context["bucket_name"]
+    res.prefix = render(rules[0]["destination_prefix"])
+    res.step_context = context
+    res.render = render
+    return res
+
+
+def find_archive_key(basic_client, bucket_name, prefix, hash_extension):
+    """Returns tuple of archive key and its hash file key (None when hash file is absent)."""
+    keys = [record.key for record in basic_client.iterate_objects(bucket_name, prefix.rstrip("/") + "/")]
+    hash_suffix = ".{}".format(hash_extension)
+    chunks_list_suffix = "{}.{}".format(hash_suffix, CHUNKS_LIST_EXTENSION)
+
+    archives = [key for key in keys if not key.endswith(hash_suffix) and not key.endswith(chunks_list_suffix)]
+    for key in archives:
+        if key + hash_suffix in keys:
+            return key, key + hash_suffix
+
+    if len(archives) == 1:
+        return archives[0], None
+
+    raise ValueError("can't find archive in '{}', objects: {}".format(prefix, keys))
+
+
+def create_chunk_store(source, basic_client):
+    """Returns store of chunks (and manifests) configured in step of `source`."""
+    store_type = source.step_context.get("chunk_store", StepCdcUploadWithRotation.CHUNK_STORE_S3)
+    if store_type == StepCdcUploadWithRotation.CHUNK_STORE_LOCAL:
+        return LocalChunkStore(source.render(source.step_context["local_chunk_store_folder"]))
+
+    if store_type != StepCdcUploadWithRotation.CHUNK_STORE_S3:
+        raise ValueError("unknown chunk store '{}'".format(store_type))
+
+    return S3ChunkStore(basic_client, source.bucket_name)
+
+
+def create_chunk_codec(source):
+    password = source.render(source.step_context.get("encryption_password") or "")
+
+    return ChunkCodec(
+        compression_preset=int(source.step_context.get("compression_preset", ChunkCodec.DEFAULT_COMPRESSION_PRESET)),
+        password=password if password else None
+    )
+
+
+def find_manifest(store, prefix):
+    """Returns tuple of manifest key and loaded manifest of rule."""
+    keys = [key for key in store.list_keys(prefix) if key.endswith(StepCdcUploadWithRotation.MANIFEST_SUFFIX)]
+    if len(keys) != 1:
+        raise ValueError("can't find manifest in '{}', manifests: {}".format(prefix, keys))
+
+    return keys[0], load_manifest(store.get_object(keys[0]))
+
+
+class ParallelRangeDownloader(object):
+    """Downloads object with parallel ranged requests and yields chunks in order.
+
+    Count of chunks requested ahead is limited, so memory usage doesn't depend on object size.
+    """
+
+    def __init__(self, raw_client, bucket_name, key, object_size, part_size, max_threads):
+        self._client = raw_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.object_size = object_size
+        self.part_size = part_size
+        self.max_threads = max_threads
+
+    def iterate_chunks(self):
+        ranges = [
+            (offset, min(offset + self.part_size, self.object_size) - 1)
+            for offset in range(0, self.object_size, self.part_size)
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="yabtool-restore") as executor:
+            pending = []
+            next_range_index = 0
+            while pending or next_range_index < len(ranges):
+                while next_range_index < len(ranges) and len(pending) < self.max_threads * 2:
+                    pending.append(executor.submit(self._download_range, *ranges[next_range_index]))
+                    next_range_index += 1
+
+                yield pending.pop(0).result()
+
+    def _download_range(self, first_byte, last_byte):
+        response = self._client.get_object(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            Range="bytes={}-{}".format(first_byte, last_byte)
+        )
+        data = response["Body"].read()
+        if len(data) != last_byte - first_byte + 1:
+            raise TransmissionError("range {}-{} of '{}' is incomplete".format(first_byte, last_byte, self.key))
+
+        return data
+
+
+def create_verification_hasher(hash_type, expected_value, chunk_size=None):
+    """Returns hasher which `hexdigest()` is comparable with `expected_value` from hash file.
+
+    Files hashed in "chunked" mode by older versions contain composite digests of chunks of `chunk_size`.
+    """
+    if parse_composite_value(expected_value) is None:
+        return hashlib.new(hash_type)
+
+    if not chunk_size:
+        raise ValueError("{} '{}' is composite digest, size of hashed chunks is required".format(
+            hash_type,
+            expected_value
+        ))
+
+    return CompositeDigestHasher(hash_type, chunk_size)
+
+
+def restore_object(downloader, output_stream, expected_hashes, chunk_size=None):
+    """Writes chunks into `output_stream` and verifies them with `expected_hashes` {hash type: value}.
+
+    Composite values (hash file produced in "chunked" mode) are verified with chunks of `chunk_size`.
+    Returns count of written bytes.
+    """
+    hashers = {
+        hash_type: create_verification_hasher(hash_type, value, chunk_size)
+        for hash_type, value in expected_hashes.items()
+    }
+
+    res = 0
+    for chunk in downloader.iterate_chunks():
+        output_stream.write(chunk)
+        for hasher in hashers.values():
+            hasher.update(chunk)
+
+        res += len(chunk)
+
+    for hash_type, hasher in hashers.items():
+        if hasher.hexdigest() != expected_hashes[hash_type]:
+            raise TransmissionError(
+                "{} of restored '{}' is '{}', but '{}' is expected".format(
+                    hash_type,
+                    downloader.key,
+                    hasher.hexdigest(),
+                    expected_hashes[hash_type]
+                )
+            )
+
+    return res
+
+
+def load_expected_hashes(basic_client, bucket_name, hash_key, hash_extension):
+    data = basic_client.get_object_data(bucket_name, hash_key)
+    if data is None:
+        raise ValueError("hash file '{}' is not found".format(hash_key))
+
+    return dict(parse_hash_file_content(data.decode("utf-8"), default_hash_type=hash_extension))
+
+
+def load_hashed_chunk_size(basic_client, bucket_name, hash_key, expected_hashes, object_size):
+    """Returns size of chunks of composite digests in `expected_hashes` (None when there are no such digests).
+
+    Size is taken from chunks list uploaded alongside of hash file, without it the size which
+    "auto" chunk size of hash step produces for object is used when count of chunks matches.
+    """
+    chunks_counts = {parse_composite_value(value) for value in expected_hashes.values()} - {None}
+    if not chunks_counts:
+        return None
+
+    chunks_list_key = "{}.{}".format(hash_key, CHUNKS_LIST_EXTENSION)
+    data = basic_client.get_object_data(bucket_name, chunks_list_key)
+    if data is not None:
+        _, chunk_size = parse_chunks_list_header(data.decode("utf-8"))
+        return chunk_size
+
+    chunk_size = calculate_part_size(object_size)
+    if chunks_counts == {max(1, (object_size + chunk_size - 1) // chunk_size)}:
+        return chunk_size
+
+    raise ValueError(
+        "hash file '{}' contains composite digests of {} chunks, but chunks list '{}' is not found; "
+        "upload it alongside of hash file or use --skip-verification".format(
+            hash_key,
+            ", ".join(str(item) for item in sorted(chunks_counts)),
+            chunks_list_key
+        )
+    )
+
+
+def restore(args=None, logger=None):
+    args = get_cli_args(args)
+    logger = logger if logger else loguru.logger
+
+    orchestrator = YabtoolFlowOrchestrator(logger)
+    loaded_configuration = orchestrator.load_configuration(args)
+
+    date = datetime.datetime.strptime(args.date, "%Y-%m-%d") if args.date else datetime.datetime.utcnow()
+    source = resolve_restore_source(loaded_configuration, args.target, args.step, args.rule, date)
+    logger.info("restoring from '{}' of bucket '{}'".format(source.prefix, source.bucket_name))
+
+    raw_client = get_boto_clients_registry().get_client(
+        "s3",
+        region_name=source.secret_context.get("region"),
+        aws_access_key_id=source.secret_context["aws_access_key_id"],
+        aws_secret_access_key=source.secret_context["aws_secret_access_key"],
+        endpoint_url=source.secret_context.get("endpoint_url"),
+        max_pool_connections=args.workers
+    )
+    basic_client = S3BasicBotoClient(logger, raw_client)
+
+    start_timestamp = time.monotonic()
+    if source.is_chunked:
+        restored_bytes, verified_with = _restore_chunked(logger, args, source, basic_client)
+    else:
+        restored_bytes, verified_with = _restore_archive(logger, args, source, raw_client, basic_client)
+
+    seconds_spent = time.monotonic() - start_timestamp
+    logger.info("restored {:.2f} MiB in {:.3f}s ({:.2f} MiB/s), verified with: {}".format(
+        restored_bytes / BYTES_IN_MEGABYTE,
+        seconds_spent,
+        restored_bytes / BYTES_IN_MEGABYTE / max(seconds_spent, 1e-6),
+        verified_with
+    ))
+    return True
+
+
+def _restore_archive(logger, args, source, raw_client, basic_client):
+    archive_key, hash_key = find_archive_key(basic_client, source.bucket_name, source.prefix, args.hash_extension)
+    expected_hashes = dict()
+    if not args.skip_verification:
+        if hash_key is None:
+            raise ValueError("hash file for '{}' is not found".format(archive_key))
+
+        expected_hashes = load_expected_hashes(basic_client, source.bucket_name, hash_key, args.hash_extension)
+
+    object_size = raw_client.head_object(Bucket=source.bucket_name, Key=archive_key)["ContentLength"]
+    logger.info("restoring '{}' ({:.2f} MiB)".format(archive_key, object_size / BYTES_IN_MEGABYTE))
+
+    chunk_size = None
+    if expected_hashes:
+        chunk_size = load_hashed_chunk_size(basic_client, source.bucket_name, hash_key, expected_hashes, object_size)
+
+    downloader = ParallelRangeDownloader(
+        raw_client,
+        source.bucket_name,
+        archive_key,
+        object_size,
+        args.part_size_mib * BYTES_IN_MEGABYTE,
+        args.workers
+    )
+
+    restored_bytes = _write_output(
+        logger,
+        args,
+        os.path.basename(archive_key),
+        lambda output_stream: restore_object(downloader, output_stream, expected_hashes, chunk_size)
+    )
+    return restored_bytes, ", ".join(expected_hashes.keys()) if expected_hashes else "nothing"
+
+
+def _restore_chunked(logger, args, source, basic_client):
+    # manifest contains sha256 of the whole backup, so it's verified always
+    store = create_chunk_store(source, basic_client)
+    manifest_key, manifest = find_manifest(store, source.prefix)
+    logger.info("restoring '{}' from {} chunks ({:.2f} MiB)".format(
+        manifest_key,
+        len(manifest["chunks"]),
+        manifest["size"] / BYTES_IN_MEGABYTE
+    ))
+
+    codec = create_chunk_codec(source)
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="yabtool-restore") as executor:
+        restored_bytes = _write_output(
+            logger,
+            args,
+            manifest["file_name"],
+            lambda output_stream: restore_from_manifest(
+                store,
+                codec,
+                manifest,
+                output_stream,
+                executor=executor,
+                max_pending_chunks=args.workers * 2
+            )
+        )
+
+    return restored_bytes, "sha256 of manifest"
+
+
+def _write_output(logger, args, file_name, write_function):
+    if args.pipe_command:
+        return _restore_into_command(logger, args.pipe_command, write_function)
+
+    output_file_name = args.output
+    if os.path.isdir(output_file_name):
+        output_file_name = os.path.join(output_file_name, file_name)
+
+    # restored data is written under temporary name, so file which failed verification is never left as backup
+    temporary_file_name = "{}.tmp".format(output_file_name)
+    try:
+        with open(temporary_file_name, "wb") as output_file:
+            res = write_function(output_file)
+    except BaseException:
+        if os.path.exists(temporary_file_name):
+            os.remove(temporary_file_name)
+        raise
+
+    os.replace(temporary_file_name, output_file_name)
+    logger.info("backup saved into '{}'".format(output_file_name))
+    return res
+
+
+def _restore_into_command(logger, command, write_function):
+    logger.info("piping backup into '{}'".format(command))
+    # command is started in its own process group, so all processes of pipeline are terminated on failure
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        stdin=subprocess.PIPE,
+        **ThirdPartyCommandsExecutor._get_process_arguments(None)
+    )
+
+    try:
+        res = write_function(process.stdin)
+    except BaseException:
+        # closed input would be treated as the end of backup, so command mustn't finish with partial data
+        ThirdPartyCommandsExecutor._terminate(process)
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        raise
+
+    process.stdin.close()
+    return_code = process.wait()
+    if return_code != 0:
+        raise RuntimeError("command '{}' failed with return code {}".format(command, return_code))
+
+    return res
+
+
+if __name__ == "__main__":
+    sys.exit(0 if restore() else 1)
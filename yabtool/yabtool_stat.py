@@ -1,9 +1,19 @@
+from collections import namedtuple
+import threading
+
+ProgressSeriesSummary = namedtuple(
+    "ProgressSeriesSummary",
+    ["samples_count", "min_rate", "max_rate", "average_rate", "stalled_seconds"]
+)
+
+
 class StatMetricEntry(object):
     def __init__(self, metric_name, initial_value=None, units_name=None):
         assert str(metric_name).strip()
         self._metric_name = metric_name
         self._value = initial_value
         self.units_name = units_name
+        self._lock = threading.Lock()
 
     @property
     def metric_name(self):
@@ -18,19 +28,23 @@ class StatMetricEntry(object):
         self._value = new_value
 
     def increment(self, delta):
-        self._value += delta
+        with self._lock:
+            self._value += delta
 
 
 class MetricsHolder(object):
     def __init__(self):
         self._metrics = {}
+        self._lock = threading.Lock()
 
     def get_metric(self, metric_name, initial_value=None, units_name=None):
-        res = self._metrics.get(metric_name)
+        # metrics may be updated from several threads of the same step
+        with self._lock:
+            res = self._metrics.get(metric_name)
 
-        if res is None:
-            res = StatMetricEntry(metric_name=metric_name, initial_value=initial_value, units_name=units_name)
-            self._metrics[metric_name] = res
+            if res is None:
+                res = StatMetricEntry(metric_name=metric_name, initial_value=initial_value, units_name=units_name)
+                self._metrics[metric_name] = res
 
         return res
 
@@ -48,10 +62,96 @@ class StepExecutionStatisticEntry(object):
         step_human_readable_name=None,
         execution_start_timestamp=None,
         execution_end_timestamp=None,
-        metrics=None
+        metrics=None,
+        step_id=None,
+        depends_on=None
     ):
         self.step_name = step_name
         self.step_human_readable_name = step_human_readable_name
         self.execution_start_timestamp = execution_start_timestamp
         self.execution_end_timestamp = execution_end_timestamp
         self.metrics = MetricsHolder() if metrics is None else metrics
+
+        # ids of steps which had to be completed before this step started, None for sequential execution
+        self.step_id = step_id if step_id is not None else step_name
+        self.depends_on = depends_on
+
+        # samples collected during step execution (e.g. progress of transfers) by name of series
+        self.time_series = dict()
+        self._time_series_lock = threading.Lock()
+
+    def add_time_series_sample(self, series_name, sample):
+        with self._time_series_lock:
+            self.time_series.setdefault(series_name, []).append(sample)
+
+    @property
+    def seconds_spent(self):
+        return (self.execution_end_timestamp - self.execution_start_timestamp).total_seconds()
+
+
+def calculate_wall_clock_time(stat_source):
+    entries = [item for item in stat_source if item.execution_start_timestamp and item.execution_end_timestamp]
+    if not entries:
+        return 0.0
+
+    execution_start_timestamp = min(item.execution_start_timestamp for item in entries)
+    execution_end_timestamp = max(item.execution_end_timestamp for item in entries)
+
+    return (execution_end_timestamp - execution_start_timestamp).total_seconds()
+
+
+def calculate_critical_path(stat_source):
+    """Returns list of entries which form the longest chain of dependent steps and its duration.
+
+    Entries without dependencies information are treated as executed strictly one after another.
+    """
+    entries = [item for item in stat_source if item.execution_start_timestamp and item.execution_end_timestamp]
+
+    longest_path_per_entry = []
+    for index, entry in enumerate(entries):
+        if entry.depends_on is None:
+            dependencies = [index - 1] if index else []
+        else:
+            dependencies = [
+                dependency_index
+                for dependency_index, item in enumerate(entries[:index]) if item.step_id in entry.depends_on
+            ]
+
+        best_path, best_duration = [], 0.0
+        for dependency_index in dependencies:
+            path, duration = longest_path_per_entry[dependency_index]
+            if duration > best_duration:
+                best_path, best_duration = path, duration
+
+        longest_path_per_entry.append((best_path + [entry], best_duration + entry.seconds_spent))
+
+    if not longest_path_per_entry:
+        return [], 0.0
+
+    return max(longest_path_per_entry, key=lambda item: item[1])
+
+
+def summarize_progress_samples(samples):
+    """Returns ProgressSeriesSummary of TransferProgressSample list (None for empty list).
+
+    Rates are instant rates of intervals between samples, `stalled_seconds` is total length
+    of intervals without transmitted bytes.
+    """
+    if not samples:
+        return None
+
+    stalled_seconds = 0.0
+    previous_seconds_elapsed = 0.0
+    for sample in samples:
+        if not sample.instant_rate:
+            stalled_seconds += sample.seconds_elapsed - previous_seconds_elapsed
+
+        previous_seconds_elapsed = sample.seconds_elapsed
+
+    return ProgressSeriesSummary(
+        len(samples),
+        min(sample.instant_rate for sample in samples),
+        max(sample.instant_rate for sample in samples),
+        samples[-1].average_rate,
+        stalled_seconds
+    )
@@ -0,0 +1,174 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from jinja2 import meta
+
+
+class StepsDependenciesError(Exception):
+    pass
+
+
+def get_step_id(step_context):
+    return step_context.get("id", step_context["name"])
+
+
+def get_unique_steps_ids(flow_steps):
+    """Returns ids of steps, repeated ids receive numeric suffix.
+
+    >>> get_unique_steps_ids([{"name": "a"}, {"name": "b"}, {"name": "a"}])
+    ['a', 'b', 'a#2']
+    """
+    res = []
+    occurrences = {}
+
+    for step_context in flow_steps:
+        step_id = get_step_id(step_context)
+        occurrences[step_id] = occurrences.get(step_id, 0) + 1
+
+        res.append(step_id if occurrences[step_id] == 1 else "{}#{}".format(step_id, occurrences[step_id]))
+
+    return res
+
+
+class StepsDependenciesResolver(object):
+    """Calculates dependencies between flow steps.
+
+    Dependencies may be declared explicitly with `depends_on` list which contains ids (or names)
+    of previous steps. Otherwise they are inferred from variables referenced in step templates
+    and values produced by `generates` sections of previous steps. Step which does not reference
+    values of any previous step depends on all previous steps, so steps like `healthchecks_ping`
+    are never executed before the work they report.
+    """
+
+    def __init__(self, rendering_environment):
+        self._rendering_environment = rendering_environment
+
+    def resolve(self, flow_steps):
+        res = []
+
+        for step_index, step_context in enumerate(flow_steps):
+            if "depends_on" in step_context:
+                dependencies = self._get_declared_dependencies(flow_steps, step_index)
+            else:
+                dependencies = self._get_inferred_dependencies(flow_steps, step_index)
+
+            res.append(dependencies)
+
+        return res
+
+    def _get_declared_dependencies(self, flow_steps, step_index):
+        res = set()
+
+        depends_on = flow_steps[step_index]["depends_on"]
+        depends_on = [depends_on] if isinstance(depends_on, str) else depends_on
+
+        for required_step_id in depends_on:
+            dependency_index = self._find_previous_step(flow_steps, step_index, required_step_id)
+            if dependency_index is None:
+                raise StepsDependenciesError(
+                    "step '{}' depends on unknown or following step '{}'".format(
+                        get_step_id(flow_steps[step_index]),
+                        required_step_id
+                    )
+                )
+
+            res.add(dependency_index)
+
+        return res
+
+    def _get_inferred_dependencies(self, flow_steps, step_index):
+        res = set()
+
+        step_context = flow_steps[step_index]
+        referenced_variables = self._get_referenced_variables(step_context) - set(step_context.keys())
+        for previous_step_index in range(step_index - 1, -1, -1):
+            generated_variables = set(flow_steps[previous_step_index].get("generates", {}).keys())
+
+            matched_variables = referenced_variables & generated_variables
+            if matched_variables:
+                res.add(previous_step_index)
+                referenced_variables -= matched_variables
+
+        if not res:
+            res = set(range(step_index))
+
+        return res
+
+    @staticmethod
+    def _find_previous_step(flow_steps, step_index, required_step_id):
+        for previous_step_index in range(step_index - 1, -1, -1):
+            previous_step = flow_steps[previous_step_index]
+            if required_step_id in (get_step_id(previous_step), previous_step["name"]):
+                return previous_step_index
+
+        return None
+
+    def _get_referenced_variables(self, value):
+        res = set()
+
+        if isinstance(value, str):
+            if ("{{" in value) or ("{%" in value):
+                parsed_content = self._rendering_environment.parse(value)
+                res.update(meta.find_undeclared_variables(parsed_content))
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if key != "generates":
+                    res.update(self._get_referenced_variables(item))
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                res.update(self._get_referenced_variables(item))
+
+        return res
+
+
+class DagStepsExecutor(object):
+    """Executes nodes of dependencies graph on thread pool as soon as all their dependencies are completed."""
+
+    def __init__(self, logger, max_workers):
+        assert max_workers >= 1
+        self.logger = logger
+        self.max_workers = max_workers
+
+    def execute(self, dependencies, execute_node, on_node_completed, cancel_event=None):
+        """Executes nodes, `cancel_event` is set on first failure, so running nodes may stop early."""
+        nodes_count = len(dependencies)
+        completed_nodes = set()
+        submitted_nodes = set()
+        running_futures = {}
+        first_exception = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="yabtool-step") as executor:
+            while len(completed_nodes) < nodes_count:
+                if first_exception is None:
+                    for node_index in self._get_ready_nodes(dependencies, submitted_nodes, completed_nodes):
+                        submitted_nodes.add(node_index)
+                        running_futures[executor.submit(execute_node, node_index)] = node_index
+
+                if not running_futures:
+                    break
+
+                done_futures, _ = wait(list(running_futures.keys()), return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    node_index = running_futures.pop(future)
+                    completed_nodes.add(node_index)
+
+                    if future.exception() is not None:
+                        self.logger.error("execution of step #{} failed: {}".format(node_index, future.exception()))
+                        first_exception = first_exception if first_exception is not None else future.exception()
+                        if cancel_event is not None:
+                            cancel_event.set()
+                        continue
+
+                    on_node_completed(node_index, future.result())
+
+        if first_exception is not None:
+            raise first_exception
+
+        return completed_nodes
+
+    @staticmethod
+    def _get_ready_nodes(dependencies, submitted_nodes, completed_nodes):
+        return [
+            node_index
+            for node_index in range(len(dependencies))
+            if (node_index not in submitted_nodes) and (dependencies[node_index] <= completed_nodes)
+        ]